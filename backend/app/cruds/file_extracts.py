@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, select
+from sqlalchemy.engine import Result
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import app.models.file_extracts as file_extracts_models
+
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+
+async def get_file_extract(
+    db: AsyncSession, file_id: int, generation: int, variant: str = ""
+) -> file_extracts_models.FileExtract | None:
+    """
+    ファイルID、世代番号、抽出方法から抽出済みのテキストを取得する関数
+
+    :param db: データベースセッション
+    :type db: AsyncSession
+    :param file_id: ファイルのID
+    :type file_id: int
+    :param generation: ブロブの世代番号
+    :type generation: int
+    :param variant: 抽出方法（PDFは pdf_variant、文字起こしは transcript_variant で決める）
+    :type variant: str
+    :return: 抽出結果のインスタンス、存在しない場合はNone
+    :rtype: file_extracts_models.FileExtract | None
+    """
+    result: Result = await db.execute(
+        select(file_extracts_models.FileExtract)
+        .filter(file_extracts_models.FileExtract.file_id == file_id)
+        .filter(file_extracts_models.FileExtract.generation == generation)
+        .filter(file_extracts_models.FileExtract.variant == variant)
+    )
+    return result.scalars().first()
+
+
+async def file_extract_exists(
+    db: AsyncSession, file_id: int, generation: int, variant: str = ""
+) -> bool:
+    """
+    ファイルID、世代番号、抽出方法の抽出結果が保存されているかを調べる関数
+
+    :param db: データベースセッション
+    :type db: AsyncSession
+    :param file_id: ファイルのID
+    :type file_id: int
+    :param generation: ブロブの世代番号
+    :type generation: int
+    :param variant: 抽出方法（PDFは pdf_variant、文字起こしは transcript_variant で決める）
+    :type variant: str
+    :return: 保存されている場合はTrue
+    :rtype: bool
+    """
+    result: Result = await db.execute(
+        select(file_extracts_models.FileExtract.id)
+        .filter(file_extracts_models.FileExtract.file_id == file_id)
+        .filter(file_extracts_models.FileExtract.generation == generation)
+        .filter(file_extracts_models.FileExtract.variant == variant)
+        .limit(1)
+    )
+    return result.first() is not None
+
+
+async def save_file_extract(
+    db: AsyncSession, file_id: int, generation: int, pages: list[str], variant: str = ""
+) -> file_extracts_models.FileExtract | None:
+    """
+    抽出したテキストを保存し、同じファイルの古い世代の抽出結果を削除する関数
+
+    古い世代の抽出結果は抽出方法によらず削除する。同じ世代・抽出方法の抽出結果が
+    並行して保存された場合は、先に保存された行を返す。
+
+    :param db: データベースセッション
+    :type db: AsyncSession
+    :param file_id: ファイルのID
+    :type file_id: int
+    :param generation: ブロブの世代番号
+    :type generation: int
+    :param pages: ページごとのテキストのリスト
+    :type pages: list[str]
+    :param variant: 抽出方法（PDFは pdf_variant、文字起こしは transcript_variant で決める）
+    :type variant: str
+    :return: 保存された抽出結果のインスタンス
+    :rtype: file_extracts_models.FileExtract | None
+    """
+    await db.execute(
+        delete(file_extracts_models.FileExtract)
+        .filter(file_extracts_models.FileExtract.file_id == file_id)
+        .filter(file_extracts_models.FileExtract.generation != generation)
+    )
+    file_extract = file_extracts_models.FileExtract(
+        file_id=file_id,
+        generation=generation,
+        variant=variant,
+        page_count=len(pages),
+        pages=pages,
+        created_at=datetime.now(JST),
+    )
+    db.add(file_extract)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return await get_file_extract(db, file_id, generation, variant)
+    await db.refresh(file_extract)
+    return file_extract
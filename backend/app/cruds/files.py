@@ -95,6 +95,40 @@ async def delete_file_by_name_and_userid(db: AsyncSession, file_name: str, uid:
     await db.commit()
 
 
+async def delete_files_by_names_and_userid(
+    db: AsyncSession, file_names: list[str], uid: str
+) -> list[int]:
+    """
+    指定されたファイル名のリストとユーザーIDに基づいてファイルをまとめて削除します。
+
+    対象のファイルは1回のクエリで取得し、1回のコミットで削除します。
+
+    :param db: データベースセッション
+    :type db: AsyncSession
+    :param file_names: 削除するファイル名のリスト
+    :type file_names: list[str]
+    :param uid: ファイルを所有するユーザーのID
+    :type uid: str
+    :return: 削除したファイルのIDのリスト
+    :rtype: list[int]
+    """
+    if not file_names:
+        return []
+
+    result: Result = await db.execute(
+        select(files_models.File)
+        .filter(files_models.File.file_name.in_(file_names))
+        .filter(files_models.File.user_id == uid)
+    )
+    # 関連テーブルの行も削除されるように、ORM経由で削除する
+    file_ids = []
+    for file in result.scalars():
+        file_ids.append(int(file.id))
+        await db.delete(file)
+    await db.commit()
+    return file_ids
+
+
 async def get_file_id_by_name_and_userid(db: AsyncSession, file_name: str, uid: str) -> int | None:
     """
     ファイル名とユーザーIDからファイルIDを取得する関数
@@ -117,6 +151,53 @@ async def get_file_id_by_name_and_userid(db: AsyncSession, file_name: str, uid:
     return file
 
 
+async def get_file_by_name_and_userid(
+    db: AsyncSession, file_name: str, uid: str
+) -> files_models.File | None:
+    """
+    ファイル名とユーザーIDからファイルを取得する関数
+
+    :param db: データベースセッション
+    :type db: AsyncSession
+    :param file_name: 取得するファイルの名前
+    :type file_name: str
+    :param uid: ファイルを所有するユーザーのID
+    :type uid: str
+    :return: ファイルのインスタンス、存在しない場合はNone
+    :rtype: files_models.File | None
+    """
+    result: Result = await db.execute(
+        select(files_models.File)
+        .filter(files_models.File.file_name == file_name)
+        .filter(files_models.File.user_id == uid)
+    )
+    return result.scalars().first()
+
+
+async def get_existing_file_names(db: AsyncSession, file_names: list[str], uid: str) -> set[str]:
+    """
+    指定されたファイル名のうち、ユーザーのファイルとして登録されているものを返す関数
+
+    :param db: データベースセッション
+    :type db: AsyncSession
+    :param file_names: 確認するファイル名のリスト
+    :type file_names: list[str]
+    :param uid: ユーザーID
+    :type uid: str
+    :return: 登録されているファイル名の集合
+    :rtype: set[str]
+    """
+    if not file_names:
+        return set()
+
+    result: Result = await db.execute(
+        select(files_models.File.file_name)
+        .filter(files_models.File.file_name.in_(file_names))
+        .filter(files_models.File.user_id == uid)
+    )
+    return set(result.scalars().all())
+
+
 # ファイルを更新する処理
 async def update_file(
     db: AsyncSession, file_id: int, file_update: files_schemas.FileUpdate, uid: str
@@ -11,6 +11,7 @@ from app.models.answers import Answer  # noqa: F401
 from app.models.exercises import Exercise  # noqa: F401
 from app.models.exercises_files import exercise_file  # noqa: F401
 from app.models.exercises_user_answer import ExerciseUserAnswer  # noqa: F401
+from app.models.file_extracts import FileExtract  # noqa: F401
 from app.models.files import File  # noqa: F401
 from app.models.notes import Note  # noqa: F401
 from app.models.outputs import Output  # noqa: F401
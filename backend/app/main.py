@@ -1,14 +1,45 @@
 import os
-from typing import Callable, Dict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict
 
 from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.routers import answers, exercises, files, notes, outputs_stream
+from app.routers import answers, exercises, files, local_storage, notes, outputs_stream
+from app.utils.blob_cache import blob_cache
+from app.utils.blob_metadata import blob_metadata_cache
+from app.utils.convert_mp4_to_mp3 import mp3_converter
+from app.utils.file_extract_store import file_extract_store
+from app.utils.gemini_extract_text_from_audio import (
+    transcription_rate_limiter,
+    transcriptions,
+)
+from app.utils.image_normalization import image_cache
+from app.utils.ingestion import ingestion_manager
+from app.utils.ingestion_governor import ingestion_governor
+from app.utils.media_workers import media_workers
+from app.utils.pdf_boilerplate import boilerplate_stats
+from app.utils.pdf_extraction import pdf_extractions, shutdown_extraction_executor
+from app.utils.prompt_packer import prompt_packer
+from app.utils.signed_url_cache import signed_url_cache
+from app.utils.silence_trim import silence_trim_stats
+from app.utils.storage_client import close_storage_client, init_storage_client
 from app.utils.user_auth import authenticate_request, get_uid
 
+
+# アプリケーションのライフサイクルで共有リソースを管理
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    init_storage_client()
+    yield
+    await ingestion_manager.shutdown()
+    shutdown_extraction_executor()
+    media_workers.shutdown()
+    close_storage_client()
+
+
 # FastAPIのインスタンスを作成
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 # テスト環境での認証バイパス用の関数
@@ -24,6 +55,8 @@ app.include_router(outputs_stream.router, dependencies=[Depends(get_auth_depende
 app.include_router(notes.router, dependencies=[Depends(get_auth_dependency())])
 app.include_router(exercises.router, dependencies=[Depends(get_auth_dependency())])
 app.include_router(answers.router, dependencies=[Depends(get_auth_dependency())])
+# ローカルストレージのエンドポイントは署名付きURLで認可するため、認証を注入しない
+app.include_router(local_storage.router)
 
 # CORSの設定
 app.add_middleware(
@@ -53,3 +86,31 @@ async def read_root() -> dict[str, str]:  # pragma: no cover
 @app.get("/protected")
 async def protected_route(uid: str = Depends(get_uid)) -> Dict[str, str]:
     return {"message": f"認証されたユーザー: {uid}"}
+
+
+# キャッシュの統計を返すエンドポイント（運用情報のため認証を必須とする）
+@app.get("/cache_stats", dependencies=[Depends(get_auth_dependency())])
+async def cache_stats() -> dict[str, dict[str, float]]:
+    """
+    プロセス内キャッシュのヒット数、ミス数などの統計を返します。
+
+    :return: キャッシュ名をキーとし、統計を値とする辞書
+    :rtype: dict[str, dict[str, float]]
+    """
+    return {
+        "blob_metadata": dict(blob_metadata_cache.stats()),
+        "signed_url": dict(signed_url_cache.stats()),
+        "blob_disk": blob_cache.stats(),
+        "file_extracts": file_extract_store.stats(),
+        "images": image_cache.stats(),
+        "mp3_conversions": mp3_converter.stats(),
+        "ingestion": ingestion_manager.stats(),
+        "ingestion_governor": ingestion_governor.stats(),
+        "media_workers": media_workers.stats(),
+        "pdf_boilerplate": boilerplate_stats.stats(),
+        "pdf_extractions": pdf_extractions.stats(),
+        "prompt_tokens": prompt_packer.stats(),
+        "silence_trim": silence_trim_stats.stats(),
+        "transcription_requests": transcription_rate_limiter.stats(),
+        "transcriptions": transcriptions.stats(),
+    }
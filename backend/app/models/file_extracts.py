@@ -0,0 +1,55 @@
+from sqlalchemy import (
+    JSON,
+    BigInteger,
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    String,
+    UniqueConstraint,
+)
+
+from app.database import Base
+
+
+class FileExtract(Base):
+    """
+    ファイルから抽出したページごとのテキストを格納するためのSQLAlchemyモデルクラス。
+
+    ブロブの世代番号と抽出方法ごとに1行を保存し、ファイルが再アップロードされた場合は
+    新しい世代番号の行で置き換える。抽出方法はPDFのテキストの場合は空文字列、
+    音声の文字起こしの場合はモデル名とプロンプトのバージョンを含む文字列とする。
+
+    :param id: 抽出結果の一意の識別子
+    :type id: int
+    :param file_id: 抽出元のファイルのID
+    :type file_id: int
+    :param generation: 抽出元のブロブの世代番号
+    :type generation: int
+    :param variant: 抽出方法（PDFは pdf_variant、文字起こしは transcript_variant で決める）
+    :type variant: str
+    :param page_count: ページ数
+    :type page_count: int
+    :param pages: ページごとのテキストのリスト
+    :type pages: list[str]
+    :param created_at: 抽出日時
+    :type created_at: datetime
+    """
+
+    __tablename__ = "file_extracts"
+    __table_args__ = (
+        UniqueConstraint(
+            "file_id", "generation", "variant", name="uq_file_extracts_file_id_generation_variant"
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    # ファイルの削除時に抽出結果も削除する
+    file_id = Column(
+        Integer, ForeignKey("files.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    generation = Column(BigInteger, nullable=False)
+    variant = Column(String(255), nullable=False, default="", server_default="")
+    page_count = Column(Integer, nullable=False)
+    pages = Column(JSON, nullable=False)
+    created_at = Column(DateTime, nullable=False)
@@ -21,6 +21,8 @@ class File(Base):
     :type user_id: str
     :param created_at: ファイルの作成日時
     :type created_at: datetime
+    :param content_hash: ファイル内容のMD5ハッシュ（base64エンコード）
+    :type content_hash: str | None
     :param exercises: このファイルに関連する練習問題のリスト
     :type exercises: list[Exercise]
     """
@@ -33,6 +35,7 @@ class File(Base):
     user_id = Column(String(128), nullable=False, index=True)  # Firebase UIDの最大長に合わせて調整
     created_at = Column(DateTime, nullable=False)
     updated_at = Column(DateTime, nullable=False)
+    content_hash = Column(String(64), nullable=True)
 
     # リレーションシップの定義
     exercises = relationship(
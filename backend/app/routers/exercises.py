@@ -20,6 +20,7 @@ import app.schemas.exercises_user_answer as exercises_user_answer_schemas
 from app.cruds.files import get_file_id_by_name_and_userid
 from app.database import get_db
 from app.models.exercises_files import exercise_file
+from app.utils.blob_metadata import to_blob_name
 from app.utils.claude_request_stream import generate_content_stream
 from app.utils.essay_question import generate_essay_json
 from app.utils.multiple_choice_question import (
@@ -107,7 +108,14 @@ async def request_content(
     # コンテンツ生成ストリームの開始
     try:
         logging.info("Starting content generation stream...")
-        response = generate_content_stream(request.files, uid, difficulty=request.difficulty)
+        response = generate_content_stream(
+            request.files,
+            uid,
+            difficulty=request.difficulty,
+            file_ids=dict(
+                zip([to_blob_name(uid, f) for f in request.files], file_ids, strict=True)
+            ),
+        )
     except NotFound as e:
         logging.error(f"File not found in Google Cloud Storage: {e}")
         raise HTTPException(
@@ -260,6 +268,9 @@ async def request_choice_question_json(
             uid=uid,
             title=request.title,  # タイトルを追加
             difficulty=request.difficulty,  # 難易度を追加
+            file_ids=dict(
+                zip([to_blob_name(uid, f) for f in request.files], file_ids, strict=True)
+            ),
         )
         logging.info(f"Difficulty is set to: {request.difficulty}")
         logging.info(f"Generated response: {response}")
@@ -521,6 +532,9 @@ async def request_essay_question_json(
             uid=uid,
             title=request.title,  # タイトルを追加
             difficulty=request.difficulty,  # 難易度を追加
+            file_ids=dict(
+                zip([to_blob_name(uid, f) for f in request.files], file_ids, strict=True)
+            ),
         )
         logging.info(f"Generated response: {response}")
     except NotFound as e:
@@ -748,6 +762,9 @@ async def request_similar_question_json(
             uid=uid,
             title=request.title,
             answers=responses_list,
+            file_ids=dict(
+                zip([to_blob_name(uid, f) for f in request.relatedFiles], file_ids, strict=True)
+            ),
         )
         logging.info(f"Generated response: {response}")
     except NotFound as e:
@@ -1,4 +1,6 @@
+import asyncio
 import logging
+import os
 import unicodedata
 from datetime import datetime, timedelta, timezone
 
@@ -8,9 +10,12 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 import app.cruds.files as files_cruds
 import app.schemas.files as files_schemas
-from app.cruds.files import get_file_id_by_name_and_userid
 from app.database import get_db
+from app.utils.blob_metadata import invalidate_blob_metadata
+from app.utils.file_extract_store import file_extract_store
+from app.utils.ingestion import ingestion_manager
 from app.utils.operate_cloud_storage import (
+    compute_md5,
     delete_files_from_gcs,
     generate_download_signed_url_v4,
     generate_upload_signed_url_v4,
@@ -30,6 +35,9 @@ router = APIRouter(
     tags=["files"],
 )
 
+# バケット名
+BUCKET_NAME: str = str(os.getenv("BUCKET_NAME"))
+
 # 日本時間のタイムゾーン
 JST = timezone(timedelta(hours=9))
 
@@ -37,6 +45,67 @@ JST = timezone(timedelta(hours=9))
 db_dependency = Depends(get_db)
 
 
+async def save_file_record(
+    db: AsyncSession, uid: str, file_name: str, file_size: int, content_hash: str | None
+) -> int:
+    """
+    ファイル情報をDBに登録し、登録済みの場合は更新します。
+
+    内容のハッシュとサイズが登録済みの値と一致する場合は、行を書き換えません。
+
+    :param db: データベースセッション
+    :type db: AsyncSession
+    :param uid: ユーザーID
+    :type uid: str
+    :param file_name: 正規化済みのファイル名
+    :type file_name: str
+    :param file_size: ファイルサイズ（バイト単位）
+    :type file_size: int
+    :param content_hash: ファイル内容のMD5ハッシュ
+    :type content_hash: str | None
+    :return: 登録または更新したファイルのID
+    :rtype: int
+    """
+    # 日本時間の現在日時を取得
+    now_japan = datetime.now(JST)
+
+    file = await files_cruds.get_file_by_name_and_userid(db, file_name, uid)
+    if file is None:
+        logging.info(f"File {file_name} not found in database.")
+        file_create = files_schemas.FileCreate(
+            file_name=file_name,
+            file_size=file_size,
+            content_hash=content_hash,
+            user_id=uid,
+            created_at=now_japan,  # 日本時間の現在日時を設定
+            updated_at=now_japan,  # 日本時間の現在日時を設定
+        )
+        regist_file = await files_cruds.create_file(db, file_create, uid)
+        logging.info(f"File {regist_file.file_name} saved to database.")
+        return int(regist_file.id)
+    elif (
+        content_hash is not None
+        and file.content_hash == content_hash
+        and file.file_size == file_size
+    ):
+        logging.info(f"File {file_name} is unchanged. Skipped database update.")
+    else:
+        logging.info(f"File {file_name} found in database. {file.id}")
+        file_update = files_schemas.FileUpdate(
+            file_name=file_name,
+            file_size=file_size,
+            content_hash=content_hash,
+            user_id=uid,
+            updated_at=now_japan,  # 日本時間の現在日時を設定
+        )
+        update_file = await files_cruds.update_file(db, int(file.id), file_update, uid)
+        if update_file:
+            logging.info(f"File {update_file.file_name} updated in database.")
+        else:
+            logging.error(f"Failed to update file {file_name} in database.")
+    return int(file.id)
+
+
 # GCSへのファイルアップロードとファイル名をDBに登録
 @router.post("/upload", response_model=dict)
 async def upload_files(
@@ -60,52 +129,40 @@ async def upload_files(
     response_data = {}
 
     # ファイルをGoogle Cloud Storageにアップロード
-    upload_result = await post_files(files, uid)
+    # （途中で失敗しても一部のファイルはアップロード済みのため、キャッシュは必ず破棄する）
+    try:
+        upload_result = await post_files(files, uid)
+    finally:
+        invalidate_blob_metadata(uid, [file.filename for file in files if file.filename])
 
     if "success" not in upload_result or not upload_result["success"]:
         raise HTTPException(status_code=500, detail="Upload failed")
 
+    # アップロード結果からファイルごとの内容のハッシュを取得
+    content_hashes = {
+        unicodedata.normalize("NFC", success_file["filename"]): success_file.get("content_hash")
+        for success_file in upload_result.get("success_files", [])
+    }
+
     for file in files:
         if file.filename and file.size:
             # ファイル名を正規化
             normalized_filename = unicodedata.normalize("NFC", file.filename)
-            # 日本時間の現在日時を取得
-            now_japan = datetime.now(JST)
 
             # ファイル情報を保存
             try:
-                file_id = await get_file_id_by_name_and_userid(db, normalized_filename, uid)
-                if file_id is None:
-                    logging.info(f"File {normalized_filename} not found in database.")
-                    file_create = files_schemas.FileCreate(
-                        file_name=normalized_filename,
-                        file_size=file.size,
-                        user_id=uid,
-                        created_at=now_japan,  # 日本時間の現在日時を設定
-                        updated_at=now_japan,  # 日本時間の現在日時を設定
-                    )
-                    regist_file = await files_cruds.create_file(db, file_create, uid)
-                    logging.info(f"File {regist_file.file_name} saved to database.")
-                else:
-                    logging.info(f"File {normalized_filename} found in database. {file_id}")
-                    file_update = files_schemas.FileUpdate(
-                        file_name=normalized_filename,
-                        file_size=file.size,
-                        user_id=uid,
-                        updated_at=now_japan,  # 日本時間の現在日時を設定
-                    )
-                    print(file_id)
-                    update_file = await files_cruds.update_file(db, file_id, file_update, uid)
-                    if update_file:
-                        logging.info(f"File {update_file.file_name} updated in database.")
-                    else:
-                        logging.error(f"Failed to update file {normalized_filename} in database.")
+                file_id = await save_file_record(
+                    db, uid, normalized_filename, file.size, content_hashes.get(normalized_filename)
+                )
             except Exception as e:
                 raise HTTPException(
                     status_code=500,
                     detail=f"{file.filename} データベース登録に失敗しました",
                 ) from e
 
+            # テキスト抽出や文字起こしをバックグラウンドで開始
+            ingestion_manager.enqueue(BUCKET_NAME, uid, normalized_filename, file_id)
+
     response_data["success"] = upload_result.get("success", False)
     response_data["success_files"] = upload_result.get("success_files", [])
     response_data["failed_files"] = upload_result.get("failed_files", [])
@@ -154,6 +211,35 @@ async def get_file_by_id(
     return file
 
 
+# ファイルの前処理（テキスト抽出、文字起こし）の状態取得
+@router.get("/{file_id}/ingestion_status", response_model=dict)
+async def get_ingestion_status(
+    file_id: int, db: AsyncSession = db_dependency, uid: str = Depends(get_uid)
+) -> dict:
+    """
+    アップロード後にバックグラウンドで実行している前処理の状態を返します。
+
+    前処理が完了したか（ready）は保存済みの抽出結果から判断するため、どのワーカーで
+    前処理したかによらず正しい値を返します。state の queued、running、failed は、
+    リクエストを処理したワーカーで実行した前処理の場合のみ返します。
+
+    :param file_id: ファイルのID
+    :type file_id: int
+    :param db: データベースセッション
+    :type db: AsyncSession
+    :param uid: ユーザーID
+    :type uid: str
+    :return: 前処理の状態の辞書
+    :rtype: dict
+    :raises HTTPException: ファイルが見つからない場合
+    """
+    file = await files_cruds.get_file_by_id_and_user_id(db, file_id, uid)
+    if not file:
+        raise HTTPException(status_code=404, detail="ファイルが見つかりません")
+
+    return await ingestion_manager.check_status(BUCKET_NAME, uid, file_id, str(file.file_name))
+
+
 # ファイル名のリストとユーザーIDによるファイルの削除
 @router.delete("/delete_files", response_model=dict)
 async def delete_files(
@@ -176,7 +262,10 @@ async def delete_files(
 
     try:
         # Google Cloud Storageからファイルを削除
-        delete_result = await delete_files_from_gcs(files, uid)
+        try:
+            delete_result = await delete_files_from_gcs(files, uid)
+        finally:
+            invalidate_blob_metadata(uid, files)
         response_data.update(delete_result)
 
         # ファイルが見つからない場合は404エラーを返す
@@ -191,10 +280,10 @@ async def delete_files(
         # GCSでの削除が成功した場合のみ、DBからの削除を実行
         if delete_result.get("success", False):
             try:
-                # ファイルをDBから削除
-                for file_name in files:
-                    await files_cruds.delete_file_by_name_and_userid(db, file_name, uid)
-                await db.commit()
+                # ファイルをDBからまとめて削除
+                file_ids = await files_cruds.delete_files_by_names_and_userid(db, files, uid)
+                # 抽出結果のテーブルの行は外部キーで削除されるため、ファイルだけを削除する
+                await file_extract_store.delete_sidecars(BUCKET_NAME, file_ids)
 
             except Exception as e:
                 # DB削除でエラーが発生した場合
@@ -267,58 +356,45 @@ async def register_files(
     :return: 登録結果の辞書
     :rtype: bool
     """
+    # 署名付きURLで直接アップロードされたファイルのメタデータキャッシュを破棄
+    invalidate_blob_metadata(uid, [file.filename for file in files if file.filename])
+
     for file in files:
         if file.filename and file.size:
             # ファイル名を正規化
             normalized_filename = unicodedata.normalize("NFC", file.filename)
-            # 日本時間の現在日時を取得
-            now_japan = datetime.now(JST)
 
             # ファイル情報を保存
             try:
-                file_id = await get_file_id_by_name_and_userid(db, normalized_filename, uid)
-                if file_id is None:
-                    logging.info(f"File {normalized_filename} not found in database.")
-                    file_create = files_schemas.FileCreate(
-                        file_name=normalized_filename,
-                        file_size=file.size,
-                        user_id=uid,
-                        created_at=now_japan,  # 日本時間の現在日時を設定
-                        updated_at=now_japan,  # 日本時間の現在日時を設定
-                    )
-                    regist_file = await files_cruds.create_file(db, file_create, uid)
-                    logging.info(f"File {regist_file.file_name} saved to database.")
-                else:
-                    logging.info(f"File {normalized_filename} found in database. {file_id}")
-                    file_update = files_schemas.FileUpdate(
-                        file_name=normalized_filename,
-                        file_size=file.size,
-                        user_id=uid,
-                        updated_at=now_japan,  # 日本時間の現在日時を設定
-                    )
-                    print(file_id)
-                    update_file = await files_cruds.update_file(db, file_id, file_update, uid)
-                    if update_file:
-                        logging.info(f"File {update_file.file_name} updated in database.")
-                    else:
-                        logging.error(f"Failed to update file {normalized_filename} in database.")
+                content_hash = await asyncio.to_thread(compute_md5, file.file)
+                file_id = await save_file_record(
+                    db, uid, normalized_filename, file.size, content_hash
+                )
             except Exception as e:
                 raise HTTPException(
                     status_code=500,
-                    detail=f"{file_create.file_name} データベース登録に失敗しました",
+                    detail=f"{file.filename} データベース登録に失敗しました",
                 ) from e
-                return False
+
+            # テキスト抽出や文字起こしをバックグラウンドで開始
+            ingestion_manager.enqueue(BUCKET_NAME, uid, normalized_filename, file_id)
     return True
 
 
 # 署名付きURLの生成（ダウンロード用）
 @router.post("/generate_download_signed_url", response_model=dict)
-async def generate_download_signed_url(files: list[str], uid: str = Depends(get_uid)) -> dict:
+async def generate_download_signed_url(
+    files: list[str], db: AsyncSession = db_dependency, uid: str = Depends(get_uid)
+) -> dict:
     """
     指定されたファイルリストに対して表示/ダウンロード用の署名付きURLを生成します。
 
+    ファイルの存在はDBのfilesテーブルで確認し、登録されているファイルのみ署名します。
+
     :param files: 署名付きURLを生成するファイルのリスト
     :type files: list[str]
+    :param db: データベースセッション
+    :type db: AsyncSession
     :param uid: ユーザーID（認証システムから取得）
     :type uid: str
     :raises HTTPException: URL生成中にエラーが発生した場合、
@@ -328,7 +404,17 @@ async def generate_download_signed_url(files: list[str], uid: str = Depends(get_
     """
     try:
         download_signed_urls: dict[str, str] = {}
-        download_signed_urls = await generate_download_signed_url_v4(files, uid)
+
+        # DBに登録されているファイルのみを対象にする
+        normalized_files = [unicodedata.normalize("NFC", file) for file in files]
+        existing_files = await files_cruds.get_existing_file_names(db, normalized_files, uid)
+        for file in normalized_files:
+            if file not in existing_files:
+                logging.warning(f"ファイル {uid}/{file} が存在しません")
+
+        download_signed_urls = await generate_download_signed_url_v4(
+            [file for file in normalized_files if file in existing_files], uid
+        )
 
         # 署名付きURLが生成されなかった場合（対象ファイルが存在しない場合など）
         if not download_signed_urls:
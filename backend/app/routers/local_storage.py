@@ -0,0 +1,119 @@
+import asyncio
+import logging
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+
+from app.utils.local_storage import LocalStorageClient, verify_signature
+from app.utils.storage_client import get_storage_client
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+router = APIRouter(
+    prefix="/local_storage",
+    tags=["local_storage"],
+)
+
+
+def get_local_storage_client() -> LocalStorageClient:
+    """
+    共有クライアントがローカルストレージの場合にクライアントを返す
+
+    :return: ローカルストレージのクライアント
+    :rtype: LocalStorageClient
+    :raises HTTPException: ローカルストレージを使っていない場合
+    """
+    client = get_storage_client()
+    if not isinstance(client, LocalStorageClient):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return client
+
+
+def check_signature(
+    method: str, bucket_name: str, blob_name: str, expires: int, type: str, signature: str
+) -> None:
+    """
+    署名付きURLの署名を検証し、不正な場合は403エラーを送出する
+
+    :raises HTTPException: 署名が不正、または有効期限切れの場合
+    """
+    if not verify_signature(method, bucket_name, blob_name, expires, type, signature):
+        raise HTTPException(status_code=403, detail="署名が無効か、有効期限が切れています")
+
+
+# 署名付きURLでファイルをダウンロード
+@router.get("/{bucket_name}/{blob_name:path}")
+async def download_local_file(
+    bucket_name: str, blob_name: str, expires: int, signature: str, type: str = ""
+) -> FileResponse:
+    """
+    ローカルストレージのファイルを返すエンドポイント
+
+    :param bucket_name: バケット名
+    :type bucket_name: str
+    :param blob_name: ブロブ名
+    :type blob_name: str
+    :param expires: 有効期限（UNIX時間）
+    :type expires: int
+    :param signature: 署名
+    :type signature: str
+    :param type: レスポンスのContent-Type
+    :type type: str
+    :return: ファイルのレスポンス
+    :rtype: FileResponse
+    """
+    check_signature("GET", bucket_name, blob_name, expires, type, signature)
+    client = get_local_storage_client()
+    blob = client.bucket(bucket_name).blob(blob_name)
+    if not await asyncio.to_thread(blob.exists):
+        raise HTTPException(status_code=404, detail="ファイルが存在しません")
+    return FileResponse(blob.path, media_type=type or blob.content_type)
+
+
+# 署名付きURLでファイルをアップロード
+@router.put("/{bucket_name}/{blob_name:path}")
+async def upload_local_file(
+    request: Request,
+    bucket_name: str,
+    blob_name: str,
+    expires: int,
+    signature: str,
+    type: str = "",
+) -> Response:
+    """
+    リクエストボディをローカルストレージに保存するエンドポイント
+
+    ボディはメモリに溜めずに一時ファイルへ書き込み、完了後に保存先へリネームする。
+
+    :param request: リクエスト
+    :type request: Request
+    :param bucket_name: バケット名
+    :type bucket_name: str
+    :param blob_name: ブロブ名
+    :type blob_name: str
+    :param expires: 有効期限（UNIX時間）
+    :type expires: int
+    :param signature: 署名
+    :type signature: str
+    :param type: 署名時に指定したContent-Type
+    :type type: str
+    :return: 空のレスポンス
+    :rtype: Response
+    """
+    check_signature("PUT", bucket_name, blob_name, expires, type, signature)
+    if type and request.headers.get("content-type") != type:
+        raise HTTPException(status_code=403, detail="Content-Typeが署名と一致しません")
+    client = get_local_storage_client()
+    blob = client.bucket(bucket_name).blob(blob_name)
+
+    writer = await asyncio.to_thread(blob.open, "wb")
+    try:
+        async for chunk in request.stream():
+            await asyncio.to_thread(writer.write, chunk)
+    except BaseException:
+        await asyncio.to_thread(writer.abort)
+        raise
+    await asyncio.to_thread(writer.close)
+    logging.info(f"ローカルストレージに {bucket_name}/{blob_name} を保存しました")
+    return Response(status_code=200)
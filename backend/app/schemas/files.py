@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Optional
 
 from pydantic import BaseModel, ConfigDict
 
@@ -11,10 +12,13 @@ class FileBase(BaseModel):
     :type file_name: str
     :param file_size: ファイルのサイズ（バイト単位）
     :type file_size: int
+    :param content_hash: ファイル内容のMD5ハッシュ（base64エンコード）
+    :type content_hash: Optional[str]
     """
 
     file_name: str
     file_size: int
+    content_hash: Optional[str] = None
 
 
 class FileCreate(FileBase):
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import math
+import os
+import uuid
+from dataclasses import dataclass
+from typing import Any
+
+import ffmpeg
+from dotenv import load_dotenv
+
+from app.utils.convert_mp4_to_mp3 import (
+    TEMPORARY_PREFIX,
+    ffmpeg_input_url,
+    probe_media_duration,
+)
+from app.utils.ingestion_governor import ingestion_governor
+from app.utils.media_workers import media_workers
+
+# 環境変数を読み込む
+load_dotenv()
+
+# 音声を分割して文字起こしする場合の1区間の長さの目安（秒）
+AUDIO_SEGMENT_SECONDS: float = float(os.getenv("AUDIO_SEGMENT_SECONDS", "600"))
+
+# 区間の境目で話が途切れないように、前の区間と重ねる長さ（秒）
+AUDIO_SEGMENT_OVERLAP_SECONDS: float = float(os.getenv("AUDIO_SEGMENT_OVERLAP_SECONDS", "15"))
+
+# 分割した音声を一時的に保存するブロブ名の接頭辞
+# （削除に失敗したファイルは、バケットのライフサイクルルールで自動的に削除する。README を参照）
+SEGMENT_PREFIX = f"{TEMPORARY_PREFIX}/segments"
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+
+@dataclass(frozen=True)
+class AudioSegment:
+    """
+    音声の1区間
+
+    :param index: 区間の番号（0から）
+    :type index: int
+    :param start: 区間の開始位置（秒）
+    :type start: float
+    :param end: 区間の終了位置（秒）
+    :type end: float
+    :param overlap: 前の区間と重なる長さ（秒）
+    :type overlap: float
+    """
+
+    index: int
+    start: float
+    end: float
+    overlap: float = 0.0
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+def plan_segments(
+    duration: float,
+    segment_seconds: float = AUDIO_SEGMENT_SECONDS,
+    overlap_seconds: float = AUDIO_SEGMENT_OVERLAP_SECONDS,
+) -> list[AudioSegment]:
+    """
+    音声を重なりのある区間に分割する
+
+    最後の区間だけが短くならないように、区間数を決めてから均等な長さに分ける。
+    2つ目以降の区間は、前の区間の末尾 overlap_seconds 秒から始める。
+
+    :param duration: 音声の長さ（秒）
+    :type duration: float
+    :param segment_seconds: 1区間の長さの目安（秒）
+    :type segment_seconds: float
+    :param overlap_seconds: 前の区間と重ねる長さ（秒）
+    :type overlap_seconds: float
+    :return: 区間のリスト（音声の長さが0以下の場合は空）
+    :rtype: list[AudioSegment]
+    """
+    if duration <= 0:
+        return []
+    count = max(1, math.ceil(duration / max(segment_seconds, 1.0)))
+    step = duration / count
+    # 重なりが区間の半分を超えると、ほとんど同じ内容を2回文字起こしすることになる
+    overlap_seconds = min(max(overlap_seconds, 0.0), step / 2)
+
+    segments = []
+    for index in range(count):
+        start = index * step
+        end = duration if index == count - 1 else (index + 1) * step
+        overlap = overlap_seconds if index > 0 else 0.0
+        segments.append(AudioSegment(index, start - overlap, end, overlap))
+    return segments
+
+
+async def probe_duration(blob: Any) -> float:
+    """
+    ffprobeで音声の長さを取得する
+
+    :param blob: 音声のブロブ
+    :type blob: Any
+    :return: 音声の長さ（秒）
+    :rtype: float
+    :raises ValueError: 長さを取得できない場合
+    """
+    input_url = await asyncio.to_thread(ffmpeg_input_url, blob)
+    duration = await media_workers.run(lambda: probe_media_duration(input_url))
+    if duration is None:
+        raise ValueError(f"{blob.name} の長さを取得できません")
+    return duration
+
+
+@dataclass(frozen=True)
+class SegmentFormat:
+    """
+    切り出した音声の形式
+
+    :param extension: 拡張子
+    :type extension: str
+    :param format: ffmpegの出力形式
+    :type format: str
+    :param acodec: ffmpegの音声コーデック（copy の場合は再エンコードしない）
+    :type acodec: str
+    :param mime_type: Geminiに渡すときのMIMEタイプ
+    :type mime_type: str
+    """
+
+    extension: str
+    format: str
+    acodec: str
+    mime_type: str
+
+
+def segment_format(source_name: str) -> SegmentFormat:
+    """
+    切り出す音声の形式を返す
+
+    MP3とAACは再エンコードせずに同じ形式で切り出し、それ以外の形式はMP3に変換する。
+
+    :param source_name: 切り出す音声のブロブ名
+    :type source_name: str
+    :return: 切り出した音声の形式
+    :rtype: SegmentFormat
+    """
+    name = source_name.lower()
+    if name.endswith(".mp3"):
+        return SegmentFormat(".mp3", "mp3", "copy", "audio/mp3")
+    if name.endswith(".aac"):
+        return SegmentFormat(".aac", "adts", "copy", "audio/aac")
+    return SegmentFormat(".mp3", "mp3", "libmp3lame", "audio/mp3")
+
+
+def segment_blob_name(run_id: str, segment: AudioSegment, extension: str = ".mp3") -> str:
+    """
+    分割した音声を保存するブロブ名を返す
+
+    :param run_id: 分割の実行ごとの識別子（同じファイルの文字起こしが重なっても衝突しない）
+    :type run_id: str
+    :param segment: 区間
+    :type segment: AudioSegment
+    :param extension: 拡張子
+    :type extension: str
+    :return: ブロブ名
+    :rtype: str
+    """
+    return f"{SEGMENT_PREFIX}/{run_id}/{segment.index:04d}{extension}"
+
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex
+
+
+async def cut_segment(bucket: Any, source: Any, segment: AudioSegment, blob_name: str) -> Any:
+    """
+    音声の1区間を切り出して保存する（形式は segment_format で決める）
+
+    :param bucket: 保存先のバケット
+    :type bucket: Any
+    :param source: 切り出す音声のブロブ
+    :type source: Any
+    :param segment: 切り出す区間
+    :type segment: AudioSegment
+    :param blob_name: 保存先のブロブ名
+    :type blob_name: str
+    :return: 保存したブロブ
+    :rtype: Any
+    """
+    input_url = await asyncio.to_thread(ffmpeg_input_url, source)
+    output_format = segment_format(source.name)
+    async with ingestion_governor.slot(cpu=0 if output_format.acodec == "copy" else 1):
+        content, _ = await media_workers.run(
+            lambda: ffmpeg.input(input_url, ss=segment.start, t=segment.duration)
+            .output(
+                "pipe:",
+                format=output_format.format,
+                acodec=output_format.acodec,
+                **media_workers.output_options(),
+            )
+            .run(cmd=media_workers.ffmpeg_cmd(), capture_stdout=True, capture_stderr=True)
+        )
+    segment_blob = bucket.blob(blob_name)
+    await asyncio.to_thread(
+        segment_blob.upload_from_string, content, content_type=output_format.mime_type
+    )
+    return segment_blob
+
+
+async def delete_segments(bucket: Any, blob_names: list[str]) -> None:
+    """
+    分割した音声を削除する（削除に失敗しても処理は続け、ライフサイクルルールで削除される）
+
+    :param bucket: バケット
+    :type bucket: Any
+    :param blob_names: 削除するブロブ名のリスト
+    :type blob_names: list[str]
+    """
+    for blob_name in blob_names:
+        try:
+            await asyncio.to_thread(bucket.blob(blob_name).delete)
+        except Exception as e:
+            logging.warning(f"分割した音声の削除に失敗しました: {blob_name}: {e}")
@@ -0,0 +1,378 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from dotenv import load_dotenv
+
+from app.utils.local_storage import LocalBucket
+
+# 環境変数を読み込む
+load_dotenv()
+
+# キャッシュを保存するディレクトリ
+BLOB_CACHE_DIR: str = os.getenv(
+    "BLOB_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ai-notebook-blob-cache")
+)
+
+# キャッシュの合計サイズの上限（バイト単位、0の場合はキャッシュしない）
+BLOB_CACHE_MAX_BYTES: int = int(os.getenv("BLOB_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# 書き込み途中のファイルに付けるプレフィックス
+TEMP_PREFIX = ".tmp-"
+
+# 書き込み途中のファイルを、中断されたダウンロードの残りとみなして削除するまでの時間（秒）
+TEMP_FILE_MAX_AGE_SECONDS = 60 * 60
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+
+class BlobDiskCache:
+    """
+    ダウンロードしたブロブをローカルディスクに保存するLRUキャッシュ
+
+    ファイルは (バケット名, ブロブ名, 世代番号) のハッシュをファイル名として保存する。
+    世代番号が変わればファイル名も変わるため、保存済みのファイルが古くなることはない。
+    書き込みは一時ファイルへの書き込み後にリネームして行い、最終更新日時をLRUの順序として
+    上限を超えた分を古いものから削除する（同じディレクトリを共有する複数のワーカーでも動作する）。
+    合計サイズはプロセス内で保持し、ディレクトリは最初の保存時と上限を超えたときだけ走査する
+    （他のワーカーが保存した分は、次に走査したときに合計サイズに反映される）。
+    上限より大きいブロブはキャッシュせず、使用中のファイル（pin で指定）は削除しない。
+
+    :param directory: キャッシュを保存するディレクトリ
+    :type directory: str
+    :param max_bytes: キャッシュの合計サイズの上限（バイト単位）
+    :type max_bytes: int
+    """
+
+    def __init__(
+        self, directory: str = BLOB_CACHE_DIR, max_bytes: int = BLOB_CACHE_MAX_BYTES
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # キャッシュの合計サイズ（未走査の場合はNone）
+        self._total_bytes: Optional[int] = None
+        # 使用中のファイルのパスと、使用しているリクエストの数
+        self._pinned: Counter[str] = Counter()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def path_for(self, bucket_name: str, blob_name: str, generation: int) -> str:
+        """
+        ブロブの保存先パスを返す
+
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param blob_name: ブロブ名
+        :type blob_name: str
+        :param generation: 世代番号
+        :type generation: int
+        :return: 保存先のパス
+        :rtype: str
+        """
+        digest = hashlib.sha256(f"{bucket_name}/{blob_name}#{generation}".encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    @contextmanager
+    def pin(self, path: str) -> Iterator[None]:
+        """
+        コンテキストの間、ファイルをキャッシュから削除しないようにする
+
+        :param path: 使用するファイルのパス
+        :type path: str
+        """
+        with self._lock:
+            self._pinned[path] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pinned[path] -= 1
+                if self._pinned[path] <= 0:
+                    del self._pinned[path]
+
+    def _is_pinned(self, path: str) -> bool:
+        with self._lock:
+            return path in self._pinned
+
+    def get(self, bucket_name: str, blob_name: str, generation: int) -> Optional[str]:
+        """
+        キャッシュ済みのファイルのパスを取得する
+
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param blob_name: ブロブ名
+        :type blob_name: str
+        :param generation: 世代番号
+        :type generation: int
+        :return: キャッシュ済みのファイルのパス。存在しない場合はNone
+        :rtype: Optional[str]
+        """
+        path = self.path_for(bucket_name, blob_name, generation)
+        try:
+            # 最終更新日時をLRUの順序として使う
+            os.utime(path)
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += size
+        return path
+
+    def download(
+        self, blob: Any, bucket_name: str, blob_name: str, generation: int
+    ) -> tuple[str, bool]:
+        """
+        ブロブを一時ファイルにダウンロードし、キャッシュに保存する
+
+        上限より大きいブロブはキャッシュに保存せず、一時ファイルのパスを返す
+        （一時ファイルは呼び出し側で削除する）。
+
+        :param blob: ダウンロードするブロブ
+        :type blob: Any
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param blob_name: ブロブ名
+        :type blob_name: str
+        :param generation: 世代番号
+        :type generation: int
+        :return: ファイルのパスと、キャッシュに保存したかどうか
+        :rtype: tuple[str, bool]
+        """
+        path = self.path_for(bucket_name, blob_name, generation)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                blob.download_to_file(f)
+                size = f.tell()
+            if size > self.max_bytes:
+                logging.info(f"{blob_name} はキャッシュの上限より大きいため、キャッシュしません")
+                return temp_path, False
+            try:
+                # 同じファイルを上書きする場合は、置き換える分のサイズを差し引く
+                size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            # 書き込みが完了したファイルだけが保存先のパスに現れるようにする
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += size
+            needs_scan = self._total_bytes is None or self._total_bytes > self.max_bytes
+        if needs_scan:
+            # 保存したファイルは呼び出し側が使うため、削除しない
+            with self.pin(path):
+                self.evict()
+        return path, True
+
+    def evict(self) -> None:
+        """
+        ディレクトリを走査して合計サイズを数え直し、上限を超えている場合は
+        最終更新日時が古いファイルから削除する
+
+        使用中のファイルは削除しない。書き込み途中のファイルは合計サイズに含めず、
+        TEMP_FILE_MAX_AGE_SECONDS より古いものは中断されたダウンロードの残りとして削除する。
+        """
+        entries = []
+        total = 0
+        temp_cutoff = time.time() - TEMP_FILE_MAX_AGE_SECONDS
+        for root, _dirs, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.startswith(TEMP_PREFIX):
+                    if stat.st_mtime < temp_cutoff and not self._is_pinned(path):
+                        self._remove(path)
+                    continue
+                total += stat.st_size
+                if not self._is_pinned(path):
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+        if total > self.max_bytes:
+            for _mtime, size, path in sorted(entries):
+                self._remove(path)
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+        with self._lock:
+            self._total_bytes = total
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        logging.info(f"キャッシュから {path} を削除しました")
+
+    def reset_stats(self) -> None:
+        """
+        統計をリセットする
+        """
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.bytes_saved = 0
+
+    def stats(self) -> dict[str, float]:
+        """
+        キャッシュの統計を返す
+
+        :return: ヒット数、ミス数、ヒット率、節約したダウンロード量を含む辞書
+        :rtype: dict[str, float]
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+            }
+
+
+# プロセス内で共有するキャッシュ
+blob_cache = BlobDiskCache()
+
+
+@asynccontextmanager
+async def _cached_blob_path(bucket: Any, blob_name: str, generation: int) -> AsyncIterator[str]:
+    """
+    ディスクキャッシュのファイルのパスを返すコンテキストマネージャ
+
+    コンテキストの間はファイルをキャッシュから削除しない。
+    キャッシュの上限より大きいブロブは一時ファイルにダウンロードし、コンテキストを抜けると削除する。
+
+    :param bucket: 対象のバケット
+    :type bucket: Any
+    :param blob_name: ブロブ名
+    :type blob_name: str
+    :param generation: ブロブの世代番号
+    :type generation: int
+    :return: ローカルファイルのパス
+    :rtype: AsyncIterator[str]
+    """
+    with blob_cache.pin(blob_cache.path_for(bucket.name, blob_name, generation)):
+        cached_path = blob_cache.get(bucket.name, blob_name, generation)
+        if cached_path is not None:
+            yield cached_path
+            return
+
+        blob = bucket.blob(blob_name, generation=generation)
+        path, cached = await asyncio.to_thread(
+            blob_cache.download, blob, bucket.name, blob_name, generation
+        )
+        if cached:
+            yield path
+            return
+
+    try:
+        with blob_cache.pin(path):
+            yield path
+    finally:
+        os.remove(path)
+
+
+async def read_blob_bytes(bucket: Any, blob_name: str, generation: Optional[int] = None) -> bytes:
+    """
+    ブロブの内容を読み込む
+
+    世代番号が指定された場合はローカルディスクのキャッシュを利用し、
+    キャッシュにない場合はダウンロードしてキャッシュに保存する。
+    世代番号が不明な場合や、ローカルストレージの場合はキャッシュを使わずに読み込む。
+
+    :param bucket: 対象のバケット
+    :type bucket: Any
+    :param blob_name: ブロブ名
+    :type blob_name: str
+    :param generation: ブロブの世代番号
+    :type generation: Optional[int]
+    :return: ファイルの内容
+    :rtype: bytes
+    """
+    if generation is None or not blob_cache.enabled or isinstance(bucket, LocalBucket):
+        blob = bucket.blob(blob_name)
+        content: bytes = await asyncio.to_thread(blob.download_as_bytes)
+        return content
+
+    def read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    async with _cached_blob_path(bucket, blob_name, generation) as path:
+        return await asyncio.to_thread(read, path)
+
+
+@asynccontextmanager
+async def open_blob_path(
+    bucket: Any, blob_name: str, generation: Optional[int] = None
+) -> AsyncIterator[str]:
+    """
+    ブロブの内容をローカルファイルとして参照するためのコンテキストマネージャ
+
+    世代番号が指定された場合はディスクキャッシュのファイルを、それ以外の場合は
+    一時ファイルにストリーミングでダウンロードしたファイルのパスを返す。
+    ファイル全体をメモリに読み込まないため、大きなPDFでもメモリ使用量を抑えられる。
+    一時ファイルはコンテキストを抜けると削除される。
+    ローカルストレージの場合は、保存されているファイルのパスをそのまま返す。
+
+    :param bucket: 対象のバケット
+    :type bucket: Any
+    :param blob_name: ブロブ名
+    :type blob_name: str
+    :param generation: ブロブの世代番号
+    :type generation: Optional[int]
+    :return: ローカルファイルのパス
+    :rtype: AsyncIterator[str]
+    """
+    if isinstance(bucket, LocalBucket):
+        local_blob = bucket.blob(blob_name)
+        await asyncio.to_thread(local_blob.reload)
+        yield local_blob.path
+        return
+
+    if generation is not None and blob_cache.enabled:
+        async with _cached_blob_path(bucket, blob_name, generation) as path:
+            yield path
+        return
+
+    blob = bucket.blob(blob_name)
+    fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(blob_name)[1])
+
+    def spool() -> None:
+        with os.fdopen(fd, "wb") as f:
+            blob.download_to_file(f)
+
+    try:
+        await asyncio.to_thread(spool)
+        yield temp_path
+    finally:
+        os.remove(temp_path)
@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+from app.utils.storage_client import get_storage_client
+
+# 環境変数を読み込む
+load_dotenv()
+
+# 一覧取得時に返却させるフィールド
+LIST_FIELDS = "items(name,size,generation,contentType,md5Hash),nextPageToken"
+
+# メタデータキャッシュの最大件数と有効期間（秒）
+# （破棄はプロセス内でのみ行うため、他のワーカーで更新したファイルは有効期間が過ぎるまで古い）
+BLOB_METADATA_CACHE_SIZE: int = int(os.getenv("BLOB_METADATA_CACHE_SIZE", "4096"))
+BLOB_METADATA_CACHE_TTL: float = float(os.getenv("BLOB_METADATA_CACHE_TTL", "5"))
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+
+@dataclass(frozen=True)
+class BlobInfo:
+    """
+    ブロブの存在とメタデータを表すクラス
+
+    :param name: ブロブ名（uid/ファイル名）
+    :type name: str
+    :param exists: ブロブが存在するかどうか
+    :type exists: bool
+    :param size: ファイルサイズ（バイト単位）
+    :type size: Optional[int]
+    :param generation: ブロブの世代番号
+    :type generation: Optional[int]
+    :param content_type: Content-Type
+    :type content_type: Optional[str]
+    :param md5_hash: 内容のMD5ハッシュ（base64エンコード）
+    :type md5_hash: Optional[str]
+    """
+
+    name: str
+    exists: bool
+    size: Optional[int] = None
+    generation: Optional[int] = None
+    content_type: Optional[str] = None
+    md5_hash: Optional[str] = None
+
+
+class BlobMetadataCache:
+    """
+    存在するブロブのメタデータを保持するLRU+TTLキャッシュ
+
+    キーは (バケット名, ブロブ名) で、世代番号を指定した取得では
+    キャッシュの世代番号と一致する場合のみヒットとする。
+    存在しないブロブはキャッシュしない。
+
+    :param max_entries: キャッシュする最大件数
+    :type max_entries: int
+    :param ttl: エントリの有効期間（秒）
+    :type ttl: float
+    """
+
+    def __init__(
+        self, max_entries: int = BLOB_METADATA_CACHE_SIZE, ttl: float = BLOB_METADATA_CACHE_TTL
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[tuple[str, str], tuple[BlobInfo, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self, bucket_name: str, blob_name: str, generation: Optional[int] = None
+    ) -> Optional[BlobInfo]:
+        """
+        キャッシュからブロブのメタデータを取得する
+
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param blob_name: ブロブ名
+        :type blob_name: str
+        :param generation: 期待する世代番号（指定しない場合は世代を問わない）
+        :type generation: Optional[int]
+        :return: メタデータ。キャッシュにない場合や期限切れの場合はNone
+        :rtype: Optional[BlobInfo]
+        """
+        key = (bucket_name, blob_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (
+                entry[1] < time.monotonic()
+                or (generation is not None and entry[0].generation != generation)
+            ):
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, bucket_name: str, info: BlobInfo) -> None:
+        """
+        ブロブのメタデータをキャッシュに保存する
+
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param info: ブロブのメタデータ
+        :type info: BlobInfo
+        """
+        if not info.exists:
+            return
+        key = (bucket_name, info.name)
+        with self._lock:
+            self._entries[key] = (info, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, bucket_name: str, blob_names: list[str]) -> None:
+        """
+        指定したブロブのメタデータを破棄する
+
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param blob_names: ブロブ名のリスト
+        :type blob_names: list[str]
+        """
+        with self._lock:
+            for blob_name in blob_names:
+                self._entries.pop((bucket_name, blob_name), None)
+
+    def clear(self) -> None:
+        """
+        キャッシュと統計をすべて破棄する
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        """
+        キャッシュの統計を返す
+
+        :return: ヒット数、ミス数、エントリ数を含む辞書
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+# プロセス内で共有するキャッシュ
+blob_metadata_cache = BlobMetadataCache()
+
+
+def to_blob_name(uid: str, file_name: str) -> str:
+    """
+    ユーザーIDとファイル名からNFC正規化したブロブ名を作成する
+
+    :param uid: ユーザーID
+    :type uid: str
+    :param file_name: ファイル名
+    :type file_name: str
+    :return: ブロブ名
+    :rtype: str
+    :raises ValueError: ユーザーIDが無効な場合
+    """
+    if not uid or not uid.strip():
+        raise ValueError("Invalid user ID")
+    safe_uid = uid.strip().rstrip("/")
+    return unicodedata.normalize("NFC", f"{safe_uid}/{file_name}")
+
+
+def common_blob_prefix(uid: str, blob_names: set[str]) -> str:
+    """
+    ブロブ名に共通するプレフィックスを返す（最短でも uid/）
+
+    :param uid: ユーザーID
+    :type uid: str
+    :param blob_names: ブロブ名の集合
+    :type blob_names: set[str]
+    :return: 一覧取得に使うプレフィックス
+    :rtype: str
+    """
+    prefix = os.path.commonprefix(sorted(blob_names))
+    uid_prefix = to_blob_name(uid, "")
+    if not prefix.startswith(uid_prefix):
+        prefix = uid_prefix
+    return prefix
+
+
+def list_blob_infos(
+    client: Any, bucket_name: str, prefix: str, targets: set[str]
+) -> dict[str, BlobInfo]:
+    """
+    プレフィックス配下を一覧取得し、対象のブロブのメタデータを返す
+
+    :param client: Cloud Storageクライアント
+    :type client: Any
+    :param bucket_name: バケット名
+    :type bucket_name: str
+    :param prefix: 一覧取得するプレフィックス
+    :type prefix: str
+    :param targets: 対象のブロブ名の集合
+    :type targets: set[str]
+    :return: 存在するブロブ名をキーとし、BlobInfoを値とする辞書
+    :rtype: dict[str, BlobInfo]
+    """
+    found: dict[str, BlobInfo] = {}
+    for blob in client.list_blobs(bucket_name, prefix=prefix, fields=LIST_FIELDS):
+        if blob.name in targets:
+            found[blob.name] = BlobInfo(
+                name=blob.name,
+                exists=True,
+                size=blob.size,
+                generation=blob.generation,
+                content_type=blob.content_type,
+                md5_hash=blob.md5_hash,
+            )
+    return found
+
+
+async def lookup_blobs(bucket_name: str, uid: str, files: list[str]) -> dict[str, BlobInfo]:
+    """
+    ユーザーのプレフィックス配下を1回の一覧取得で調べ、
+    指定されたファイルの存在とメタデータをまとめて返す
+
+    :param bucket_name: バケット名
+    :type bucket_name: str
+    :param uid: ユーザーID
+    :type uid: str
+    :param files: ファイル名のリスト
+    :type files: list[str]
+    :return: ブロブ名をキーとし、BlobInfoを値とする辞書
+    :rtype: dict[str, BlobInfo]
+    :raises ValueError: ユーザーIDが無効な場合
+    """
+    blob_names = [to_blob_name(uid, file_name) for file_name in files if file_name]
+    if not blob_names:
+        return {}
+
+    # キャッシュにあるブロブは一覧取得の対象から外す
+    cached: dict[str, BlobInfo] = {}
+    for name in blob_names:
+        info = blob_metadata_cache.get(bucket_name, name)
+        if info is not None:
+            cached[name] = info
+
+    targets = set(blob_names) - set(cached)
+    if not targets:
+        return {name: cached[name] for name in blob_names}
+
+    # 対象のブロブ名に共通するプレフィックスに絞って一覧を取得
+    prefix = common_blob_prefix(uid, targets)
+    client = get_storage_client()
+    found = await asyncio.to_thread(list_blob_infos, client, bucket_name, prefix, targets)
+    logging.info(f"{prefix} 配下で {len(found)}/{len(targets)} 件のファイルを確認しました")
+
+    for info in found.values():
+        blob_metadata_cache.put(bucket_name, info)
+    found.update(cached)
+
+    return {name: found.get(name, BlobInfo(name=name, exists=False)) for name in blob_names}
+
+
+def invalidate_blob_metadata(uid: str, files: list[str]) -> None:
+    """
+    ユーザーのファイルのメタデータキャッシュを破棄する
+
+    ファイルのアップロード、登録、削除時に呼び出す。破棄するのはこのプロセスのキャッシュだけで、
+    他のワーカーのキャッシュは BLOB_METADATA_CACHE_TTL 秒で期限切れになる。
+
+    :param uid: ユーザーID
+    :type uid: str
+    :param files: ファイル名のリスト
+    :type files: list[str]
+    """
+    bucket_name = os.getenv("BUCKET_NAME")
+    if not bucket_name or not uid or not uid.strip():
+        return
+    blob_metadata_cache.invalidate(
+        bucket_name, [to_blob_name(uid, file_name) for file_name in files if file_name]
+    )
@@ -1,23 +1,23 @@
 import asyncio
-import base64
-import io
 import logging
 import os
 import random
 import unicodedata
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 
-import fitz
 from anthropic import AnthropicVertex
 from dotenv import load_dotenv
 from google.api_core.exceptions import (
     GoogleAPIError,
     InternalServerError,
 )
-from google.cloud import storage
 
-from app.utils.convert_mp4_to_mp3 import convert_mp4_to_mp3
-from app.utils.gemini_extract_text_from_audio import extract_text_from_audio
+from app.utils.blob_metadata import BlobInfo, lookup_blobs
+from app.utils.gemini_extract_text_from_audio import transcribe_media
+from app.utils.image_normalization import read_image_base64
+from app.utils.ingestion_governor import ingestion_user
+from app.utils.pdf_extraction import extract_text_from_pdf
+from app.utils.storage_client import get_storage_client
 
 # 環境変数を読み込む
 load_dotenv()
@@ -33,63 +33,20 @@ BUCKET_NAME: str = str(os.getenv("BUCKET_NAME"))
 logging.basicConfig(level=logging.INFO)
 
 
-# Google Cloud Storageでファイルが存在するかチェック
-async def check_file_exists(bucket_name: str, file_name: str) -> bool:
-    """
-    Google Cloud Storageで指定されたバケット内のファイルが存在するかどうかを確認
-
-    :param bucket_name: バケット名
-    :param file_name: ファイル名
-    :return: ファイルの存在を示す真偽値
-    """
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(file_name)
-    return blob.exists()
-
-
 # GCSのファイル読み込み
-async def read_file(bucket_name: str, file_name: str) -> str:
+async def read_file(bucket_name: str, file_name: str, generation: Optional[int] = None) -> str:
     """
-    Google Cloud Storageからファイルを読み込み、base64エンコードされた文字列として返す
+    Google Cloud Storageから画像を読み込み、縮小・再エンコードしてbase64エンコードした文字列を返す
 
     :param bucket_name: バケット名
     :param file_name: ファイル名
+    :param generation: ブロブの世代番号（指定した場合はローカルキャッシュを利用）
     :return: base64エンコードされたファイル内容
     """
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(file_name)
-    # asyncio.to_threadを使用して同期的な操作を非同期に変換
-    file_content = await asyncio.to_thread(blob.download_as_bytes)
-    # base64エンコーディング
-    base64_encoded = base64.b64encode(file_content).decode("utf-8")
-    return base64_encoded
-
-
-# pdfからテキスト抽出
-async def extract_text_from_pdf(bucket_name: str, file_name: str) -> str:
-    """
-    指定されたPDFファイルからテキストを抽出して返す
-
-    :param bucket_name: バケット名
-    :param file_name: PDFファイル名
-    :return: 抽出されたテキスト
-    """
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(file_name)
-    # blobの内容をメモリにダウンロード
-    pdf_content = await asyncio.to_thread(blob.download_as_bytes)
-    # BytesIOオブジェクトを作成
-    pdf_file = io.BytesIO(pdf_content)
-    # PDFファイルを開く
-    doc = await asyncio.to_thread(fitz.open, stream=pdf_file, filetype="pdf")
-    extracted_text = ""
-    for i, page in enumerate(doc):
-        page_text = await asyncio.to_thread(page.get_text)
-        extracted_text += f"\n# {i+1}ページ\n{page_text}"
-    return extracted_text
+    client = get_storage_client()
+    bucket = client.bucket(bucket_name)
+    # モデルが扱う最大サイズに縮小した画像を、世代番号ごとにキャッシュして返す
+    return await read_image_base64(bucket, file_name, generation)
 
 
 # ファイル拡張子から適切なmedia_typeを返す
@@ -179,8 +136,12 @@ async def generate_content_stream(
     difficulty: str,
     model_name: str = MODEL_NAME,
     bucket_name: str = BUCKET_NAME,
+    blob_infos: Optional[dict[str, BlobInfo]] = None,
+    file_ids: Optional[dict[str, int]] = None,
 ) -> AsyncGenerator[str, None]:
     print("generate_content_stream started")  # デバッグ用
+    # ファイルの解析や変換の順番をユーザーごとに公平に回すため、依頼したユーザーを記録する
+    ingestion_user.set(uid)
     difficulty_jp = await _convert_difficulty_in_japanese(difficulty)
 
     image_files: list[dict] = []
@@ -201,6 +162,9 @@ async def generate_content_stream(
 
     try:
         client = AnthropicVertex(region=REGION, project_id=PROJECT_ID)
+        # ファイルの存在とメタデータを1回の一覧取得でまとめて確認
+        if blob_infos is None:
+            blob_infos = await lookup_blobs(bucket_name, uid, files)
         extracted_text = ""  # 初期化
         for file_name in files:
             # ブロブ名を正規化
@@ -213,11 +177,12 @@ async def generate_content_stream(
                 safe_uid = uid.strip().rstrip("/")
                 file_name = unicodedata.normalize("NFC", f"{safe_uid}/{file_name}")
                 print(f"Processing file: {file_name}")  # デバッグ用
-            if await check_file_exists(bucket_name, file_name):
+            blob_info = blob_infos.get(file_name)
+            if blob_info and blob_info.exists:
                 print(f"File {file_name} exists in bucket {bucket_name}")  # デバッグ用
                 if file_name.lower().endswith((".png", ".jpg", ".jpeg", ".gif", "webp")):
                     print(f"Reading image file: {file_name}")  # デバッグ用
-                    image_file = await read_file(bucket_name, file_name)
+                    image_file = await read_file(bucket_name, file_name, blob_info.generation)
 
                     file_extension = file_name.split(".")[-1].lower()
                     image_files.append(
@@ -234,23 +199,25 @@ async def generate_content_stream(
                     print(f"Added image file: {file_name} to image_files")  # デバッグ用
                 if file_name.lower().endswith(".pdf"):
                     print(f"Extracting text from PDF: {file_name}")  # デバッグ用
-                    extracted_text = await extract_text_from_pdf(bucket_name, file_name)
+                    extracted_text = await extract_text_from_pdf(
+                        bucket_name,
+                        file_name,
+                        blob_info.generation,
+                        # 抽出済みのテキストがあれば再利用する
+                        file_ids.get(file_name) if file_ids else None,
+                    )
                     print(f"Extracted text length: {len(extracted_text)}")  # デバッグ用
                     content.append({"type": "text", "text": extracted_text})
                     print("Added extracted text to content")  # デバッグ用
-                if file_name.lower().endswith(".mp4"):
-                    # ファイルを音声ファイルに変換する
-                    logging.info(f"Converting {file_name} to mp3 format.")
-                    if await convert_mp4_to_mp3(bucket_name, file_name):
-                        print(f"Successfully converted {file_name} to mp3 format.")
-                        extracted_text = await extract_text_from_audio(bucket_name, file_name)
-                        content.append({"type": "text", "text": extracted_text})
-                        print("Added extracted text to content")  # デバッグ用
-                    else:
-                        logging.error(f"Failed to convert {file_name} to mp3 format.")
-                        raise InternalServerError(f"Failed to convert {file_name} to mp3 format.")
-                if file_name.lower().endswith(".mp3") or file_name.lower().endswith(".wav"):
-                    extracted_text = await extract_text_from_audio(bucket_name, file_name)
+                if file_name.lower().endswith((".mp4", ".mp3", ".wav")):
+                    # 動画ファイルはMP3に変換してから文字起こしする
+                    extracted_text = await transcribe_media(
+                        bucket_name,
+                        file_name,
+                        blob_info.generation,
+                        # 文字起こし済みのテキストがあれば再利用する
+                        file_ids.get(file_name) if file_ids else None,
+                    )
                     content.append({"type": "text", "text": extracted_text})
                     print("Added extracted text to content")  # デバッグ用
 
@@ -262,7 +229,6 @@ async def generate_content_stream(
             print(f"Added {len(image_files)} images to content")  # デバッグ用
 
         content.append({"type": "text", "text": prompt})
-        print(f"contents: {content}")
 
         print(f"Starting stream with model: {model_name}")  # デバッグ用
 
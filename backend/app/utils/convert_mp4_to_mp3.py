@@ -1,46 +1,632 @@
 import asyncio
+import datetime
 import logging
 import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import uuid
+from dataclasses import dataclass, field
+from typing import IO, Any, Optional
 
 import ffmpeg
-from google.cloud import storage
+from dotenv import load_dotenv
+from google.api_core.exceptions import NotFound
+
+from app.utils.ingestion_governor import ingestion_governor
+from app.utils.local_storage import LocalBlob
+from app.utils.media_workers import media_workers
+from app.utils.silence_trim import (
+    SILENCE_TRIM,
+    silence_filter,
+    silence_trim_stats,
+    silence_trim_tag,
+)
+from app.utils.storage_client import get_storage_client
+
+# 環境変数を読み込む
+load_dotenv()
+
+# ダウンロードとアップロードをパイプでつないで変換するかどうか（falseの場合は一時ファイルを使う）
+CONVERSION_STREAMING: bool = os.getenv("CONVERSION_STREAMING", "true").lower() == "true"
+
+# ストリーミングで読み書きする単位（バイト単位、GCSの再開可能なアップロードのため256KBの倍数）
+CONVERSION_CHUNK_SIZE: int = int(os.getenv("CONVERSION_CHUNK_SIZE", str(8 * 1024 * 1024)))
+
+# ffmpegにURLで読み込ませる場合の署名付きURLの有効期間
+CONVERSION_URL_EXPIRATION = datetime.timedelta(hours=6)
+
+# 変換のプロファイル
+# （standard: 元の音声のままのMP3、speech: 講義音声向けのモノラル・低ビットレートのMP3）
+CONVERSION_PROFILE: str = os.getenv("CONVERSION_PROFILE", "standard")
+
+# 元の音声がAACの場合は、再エンコードせずに音声だけを取り出すかどうか
+CONVERSION_REMUX_AAC: bool = os.getenv("CONVERSION_REMUX_AAC", "true").lower() == "true"
+
+# 変換中のファイルを一時的に保存するブロブ名の接頭辞
+# （バケットのライフサイクルルールで、残ったファイルを自動的に削除する。README を参照）
+TEMPORARY_PREFIX = "tmp"
+
+# MP4の先頭から調べるボックスの数の上限
+MP4_MAX_TOP_LEVEL_BOXES = 16
 
 # ロギングの設定
 logging.basicConfig(level=logging.INFO)
 
+# 変換元のブロブの世代番号と、変換に使ったプロファイルを記録するメタデータのキー
+SOURCE_GENERATION_KEY = "source_generation"
+PROFILE_KEY = "conversion_profile"
+
+# 無音を取り除いた場合に、変換前と変換後の長さ（秒）を記録するメタデータのキー
+SOURCE_DURATION_KEY = "source_duration"
+DURATION_KEY = "duration"
+
+
+@dataclass(frozen=True)
+class ConversionProfile:
+    """
+    音声の変換方法
+
+    :param name: プロファイル名
+    :type name: str
+    :param extension: 変換後のファイルの拡張子
+    :type extension: str
+    :param format: ffmpegの出力形式
+    :type format: str
+    :param mime_type: 変換後のファイルをGeminiに渡すときのMIMEタイプ
+    :type mime_type: str
+    :param content_type: 変換後のファイルを保存するときのContent-Type
+    :type content_type: str
+    :param options: ffmpegの出力オプション
+    :type options: dict[str, Any]
+    """
+
+    name: str
+    extension: str
+    format: str
+    mime_type: str
+    content_type: str
+    options: dict[str, Any] = field(default_factory=dict)
+
+
+# 選択できる変換のプロファイル
+CONVERSION_PROFILES = {
+    "standard": ConversionProfile(
+        "standard", ".mp3", "mp3", "audio/mp3", "audio/mpeg", {"acodec": "libmp3lame"}
+    ),
+    # 話し声の帯域に合わせてモノラル・22.05kHz・48kbpsにし、ファイルサイズを小さくする
+    "speech": ConversionProfile(
+        "speech",
+        ".mp3",
+        "mp3",
+        "audio/mp3",
+        "audio/mpeg",
+        {"acodec": "libmp3lame", "ac": 1, "ar": 22050, "audio_bitrate": "48k"},
+    ),
+}
+
+# AACの音声を再エンコードせずにADTS形式で取り出すプロファイル
+REMUX_PROFILE = ConversionProfile(
+    "remux", ".aac", "adts", "audio/aac", "audio/aac", {"acodec": "copy"}
+)
+
+# 再エンコードせずに取り出す音声のコーデック
+REMUX_CODECS = {"aac"}
+
+
+@dataclass(frozen=True)
+class AudioArtifact:
+    """
+    MP4ファイルから変換した音声ファイル
+
+    :param blob_name: ブロブ名
+    :type blob_name: str
+    :param mime_type: MIMEタイプ
+    :type mime_type: str
+    :param profile: 変換に使ったプロファイル名
+    :type profile: str
+    :param trimmed: 無音を取り除いたかどうか（音声の位置が元の動画の時刻と対応しない）
+    :type trimmed: bool
+    """
+
+    blob_name: str
+    mime_type: str
+    profile: str
+    trimmed: bool = False
+
+
+# MP4ファイルから変換したMP3ファイルのブロブ名を返す
+def get_mp3_blob_name(file_name: str) -> str:
+    return f'mp3/{file_name.replace(".mp4", ".mp3")}'
+
+
+# MP4ファイルから変換した音声ファイルのブロブ名を返す
+def get_audio_blob_name(file_name: str, profile: ConversionProfile) -> str:
+    return f'mp3/{file_name.replace(".mp4", profile.extension)}'
+
+
+def get_temporary_blob_name(category: str, file_name: str) -> str:
+    """
+    処理中のファイルを一時的に保存するブロブ名を返す
+
+    :param category: 処理の種類（conversions、segments など）
+    :type category: str
+    :param file_name: 保存するファイル名
+    :type file_name: str
+    :return: 実行ごとに異なるブロブ名
+    :rtype: str
+    """
+    return f"{TEMPORARY_PREFIX}/{category}/{uuid.uuid4().hex}/{os.path.basename(file_name)}"
+
+
+def copy_blob(source: Any, destination: Any) -> None:
+    """
+    同じバケット内でブロブをコピーする（大きなファイルは複数回のリクエストでコピーする）
+
+    :param source: コピー元のブロブ
+    :type source: Any
+    :param destination: コピー先のブロブ
+    :type destination: Any
+    """
+    token, _, _ = destination.rewrite(source)
+    while token is not None:
+        token, _, _ = destination.rewrite(source, token=token)
+
+
+async def delete_temporary_blob(blob: Any) -> None:
+    """
+    一時的に保存したブロブを削除する（削除に失敗してもライフサイクルルールで削除される）
+
+    :param blob: 削除するブロブ
+    :type blob: Any
+    """
+    try:
+        await asyncio.to_thread(blob.delete)
+    except NotFound:
+        pass
+    except Exception as e:
+        logging.warning(f"一時ファイルの削除に失敗しました: {blob.name}: {e}")
+
+
+def get_conversion_profile(name: Optional[str] = None) -> ConversionProfile:
+    """
+    プロファイル名から変換のプロファイルを返す（不明な名前の場合は standard）
+
+    :param name: プロファイル名（省略した場合は CONVERSION_PROFILE）
+    :type name: Optional[str]
+    :return: 変換のプロファイル
+    :rtype: ConversionProfile
+    """
+    if name is None:
+        name = CONVERSION_PROFILE
+    profile = CONVERSION_PROFILES.get(name)
+    if profile is None:
+        logging.warning(f"不明な変換のプロファイルのため standard を使います: {name}")
+        return CONVERSION_PROFILES["standard"]
+    return profile
+
+
+def probe_audio_codec(input_url: str) -> Optional[str]:
+    """
+    ffprobeで最初の音声トラックのコーデックを調べる（ブロッキング処理のためスレッドで実行する）
+
+    :param input_url: ファイルのパスまたは署名付きURL
+    :type input_url: str
+    :return: コーデック名。音声トラックがない場合や調べられない場合はNone
+    :rtype: Optional[str]
+    """
+    try:
+        info = ffmpeg.probe(input_url, select_streams="a:0")
+    except ffmpeg.Error as e:
+        logging.warning(f"音声のコーデックを調べられませんでした: {e}")
+        return None
+    for stream in info.get("streams", []):
+        return str(stream.get("codec_name"))
+    return None
+
+
+def probe_media_duration(input_url: str) -> Optional[float]:
+    """
+    ffprobeで音声・動画の長さを調べる（ブロッキング処理のためスレッドで実行する）
 
-# MP4のファイルをMP3に変換してGCSに保存
-async def convert_mp4_to_mp3(bucket_name: str, file_name: str) -> bool:
-    # GCSからファイルを取得
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(file_name)
-
-    mp4_base_name = os.path.basename(file_name)
-    mp4_file_path = os.path.normpath(f"/tmp/{mp4_base_name}")
-    if not mp4_file_path.startswith("/tmp/"):
-        raise ValueError("Invalid file path")
-    await asyncio.to_thread(blob.download_to_filename, mp4_file_path)
-
-    # MP4ファイルをMP3に変換
-    mp3_base_name = mp4_base_name.replace(".mp4", ".mp3")
-    mp3_file_path = os.path.normpath(f"/tmp/{mp3_base_name}")
-    if not mp3_file_path.startswith("/tmp/"):
-        raise ValueError("Invalid file path")
-    await asyncio.to_thread(
-        lambda: ffmpeg.input(mp4_file_path)
-        .output(mp3_file_path, format="mp3", acodec="libmp3lame")
-        .run()
+    :param input_url: ファイルのパスまたは署名付きURL
+    :type input_url: str
+    :return: 長さ（秒）。調べられない場合はNone
+    :rtype: Optional[float]
+    """
+    try:
+        info = ffmpeg.probe(input_url)
+        return float(info["format"]["duration"])
+    except (ffmpeg.Error, KeyError, TypeError, ValueError) as e:
+        logging.warning(f"長さを調べられませんでした: {e}")
+        return None
+
+
+def is_streamable_mp4(file_obj: IO[bytes]) -> bool:
+    """
+    MP4の先頭のボックスを調べ、先頭から順に読むだけで変換できるかどうかを判定する
+
+    moov ボックス（インデックス）が mdat ボックス（データ）より前にある場合は、
+    ffmpegが標準入力から読み込んで変換できる。
+
+    :param file_obj: シークできるMP4のファイルオブジェクト
+    :type file_obj: IO[bytes]
+    :return: moov ボックスが mdat ボックスより前にある場合はTrue
+    :rtype: bool
+    """
+    offset = 0
+    for _ in range(MP4_MAX_TOP_LEVEL_BOXES):
+        file_obj.seek(offset)
+        header = file_obj.read(16)
+        if len(header) < 8:
+            return False
+        size = int.from_bytes(header[:4], "big")
+        box_type = header[4:8]
+        if box_type == b"moov":
+            return True
+        if box_type == b"mdat":
+            return False
+        if size == 1 and len(header) == 16:
+            size = int.from_bytes(header[8:16], "big")
+        if size < 8:
+            # ファイルの末尾まで続くボックス（size == 0）や壊れたボックス
+            return False
+        offset += size
+    return False
+
+
+def ffmpeg_input_url(blob: Any) -> str:
+    """
+    ffmpegに読み込ませるブロブの場所を返す（ブロッキング処理のためスレッドで実行する）
+
+    ローカルストレージのファイルはパスを、それ以外は範囲指定で読み込める署名付きURLを返す。
+
+    :param blob: ブロブ
+    :type blob: Any
+    :return: ファイルのパスまたは署名付きURL
+    :rtype: str
+    """
+    if isinstance(blob, LocalBlob):
+        return str(blob.path)
+    return str(
+        blob.generate_signed_url(version="v4", expiration=CONVERSION_URL_EXPIRATION, method="GET")
     )
 
-    # MP3ファイルをGCSにアップロード
-    upload_file_name = f'mp3/{file_name.replace(".mp4", ".mp3")}'
-    mp3_blob = bucket.blob(upload_file_name)
-    await asyncio.to_thread(mp3_blob.upload_from_filename, mp3_file_path)
 
-    # 一時ファイルを削除
-    await asyncio.to_thread(os.remove, mp4_file_path)
-    await asyncio.to_thread(os.remove, mp3_file_path)
+def feed_stdin(reader: IO[bytes], process: subprocess.Popen) -> None:
+    """
+    ダウンロードしたMP4をffmpegの標準入力に書き込む（スレッドで実行する）
+
+    :param reader: MP4のファイルオブジェクト
+    :type reader: IO[bytes]
+    :param process: ffmpegのプロセス
+    :type process: subprocess.Popen
+    """
+    assert process.stdin is not None
+    try:
+        while chunk := reader.read(CONVERSION_CHUNK_SIZE):
+            process.stdin.write(chunk)
+    except BrokenPipeError:
+        # ffmpegが先に終了した場合（終了コードで失敗を判定する）
+        pass
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def drain_stdout(process: subprocess.Popen, writer: IO[bytes]) -> None:
+    """
+    ffmpegの標準出力のMP3をアップロードに書き込む（スレッドで実行する）
+
+    :param process: ffmpegのプロセス
+    :type process: subprocess.Popen
+    :param writer: MP3のアップロード先のファイルオブジェクト
+    :type writer: IO[bytes]
+    """
+    assert process.stdout is not None
+    try:
+        while chunk := process.stdout.read(CONVERSION_CHUNK_SIZE):
+            writer.write(chunk)
+    except Exception:
+        # 読み込みを止めるとffmpegと標準入力への書き込みが止まるため、プロセスを終了する
+        process.kill()
+        raise
+
+
+class Mp3Converter:
+    """
+    MP4ファイルをMP3に変換し、変換元の世代番号を付けてGCSに保存するクラス
+
+    変換には CONVERSION_PROFILE のプロファイルを使う。元の音声がAACの場合は、
+    再エンコードせずに音声だけをADTS形式で取り出す（変換よりはるかに速く、サイズも小さい）。
+    変換済みのファイルのメタデータに記録した世代番号とプロファイルが同じ場合は変換しない。
+    同じファイルの同じ世代に対する変換が同時に要求された場合は、実行中の1つの変換の
+    結果を共有する。変換の待機が取り消されても、実行中の変換は取り消さない。
+    """
+
+    def __init__(self) -> None:
+        self._in_flight: dict[tuple[str, str, Any], asyncio.Future[Optional[AudioArtifact]]] = {}
+        self._lock = threading.Lock()
+        self.converted = 0
+        self.remuxed = 0
+        self.reused = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    async def convert(
+        self, bucket_name: str, file_name: str, generation: Optional[int] = None
+    ) -> Optional[AudioArtifact]:
+        """
+        MP4ファイルを音声ファイルに変換する（変換済みの場合は変換しない）
+
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param file_name: MP4ファイル名
+        :type file_name: str
+        :param generation: 変換元のブロブの世代番号（省略した場合はGCSから取得）
+        :type generation: Optional[int]
+        :return: 変換した音声ファイル。変換後のファイルが存在しない場合はNone
+        :rtype: Optional[AudioArtifact]
+        """
+        client = get_storage_client()
+        bucket = client.bucket(bucket_name)
+        if generation is None:
+            blob = bucket.blob(file_name)
+            await asyncio.to_thread(blob.reload)
+            generation = blob.generation
+
+        key = (bucket_name, file_name, generation)
+        future = self._in_flight.get(key)
+        if future is not None:
+            self._count("coalesced")
+        else:
+            future = asyncio.ensure_future(self._convert(bucket, file_name, generation))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # 待機が取り消されても、他の待機中のリクエストのために変換は続ける
+        return await asyncio.shield(future)
+
+    async def _is_current(self, mp3_blob: Any, generation: Any, profile: ConversionProfile) -> bool:
+        try:
+            await asyncio.to_thread(mp3_blob.reload)
+        except NotFound:
+            return False
+        metadata = mp3_blob.metadata or {}
+        # プロファイルを記録していないMP3は standard で変換したもの
+        return bool(
+            metadata.get(SOURCE_GENERATION_KEY) == str(generation)
+            and metadata.get(PROFILE_KEY, "standard") == self._profile_tag(profile)
+        )
+
+    def _trims_silence(self, profile: ConversionProfile) -> bool:
+        # 再エンコードしない場合はフィルタを使えない
+        return SILENCE_TRIM and profile is not REMUX_PROFILE
+
+    def _profile_tag(self, profile: ConversionProfile) -> str:
+        if self._trims_silence(profile):
+            return f"{profile.name}+{silence_trim_tag()}"
+        return profile.name
+
+    def _output_options(self, profile: ConversionProfile) -> dict[str, Any]:
+        options = {**profile.options, **media_workers.output_options()}
+        if self._trims_silence(profile):
+            options["af"] = silence_filter()
+        return options
+
+    async def _probe_duration(self, blob: Any) -> Optional[float]:
+        input_url = await asyncio.to_thread(ffmpeg_input_url, blob)
+        return await media_workers.run(lambda: probe_media_duration(input_url))
+
+    async def _record_trimmed(self, file_name: str, source: Any, mp3_blob: Any) -> dict[str, str]:
+        """
+        無音を取り除く前と後の長さを調べて記録し、メタデータに追加する値を返す
+        """
+        source_seconds = await self._probe_duration(source)
+        output_seconds = await self._probe_duration(mp3_blob)
+        if source_seconds is None or output_seconds is None:
+            return {}
+        silence_trim_stats.record(file_name, source_seconds, output_seconds)
+        return {
+            SOURCE_DURATION_KEY: f"{source_seconds:.1f}",
+            DURATION_KEY: f"{output_seconds:.1f}",
+        }
+
+    async def _transcode_streaming(
+        self, source: Any, mp3_blob: Any, profile: ConversionProfile
+    ) -> None:
+        """
+        MP4のダウンロード、ffmpegでの変換、MP3のアップロードをパイプでつないで実行する
+
+        ローカルストレージのファイルはパスで、先頭から読める（moov が先頭にある）MP4は
+        標準入力で、それ以外は署名付きURLでffmpegに読み込ませる。ディスクやメモリに
+        ファイル全体を保持しないため、動画の長さによらずメモリ使用量は一定になる。
+        """
+        reader: Optional[IO[bytes]] = None
+        if isinstance(source, LocalBlob):
+            input_spec = ffmpeg_input_url(source)
+        else:
+            stream = await asyncio.to_thread(source.open, "rb", chunk_size=CONVERSION_CHUNK_SIZE)
+            if await asyncio.to_thread(is_streamable_mp4, stream):
+                await asyncio.to_thread(stream.seek, 0)
+                reader = stream
+                input_spec = "pipe:"
+            else:
+                # シークが必要なMP4は、ffmpegに範囲指定のリクエストで読み込ませる
+                await asyncio.to_thread(stream.close)
+                input_spec = await asyncio.to_thread(ffmpeg_input_url, source)
+
+        # 途中で失敗しても保存先に途中までのファイルが残らないように、一時的なブロブに書き込む
+        # （GCSの書き込みは破棄できず、close() やガベージコレクションでアップロードされる）
+        temp_blob = mp3_blob.bucket.blob(get_temporary_blob_name("conversions", mp3_blob.name))
+        try:
+            writer = await asyncio.to_thread(
+                temp_blob.open,
+                "wb",
+                chunk_size=CONVERSION_CHUNK_SIZE,
+                content_type=profile.content_type,
+            )
+            try:
+                # ffmpegのプロセス数を制限し、入出力と終了の待機は専用のスレッドで行う
+                async with media_workers.slot():
+                    process = (
+                        ffmpeg.input(input_spec)
+                        .output("pipe:", format=profile.format, **self._output_options(profile))
+                        .run_async(
+                            cmd=media_workers.ffmpeg_cmd(),
+                            pipe_stdin=reader is not None,
+                            pipe_stdout=True,
+                        )
+                    )
+                    try:
+                        tasks = [media_workers.to_thread(drain_stdout, process, writer)]
+                        if reader is not None:
+                            tasks.append(media_workers.to_thread(feed_stdin, reader, process))
+                        # どちらかが失敗しても、もう一方のスレッドが終わるまで待つ
+                        results = await asyncio.gather(*tasks, return_exceptions=True)
+                        return_code = await media_workers.to_thread(process.wait)
+                        for result in results:
+                            if isinstance(result, BaseException):
+                                raise result
+                        if return_code != 0:
+                            raise ffmpeg.Error("ffmpeg", None, None)
+                    except BaseException:
+                        process.kill()
+                        raise
+            except BaseException:
+                # 破棄できる書き込み先は破棄し、それ以外は閉じてから一時的なブロブを削除する
+                await asyncio.to_thread(getattr(writer, "abort", writer.close))
+                raise
+            await asyncio.to_thread(writer.close)
+            await asyncio.to_thread(copy_blob, temp_blob, mp3_blob)
+        finally:
+            if reader is not None:
+                await asyncio.to_thread(reader.close)
+            await delete_temporary_blob(temp_blob)
+
+    async def _transcode_with_files(
+        self, source: Any, mp3_blob: Any, profile: ConversionProfile
+    ) -> None:
+        """
+        MP4を一時ディレクトリにダウンロードして変換し、MP3をアップロードする
+        """
+        # 同じファイル名の変換が重ならないように、変換ごとに一時ディレクトリを作る
+        temp_dir = await asyncio.to_thread(tempfile.mkdtemp, prefix="convert-")
+        try:
+            mp4_file_path = os.path.join(temp_dir, "source.mp4")
+            mp3_file_path = os.path.join(temp_dir, f"output{profile.extension}")
+            await asyncio.to_thread(source.download_to_filename, mp4_file_path)
+            await media_workers.run(
+                lambda: ffmpeg.input(mp4_file_path)
+                .output(mp3_file_path, format=profile.format, **self._output_options(profile))
+                .run(cmd=media_workers.ffmpeg_cmd())
+            )
+            await asyncio.to_thread(
+                mp3_blob.upload_from_filename, mp3_file_path, content_type=profile.content_type
+            )
+        finally:
+            # 一時ファイルを削除
+            await asyncio.to_thread(shutil.rmtree, temp_dir, True)
+
+    async def _can_remux(self, source: Any) -> bool:
+        input_url = await asyncio.to_thread(ffmpeg_input_url, source)
+        return await media_workers.run(lambda: probe_audio_codec(input_url)) in REMUX_CODECS
+
+    async def _convert(
+        self, bucket: Any, file_name: str, generation: Any
+    ) -> Optional[AudioArtifact]:
+        profile = get_conversion_profile()
+        # 無音を取り除く場合は再エンコードが必要なため、AACを取り出さない
+        remux = CONVERSION_REMUX_AAC and not SILENCE_TRIM
+        candidates = [REMUX_PROFILE, profile] if remux else [profile]
+        for candidate in candidates:
+            mp3_blob = bucket.blob(get_audio_blob_name(file_name, candidate))
+            if await self._is_current(mp3_blob, generation, candidate):
+                self._count("reused")
+                return AudioArtifact(
+                    mp3_blob.name,
+                    candidate.mime_type,
+                    candidate.name,
+                    self._trims_silence(candidate),
+                )
+
+        source = bucket.blob(file_name)
+        try:
+            # 元の音声がAACの場合は、再エンコードせずに取り出す
+            if remux and await self._can_remux(source):
+                profile = REMUX_PROFILE
+            mp3_blob = bucket.blob(get_audio_blob_name(file_name, profile))
+
+            # 他の解析や変換とCPUを取り合わないように、順番を待ってから変換する
+            # （再エンコードしない場合はCPUをほとんど使わない）
+            async with ingestion_governor.slot(cpu=0 if profile is REMUX_PROFILE else 1):
+                if CONVERSION_STREAMING:
+                    await self._transcode_streaming(source, mp3_blob, profile)
+                else:
+                    await self._transcode_with_files(source, mp3_blob, profile)
+
+            # 変換が完了してから世代番号を記録し、途中で失敗したMP3を再利用しないようにする
+            metadata = {
+                SOURCE_GENERATION_KEY: str(generation),
+                PROFILE_KEY: self._profile_tag(profile),
+            }
+            if self._trims_silence(profile):
+                # 取り除いた長さをファイルごとに確認できるように記録する
+                metadata.update(await self._record_trimmed(file_name, source, mp3_blob))
+            mp3_blob.metadata = metadata
+            await asyncio.to_thread(mp3_blob.patch)
+        except Exception:
+            self._count("failed")
+            raise
+
+        # mp3_blob.exists() は同期的なので非同期にラップ
+        if not await asyncio.to_thread(mp3_blob.exists):
+            self._count("failed")
+            return None
+        self._count("remuxed" if profile is REMUX_PROFILE else "converted")
+        return AudioArtifact(
+            mp3_blob.name, profile.mime_type, profile.name, self._trims_silence(profile)
+        )
+
+    def stats(self) -> dict[str, float]:
+        """
+        変換の統計を返す
+
+        :return: 変換数、再エンコードせずに取り出した数、変換済みのファイルを再利用した数、
+            実行中の変換を共有した数、失敗数を含む辞書
+        :rtype: dict[str, float]
+        """
+        with self._lock:
+            return {
+                "converted": self.converted,
+                "remuxed": self.remuxed,
+                "reused": self.reused,
+                "coalesced": self.coalesced,
+                "failed": self.failed,
+                "in_flight": len(self._in_flight),
+            }
+
+
+# プロセス内で共有する変換
+mp3_converter = Mp3Converter()
+
+
+# MP4のファイルを音声ファイルに変換してGCSに保存し、変換したファイルを返す
+# （変換済みの場合は変換しない）
+async def convert_mp4_to_audio(
+    bucket_name: str, file_name: str, generation: Optional[int] = None
+) -> Optional[AudioArtifact]:
+    return await mp3_converter.convert(bucket_name, file_name, generation)
+
 
-    # mp3_blob.exists() は同期的なので非同期にラップ
-    return await asyncio.to_thread(mp3_blob.exists)
+# MP4のファイルをMP3に変換してGCSに保存（変換済みの場合は変換しない）
+async def convert_mp4_to_mp3(
+    bucket_name: str, file_name: str, generation: Optional[int] = None
+) -> bool:
+    return await convert_mp4_to_audio(bucket_name, file_name, generation) is not None
@@ -1,20 +1,25 @@
 import asyncio
-import base64
-import io
 import logging
 import os
 import random
 import unicodedata
 from typing import Any, Callable, Dict, List, Optional, Protocol, Set, TypeVar
 
-import fitz
 from anthropic import AnthropicVertex
 from dotenv import load_dotenv
 from google.api_core.exceptions import GoogleAPIError, InternalServerError
-from google.cloud import storage
 
-from app.utils.convert_mp4_to_mp3 import convert_mp4_to_mp3
-from app.utils.gemini_extract_text_from_audio import extract_text_from_audio
+from app.utils.blob_metadata import BlobInfo, lookup_blobs
+from app.utils.gemini_extract_text_from_audio import transcribe_media
+from app.utils.image_normalization import read_image_base64
+from app.utils.ingestion_governor import ingestion_user
+from app.utils.pdf_extraction import load_pdf_pages
+from app.utils.prompt_packer import (
+    PromptDocument,
+    estimate_reserved_tokens,
+    prompt_packer,
+)
+from app.utils.storage_client import get_storage_client
 
 # 環境変数を読み込む
 load_dotenv()
@@ -157,55 +162,19 @@ prompt: str = f"""
 """
 
 
-async def check_file_exists(bucket_name: str, file_name: str) -> bool:
+async def read_file(bucket_name: str, file_name: str, generation: Optional[int] = None) -> str:
     """
-    Google Cloud Storageで指定されたバケット内のファイルが存在するかどうかを確認
-
-    :param bucket_name: バケット名
-    :param file_name: ファイル名
-    :return: ファイルの存在を示す真偽値
-    """
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(file_name)
-    return blob.exists()
-
-
-async def read_file(bucket_name: str, file_name: str) -> str:
-    """
-    Google Cloud Storageからファイルを読み込み、base64エンコードされた文字列として返す
+    Google Cloud Storageから画像を読み込み、縮小・再エンコードしてbase64エンコードした文字列を返す
 
     :param bucket_name: バケット名
     :param file_name: ファイル名
+    :param generation: ブロブの世代番号（指定した場合はローカルキャッシュを利用）
     :return: base64エンコードされたファイル内容
     """
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(file_name)
-    file_content: bytes = await asyncio.to_thread(blob.download_as_bytes)
-    base64_encoded: str = base64.b64encode(file_content).decode("utf-8")
-    return base64_encoded
-
-
-async def extract_text_from_pdf(bucket_name: str, file_name: str) -> str:
-    """
-    指定されたPDFファイルからテキストを抽出して返す
-
-    :param bucket_name: バケット名
-    :param file_name: PDFファイル名
-    :return: 抽出されたテキスト
-    """
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(file_name)
-    pdf_content: bytes = await asyncio.to_thread(blob.download_as_bytes)
-    pdf_file = io.BytesIO(pdf_content)
-    doc = await asyncio.to_thread(fitz.open, stream=pdf_file, filetype="pdf")
-    extracted_text: str = ""
-    for i, page in enumerate(doc):
-        page_text: str = await asyncio.to_thread(page.get_text)
-        extracted_text += f"\n# {i+1}ページ\n{page_text}"
-    return extracted_text
+    client = get_storage_client()
+    bucket = client.bucket(bucket_name)
+    # モデルが扱う最大サイズに縮小した画像を、世代番号ごとにキャッシュして返す
+    return await read_image_base64(bucket, file_name, generation)
 
 
 def get_media_type(extension: str) -> str:
@@ -229,8 +198,12 @@ async def generate_essay_json(
     difficulty: str,
     model_name: str = MODEL_NAME,
     bucket_name: str = BUCKET_NAME,
+    blob_infos: Optional[Dict[str, BlobInfo]] = None,
+    file_ids: Optional[Dict[str, int]] = None,
 ) -> Dict[str, Any]:
     print("generate_essay_json started")
+    # ファイルの解析や変換の順番をユーザーごとに公平に回すため、依頼したユーザーを記録する
+    ingestion_user.set(uid)
     print(f"tool_name: {tool_name}")
     print(f"tool_definition: {tool_definition}")
 
@@ -240,7 +213,10 @@ async def generate_essay_json(
 
     try:
         client = AnthropicVertex(region=REGION, project_id=PROJECT_ID)
-        all_extracted_text: str = ""
+        # ファイルの存在とメタデータを1回の一覧取得でまとめて確認
+        if blob_infos is None:
+            blob_infos = await lookup_blobs(bucket_name, uid, files)
+        documents: List[PromptDocument] = []
 
         for file_name in files:
             if not uid or not uid.strip():
@@ -250,20 +226,27 @@ async def generate_essay_json(
             normalized_file_name: str = unicodedata.normalize("NFC", f"{safe_uid}/{file_name}")
             print(f"Processing file: {normalized_file_name}")
 
-            if await check_file_exists(bucket_name, normalized_file_name):
+            blob_info: Optional[BlobInfo] = blob_infos.get(normalized_file_name)
+            if blob_info and blob_info.exists:
                 print(f"File {normalized_file_name} exists in bucket {bucket_name}")
 
                 if normalized_file_name.lower().endswith(".pdf"):
                     print(f"Extracting text from PDF: {normalized_file_name}")
-                    extracted_text: str = await extract_text_from_pdf(
-                        bucket_name, normalized_file_name
+                    pages: List[str] = await load_pdf_pages(
+                        bucket_name,
+                        normalized_file_name,
+                        blob_info.generation,
+                        # 抽出済みのテキストがあれば再利用する
+                        file_ids.get(normalized_file_name) if file_ids else None,
                     )
-                    print(f"Extracted text length: {len(extracted_text)}")
-                    all_extracted_text += f"\n=== {normalized_file_name} ===\n{extracted_text}"
+                    print(f"Extracted pages: {len(pages)}")
+                    documents.append(PromptDocument(normalized_file_name, pages))
 
                 elif normalized_file_name.lower().endswith((".png", ".jpg", ".jpeg")):
                     print(f"Reading image file: {normalized_file_name}")
-                    image_file: str = await read_file(bucket_name, normalized_file_name)
+                    image_file: str = await read_file(
+                        bucket_name, normalized_file_name, blob_info.generation
+                    )
                     file_extension: str = normalized_file_name.split(".")[-1].lower()
                     image_files.append(
                         {
@@ -277,45 +260,42 @@ async def generate_essay_json(
                     )
                     print(f"Added image file: {normalized_file_name} to image_files")
 
-                elif normalized_file_name.lower().endswith(".mp4"):
-                    logging.info(f"Converting {normalized_file_name} to mp3 format.")
-                    if await convert_mp4_to_mp3(bucket_name, normalized_file_name):
-                        print(f"Successfully converted {normalized_file_name} to mp3 format.")
-                        audio_text: str = await extract_text_from_audio(
-                            bucket_name, normalized_file_name
-                        )
-                        all_extracted_text += f"\n=== {normalized_file_name} ===\n{audio_text}"
-                    else:
-                        logging.error(f"Failed to convert {normalized_file_name} to mp3 format.")
-                        raise InternalServerError(
-                            f"Failed to convert {normalized_file_name} to mp3 format."
-                        )
-
-                elif normalized_file_name.lower().endswith((".mp3", ".wav")):
-                    audio_content: str = await extract_text_from_audio(
-                        bucket_name, normalized_file_name
+                elif normalized_file_name.lower().endswith((".mp4", ".mp3", ".wav")):
+                    # 動画ファイルはMP3に変換してから文字起こしし、文字起こし済みなら再利用する
+                    audio_text: str = await transcribe_media(
+                        bucket_name,
+                        normalized_file_name,
+                        blob_info.generation,
+                        file_ids.get(normalized_file_name) if file_ids else None,
+                    )
+                    documents.append(
+                        PromptDocument(normalized_file_name, [audio_text], paged=False)
                     )
-                    all_extracted_text += f"\n=== {normalized_file_name} ===\n{audio_content}"
 
-        if all_extracted_text:
-            content.append({"type": "text", "text": f"講義テキスト:\n{all_extracted_text}"})
-            print(f"Added extracted text to content (length: {len(all_extracted_text)})")
+        instruction: str = (
+            f"上記の講義テキスト{title}の内容に基づいて、"
+            f"{tool_name}ツールを使用して問題を作成して下さい。"
+            f"なお、問題の難易度は{difficulty_jp}としてください。"
+        )
+        # 講義テキストをモデルのトークン数の上限に収める
+        packed = prompt_packer.pack(
+            documents,
+            model_name,
+            query=title,
+            reserved_tokens=estimate_reserved_tokens(
+                instruction, str(tool_definition), image_count=len(image_files)
+            ),
+        )
+        if packed.text:
+            content.append({"type": "text", "text": f"講義テキスト:\n{packed.text}"})
+            print(f"Added extracted text to content (tokens: {packed.estimated_tokens})")
 
         if image_files:
             for i, image in enumerate(image_files, 1):
                 content.extend([{"type": "text", "text": f"Image {i}:"}, image])
             print(f"Added {len(image_files)} images to content")
 
-        content.append(
-            {
-                "type": "text",
-                "text": (
-                    f"上記の講義テキスト{title}の内容に基づいて、"
-                    f"{tool_name}ツールを使用して問題を作成して下さい。"
-                    f"なお、問題の難易度は{difficulty_jp}としてください。"
-                ),
-            }
-        )
+        content.append({"type": "text", "text": instruction})
         print("Added prompt to content")
 
         print("Content structure:")
@@ -347,6 +327,7 @@ async def generate_essay_json(
         response = await retry_create_with_backoff(
             create_request, retryable_status_codes={429, 503, 504}
         )
+        prompt_packer.record_usage(model_name, packed, response)
 
         if response.content and len(response.content) > 0:
             if response.content[0].type == "tool_use":
@@ -0,0 +1,269 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+from typing import Optional
+
+from dotenv import load_dotenv
+from google.api_core.exceptions import NotFound
+
+from app.cruds.file_extracts import file_extract_exists, get_file_extract, save_file_extract
+from app.database import async_session
+from app.utils.storage_client import get_storage_client
+
+# 環境変数を読み込む
+load_dotenv()
+
+# 抽出結果を圧縮したファイルをCloud Storageにも保存するかどうか
+FILE_EXTRACT_SIDECAR: bool = os.getenv("FILE_EXTRACT_SIDECAR", "false").lower() == "true"
+
+# 抽出結果のファイルを保存するプレフィックス
+EXTRACT_SIDECAR_PREFIX = "extracts"
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+
+def sidecar_blob_name(file_id: int, generation: int, variant: str = "") -> str:
+    """
+    抽出結果を保存するブロブ名を返す
+
+    :param file_id: ファイルのID
+    :type file_id: int
+    :param generation: 抽出元のブロブの世代番号
+    :type generation: int
+    :param variant: 抽出方法（PDFは pdf_variant、文字起こしは transcript_variant で決める）
+    :type variant: str
+    :return: ブロブ名
+    :rtype: str
+    """
+    if not variant:
+        return f"{EXTRACT_SIDECAR_PREFIX}/{file_id}/{generation}.json.gz"
+    # ブロブ名に使えない文字を置き換える
+    safe_variant = re.sub(r"[^A-Za-z0-9._-]", "_", variant)
+    return f"{EXTRACT_SIDECAR_PREFIX}/{file_id}/{generation}.{safe_variant}.json.gz"
+
+
+class FileExtractStore:
+    """
+    ファイルから抽出したページごとのテキストを (ファイルID, 世代番号, 抽出方法) をキーに
+    保存するストア
+
+    file_extracts テーブルを優先し、sidecar が有効な場合はCloud Storage上の
+    gzip圧縮したJSONも参照する。保存や読み込みに失敗しても例外は送出せず、
+    呼び出し元は抽出し直せるようにする。
+
+    :param sidecar: Cloud Storageにも保存するかどうか
+    :type sidecar: bool
+    """
+
+    def __init__(self, sidecar: bool = FILE_EXTRACT_SIDECAR) -> None:
+        self.sidecar = sidecar
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.sidecar_hits = 0
+        self.misses = 0
+
+    async def _read_sidecar(
+        self, bucket_name: str, file_id: int, generation: int, variant: str
+    ) -> Optional[list[str]]:
+        blob_name = sidecar_blob_name(file_id, generation, variant)
+        blob = get_storage_client().bucket(bucket_name).blob(blob_name)
+        try:
+            compressed = await asyncio.to_thread(blob.download_as_bytes)
+        except NotFound:
+            return None
+        pages: list[str] = await asyncio.to_thread(
+            lambda: json.loads(gzip.decompress(compressed).decode("utf-8"))
+        )
+        return pages
+
+    async def _write_sidecar(
+        self, bucket_name: str, file_id: int, generation: int, pages: list[str], variant: str
+    ) -> None:
+        client = get_storage_client()
+        bucket = client.bucket(bucket_name)
+        blob_name = sidecar_blob_name(file_id, generation, variant)
+        compressed = await asyncio.to_thread(
+            gzip.compress, json.dumps(pages, ensure_ascii=False).encode("utf-8")
+        )
+        await asyncio.to_thread(
+            bucket.blob(blob_name).upload_from_string, compressed, content_type="application/gzip"
+        )
+
+        # 同じファイルの古い世代の抽出結果を削除する
+        def delete_old() -> None:
+            prefix = f"{EXTRACT_SIDECAR_PREFIX}/{file_id}/"
+            for blob in client.list_blobs(bucket_name, prefix=prefix):
+                if not blob.name.startswith(f"{prefix}{generation}."):
+                    blob.delete()
+
+        await asyncio.to_thread(delete_old)
+
+    async def _save_to_db(
+        self, file_id: int, generation: int, pages: list[str], variant: str
+    ) -> None:
+        async with async_session() as db:
+            await save_file_extract(db, file_id, generation, pages, variant)
+
+    async def load(
+        self, bucket_name: str, file_id: int, generation: int, variant: str = ""
+    ) -> Optional[list[str]]:
+        """
+        保存済みのページごとのテキストを読み込む
+
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param file_id: ファイルのID
+        :type file_id: int
+        :param generation: 抽出元のブロブの世代番号
+        :type generation: int
+        :param variant: 抽出方法（PDFは pdf_variant、文字起こしは transcript_variant で決める）
+        :type variant: str
+        :return: ページごとのテキストのリスト。保存されていない場合はNone
+        :rtype: Optional[list[str]]
+        """
+        try:
+            async with async_session() as db:
+                file_extract = await get_file_extract(db, file_id, generation, variant)
+            if file_extract is not None:
+                with self._lock:
+                    self.hits += 1
+                return list(file_extract.pages)
+        except Exception as e:
+            logging.warning(f"抽出結果の読み込みに失敗しました (file_id={file_id}): {e}")
+
+        if self.sidecar:
+            pages = None
+            try:
+                pages = await self._read_sidecar(bucket_name, file_id, generation, variant)
+            except Exception as e:
+                logging.warning(
+                    f"抽出結果のファイルの読み込みに失敗しました (file_id={file_id}): {e}"
+                )
+            if pages is not None:
+                with self._lock:
+                    self.sidecar_hits += 1
+                # 次回以降はデータベースから読み込めるようにする
+                try:
+                    await self._save_to_db(file_id, generation, pages, variant)
+                except Exception as e:
+                    logging.warning(f"抽出結果の保存に失敗しました (file_id={file_id}): {e}")
+                return pages
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def exists(
+        self, bucket_name: str, file_id: int, generation: int, variant: str = ""
+    ) -> bool:
+        """
+        抽出結果が保存されているかを調べる（ページのテキストは読み込まない）
+
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param file_id: ファイルのID
+        :type file_id: int
+        :param generation: 抽出元のブロブの世代番号
+        :type generation: int
+        :param variant: 抽出方法（PDFは pdf_variant、文字起こしは transcript_variant で決める）
+        :type variant: str
+        :return: 保存されている場合はTrue
+        :rtype: bool
+        """
+        try:
+            async with async_session() as db:
+                if await file_extract_exists(db, file_id, generation, variant):
+                    return True
+        except Exception as e:
+            logging.warning(f"抽出結果の確認に失敗しました (file_id={file_id}): {e}")
+
+        if self.sidecar:
+            blob_name = sidecar_blob_name(file_id, generation, variant)
+            blob = get_storage_client().bucket(bucket_name).blob(blob_name)
+            try:
+                return await asyncio.to_thread(blob.exists)
+            except Exception as e:
+                logging.warning(f"抽出結果のファイルの確認に失敗しました (file_id={file_id}): {e}")
+        return False
+
+    async def save(
+        self,
+        bucket_name: str,
+        file_id: int,
+        generation: int,
+        pages: list[str],
+        variant: str = "",
+    ) -> None:
+        """
+        ページごとのテキストを保存する
+
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param file_id: ファイルのID
+        :type file_id: int
+        :param generation: 抽出元のブロブの世代番号
+        :type generation: int
+        :param pages: ページごとのテキストのリスト
+        :type pages: list[str]
+        :param variant: 抽出方法（PDFは pdf_variant、文字起こしは transcript_variant で決める）
+        :type variant: str
+        """
+        try:
+            await self._save_to_db(file_id, generation, pages, variant)
+        except Exception as e:
+            logging.warning(f"抽出結果の保存に失敗しました (file_id={file_id}): {e}")
+
+        if self.sidecar:
+            try:
+                await self._write_sidecar(bucket_name, file_id, generation, pages, variant)
+            except Exception as e:
+                logging.warning(f"抽出結果のファイルの保存に失敗しました (file_id={file_id}): {e}")
+
+    async def delete_sidecars(self, bucket_name: str, file_ids: list[int]) -> None:
+        """
+        削除したファイルの抽出結果のファイルを削除する
+
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param file_ids: 削除したファイルのIDのリスト
+        :type file_ids: list[int]
+        """
+        if not self.sidecar or not file_ids:
+            return
+        client = get_storage_client()
+
+        def delete_all() -> None:
+            for file_id in file_ids:
+                prefix = f"{EXTRACT_SIDECAR_PREFIX}/{file_id}/"
+                for blob in client.list_blobs(bucket_name, prefix=prefix):
+                    blob.delete()
+
+        try:
+            await asyncio.to_thread(delete_all)
+        except Exception as e:
+            logging.warning(f"抽出結果のファイルの削除に失敗しました: {e}")
+
+    def stats(self) -> dict[str, float]:
+        """
+        ストアの統計を返す
+
+        :return: データベースのヒット数、ファイルのヒット数、ミス数、ヒット率を含む辞書
+        :rtype: dict[str, float]
+        """
+        with self._lock:
+            lookups = self.hits + self.sidecar_hits + self.misses
+            return {
+                "hits": self.hits,
+                "sidecar_hits": self.sidecar_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.sidecar_hits) / lookups if lookups else 0.0,
+            }
+
+
+# プロセス内で共有するストア
+file_extract_store = FileExtractStore()
@@ -1,8 +1,9 @@
 import asyncio
+import hashlib
 import logging
 import os
 import random
-from typing import Any, Callable, List, Optional, Protocol, Set, TypeVar
+from typing import Any, Callable, Optional, Protocol, Set, TypeVar
 
 import vertexai
 from dotenv import load_dotenv
@@ -15,6 +16,24 @@ from vertexai.generative_models import (
     Part,
 )
 
+from app.utils.audio_segments import (
+    AUDIO_SEGMENT_OVERLAP_SECONDS,
+    AUDIO_SEGMENT_SECONDS,
+    AudioSegment,
+    cut_segment,
+    delete_segments,
+    new_run_id,
+    plan_segments,
+    probe_duration,
+    segment_blob_name,
+    segment_format,
+)
+from app.utils.convert_mp4_to_mp3 import convert_mp4_to_audio, get_mp3_blob_name
+from app.utils.file_extract_store import file_extract_store
+from app.utils.in_flight import InFlightRequests
+from app.utils.rate_limiter import RateLimiter
+from app.utils.storage_client import get_storage_client
+
 
 # プロトコルの定義
 class Response(Protocol):
@@ -30,9 +49,78 @@ REGION = os.getenv("REGION")
 MODEL_NAME = "gemini-1.5-pro-001"
 BUCKET_NAME: str = str(os.getenv("BUCKET_NAME"))
 
+# 長い音声を区間に分割し、並行して文字起こしするかどうか
+TRANSCRIPTION_SEGMENTED: bool = os.getenv("TRANSCRIPTION_SEGMENTED", "true").lower() == "true"
+
+# 文字起こしで同時に実行するGeminiへのリクエスト数と、1分あたりのリクエスト数の上限（0で制限しない）
+TRANSCRIPTION_CONCURRENCY: int = int(os.getenv("TRANSCRIPTION_CONCURRENCY", "4"))
+TRANSCRIPTION_REQUESTS_PER_MINUTE: float = float(
+    os.getenv("TRANSCRIPTION_REQUESTS_PER_MINUTE", "0")
+)
+
+# 要約全体の文字数の目安と、分割した場合の1区間あたりの文字数の下限
+SUMMARY_LENGTH = 8000
+SEGMENT_SUMMARY_MIN_LENGTH = 1000
+
 # 生成モデルのパラメータを設定
 GENERATION_CONFIG = GenerationConfig(max_output_tokens=8192, temperature=0)
 
+# プロンプト（指示文）
+TRANSCRIPT_PROMPT = """
+        - #role: あなたは、学術・教育分野における高精度な要約のプロフェッショナルです。。
+        - #input_files: 添付のファイルは、大学院の講義の音声ファイルです。
+        - #instruction: 音声ファイルの内容を、8000文字程度の正確で読みやすい文章に要約してください。
+            学術的な正確性と可読性の両立を目指してください。
+        - #condition1: フィラーや繋ぎ言葉は全て除外してください。
+        - #condition2: 固有名詞、数値や日付、専門用語は正確に記録してください。
+        - #condition3: 可能な限り自然な日本語に整形してください。
+        - #condition4: 会話の流れや論理展開を損なわないように注意してください。
+        - #condition5: 専門的な内容の場合、その分野の専門用語や表現は維持してください。
+        - #format: 8000文字程度の要約テキストとして出力してください。
+    """
+
+# 分割した区間ごとのプロンプト
+SEGMENT_PROMPT = """
+        - #role: あなたは、学術・教育分野における高精度な要約のプロフェッショナルです。
+        - #input_files: 添付のファイルは、大学院の講義の音声を{count}個の区間に分けたうちの
+            {number}番目の区間{position}です。
+        - #instruction: 音声ファイルの内容を、{length}文字程度の正確で読みやすい文章に
+            要約してください。学術的な正確性と可読性の両立を目指してください。
+        - #condition1: フィラーや繋ぎ言葉は全て除外してください。
+        - #condition2: 固有名詞、数値や日付、専門用語は正確に記録してください。
+        - #condition3: 可能な限り自然な日本語に整形してください。
+        - #condition4: 会話の流れや論理展開を損なわないように注意してください。
+        - #condition5: 専門的な内容の場合、その分野の専門用語や表現は維持してください。{overlap}
+        - #format: {length}文字程度の要約テキストとして出力してください。
+            前後の区間の要約と続けて読むため、見出しや前置きは付けないでください。
+    """
+
+# 区間の講義内での位置（無音を取り除いた音声では講義の時刻と対応しないため付けない）
+SEGMENT_POSITION = "（講義の{start}から{end}まで）"
+
+# 区間が前の区間と重なる場合に追加する条件
+SEGMENT_OVERLAP_CONDITION = """
+        - #condition6: 冒頭の{overlap}秒は前の区間の末尾と重複しています。
+            重複部分は話の流れを理解するためだけに使い、その内容は要約に含めないでください。"""
+
+
+def _prompt_version(*parts: object) -> str:
+    return hashlib.sha256("\n".join(map(str, parts)).encode("utf-8")).hexdigest()[:12]
+
+
+# プロンプトのバージョン（プロンプトを変更すると保存済みの文字起こし結果を使わなくなる）
+TRANSCRIPT_PROMPT_VERSION = _prompt_version(TRANSCRIPT_PROMPT)
+
+# 分割して文字起こしする場合のバージョン（区間の長さを変えた場合も使わなくなる）
+SEGMENTED_PROMPT_VERSION = _prompt_version(
+    TRANSCRIPT_PROMPT,
+    SEGMENT_PROMPT,
+    SEGMENT_POSITION,
+    SEGMENT_OVERLAP_CONDITION,
+    AUDIO_SEGMENT_SECONDS,
+    AUDIO_SEGMENT_OVERLAP_SECONDS,
+)
+
 # Vertex AIを初期化
 vertexai.init(project=PROJECT_ID, location=REGION)
 
@@ -41,6 +129,14 @@ logging.basicConfig(level=logging.INFO)
 
 T = TypeVar("T")
 
+# プロセス内の文字起こしで共有するGeminiへのリクエストの制限
+transcription_rate_limiter = RateLimiter(
+    TRANSCRIPTION_CONCURRENCY, TRANSCRIPTION_REQUESTS_PER_MINUTE
+)
+
+# プロセス内で実行中の文字起こし（前処理と問題生成のリクエストで共有する）
+transcriptions = InFlightRequests()
+
 
 async def retry_create_with_backoff(
     create_func: Callable[[], T],
@@ -84,6 +180,67 @@ async def retry_create_with_backoff(
                 raise e
 
 
+async def generate_from_audio(
+    model_name: str,
+    audio_file: Part,
+    prompt: str,
+    generation_config: GenerationConfig = GENERATION_CONFIG,
+) -> str:
+    """
+    リクエスト数の制限を守って、音声とプロンプトからテキストを生成する非同期関数
+
+    :param model_name: 使用するモデル名
+    :type model_name: str
+    :param audio_file: 音声ファイル
+    :type audio_file: Part
+    :param prompt: プロンプト
+    :type prompt: str
+    :param generation_config: 生成設定
+    :type generation_config: GenerationConfig
+    :return: 生成されたテキスト
+    :rtype: str
+    """
+    # モデルのインスタンスを作成
+    model = GenerativeModel(model_name=model_name)
+
+    # コンテンツリストを作成
+    contents = [audio_file, prompt]
+
+    def create_request() -> Response:
+        return model.generate_content(
+            contents,
+            generation_config=generation_config,
+            stream=False,
+        )
+
+    async with transcription_rate_limiter.acquire():
+        response = await retry_create_with_backoff(create_request)
+
+    # レスポンスからテキストを取得
+    return response.text
+
+
+def audio_blob_name(file_name: str) -> tuple[str, str]:
+    """
+    文字起こしに使う音声のブロブ名とMIMEタイプを返す
+
+    :param file_name: 音声・動画ファイル名（MP4の場合は変換済みのMP3を使う）
+    :type file_name: str
+    :return: ブロブ名とMIMEタイプ
+    :rtype: tuple[str, str]
+    :raises ValueError: 対応していない形式の場合
+    """
+    if file_name.lower().endswith(".mp4"):
+        return get_mp3_blob_name(file_name), "audio/mp3"
+    elif file_name.lower().endswith(".mp3"):
+        return file_name, "audio/mp3"
+    elif file_name.lower().endswith(".wav"):
+        return file_name, "audio/wav"
+    elif file_name.lower().endswith(".aac"):
+        return file_name, "audio/aac"
+    raise ValueError("Unsupported audio file format.")
+
+
 async def extract_text_from_audio(
     bucket_name: str,
     file_name: str,
@@ -104,56 +261,261 @@ async def extract_text_from_audio(
     """
 
     print("extract_text_from_audio started!!!")
-    # プロンプト（指示文）
-    prompt = """
-        - #role: あなたは、学術・教育分野における高精度な要約のプロフェッショナルです。。
-        - #input_files: 添付のファイルは、大学院の講義の音声ファイルです。
-        - #instruction: 音声ファイルの内容を、8000文字程度の正確で読みやすい文章に要約してください。
-            学術的な正確性と可読性の両立を目指してください。
-        - #condition1: フィラーや繋ぎ言葉は全て除外してください。
-        - #condition2: 固有名詞、数値や日付、専門用語は正確に記録してください。
-        - #condition3: 可能な限り自然な日本語に整形してください。
-        - #condition4: 会話の流れや論理展開を損なわないように注意してください。
-        - #condition5: 専門的な内容の場合、その分野の専門用語や表現は維持してください。
-        - #format: 8000文字程度の要約テキストとして出力してください。
-    """
+    prompt = TRANSCRIPT_PROMPT
     print(f"prompt: {prompt}")  # デバッグ用
-    audio_files: List[Part] = []
     try:
         # オーディオ設定
-        if file_name.lower().endswith(".mp4"):
-            mp3_file_name = file_name.replace(".mp4", ".mp3")
-            audio_gcs_uri = f"gs://{bucket_name}/mp3/{mp3_file_name}"
-            audio_file = Part.from_uri(audio_gcs_uri, mime_type="audio/mp3")
-        elif file_name.lower().endswith(".mp3"):
-            audio_gcs_uri = f"gs://{bucket_name}/{file_name}"
-            audio_file = Part.from_uri(audio_gcs_uri, mime_type="audio/mp3")
-        elif file_name.lower().endswith(".wav"):
-            audio_gcs_uri = f"gs://{bucket_name}/{file_name}"
-            audio_file = Part.from_uri(audio_gcs_uri, mime_type="audio/wav")
-        else:
-            raise ValueError("Unsupported audio file format.")
-
-        audio_files.append(audio_file)
-
-        # モデルのインスタンスを作成
-        model = GenerativeModel(model_name=model_name)
-
-        # コンテンツリストを作成
-        contents = audio_files + [prompt]
-
-        def create_request() -> Response:
-            return model.generate_content(
-                contents,
-                generation_config=generation_config,
-                stream=False,
-            )
-
-        response = await retry_create_with_backoff(create_request)
-
-        # レスポンスからテキストを取得
-        return response.text
+        blob_name, mime_type = audio_blob_name(file_name)
+        audio_file = Part.from_uri(f"gs://{bucket_name}/{blob_name}", mime_type=mime_type)
+        return await generate_from_audio(model_name, audio_file, prompt, generation_config)
 
     except Exception as e:
         logging.error(f"音声の文字起こしエラー: {str(e)}", exc_info=True)
         raise InternalServerError(f"音声の文字起こしエラー: {str(e)}") from None
+
+
+def format_timestamp(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}分{seconds:02d}秒"
+
+
+def segment_prompt(segment: AudioSegment, count: int, trimmed: bool = False) -> str:
+    """
+    区間ごとのプロンプトを作成する
+
+    :param segment: 区間
+    :type segment: AudioSegment
+    :param count: 区間の数
+    :type count: int
+    :param trimmed: 無音を取り除いた音声かどうか（講義の時刻を付けない）
+    :type trimmed: bool
+    :return: プロンプト
+    :rtype: str
+    """
+    overlap = ""
+    if segment.overlap > 0:
+        overlap = SEGMENT_OVERLAP_CONDITION.format(overlap=round(segment.overlap))
+    position = ""
+    if not trimmed:
+        position = SEGMENT_POSITION.format(
+            start=format_timestamp(segment.start), end=format_timestamp(segment.end)
+        )
+    return SEGMENT_PROMPT.format(
+        count=count,
+        number=segment.index + 1,
+        position=position,
+        length=max(SUMMARY_LENGTH // count, SEGMENT_SUMMARY_MIN_LENGTH),
+        overlap=overlap,
+    )
+
+
+async def transcribe_segment(
+    bucket: Any,
+    source: Any,
+    segment: AudioSegment,
+    count: int,
+    blob_name: str,
+    mime_type: str,
+    model_name: str,
+    generation_config: GenerationConfig,
+    trimmed: bool = False,
+) -> str:
+    """
+    音声の1区間を切り出して保存し、その区間を要約する非同期関数
+
+    :param bucket: バケット
+    :type bucket: Any
+    :param source: 音声のブロブ
+    :type source: Any
+    :param segment: 区間
+    :type segment: AudioSegment
+    :param count: 区間の数
+    :type count: int
+    :param blob_name: 切り出した音声を保存するブロブ名
+    :type blob_name: str
+    :param mime_type: 切り出した音声のMIMEタイプ
+    :type mime_type: str
+    :param model_name: 使用するモデル名
+    :type model_name: str
+    :param generation_config: 生成設定
+    :type generation_config: GenerationConfig
+    :param trimmed: 無音を取り除いた音声かどうか
+    :type trimmed: bool
+    :return: 区間の要約
+    :rtype: str
+    """
+    await cut_segment(bucket, source, segment, blob_name)
+    audio_file = Part.from_uri(f"gs://{bucket.name}/{blob_name}", mime_type=mime_type)
+    text = await generate_from_audio(
+        model_name, audio_file, segment_prompt(segment, count, trimmed), generation_config
+    )
+    return text.strip()
+
+
+async def transcribe_segmented(
+    bucket_name: str,
+    file_name: str,
+    model_name: str = MODEL_NAME,
+    generation_config: GenerationConfig = GENERATION_CONFIG,
+    trimmed: bool = False,
+) -> str:
+    """
+    長い音声を重なりのある区間に分割し、区間ごとの要約を並行して作成してつなげる非同期関数
+
+    区間の切り出しと要約は区間ごとに並行して実行し、Geminiへのリクエストは
+    プロセス内で共有する制限の範囲で実行する。音声が1区間に収まる場合や、
+    音声の長さを取得できない場合は、分割せずに要約する。
+
+    :param bucket_name: バケット名
+    :type bucket_name: str
+    :param file_name: 音声ファイル名（MP4の場合は変換済みのMP3を使う）
+    :type file_name: str
+    :param model_name: 使用するモデル名
+    :type model_name: str
+    :param generation_config: 生成設定
+    :type generation_config: GenerationConfig
+    :param trimmed: 無音を取り除いた音声かどうか（区間の位置は講義の時刻と対応しない）
+    :type trimmed: bool
+    :return: 区間の順につなげた要約
+    :rtype: str
+    :raises InternalServerError: 文字起こしに失敗した場合
+    """
+    try:
+        blob_name, _ = audio_blob_name(file_name)
+        bucket = get_storage_client().bucket(bucket_name)
+        source = bucket.blob(blob_name)
+        duration = await probe_duration(source)
+    except Exception as e:
+        logging.warning(f"音声の長さを取得できないため、分割せずに文字起こしします: {e}")
+        return await extract_text_from_audio(bucket_name, file_name, model_name, generation_config)
+
+    segments = plan_segments(duration)
+    if len(segments) <= 1:
+        return await extract_text_from_audio(bucket_name, file_name, model_name, generation_config)
+
+    logging.info(f"{file_name} を{len(segments)}個の区間に分割して文字起こしします")
+    run_id = new_run_id()
+    output_format = segment_format(blob_name)
+    segment_names = [
+        segment_blob_name(run_id, segment, output_format.extension) for segment in segments
+    ]
+    try:
+        # 1つの区間が失敗しても、他の区間が終わってから一時ファイルを削除する
+        results = await asyncio.gather(
+            *[
+                transcribe_segment(
+                    bucket,
+                    source,
+                    segment,
+                    len(segments),
+                    name,
+                    output_format.mime_type,
+                    model_name,
+                    generation_config,
+                    trimmed,
+                )
+                for segment, name in zip(segments, segment_names, strict=True)
+            ],
+            return_exceptions=True,
+        )
+    finally:
+        await delete_segments(bucket, segment_names)
+
+    for result in results:
+        if isinstance(result, BaseException):
+            logging.error(f"音声の文字起こしエラー: {result}", exc_info=result)
+            raise InternalServerError(f"音声の文字起こしエラー: {result}") from None
+    return "\n\n".join(str(result) for result in results)
+
+
+def transcript_variant(model_name: str = MODEL_NAME, segmented: Optional[bool] = None) -> str:
+    """
+    文字起こし結果を保存するときの抽出方法を返す
+
+    :param model_name: 文字起こしに使うモデル名
+    :type model_name: str
+    :param segmented: 分割して文字起こしするかどうか（省略した場合は設定に従う）
+    :type segmented: Optional[bool]
+    :return: モデル名とプロンプトのバージョンを含む抽出方法
+    :rtype: str
+    """
+    if segmented is None:
+        segmented = TRANSCRIPTION_SEGMENTED
+    version = SEGMENTED_PROMPT_VERSION if segmented else TRANSCRIPT_PROMPT_VERSION
+    return f"transcript:{model_name}:{version}"
+
+
+async def transcribe_media(
+    bucket_name: str,
+    file_name: str,
+    generation: Optional[int] = None,
+    file_id: Optional[int] = None,
+    model_name: str = MODEL_NAME,
+) -> str:
+    """
+    音声・動画ファイルからテキストを抽出して返す
+
+    MP4ファイルはMP3に変換してから文字起こしする。TRANSCRIPTION_SEGMENTED が有効な場合は、
+    長い音声を区間に分割して並行して文字起こしする。ファイルIDと世代番号が分かる場合は、
+    同じモデルとプロンプトで保存済みの文字起こし結果を優先して使い、ない場合は
+    文字起こしした結果を保存する。同じファイルの文字起こしが実行中の場合は、
+    新しく文字起こしせずにその結果を待つ。
+
+    :param bucket_name: バケット名
+    :type bucket_name: str
+    :param file_name: 音声・動画ファイル名
+    :type file_name: str
+    :param generation: ブロブの世代番号
+    :type generation: Optional[int]
+    :param file_id: filesテーブルのファイルID（指定した場合は文字起こし結果を保存して再利用）
+    :type file_id: Optional[int]
+    :param model_name: 文字起こしに使うモデル名
+    :type model_name: str
+    :return: 抽出されたテキスト
+    :rtype: str
+    :raises InternalServerError: MP3への変換または文字起こしに失敗した場合
+    """
+    variant = transcript_variant(model_name)
+    if file_id is None or generation is None:
+        return await _transcribe_media(bucket_name, file_name, generation, None, model_name)
+    # 同じファイルの文字起こしが実行中の場合は、その結果を待つ
+    return await transcriptions.run(
+        (bucket_name, file_id, generation, variant),
+        lambda: _transcribe_media(bucket_name, file_name, generation, file_id, model_name),
+    )
+
+
+async def _transcribe_media(
+    bucket_name: str,
+    file_name: str,
+    generation: Optional[int],
+    file_id: Optional[int],
+    model_name: str,
+) -> str:
+    variant = transcript_variant(model_name)
+    if file_id is not None and generation is not None:
+        pages = await file_extract_store.load(bucket_name, file_id, generation, variant)
+        if pages:
+            logging.info(f"保存済みの文字起こし結果を使います: {file_name} ({variant})")
+            return pages[0]
+
+    audio_name = file_name
+    trimmed = False
+    if file_name.lower().endswith(".mp4"):
+        # ファイルを音声ファイルに変換する（AACの場合は再エンコードせずに取り出す）
+        logging.info(f"Converting {file_name} to mp3 format.")
+        artifact = await convert_mp4_to_audio(bucket_name, file_name, generation)
+        if artifact is None:
+            logging.error(f"Failed to convert {file_name} to mp3 format.")
+            raise InternalServerError(f"Failed to convert {file_name} to mp3 format.")
+        audio_name = artifact.blob_name
+        trimmed = artifact.trimmed
+
+    if TRANSCRIPTION_SEGMENTED:
+        text = await transcribe_segmented(bucket_name, audio_name, model_name, trimmed=trimmed)
+    else:
+        text = await extract_text_from_audio(bucket_name, audio_name, model_name)
+    if file_id is not None and generation is not None:
+        # 文字起こし結果は1ページのテキストとして保存する
+        await file_extract_store.save(bucket_name, file_id, generation, [text], variant)
+    return text
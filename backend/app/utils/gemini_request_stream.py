@@ -14,7 +14,6 @@ from google.api_core.exceptions import (
     InvalidArgument,
     NotFound,
 )
-from google.cloud import storage
 from vertexai.generative_models import (
     GenerationConfig,
     GenerationResponse,
@@ -22,7 +21,9 @@ from vertexai.generative_models import (
     Part,
 )
 
-from app.utils.convert_mp4_to_mp3 import convert_mp4_to_mp3
+from app.utils.blob_metadata import BlobInfo, lookup_blobs
+from app.utils.convert_mp4_to_mp3 import convert_mp4_to_audio
+from app.utils.ingestion_governor import ingestion_user
 
 # 環境変数を読み込む
 load_dotenv()
@@ -87,14 +88,6 @@ async def retry_create_with_backoff(
                 raise e
 
 
-# Google Cloud Storageでファイルが存在するかチェック
-def check_file_exists(bucket_name: str, file_name: str) -> bool:
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(file_name)
-    return blob.exists()
-
-
 # 複数のPDF, imageファイルを入力してコンテンツを生成
 async def generate_content_stream(
     files: list[str],
@@ -103,7 +96,10 @@ async def generate_content_stream(
     model_name: str = MODEL_NAME,
     generation_config: GenerationConfig = GENERATION_CONFIG,
     bucket_name: str = BUCKET_NAME,
+    blob_infos: Optional[dict[str, BlobInfo]] = None,
 ) -> AsyncGenerator[GenerationResponse, None]:
+    # ファイルの解析や変換の順番をユーザーごとに公平に回すため、依頼したユーザーを記録する
+    ingestion_user.set(uid)
     pdf_files: list[Part] = []
     image_files: list[Part] = []
     mp3_files: list[Part] = []
@@ -161,13 +157,17 @@ async def generate_content_stream(
 
     logging.info(f"Prompt: {prompt}")
     try:
+        # ファイルの存在とメタデータを1回の一覧取得でまとめて確認
+        if blob_infos is None:
+            blob_infos = await lookup_blobs(bucket_name, uid, files)
         for file_name in files:
             if file_name:
                 if not uid or not uid.strip():
                     raise ValueError("Invalid user ID")
                 safe_uid = uid.strip().rstrip("/")
                 file_name = unicodedata.normalize("NFC", f"{safe_uid}/{file_name}")
-            if check_file_exists(bucket_name, file_name):
+            blob_info = blob_infos.get(file_name)
+            if blob_info and blob_info.exists:
                 if file_name.endswith(".pdf"):
                     pdf_file_uri = f"gs://{bucket_name}/{file_name}"
                     pdf_file = Part.from_uri(pdf_file_uri, mime_type="application/pdf")
@@ -181,10 +181,12 @@ async def generate_content_stream(
                     image_file = Part.from_uri(image_file_uri, mime_type="image/png")
                     image_files.append(image_file)
                 elif file_name.endswith(".mp4"):
-                    if await convert_mp4_to_mp3(bucket_name, file_name):
-                        mp3_file_name = file_name.replace(".mp4", ".mp3")
-                        mp3_file_url = f"gs://{bucket_name}/mp3/{mp3_file_name}"
-                        mp3_file = Part.from_uri(mp3_file_url, mime_type="audio/mp3")
+                    artifact = await convert_mp4_to_audio(
+                        bucket_name, file_name, blob_info.generation
+                    )
+                    if artifact is not None:
+                        mp3_file_url = f"gs://{bucket_name}/{artifact.blob_name}"
+                        mp3_file = Part.from_uri(mp3_file_url, mime_type=artifact.mime_type)
                         mp3_files.append(mp3_file)
                     else:
                         logging.error(f"Failed to convert {file_name} to mp3 format.")
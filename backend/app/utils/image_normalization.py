@@ -0,0 +1,171 @@
+import asyncio
+import base64
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+from app.utils.blob_cache import read_blob_bytes
+from app.utils.image_resize import detect_image_format, normalize_image
+from app.utils.ingestion_governor import ingestion_governor
+from app.utils.pdf_extraction import get_extraction_executor
+
+# 環境変数を読み込む
+load_dotenv()
+
+# 変換後の画像をキャッシュする合計サイズの上限（バイト単位、0でキャッシュしない）
+IMAGE_CACHE_MAX_BYTES: int = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# これより小さいファイルは変換しない（変換しても削減量が小さいため）
+IMAGE_NORMALIZE_MIN_BYTES = 64 * 1024
+
+# 展開した画像のメモリ使用量の見積もり（ファイルサイズに対する倍率）
+IMAGE_MEMORY_FACTOR = 8
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+
+class NormalizedImageCache:
+    """
+    変換してbase64エンコードした画像を (バケット名, ブロブ名, 世代番号) をキーに保持する
+    LRUキャッシュ
+
+    :param max_bytes: キャッシュする合計サイズの上限（バイト単位）
+    :type max_bytes: int
+    """
+
+    def __init__(self, max_bytes: int = IMAGE_CACHE_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple[str, str, int], str] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.original_bytes = 0
+        self.normalized_bytes = 0
+
+    def get(self, bucket_name: str, blob_name: str, generation: int) -> Optional[str]:
+        """
+        キャッシュから変換済みの画像を取得する
+
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param blob_name: ブロブ名
+        :type blob_name: str
+        :param generation: ブロブの世代番号
+        :type generation: int
+        :return: base64エンコードした画像。キャッシュにない場合はNone
+        :rtype: Optional[str]
+        """
+        key = (bucket_name, blob_name, generation)
+        with self._lock:
+            encoded = self._entries.get(key)
+            if encoded is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return encoded
+
+    def put(self, bucket_name: str, blob_name: str, generation: int, encoded: str) -> None:
+        """
+        変換済みの画像をキャッシュに保存する
+
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param blob_name: ブロブ名
+        :type blob_name: str
+        :param generation: ブロブの世代番号
+        :type generation: int
+        :param encoded: base64エンコードした画像
+        :type encoded: str
+        """
+        if len(encoded) > self.max_bytes:
+            return
+        key = (bucket_name, blob_name, generation)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = encoded
+            self._size += len(encoded)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def record(self, original_size: int, normalized_size: int) -> None:
+        """
+        変換前後のサイズを記録する
+
+        :param original_size: 変換前のサイズ（バイト単位）
+        :type original_size: int
+        :param normalized_size: 変換後のサイズ（バイト単位）
+        :type normalized_size: int
+        """
+        with self._lock:
+            self.original_bytes += original_size
+            self.normalized_bytes += normalized_size
+
+    def stats(self) -> dict[str, float]:
+        """
+        キャッシュの統計を返す
+
+        :return: ヒット数、ミス数、エントリ数、合計サイズ、変換前後の合計サイズを含む辞書
+        :rtype: dict[str, float]
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "original_bytes": self.original_bytes,
+                "normalized_bytes": self.normalized_bytes,
+            }
+
+
+# プロセス内で共有するキャッシュ
+image_cache = NormalizedImageCache()
+
+
+async def read_image_base64(bucket: Any, file_name: str, generation: Optional[int] = None) -> str:
+    """
+    画像を縮小・再エンコードし、base64エンコードした文字列を返す
+
+    世代番号が分かる場合は変換結果をキャッシュする。変換はPDFのテキスト抽出と同じ
+    プロセスプールで実行し、イベントループを止めないようにする。
+
+    :param bucket: バケット
+    :type bucket: Any
+    :param file_name: 画像のファイル名
+    :type file_name: str
+    :param generation: ブロブの世代番号（指定した場合は変換結果とダウンロードをキャッシュ）
+    :type generation: Optional[int]
+    :return: base64エンコードした画像
+    :rtype: str
+    """
+    bucket_name = str(bucket.name)
+    if generation is not None and image_cache.max_bytes > 0:
+        cached = image_cache.get(bucket_name, file_name, generation)
+        if cached is not None:
+            return cached
+
+    data = await read_blob_bytes(bucket, file_name, generation)
+    normalized = data
+    if len(data) >= IMAGE_NORMALIZE_MIN_BYTES and detect_image_format(data) is not None:
+        loop = asyncio.get_running_loop()
+        # 展開した画像のサイズで順番を待ってから変換する
+        async with ingestion_governor.slot(len(data) * IMAGE_MEMORY_FACTOR):
+            normalized = await loop.run_in_executor(
+                get_extraction_executor(), normalize_image, data
+            )
+        image_cache.record(len(data), len(normalized))
+
+    encoded = base64.b64encode(normalized).decode("utf-8")
+    if generation is not None and image_cache.max_bytes > 0:
+        image_cache.put(bucket_name, file_name, generation, encoded)
+    return encoded
@@ -0,0 +1,84 @@
+import logging
+import math
+import os
+from typing import Optional
+
+import fitz
+from dotenv import load_dotenv
+
+# テキスト抽出のプロセスプールで実行する画像の変換
+# （spawnで起動したプロセスは実行する関数のモジュールを読み込むため、
+# vertexai、anthropic、sqlalchemy などを読み込むモジュールをインポートしない）
+
+# 環境変数を読み込む
+load_dotenv()
+
+# 縮小後の長辺の最大ピクセル数（Claudeはこれより大きい画像を縮小して扱う）
+IMAGE_MAX_DIMENSION: int = int(os.getenv("IMAGE_MAX_DIMENSION", "1568"))
+
+# 縮小後の最大画素数（約1.15メガピクセル）
+IMAGE_MAX_PIXELS: int = int(os.getenv("IMAGE_MAX_PIXELS", "1150000"))
+
+# JPEGで再エンコードするときの品質
+IMAGE_JPEG_QUALITY: int = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+# ファイルの先頭のバイト列と画像形式の対応
+_SIGNATURES = {b"\x89PNG\r\n\x1a\n": "png", b"\xff\xd8\xff": "jpeg"}
+
+
+def detect_image_format(data: bytes) -> Optional[str]:
+    """
+    ファイルの先頭のバイト列から、変換できる画像形式を判定する
+
+    :param data: ファイルの内容
+    :type data: bytes
+    :return: png または jpeg。変換できない形式の場合はNone
+    :rtype: Optional[str]
+    """
+    for signature, image_format in _SIGNATURES.items():
+        if data.startswith(signature):
+            return image_format
+    return None
+
+
+def normalize_image(data: bytes) -> bytes:
+    """
+    画像をモデルが扱う最大サイズまで縮小し、元の形式で再エンコードする（プロセスプールで実行する）
+
+    形式を変えないため、拡張子から決めた media_type はそのまま使える。
+    変換に失敗した場合や、変換しても小さくならない場合は元の内容を返す。
+
+    :param data: PNGまたはJPEGの内容
+    :type data: bytes
+    :return: 変換後の内容
+    :rtype: bytes
+    """
+    image_format = detect_image_format(data)
+    if image_format is None:
+        return data
+    try:
+        pixmap = fitz.Pixmap(data)
+        width, height = pixmap.width, pixmap.height
+        scale = min(
+            1.0,
+            IMAGE_MAX_DIMENSION / max(width, height),
+            math.sqrt(IMAGE_MAX_PIXELS / (width * height)),
+        )
+        if scale < 1.0:
+            pixmap = fitz.Pixmap(
+                pixmap, max(int(width * scale), 1), max(int(height * scale), 1), None
+            )
+        if image_format == "jpeg":
+            # JPEGはRGBまたはグレースケールで書き出す（CMYKなどはRGBに変換する）
+            if pixmap.colorspace is not None and pixmap.colorspace.n not in (1, 3):
+                pixmap = fitz.Pixmap(fitz.csRGB, pixmap)
+            normalized: bytes = pixmap.tobytes("jpeg", jpg_quality=IMAGE_JPEG_QUALITY)
+        else:
+            normalized = pixmap.tobytes("png")
+    except Exception as e:
+        logging.warning(f"画像の変換に失敗したため、元の画像を使います: {e}")
+        return data
+    return normalized if len(normalized) < len(data) else data
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class InFlightRequests:
+    """
+    同じキーの処理が実行中の場合は、新しく実行せずに実行中の処理の結果を共有するクラス
+
+    アップロード後の前処理と問題生成のリクエストが同じファイルを同時に処理する場合に、
+    テキスト抽出や文字起こしを重複して実行しないようにする。
+    """
+
+    def __init__(self) -> None:
+        self._futures: dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.coalesced = 0
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        キーごとに処理を1つだけ実行し、結果を返す
+
+        :param key: 処理を識別するキー
+        :type key: Hashable
+        :param func: 処理を開始する関数
+        :type func: Callable[[], Awaitable[T]]
+        :return: 処理の結果
+        :rtype: T
+        """
+        future = self._futures.get(key)
+        if future is not None:
+            self._count("coalesced")
+        else:
+            self._count("started")
+            future = asyncio.ensure_future(func())
+            self._futures[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        # 待機が取り消されても、他の待機中のリクエストのために処理は続ける
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._futures.get(key) is future:
+            del self._futures[key]
+
+    def stats(self) -> dict[str, float]:
+        """
+        処理の統計を返す
+
+        :return: 開始した処理の数、実行中の処理を共有した数、実行中の処理の数を含む辞書
+        :rtype: dict[str, float]
+        """
+        with self._lock:
+            return {
+                "started": self.started,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._futures),
+            }
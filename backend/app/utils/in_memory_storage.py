@@ -0,0 +1,291 @@
+import base64
+import datetime
+import hashlib
+import io
+import itertools
+import threading
+from typing import IO, Any, Callable, Iterator, Optional
+
+from google.api_core.exceptions import NotFound
+
+# 世代番号の採番
+_generation_counter = itertools.count(1)
+
+
+class InMemoryBlobWriter(io.BytesIO):
+    """
+    ブロブに書き込むためのファイルオブジェクト（close() でまとめてアップロードする）
+
+    :param blob: 書き込み先のブロブ
+    :type blob: InMemoryBlob
+    :param content_type: 保存するときのContent-Type
+    :type content_type: Optional[str]
+    """
+
+    def __init__(self, blob: "InMemoryBlob", content_type: Optional[str] = None) -> None:
+        super().__init__()
+        self._blob = blob
+        self._content_type = content_type
+        self._aborted = False
+
+    def close(self) -> None:
+        if not self.closed and not self._aborted:
+            self._blob.upload_from_string(self.getvalue(), content_type=self._content_type)
+        super().close()
+
+    def abort(self) -> None:
+        self._aborted = True
+        self.close()
+
+
+class InMemoryBlob:
+    """
+    google.cloud.storage.Blob と同じインターフェースを持つインメモリのブロブ
+
+    :param name: ブロブ名
+    :type name: str
+    :param bucket: 所属するバケット
+    :type bucket: InMemoryBucket
+    """
+
+    def __init__(self, name: str, bucket: "InMemoryBucket") -> None:
+        self.name = name
+        self.bucket = bucket
+        self.metadata: Optional[dict] = None
+        self.content_type: Optional[str] = None
+
+    def _stored(self) -> dict:
+        stored = self.bucket._objects.get(self.name)
+        if stored is None:
+            raise NotFound(f"{self.bucket.name}/{self.name} が存在しません")
+        return stored
+
+    @property
+    def size(self) -> Optional[int]:
+        stored = self.bucket._objects.get(self.name)
+        return len(stored["data"]) if stored else None
+
+    @property
+    def generation(self) -> Optional[int]:
+        stored = self.bucket._objects.get(self.name)
+        return stored["generation"] if stored else None
+
+    @property
+    def md5_hash(self) -> Optional[str]:
+        stored = self.bucket._objects.get(self.name)
+        if stored is None:
+            return None
+        return base64.b64encode(hashlib.md5(stored["data"]).digest()).decode("utf-8")
+
+    @property
+    def updated(self) -> Optional[datetime.datetime]:
+        stored = self.bucket._objects.get(self.name)
+        return stored["updated"] if stored else None
+
+    def exists(self, **kwargs: Any) -> bool:
+        return self.name in self.bucket._objects
+
+    def reload(self, **kwargs: Any) -> None:
+        stored = self._stored()
+        self.content_type = stored["content_type"]
+        self.metadata = stored["metadata"]
+
+    def patch(self, **kwargs: Any) -> None:
+        with self.bucket._lock:
+            self._stored()["metadata"] = self.metadata
+
+    def open(self, mode: str = "rb", **kwargs: Any) -> Any:
+        if mode == "rb":
+            return io.BytesIO(self._stored()["data"])
+        if mode == "wb":
+            return InMemoryBlobWriter(self, kwargs.get("content_type"))
+        raise ValueError(f"サポートしていないモードです: {mode}")
+
+    def download_as_bytes(self, **kwargs: Any) -> bytes:
+        return bytes(self._stored()["data"])
+
+    def download_to_file(self, file_obj: IO[bytes], **kwargs: Any) -> None:
+        file_obj.write(self._stored()["data"])
+
+    def download_to_filename(self, filename: str, **kwargs: Any) -> None:
+        with open(filename, "wb") as f:
+            self.download_to_file(f)
+
+    def upload_from_string(
+        self, data: bytes | str, content_type: Optional[str] = None, **kwargs: Any
+    ) -> None:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self.bucket._lock:
+            self.bucket._objects[self.name] = {
+                "data": bytes(data),
+                "generation": next(_generation_counter),
+                "content_type": content_type or self.content_type or "application/octet-stream",
+                "metadata": self.metadata,
+                "updated": datetime.datetime.now(datetime.timezone.utc),
+            }
+        self.content_type = self.bucket._objects[self.name]["content_type"]
+
+    def upload_from_file(
+        self, file_obj: IO[bytes], content_type: Optional[str] = None, **kwargs: Any
+    ) -> None:
+        self.upload_from_string(file_obj.read(), content_type=content_type)
+
+    def upload_from_filename(
+        self, filename: str, content_type: Optional[str] = None, **kwargs: Any
+    ) -> None:
+        with open(filename, "rb") as f:
+            self.upload_from_file(f, content_type=content_type)
+
+    def rewrite(
+        self, source: "InMemoryBlob", token: Optional[str] = None, **kwargs: Any
+    ) -> tuple[Optional[str], int, int]:
+        stored = source._stored()
+        self.metadata = stored["metadata"]
+        self.upload_from_string(stored["data"], content_type=stored["content_type"])
+        size = len(stored["data"])
+        return None, size, size
+
+    def delete(self, **kwargs: Any) -> None:
+        batch = self.bucket.client.current_batch
+        if batch is not None:
+            # バッチ中は送信を遅延し、結果はレスポンスとして記録する
+            batch._deferred.append(self._delete_now)
+            return
+        self._delete_now()
+
+    def _delete_now(self) -> None:
+        with self.bucket._lock:
+            if self.bucket._objects.pop(self.name, None) is None:
+                raise NotFound(f"{self.bucket.name}/{self.name} が存在しません")
+
+    def generate_signed_url(self, method: str = "GET", **kwargs: Any) -> str:
+        generation = self.generation or 0
+        base_url = f"https://storage.example.com/{self.bucket.name}/{self.name}"
+        return f"{base_url}?method={method}&generation={generation}"
+
+
+class InMemoryBucket:
+    """
+    google.cloud.storage.Bucket と同じインターフェースを持つインメモリのバケット
+
+    :param client: 所属するクライアント
+    :type client: InMemoryStorageClient
+    :param name: バケット名
+    :type name: str
+    """
+
+    def __init__(self, client: "InMemoryStorageClient", name: str) -> None:
+        self.client = client
+        self.name = name
+        self._objects: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def blob(self, blob_name: str, **kwargs: Any) -> InMemoryBlob:
+        return InMemoryBlob(blob_name, self)
+
+    def get_blob(self, blob_name: str, **kwargs: Any) -> Optional[InMemoryBlob]:
+        if blob_name not in self._objects:
+            return None
+        blob = InMemoryBlob(blob_name, self)
+        blob.reload()
+        return blob
+
+    def list_blobs(self, prefix: Optional[str] = None, **kwargs: Any) -> Iterator[InMemoryBlob]:
+        for name in sorted(self._objects):
+            if prefix is None or name.startswith(prefix):
+                blob = InMemoryBlob(name, self)
+                blob.reload()
+                yield blob
+
+
+class InMemoryBatchResponse:
+    """
+    バッチ内の個々のリクエストに対するレスポンス
+
+    :param status_code: HTTPステータスコード
+    :type status_code: int
+    """
+
+    def __init__(self, status_code: int) -> None:
+        self.status_code = status_code
+
+
+class InMemoryBatch:
+    """
+    google.cloud.storage.Batch と同じインターフェースを持つインメモリのバッチ
+
+    :param client: 所属するクライアント
+    :type client: InMemoryStorageClient
+    :param raise_exception: 失敗したリクエストがある場合に例外を送出するかどうか
+    :type raise_exception: bool
+    """
+
+    def __init__(self, client: "InMemoryStorageClient", raise_exception: bool = True) -> None:
+        self._client = client
+        self._raise_exception = raise_exception
+        self._deferred: list[Callable[[], None]] = []
+
+    def finish(self, raise_exception: bool = True) -> list[InMemoryBatchResponse]:
+        if not self._deferred:
+            raise ValueError("No deferred requests")
+        responses = []
+        for request in self._deferred:
+            try:
+                request()
+                responses.append(InMemoryBatchResponse(204))
+            except NotFound:
+                if raise_exception:
+                    raise
+                responses.append(InMemoryBatchResponse(404))
+        return responses
+
+    def __enter__(self) -> "InMemoryBatch":
+        self._client._batch_local.batch = self
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        try:
+            if exc_type is None:
+                self.finish(raise_exception=self._raise_exception)
+        finally:
+            self._client._batch_local.batch = None
+
+
+class InMemoryStorageClient:
+    """
+    テストやオフライン実行用のインメモリCloud Storageクライアント
+
+    set_storage_client() に渡すことで、共有クライアントとして利用できる。
+    """
+
+    def __init__(self) -> None:
+        self._buckets: dict[str, InMemoryBucket] = {}
+        self._lock = threading.Lock()
+        self._batch_local = threading.local()
+
+    @property
+    def current_batch(self) -> Optional[InMemoryBatch]:
+        return getattr(self._batch_local, "batch", None)
+
+    def batch(self, raise_exception: bool = True) -> InMemoryBatch:
+        return InMemoryBatch(self, raise_exception=raise_exception)
+
+    def bucket(self, bucket_name: str, **kwargs: Any) -> InMemoryBucket:
+        with self._lock:
+            if bucket_name not in self._buckets:
+                self._buckets[bucket_name] = InMemoryBucket(self, bucket_name)
+            return self._buckets[bucket_name]
+
+    def get_bucket(self, bucket_name: str, **kwargs: Any) -> InMemoryBucket:
+        return self.bucket(bucket_name)
+
+    def list_blobs(
+        self, bucket_or_name: InMemoryBucket | str, prefix: Optional[str] = None, **kwargs: Any
+    ) -> Iterator[InMemoryBlob]:
+        bucket = (
+            bucket_or_name
+            if isinstance(bucket_or_name, InMemoryBucket)
+            else self.bucket(bucket_or_name)
+        )
+        return bucket.list_blobs(prefix=prefix)
@@ -0,0 +1,322 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+from app.utils.blob_metadata import lookup_blobs, to_blob_name
+from app.utils.file_extract_store import file_extract_store
+from app.utils.gemini_extract_text_from_audio import transcribe_media, transcript_variant
+from app.utils.ingestion_governor import ingestion_user
+from app.utils.pdf_extraction import extract_text_from_pdf, pdf_variant
+
+# 環境変数を読み込む
+load_dotenv()
+
+# アップロード後にバックグラウンドで前処理を行うかどうか
+INGESTION_ENABLED: bool = os.getenv("INGESTION_ENABLED", "true").lower() == "true"
+
+# 同時に実行する前処理の数
+INGESTION_CONCURRENCY: int = int(os.getenv("INGESTION_CONCURRENCY", "2"))
+
+# 保持する前処理の状態の最大件数
+INGESTION_STATUS_MAX_ENTRIES: int = int(os.getenv("INGESTION_STATUS_MAX_ENTRIES", "4096"))
+
+# 前処理の対象となる拡張子と処理内容
+PDF_EXTENSIONS = (".pdf",)
+MEDIA_EXTENSIONS = (".mp4", ".mp3", ".wav")
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+
+@dataclass
+class IngestionStatus:
+    """
+    ファイルごとの前処理の状態
+
+    :param file_id: ファイルのID
+    :type file_id: int
+    :param file_name: 正規化済みのファイル名
+    :type file_name: str
+    :param state: queued, running, completed, failed, cancelled, not_required のいずれか
+    :type state: str
+    :param step: 実行中または実行した処理（extract_text または transcribe）
+    :type step: Optional[str]
+    :param generation: 前処理したブロブの世代番号
+    :type generation: Optional[int]
+    :param error: 失敗した場合のエラーメッセージ
+    :type error: Optional[str]
+    :param queued_at: 登録日時（UNIX時間）
+    :type queued_at: float
+    :param started_at: 開始日時（UNIX時間）
+    :type started_at: Optional[float]
+    :param finished_at: 終了日時（UNIX時間）
+    :type finished_at: Optional[float]
+    """
+
+    file_id: int
+    file_name: str
+    state: str
+    step: Optional[str] = None
+    generation: Optional[int] = None
+    error: Optional[str] = None
+    queued_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        状態を辞書に変換する
+
+        :return: 状態の辞書
+        :rtype: dict[str, Any]
+        """
+        return asdict(self)
+
+
+def ingestion_step(file_name: str) -> Optional[str]:
+    """
+    ファイルの拡張子から前処理の内容を返す
+
+    :param file_name: ファイル名
+    :type file_name: str
+    :return: extract_text, transcribe のいずれか。前処理が不要な場合はNone
+    :rtype: Optional[str]
+    """
+    lower_name = file_name.lower()
+    if lower_name.endswith(PDF_EXTENSIONS):
+        return "extract_text"
+    if lower_name.endswith(MEDIA_EXTENSIONS):
+        return "transcribe"
+    return None
+
+
+class IngestionManager:
+    """
+    アップロードされたファイルの前処理（テキスト抽出、MP3への変換、文字起こし）を
+    バックグラウンドで実行し、ファイルIDごとの状態を保持するクラス
+
+    前処理の結果は file_extracts に保存されるため、問題生成のリクエストでは
+    保存済みの結果をそのまま使える。前処理の実行中は、同じプロセスのリクエストは
+    実行中の抽出や文字起こしの結果を待つ。実行中の状態はプロセス内にのみ保持するため、
+    複数のワーカーで実行する場合は check_status で保存済みの抽出結果から判断する。
+
+    :param enabled: 前処理を行うかどうか
+    :type enabled: bool
+    :param concurrency: 同時に実行する前処理の数
+    :type concurrency: int
+    :param max_entries: 保持する状態の最大件数
+    :type max_entries: int
+    """
+
+    def __init__(
+        self,
+        enabled: bool = INGESTION_ENABLED,
+        concurrency: int = INGESTION_CONCURRENCY,
+        max_entries: int = INGESTION_STATUS_MAX_ENTRIES,
+    ) -> None:
+        self.enabled = enabled
+        self.concurrency = max(concurrency, 1)
+        self.max_entries = max_entries
+        self._statuses: OrderedDict[int, IngestionStatus] = OrderedDict()
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.completed = 0
+        self.failed = 0
+
+    def _set_status(self, status: IngestionStatus) -> None:
+        with self._lock:
+            self._statuses[status.file_id] = status
+            self._statuses.move_to_end(status.file_id)
+            # 古い状態から破棄する（実行中の状態は残す）
+            for file_id in list(self._statuses):
+                if len(self._statuses) <= self.max_entries:
+                    break
+                if self._statuses[file_id].state not in ("queued", "running"):
+                    del self._statuses[file_id]
+
+    def enqueue(
+        self, bucket_name: str, uid: str, file_name: str, file_id: int
+    ) -> Optional[IngestionStatus]:
+        """
+        ファイルの前処理をバックグラウンドで開始する
+
+        同じファイルの前処理が実行中の場合は、古い内容の前処理を取り消して登録し直す。
+
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param uid: ユーザーID
+        :type uid: str
+        :param file_name: 正規化済みのファイル名
+        :type file_name: str
+        :param file_id: ファイルのID
+        :type file_id: int
+        :return: 登録した前処理の状態。前処理が無効な場合はNone
+        :rtype: Optional[IngestionStatus]
+        """
+        if not self.enabled:
+            return None
+
+        step = ingestion_step(file_name)
+        if step is None:
+            status = IngestionStatus(
+                file_id=file_id, file_name=file_name, state="not_required", queued_at=time.time()
+            )
+            self._set_status(status)
+            return status
+
+        previous = self._tasks.pop(file_id, None)
+        if previous is not None and not previous.done():
+            previous.cancel()
+
+        status = IngestionStatus(
+            file_id=file_id, file_name=file_name, state="queued", step=step, queued_at=time.time()
+        )
+        self._set_status(status)
+        with self._lock:
+            self.enqueued += 1
+
+        task = asyncio.create_task(self._run(bucket_name, uid, status))
+        self._tasks[file_id] = task
+        task.add_done_callback(lambda done: self._forget(file_id, done))
+        return status
+
+    def _forget(self, file_id: int, task: asyncio.Task) -> None:
+        if self._tasks.get(file_id) is task:
+            del self._tasks[file_id]
+
+    async def _run(self, bucket_name: str, uid: str, status: IngestionStatus) -> None:
+        # 解析や変換の順番は、問題生成のリクエストと同じくユーザーごとに公平に回す
+        ingestion_user.set(uid)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            status.state = "running"
+            status.started_at = time.time()
+            blob_name = to_blob_name(uid, status.file_name)
+            try:
+                blob_infos = await lookup_blobs(bucket_name, uid, [status.file_name])
+                blob_info = blob_infos.get(blob_name)
+                if blob_info is None or not blob_info.exists:
+                    raise FileNotFoundError(f"{blob_name} が見つかりません")
+                status.generation = blob_info.generation
+
+                # 抽出結果は file_extracts に保存され、問題生成のリクエストで再利用される
+                if status.step == "extract_text":
+                    await extract_text_from_pdf(
+                        bucket_name, blob_name, blob_info.generation, status.file_id
+                    )
+                else:
+                    await transcribe_media(
+                        bucket_name, blob_name, blob_info.generation, status.file_id
+                    )
+                status.state = "completed"
+                with self._lock:
+                    self.completed += 1
+                logging.info(f"{blob_name} の前処理が完了しました ({status.step})")
+            except asyncio.CancelledError:
+                status.state = "cancelled"
+                raise
+            except Exception as e:
+                status.state = "failed"
+                status.error = str(e)
+                with self._lock:
+                    self.failed += 1
+                logging.error(f"{blob_name} の前処理に失敗しました: {e}")
+            finally:
+                status.finished_at = time.time()
+
+    def get_status(self, file_id: int) -> Optional[IngestionStatus]:
+        """
+        ファイルの前処理の状態を返す
+
+        :param file_id: ファイルのID
+        :type file_id: int
+        :return: 前処理の状態。登録されていない場合はNone
+        :rtype: Optional[IngestionStatus]
+        """
+        with self._lock:
+            return self._statuses.get(file_id)
+
+    async def check_status(
+        self, bucket_name: str, uid: str, file_id: int, file_name: str
+    ) -> dict[str, Any]:
+        """
+        保存済みの抽出結果から、ファイルの前処理が完了しているかを返す
+
+        ready は file_extracts に現在の世代番号の抽出結果があるかで判断するため、
+        どのワーカーで前処理したかによらない。queued、running、failed などの
+        実行中の状態は、このプロセスで登録した前処理の場合のみ返す（参考値）。
+
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param uid: ユーザーID
+        :type uid: str
+        :param file_id: ファイルのID
+        :type file_id: int
+        :param file_name: 正規化済みのファイル名
+        :type file_name: str
+        :return: 前処理の状態と ready を含む辞書
+        :rtype: dict[str, Any]
+        """
+        step = ingestion_step(file_name)
+        local_status = self.get_status(file_id)
+        if local_status is None:
+            local_status = IngestionStatus(file_id=file_id, file_name=file_name, state="unknown")
+        status = local_status.to_dict()
+        status["step"] = step
+        if step is None:
+            return {**status, "state": "not_required", "ready": True}
+
+        blob_name = to_blob_name(uid, file_name)
+        blob_info = (await lookup_blobs(bucket_name, uid, [file_name])).get(blob_name)
+        if blob_info is None or not blob_info.exists or blob_info.generation is None:
+            return {**status, "ready": False}
+
+        variant = pdf_variant() if step == "extract_text" else transcript_variant()
+        ready = await file_extract_store.exists(bucket_name, file_id, blob_info.generation, variant)
+        status["generation"] = blob_info.generation
+        status["ready"] = ready
+        if ready:
+            status["state"] = "completed"
+        elif status["state"] in ("unknown", "completed"):
+            # 他のワーカーで実行中、または古い世代の前処理しか完了していない
+            status["state"] = "not_ready"
+        return status
+
+    async def shutdown(self) -> None:
+        """
+        アプリケーション終了時に実行中の前処理を取り消す
+        """
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def stats(self) -> dict[str, float]:
+        """
+        前処理の統計を返す
+
+        :return: 登録数、完了数、失敗数、実行中または待機中の数を含む辞書
+        :rtype: dict[str, float]
+        """
+        with self._lock:
+            return {
+                "enqueued": self.enqueued,
+                "completed": self.completed,
+                "failed": self.failed,
+                "pending": len(self._tasks),
+            }
+
+
+# プロセス内で共有する前処理の管理
+ingestion_manager = IngestionManager()
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+
+from dotenv import load_dotenv
+
+# 環境変数を読み込む
+load_dotenv()
+
+# 同時に解析するファイルの合計サイズの上限（バイト単位）
+INGESTION_MAX_BYTES: int = int(os.getenv("INGESTION_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# 同時に実行するCPU負荷の高い処理の数
+INGESTION_CPU_SLOTS: int = int(os.getenv("INGESTION_CPU_SLOTS", str(os.cpu_count() or 1)))
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+# 処理を依頼したユーザー（ユーザーごとに公平に順番を回すために使う）
+ingestion_user: ContextVar[str] = ContextVar("ingestion_user", default="")
+
+
+@dataclass
+class _Waiter:
+    nbytes: int
+    cpu: int
+    future: asyncio.Future = field(repr=False)
+
+
+class IngestionGovernor:
+    """
+    ファイルのダウンロード後の解析や変換の同時実行を、サイズとCPUの重みで制限するクラス
+
+    待機中の処理はユーザーごとのキューに入れ、ユーザーを順番に回して実行する。
+    先頭の処理が実行できない場合は後続の処理も待たせ、大きいファイルが後回しにされ続けないようにする。
+    実行中の処理がない場合は、上限より大きい処理も1つだけ実行する。
+    イベントループのスレッドからのみ使う。
+
+    :param max_bytes: 同時に解析するファイルの合計サイズの上限（バイト単位）
+    :type max_bytes: int
+    :param cpu_slots: 同時に実行するCPU負荷の高い処理の数
+    :type cpu_slots: int
+    """
+
+    def __init__(
+        self, max_bytes: int = INGESTION_MAX_BYTES, cpu_slots: int = INGESTION_CPU_SLOTS
+    ) -> None:
+        self.max_bytes = max(max_bytes, 1)
+        self.cpu_slots = max(cpu_slots, 1)
+        self._queues: OrderedDict[str, deque[_Waiter]] = OrderedDict()
+        self._bytes_in_use = 0
+        self._cpu_in_use = 0
+        self._active = 0
+        self.granted = 0
+        self.waited = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _fits(self, nbytes: int, cpu: int) -> bool:
+        if self._active == 0:
+            return True
+        return (
+            self._bytes_in_use + nbytes <= self.max_bytes
+            and self._cpu_in_use + cpu <= self.cpu_slots
+        )
+
+    def _grant(self, nbytes: int, cpu: int) -> None:
+        self._bytes_in_use += nbytes
+        self._cpu_in_use += cpu
+        self._active += 1
+        self.granted += 1
+
+    def _release(self, nbytes: int, cpu: int) -> None:
+        self._bytes_in_use -= nbytes
+        self._cpu_in_use -= cpu
+        self._active -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._queues:
+            user, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            if waiter.future.done():
+                # 取り消された処理を取り除く
+                queue.popleft()
+            elif self._fits(waiter.nbytes, waiter.cpu):
+                queue.popleft()
+                self._grant(waiter.nbytes, waiter.cpu)
+                waiter.future.set_result(None)
+            else:
+                break
+            # 次のユーザーに順番を回す
+            del self._queues[user]
+            if queue:
+                self._queues[user] = queue
+
+    def _remove(self, user: str, waiter: _Waiter) -> None:
+        queue = self._queues.get(user)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[user]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(
+        self, nbytes: int = 0, cpu: int = 1, user: Optional[str] = None
+    ) -> AsyncIterator[None]:
+        """
+        処理を実行できるまで待機し、処理が終わるまで枠を確保する
+
+        :param nbytes: 処理で使うメモリの見積もり（バイト単位）
+        :type nbytes: int
+        :param cpu: 処理のCPUの重み
+        :type cpu: int
+        :param user: 処理を依頼したユーザー（省略した場合は ingestion_user の値）
+        :type user: Optional[str]
+        """
+        nbytes = max(nbytes, 0)
+        cpu = min(max(cpu, 0), self.cpu_slots)
+        user = ingestion_user.get() if user is None else user
+
+        if not self._queues and self._fits(nbytes, cpu):
+            self._grant(nbytes, cpu)
+        else:
+            waiter = _Waiter(nbytes, cpu, asyncio.get_running_loop().create_future())
+            self._queues.setdefault(user, deque()).append(waiter)
+            started = time.monotonic()
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    # 枠を確保した直後に取り消された場合は枠を返す
+                    self._release(nbytes, cpu)
+                else:
+                    self._remove(user, waiter)
+                raise
+            waited = time.monotonic() - started
+            self.waited += 1
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+        try:
+            yield
+        finally:
+            self._release(nbytes, cpu)
+
+    def stats(self) -> dict[str, float]:
+        """
+        同時実行の統計を返す
+
+        :return: 待機中の数、実行中の数、使用中のサイズとCPU、待機時間などを含む辞書
+        :rtype: dict[str, float]
+        """
+        return {
+            "queue_depth": sum(len(queue) for queue in self._queues.values()),
+            "waiting_users": len(self._queues),
+            "active": self._active,
+            "bytes_in_use": self._bytes_in_use,
+            "cpu_in_use": self._cpu_in_use,
+            "granted": self.granted,
+            "waited": self.waited,
+            "total_wait_seconds": round(self.total_wait_seconds, 3),
+            "max_wait_seconds": round(self.max_wait_seconds, 3),
+        }
+
+
+# プロセス内で共有する同時実行の制御
+ingestion_governor = IngestionGovernor()
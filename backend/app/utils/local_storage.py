@@ -0,0 +1,596 @@
+import base64
+import datetime
+import fcntl
+import hashlib
+import hmac
+import json
+import mimetypes
+import mmap
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import urllib.parse
+from typing import IO, Any, Iterator, Optional
+
+from dotenv import load_dotenv
+from google.api_core.exceptions import NotFound
+
+from app.utils.in_memory_storage import InMemoryBatch
+
+# 環境変数を読み込む
+load_dotenv()
+
+# ファイルを保存するルートディレクトリ（バケットごとにサブディレクトリを作成）
+LOCAL_STORAGE_ROOT: str = os.getenv(
+    "LOCAL_STORAGE_ROOT", os.path.join(tempfile.gettempdir(), "ai-notebook-storage")
+)
+
+# 署名付きURLのベースURL（ローカルストレージのエンドポイントを公開するURL）
+LOCAL_STORAGE_BASE_URL: str = os.getenv("LOCAL_STORAGE_BASE_URL", "http://localhost:8000")
+
+# 署名付きURLの署名鍵（複数プロセスで共有する場合は必ず設定する）
+LOCAL_STORAGE_SIGNING_KEY: bytes = os.getenv(
+    "LOCAL_STORAGE_SIGNING_KEY", base64.b64encode(os.urandom(32)).decode("utf-8")
+).encode("utf-8")
+
+# 書き込み途中のファイルに付けるプレフィックス
+TEMP_PREFIX = ".tmp-"
+
+# MD5ハッシュを保存する拡張属性の名前
+MD5_XATTR = "user.ai_notebook.md5"
+
+# カスタムメタデータを保存する拡張属性の名前
+METADATA_XATTR = "user.ai_notebook.metadata"
+
+# 世代番号を保存する拡張属性の名前（バケットのディレクトリには最後に採番した値を保存する）
+GENERATION_XATTR = "user.ai_notebook.generation"
+
+# sendfileで一度に転送する最大バイト数
+SENDFILE_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def _real_fileno(file_obj: IO[bytes]) -> Optional[int]:
+    """
+    ファイルオブジェクトが実ファイルを指す場合はファイルディスクリプタを返す
+
+    メモリ上にある SpooledTemporaryFile は fileno() でディスクに書き出されるため対象外とする。
+
+    :param file_obj: ファイルオブジェクト
+    :type file_obj: IO[bytes]
+    :return: ファイルディスクリプタ。実ファイルでない場合はNone
+    :rtype: Optional[int]
+    """
+    if isinstance(file_obj, tempfile.SpooledTemporaryFile):
+        if not file_obj._rolled:  # type: ignore[attr-defined]
+            return None
+    try:
+        fd = file_obj.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+    # sendfileの入力は通常ファイルである必要がある
+    return fd if stat.S_ISREG(os.fstat(fd).st_mode) else None
+
+
+def _sendfile(out_fd: int, in_fd: int, offset: int, count: int) -> None:
+    """
+    カーネル内でファイルの内容をコピーする（ユーザー空間のバッファを経由しない）
+
+    :param out_fd: 出力先のファイルディスクリプタ
+    :type out_fd: int
+    :param in_fd: 入力元のファイルディスクリプタ
+    :type in_fd: int
+    :param offset: 入力元の読み込み開始位置
+    :type offset: int
+    :param count: コピーするバイト数
+    :type count: int
+    """
+    while count > 0:
+        sent = os.sendfile(out_fd, in_fd, offset, min(count, SENDFILE_CHUNK_SIZE))
+        if sent == 0:
+            break
+        offset += sent
+        count -= sent
+
+
+def _copy_from_file(src: IO[bytes], dst: IO[bytes]) -> None:
+    """
+    ファイルオブジェクトの現在位置から末尾までを別のファイルに書き込む
+
+    両方が実ファイルの場合は sendfile でコピーし、それ以外は通常のコピーを行う。
+
+    :param src: 入力元のファイルオブジェクト
+    :type src: IO[bytes]
+    :param dst: 出力先のファイルオブジェクト
+    :type dst: IO[bytes]
+    """
+    in_fd = _real_fileno(src)
+    out_fd = _real_fileno(dst)
+    if in_fd is None or out_fd is None or not hasattr(os, "sendfile"):
+        shutil.copyfileobj(src, dst)
+        return
+
+    offset = src.tell()
+    dst.flush()
+    _sendfile(out_fd, in_fd, offset, os.fstat(in_fd).st_size - offset)
+    # ファイルオブジェクトの位置をディスクリプタの位置に合わせる
+    src.seek(0, os.SEEK_END)
+    dst.seek(os.lseek(out_fd, 0, os.SEEK_CUR))
+
+
+def sign(method: str, bucket_name: str, blob_name: str, expires: int, content_type: str) -> str:
+    """
+    ローカルストレージの署名付きURLの署名を計算する
+
+    :param method: HTTPメソッド
+    :type method: str
+    :param bucket_name: バケット名
+    :type bucket_name: str
+    :param blob_name: ブロブ名
+    :type blob_name: str
+    :param expires: 有効期限（UNIX時間）
+    :type expires: int
+    :param content_type: Content-Type（GETの場合はレスポンスのContent-Type）
+    :type content_type: str
+    :return: 署名
+    :rtype: str
+    """
+    message = f"{method}\n{bucket_name}\n{blob_name}\n{expires}\n{content_type}"
+    return hmac.new(LOCAL_STORAGE_SIGNING_KEY, message.encode("utf-8"), "sha256").hexdigest()
+
+
+def verify_signature(
+    method: str,
+    bucket_name: str,
+    blob_name: str,
+    expires: int,
+    content_type: str,
+    signature: str,
+) -> bool:
+    """
+    署名付きURLの署名と有効期限を検証する
+
+    :param method: HTTPメソッド
+    :type method: str
+    :param bucket_name: バケット名
+    :type bucket_name: str
+    :param blob_name: ブロブ名
+    :type blob_name: str
+    :param expires: 有効期限（UNIX時間）
+    :type expires: int
+    :param content_type: Content-Type
+    :type content_type: str
+    :param signature: URLに含まれる署名
+    :type signature: str
+    :return: 署名が正しく、有効期限内であればTrue
+    :rtype: bool
+    """
+    if expires < time.time():
+        return False
+    expected = sign(method, bucket_name, blob_name, expires, content_type)
+    return hmac.compare_digest(expected, signature)
+
+
+class LocalBlobWriter:
+    """
+    ブロブに書き込むためのファイルオブジェクト
+
+    一時ファイルに書き込み、close() で保存先にリネームする。
+    例外で終了した場合は一時ファイルを削除し、既存のファイルは変更しない。
+
+    :param blob: 書き込み先のブロブ
+    :type blob: LocalBlob
+    """
+
+    def __init__(self, blob: "LocalBlob") -> None:
+        self._blob = blob
+        directory = os.path.dirname(blob.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, self._temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=directory)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes) -> int:
+        return self._file.write(data)
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self._file.close()
+        # 世代番号を採番して保存する（対応していないファイルシステムでは最終更新日時を使う）
+        try:
+            generation = self._blob.bucket.next_generation()
+            os.setxattr(self._temp_path, GENERATION_XATTR, str(generation).encode("utf-8"))
+        except (AttributeError, OSError):
+            pass
+        if self._blob.metadata:
+            # カスタムメタデータは拡張属性に保存する（対応していないファイルシステムでは保存しない）
+            try:
+                os.setxattr(
+                    self._temp_path,
+                    METADATA_XATTR,
+                    json.dumps(self._blob.metadata).encode("utf-8"),
+                )
+            except (AttributeError, OSError):
+                pass
+        os.replace(self._temp_path, self._blob.path)
+
+    def abort(self) -> None:
+        self._file.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+    def __enter__(self) -> "LocalBlobWriter":
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class LocalBlob:
+    """
+    google.cloud.storage.Blob と同じインターフェースを持つローカルファイルシステムのブロブ
+
+    世代番号は書き込みごとにバケット内で採番し、ファイルの拡張属性に保存する（拡張属性に
+    対応していないファイルシステムでは最終更新日時（ナノ秒）を使う）。最終更新日時と違い、
+    同じ時刻に書き込んでも世代番号は重複しない。保存するのは最新の内容だけで、
+    generation を指定しても過去の世代は参照できない。
+
+    :param name: ブロブ名
+    :type name: str
+    :param bucket: 所属するバケット
+    :type bucket: LocalBucket
+    """
+
+    def __init__(self, name: str, bucket: "LocalBucket") -> None:
+        self.name = name
+        self.bucket = bucket
+        self.path = bucket.path_for(name)
+        self.metadata: Optional[dict] = None
+        self.content_type: Optional[str] = mimetypes.guess_type(name)[0]
+
+    def _stat(self) -> Optional[os.stat_result]:
+        try:
+            return os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+    def _open(self) -> IO[bytes]:
+        try:
+            return open(self.path, "rb")
+        except FileNotFoundError as e:
+            raise NotFound(f"{self.bucket.name}/{self.name} が存在しません") from e
+
+    @property
+    def size(self) -> Optional[int]:
+        file_stat = self._stat()
+        return file_stat.st_size if file_stat else None
+
+    def _generation(self, file_stat: os.stat_result) -> int:
+        try:
+            return int(os.getxattr(self.path, GENERATION_XATTR).decode("utf-8"))
+        except (AttributeError, OSError, ValueError):
+            return file_stat.st_mtime_ns
+
+    @property
+    def generation(self) -> Optional[int]:
+        file_stat = self._stat()
+        return self._generation(file_stat) if file_stat else None
+
+    @property
+    def updated(self) -> Optional[datetime.datetime]:
+        file_stat = self._stat()
+        if file_stat is None:
+            return None
+        return datetime.datetime.fromtimestamp(file_stat.st_mtime, datetime.timezone.utc)
+
+    @property
+    def md5_hash(self) -> Optional[str]:
+        file_stat = self._stat()
+        if file_stat is None:
+            return None
+
+        # 計算済みのハッシュは世代番号とともに拡張属性に保存して再利用する
+        current_generation = self._generation(file_stat)
+        try:
+            cached = os.getxattr(self.path, MD5_XATTR).decode("utf-8")
+            generation, md5_hash = cached.split(":", 1)
+            if int(generation) == current_generation:
+                return md5_hash
+        except (AttributeError, OSError, ValueError):
+            pass
+
+        digest = hashlib.md5()
+        with self._open() as f:
+            if file_stat.st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    digest.update(mapped)
+        md5_hash = base64.b64encode(digest.digest()).decode("utf-8")
+        try:
+            os.setxattr(self.path, MD5_XATTR, f"{current_generation}:{md5_hash}".encode("utf-8"))
+        except (AttributeError, OSError):
+            pass
+        return md5_hash
+
+    def exists(self, **kwargs: Any) -> bool:
+        return os.path.isfile(self.path)
+
+    def reload(self, **kwargs: Any) -> None:
+        if not self.exists():
+            raise NotFound(f"{self.bucket.name}/{self.name} が存在しません")
+        try:
+            self.metadata = json.loads(os.getxattr(self.path, METADATA_XATTR).decode("utf-8"))
+        except (AttributeError, OSError, ValueError):
+            self.metadata = None
+
+    def patch(self, **kwargs: Any) -> None:
+        if not self.exists():
+            raise NotFound(f"{self.bucket.name}/{self.name} が存在しません")
+        # メタデータの変更では世代番号は変わらない
+        try:
+            os.setxattr(self.path, METADATA_XATTR, json.dumps(self.metadata or {}).encode("utf-8"))
+        except (AttributeError, OSError):
+            pass
+
+    def open(self, mode: str = "rb", **kwargs: Any) -> Any:
+        """
+        ブロブをファイルオブジェクトとして開く（ストリーミングでの読み書き用）
+
+        :param mode: "rb" または "wb"
+        :type mode: str
+        :return: 読み込み用のファイルオブジェクト、または書き込み用の LocalBlobWriter
+        :rtype: Any
+        """
+        if mode == "rb":
+            return self._open()
+        if mode == "wb":
+            return LocalBlobWriter(self)
+        raise ValueError(f"サポートしていないモードです: {mode}")
+
+    def download_as_bytes(self, **kwargs: Any) -> bytes:
+        with self._open() as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            # メモリマップでページキャッシュから直接読み込む
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:]
+
+    def download_to_file(self, file_obj: IO[bytes], **kwargs: Any) -> None:
+        with self._open() as f:
+            _copy_from_file(f, file_obj)
+
+    def download_to_filename(self, filename: str, **kwargs: Any) -> None:
+        with open(filename, "wb") as f:
+            self.download_to_file(f)
+
+    def upload_from_string(
+        self, data: bytes | str, content_type: Optional[str] = None, **kwargs: Any
+    ) -> None:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with LocalBlobWriter(self) as writer:
+            writer.write(data)
+
+    def upload_from_file(
+        self,
+        file_obj: IO[bytes],
+        rewind: bool = False,
+        content_type: Optional[str] = None,
+        **kwargs: Any,
+    ) -> None:
+        if rewind:
+            file_obj.seek(0)
+        with LocalBlobWriter(self) as writer:
+            _copy_from_file(file_obj, writer)  # type: ignore[arg-type]
+
+    def upload_from_filename(
+        self, filename: str, content_type: Optional[str] = None, **kwargs: Any
+    ) -> None:
+        with open(filename, "rb") as f:
+            self.upload_from_file(f, content_type=content_type)
+
+    def rewrite(
+        self, source: "LocalBlob", token: Optional[str] = None, **kwargs: Any
+    ) -> tuple[Optional[str], int, int]:
+        source.reload()
+        self.metadata = source.metadata
+        with source._open() as f:
+            self.upload_from_file(f)
+        size = self.size or 0
+        return None, size, size
+
+    def delete(self, **kwargs: Any) -> None:
+        batch = self.bucket.client.current_batch
+        if batch is not None:
+            # バッチ中は削除を遅延し、結果はレスポンスとして記録する
+            batch._deferred.append(self._delete_now)
+            return
+        self._delete_now()
+
+    def _delete_now(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError as e:
+            raise NotFound(f"{self.bucket.name}/{self.name} が存在しません") from e
+
+    def generate_signed_url(
+        self,
+        expiration: datetime.timedelta = datetime.timedelta(minutes=15),
+        method: str = "GET",
+        content_type: Optional[str] = None,
+        response_type: Optional[str] = None,
+        **kwargs: Any,
+    ) -> str:
+        """
+        ローカルストレージのエンドポイントに対する署名付きURLを生成する
+
+        :param expiration: 有効期間
+        :type expiration: datetime.timedelta
+        :param method: HTTPメソッド（GET または PUT）
+        :type method: str
+        :param content_type: PUTで送信するContent-Type
+        :type content_type: Optional[str]
+        :param response_type: GETのレスポンスのContent-Type
+        :type response_type: Optional[str]
+        :return: 署名付きURL
+        :rtype: str
+        """
+        expires = int(time.time() + expiration.total_seconds())
+        media_type = (content_type if method == "PUT" else response_type) or ""
+        query = urllib.parse.urlencode(
+            {
+                "expires": expires,
+                "type": media_type,
+                "signature": sign(method, self.bucket.name, self.name, expires, media_type),
+            }
+        )
+        path = urllib.parse.quote(f"{self.bucket.name}/{self.name}")
+        return f"{LOCAL_STORAGE_BASE_URL}/local_storage/{path}?{query}"
+
+
+class LocalBucket:
+    """
+    google.cloud.storage.Bucket と同じインターフェースを持つローカルファイルシステムのバケット
+
+    :param client: 所属するクライアント
+    :type client: LocalStorageClient
+    :param name: バケット名
+    :type name: str
+    """
+
+    def __init__(self, client: "LocalStorageClient", name: str) -> None:
+        self.client = client
+        self.name = name
+        self.directory = os.path.realpath(os.path.join(client.root, name))
+
+    def path_for(self, blob_name: str) -> str:
+        """
+        ブロブの保存先パスを返す（バケットのディレクトリ外を指す名前は拒否する）
+
+        :param blob_name: ブロブ名
+        :type blob_name: str
+        :return: 保存先のパス
+        :rtype: str
+        """
+        parts = blob_name.split("/")
+        if not blob_name or blob_name.startswith("/") or ".." in parts:
+            raise ValueError(f"不正なブロブ名です: {blob_name}")
+        if parts[-1].startswith(TEMP_PREFIX):
+            raise ValueError(f"不正なブロブ名です: {blob_name}")
+        return os.path.join(self.directory, *parts)
+
+    def next_generation(self) -> int:
+        """
+        書き込みごとに増える世代番号を採番する
+
+        最後に採番した値をバケットのディレクトリの拡張属性に保存し、ディレクトリのロックで
+        同じバケットに書き込む複数のプロセスでも重複しないようにする。最終更新日時を
+        世代番号として使っていたファイルより小さくならないように、現在時刻（ナノ秒）以上の値にする。
+
+        :return: 世代番号
+        :rtype: int
+        :raises OSError: 拡張属性に対応していないファイルシステムの場合
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                last = int(os.getxattr(fd, GENERATION_XATTR).decode("utf-8"))
+            except (OSError, ValueError):
+                last = 0
+            generation = max(last + 1, time.time_ns())
+            os.setxattr(fd, GENERATION_XATTR, str(generation).encode("utf-8"))
+            return generation
+        finally:
+            # ファイルディスクリプタを閉じるとロックも解放される
+            os.close(fd)
+
+    def blob(self, blob_name: str, **kwargs: Any) -> LocalBlob:
+        return LocalBlob(blob_name, self)
+
+    def get_blob(self, blob_name: str, **kwargs: Any) -> Optional[LocalBlob]:
+        blob = LocalBlob(blob_name, self)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix: Optional[str] = None, **kwargs: Any) -> Iterator[LocalBlob]:
+        # プレフィックスのディレクトリ部分から走査を始める
+        start = self.directory
+        if prefix and "/" in prefix:
+            start = os.path.join(self.directory, *prefix.rsplit("/", 1)[0].split("/"))
+
+        names = []
+        for root, _dirs, files in os.walk(start):
+            relative_root = os.path.relpath(root, self.directory)
+            for file_name in files:
+                if file_name.startswith(TEMP_PREFIX):
+                    continue
+                name = file_name if relative_root == "." else f"{relative_root}/{file_name}"
+                name = name.replace(os.sep, "/")
+                if prefix is None or name.startswith(prefix):
+                    names.append(name)
+
+        for name in sorted(names):
+            yield LocalBlob(name, self)
+
+
+class LocalStorageClient:
+    """
+    ローカルファイルシステムにファイルを保存するCloud Storage互換のクライアント
+
+    オンプレミスや単一ノードの環境で、ネットワーク越しではなくローカルディスクから
+    ファイルを読み書きするために使う。読み込みはメモリマップ、ファイル間のコピーは
+    sendfile で行う。署名付きURLは /local_storage エンドポイントに対するHMAC署名で生成する。
+
+    :param root: ファイルを保存するルートディレクトリ
+    :type root: str
+    """
+
+    def __init__(self, root: str = LOCAL_STORAGE_ROOT) -> None:
+        self.root = root
+        self._buckets: dict[str, LocalBucket] = {}
+        self._lock = threading.Lock()
+        self._batch_local = threading.local()
+
+    @property
+    def current_batch(self) -> Optional[InMemoryBatch]:
+        return getattr(self._batch_local, "batch", None)
+
+    def batch(self, raise_exception: bool = True) -> InMemoryBatch:
+        # 削除を遅延して実行するだけなので、インメモリ実装のバッチを使う
+        return InMemoryBatch(self, raise_exception=raise_exception)  # type: ignore[arg-type]
+
+    def bucket(self, bucket_name: str, **kwargs: Any) -> LocalBucket:
+        with self._lock:
+            if bucket_name not in self._buckets:
+                self._buckets[bucket_name] = LocalBucket(self, bucket_name)
+            return self._buckets[bucket_name]
+
+    def get_bucket(self, bucket_name: str, **kwargs: Any) -> LocalBucket:
+        return self.bucket(bucket_name)
+
+    def list_blobs(
+        self, bucket_or_name: LocalBucket | str, prefix: Optional[str] = None, **kwargs: Any
+    ) -> Iterator[LocalBlob]:
+        bucket = (
+            bucket_or_name
+            if isinstance(bucket_or_name, LocalBucket)
+            else self.bucket(bucket_or_name)
+        )
+        return bucket.list_blobs(prefix=prefix)
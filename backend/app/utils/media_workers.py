@@ -0,0 +1,227 @@
+import asyncio
+import functools
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Optional, TypeVar
+
+from dotenv import load_dotenv
+
+# 環境変数を読み込む
+load_dotenv()
+
+
+def available_cpus() -> int:
+    """
+    このプロセスが使えるCPUの数を返す（コンテナでCPUを割り当てている場合はその数）
+
+    :return: CPUの数
+    :rtype: int
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return max(len(os.sched_getaffinity(0)), 1)
+    return os.cpu_count() or 1
+
+
+# 同時に実行するffmpegのプロセス数（APIのイベントループ用にCPUを残す）
+MEDIA_WORKERS: int = int(os.getenv("MEDIA_WORKERS", str(max(available_cpus() // 2, 1))))
+
+# ffmpegの1つのプロセスが使うスレッド数（0の場合はCPUの数をプロセス数で割る）
+MEDIA_THREADS_PER_JOB: int = int(os.getenv("MEDIA_THREADS_PER_JOB", "0"))
+
+# ffmpegを実行する優先度（nice値、0の場合は変更しない）
+MEDIA_NICE: int = int(os.getenv("MEDIA_NICE", "10"))
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+T = TypeVar("T")
+
+
+class MediaWorkerPool:
+    """
+    ffmpeg・ffprobeのプロセスの同時実行数を制限し、専用のスレッドで実行を待つクラス
+
+    プロセスは枠を確保した順に起動し、スレッド数と優先度（nice値）を指定して
+    APIのイベントループやリクエストの処理とCPUを取り合わないようにする。
+    プロセスへの入出力や終了の待機はデフォルトのスレッドプールとは別のスレッドで行う。
+    枠はイベントループのスレッドからのみ確保する。
+
+    :param workers: 同時に実行するプロセス数
+    :type workers: int
+    :param threads_per_job: 1つのプロセスが使うスレッド数（0の場合はCPUの数をプロセス数で割る）
+    :type threads_per_job: int
+    :param nice: プロセスの優先度（nice値、0の場合は変更しない）
+    :type nice: int
+    """
+
+    def __init__(
+        self,
+        workers: int = MEDIA_WORKERS,
+        threads_per_job: int = MEDIA_THREADS_PER_JOB,
+        nice: int = MEDIA_NICE,
+    ) -> None:
+        self.workers = max(workers, 1)
+        self.threads_per_job = threads_per_job or max(available_cpus() // self.workers, 1)
+        self.nice = nice
+        self._waiters: deque[asyncio.Future] = deque()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.running = 0
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+        self.max_run_seconds = 0.0
+
+    def ffmpeg_cmd(self, cmd: str = "ffmpeg") -> list[str]:
+        """
+        優先度を指定してffmpegを起動するコマンドを返す（ffmpeg-pythonの cmd 引数に渡す）
+
+        :param cmd: 実行するコマンド
+        :type cmd: str
+        :return: コマンドのリスト
+        :rtype: list[str]
+        """
+        if self.nice and shutil.which("nice"):
+            return ["nice", "-n", str(self.nice), cmd]
+        return [cmd]
+
+    def output_options(self) -> dict[str, Any]:
+        """
+        ffmpegの出力に指定するオプションを返す
+
+        :return: スレッド数を含むオプション
+        :rtype: dict[str, Any]
+        """
+        return {"threads": self.threads_per_job}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    # 1つのプロセスにつき、標準入力・標準出力・終了の待機の3つのスレッドを使う
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers * 3, thread_name_prefix="media-worker"
+                    )
+        return self._executor
+
+    async def to_thread(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        ブロッキング処理を専用のスレッドで実行する
+
+        :param func: 実行する関数
+        :type func: Callable[..., T]
+        :return: 関数の戻り値
+        :rtype: T
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(), functools.partial(func, *args, **kwargs)
+        )
+
+    def _release(self) -> None:
+        self.running -= 1
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                self.running += 1
+                future.set_result(None)
+                break
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        プロセスを起動できるまで待機し、プロセスが終わるまで枠を確保する
+        """
+        queued_at = time.monotonic()
+        if self.running < self.workers and not self._waiters:
+            self.running += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # 枠を確保した直後に取り消された場合は、次の処理に枠を渡す
+                    self._release()
+                elif future in self._waiters:
+                    self._waiters.remove(future)
+                raise
+
+        started_at = time.monotonic()
+        wait_seconds = started_at - queued_at
+        with self._lock:
+            self.started += 1
+            self.total_wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+        finally:
+            run_seconds = time.monotonic() - started_at
+            with self._lock:
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self.total_run_seconds += run_seconds
+                self.max_run_seconds = max(self.max_run_seconds, run_seconds)
+            self._release()
+
+    async def run(self, func: Callable[[], T]) -> T:
+        """
+        ffmpeg・ffprobeを起動して終了まで待つ関数を、枠を確保してから専用のスレッドで実行する
+
+        :param func: プロセスを起動して終了まで待つ関数
+        :type func: Callable[[], T]
+        :return: 関数の戻り値
+        :rtype: T
+        """
+        async with self.slot():
+            return await self.to_thread(func)
+
+    def shutdown(self) -> None:
+        """
+        アプリケーション終了時にスレッドを停止する
+        """
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def stats(self) -> dict[str, float]:
+        """
+        プロセスの実行の統計を返す
+
+        :return: 待機中・実行中のプロセス数、実行数、失敗数、待機時間と実行時間を含む辞書
+        :rtype: dict[str, float]
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "threads_per_job": self.threads_per_job,
+                "queue_depth": sum(1 for future in self._waiters if not future.done()),
+                "running": self.running,
+                "started": self.started,
+                "completed": self.completed,
+                "failed": self.failed,
+                "total_wait_seconds": round(self.total_wait_seconds, 3),
+                "max_wait_seconds": round(self.max_wait_seconds, 3),
+                "total_run_seconds": round(self.total_run_seconds, 3),
+                "max_run_seconds": round(self.max_run_seconds, 3),
+            }
+
+
+# プロセス内で共有するffmpegの実行
+media_workers = MediaWorkerPool()
@@ -1,23 +1,28 @@
 import asyncio
-import base64
-import io
 import logging
 import os
 import random
 import unicodedata
 from typing import Any, Callable, Dict, List, Optional, Protocol, Set, TypeVar
 
-import fitz
 from anthropic import AnthropicVertex
 from dotenv import load_dotenv
 from google.api_core.exceptions import (
     GoogleAPIError,
     InternalServerError,
 )
-from google.cloud import storage
 
-from app.utils.convert_mp4_to_mp3 import convert_mp4_to_mp3
-from app.utils.gemini_extract_text_from_audio import extract_text_from_audio
+from app.utils.blob_metadata import BlobInfo, lookup_blobs
+from app.utils.gemini_extract_text_from_audio import transcribe_media
+from app.utils.image_normalization import read_image_base64
+from app.utils.ingestion_governor import ingestion_user
+from app.utils.pdf_extraction import load_pdf_pages
+from app.utils.prompt_packer import (
+    PromptDocument,
+    estimate_reserved_tokens,
+    prompt_packer,
+)
+from app.utils.storage_client import get_storage_client
 
 
 # プロトコルの定義
@@ -197,34 +202,11 @@ prompt = f"""
 """
 
 
-async def check_file_exists(bucket_name: str, file_name: str) -> bool:
-    client = storage.Client()
+async def read_file(bucket_name: str, file_name: str, generation: Optional[int] = None) -> str:
+    client = get_storage_client()
     bucket = client.bucket(bucket_name)
-    blob = bucket.blob(file_name)
-    return blob.exists()
-
-
-async def read_file(bucket_name: str, file_name: str) -> str:
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(file_name)
-    file_content = await asyncio.to_thread(blob.download_as_bytes)
-    base64_encoded = base64.b64encode(file_content).decode("utf-8")
-    return base64_encoded
-
-
-async def extract_text_from_pdf(bucket_name: str, file_name: str) -> str:
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(file_name)
-    pdf_content = await asyncio.to_thread(blob.download_as_bytes)
-    pdf_file = io.BytesIO(pdf_content)
-    doc = await asyncio.to_thread(fitz.open, stream=pdf_file, filetype="pdf")
-    extracted_text = ""
-    for i, page in enumerate(doc):
-        page_text = await asyncio.to_thread(page.get_text)
-        extracted_text += f"\n# {i+1}ページ\n{page_text}"
-    return extracted_text
+    # モデルが扱う最大サイズに縮小した画像を、世代番号ごとにキャッシュして返す
+    return await read_image_base64(bucket, file_name, generation)
 
 
 def get_media_type(extension: str) -> str:
@@ -245,8 +227,12 @@ async def generate_content_json(
     difficulty: str,
     model_name: str = MODEL_NAME,
     bucket_name: str = BUCKET_NAME,
+    blob_infos: Optional[dict[str, BlobInfo]] = None,
+    file_ids: Optional[dict[str, int]] = None,
 ) -> dict:
     print("generate_content_json started")  # デバッグ用
+    # ファイルの解析や変換の順番をユーザーごとに公平に回すため、依頼したユーザーを記録する
+    ingestion_user.set(uid)
 
     content: list = []
     image_files: list[dict] = []
@@ -254,7 +240,10 @@ async def generate_content_json(
 
     try:
         client = AnthropicVertex(region=REGION, project_id=PROJECT_ID)
-        all_extracted_text = ""
+        # ファイルの存在とメタデータを1回の一覧取得でまとめて確認
+        if blob_infos is None:
+            blob_infos = await lookup_blobs(bucket_name, uid, files)
+        documents: list[PromptDocument] = []
 
         for file_name in files:
             if not uid or not uid.strip():
@@ -264,18 +253,25 @@ async def generate_content_json(
             file_name = unicodedata.normalize("NFC", f"{safe_uid}/{file_name}")
             print(f"Processing file: {file_name}")
 
-            if await check_file_exists(bucket_name, file_name):
+            blob_info = blob_infos.get(file_name)
+            if blob_info and blob_info.exists:
                 print(f"File {file_name} exists in bucket {bucket_name}")
 
                 if file_name.lower().endswith(".pdf"):
                     print(f"Extracting text from PDF: {file_name}")
-                    extracted_text = await extract_text_from_pdf(bucket_name, file_name)
-                    print(f"Extracted text length: {len(extracted_text)}")
-                    all_extracted_text += f"\n=== {file_name} ===\n{extracted_text}"
+                    pages = await load_pdf_pages(
+                        bucket_name,
+                        file_name,
+                        blob_info.generation,
+                        # 抽出済みのテキストがあれば再利用する
+                        file_ids.get(file_name) if file_ids else None,
+                    )
+                    print(f"Extracted pages: {len(pages)}")
+                    documents.append(PromptDocument(file_name, pages))
 
                 elif file_name.lower().endswith((".png", ".jpg", ".jpeg")):
                     print(f"Reading image file: {file_name}")
-                    image_file = await read_file(bucket_name, file_name)
+                    image_file = await read_file(bucket_name, file_name, blob_info.generation)
                     file_extension = file_name.split(".")[-1].lower()
                     image_files.append(
                         {
@@ -289,37 +285,40 @@ async def generate_content_json(
                     )
                     print(f"Added image file: {file_name} to image_files")
 
-                elif file_name.lower().endswith(".mp4"):
-                    logging.info(f"Converting {file_name} to mp3 format.")
-                    if await convert_mp4_to_mp3(bucket_name, file_name):
-                        print(f"Successfully converted {file_name} to mp3 format.")
-                        audio_text = await extract_text_from_audio(bucket_name, file_name)
-                        all_extracted_text += f"\n=== {file_name} ===\n{audio_text}"
-                    else:
-                        logging.error(f"Failed to convert {file_name} to mp3 format.")
-                        raise InternalServerError(f"Failed to convert {file_name} to mp3 format.")
-
-                elif file_name.lower().endswith((".mp3", ".wav")):
-                    audio_text = await extract_text_from_audio(bucket_name, file_name)
-                    all_extracted_text += f"\n=== {file_name} ===\n{audio_text}"
+                elif file_name.lower().endswith((".mp4", ".mp3", ".wav")):
+                    # 動画ファイルはMP3に変換してから文字起こしし、文字起こし済みなら再利用する
+                    audio_text = await transcribe_media(
+                        bucket_name,
+                        file_name,
+                        blob_info.generation,
+                        file_ids.get(file_name) if file_ids else None,
+                    )
+                    documents.append(PromptDocument(file_name, [audio_text], paged=False))
 
-        if all_extracted_text:
-            content.append({"type": "text", "text": f"講義テキスト:\n{all_extracted_text}"})
-            print(f"Added extracted text to content (length: {len(all_extracted_text)})")
+        instruction = (
+            f"上記の講義テキスト{title}の内容に基づいて、"
+            + f"{tool_name}ツールを使用して問題を作成して下さい。"
+            + f"なお、問題の難易度は{difficulty_jp}としてください。"
+        )
+        # 講義テキストをモデルのトークン数の上限に収める
+        packed = prompt_packer.pack(
+            documents,
+            model_name,
+            query=title,
+            reserved_tokens=estimate_reserved_tokens(
+                instruction, str(tool_definition), image_count=len(image_files)
+            ),
+        )
+        if packed.text:
+            content.append({"type": "text", "text": f"講義テキスト:\n{packed.text}"})
+            print(f"Added extracted text to content (tokens: {packed.estimated_tokens})")
 
         if image_files:
             for i, image in enumerate(image_files, 1):
                 content.extend([{"type": "text", "text": f"Image {i}:"}, image])
             print(f"Added {len(image_files)} images to content")
 
-        content.append(
-            {
-                "type": "text",
-                "text": f"上記の講義テキスト{title}の内容に基づいて、"
-                + f"{tool_name}ツールを使用して問題を作成して下さい。"
-                + f"なお、問題の難易度は{difficulty_jp}としてください。",
-            }
-        )
+        content.append({"type": "text", "text": instruction})
         print("Added prompt to content")
 
         print("Content structure:")
@@ -351,6 +350,7 @@ async def generate_content_json(
         response = await retry_create_with_backoff(
             create_request, retryable_status_codes={429, 503, 504}
         )
+        prompt_packer.record_usage(model_name, packed, response)
 
         if response.content and len(response.content) > 0:
             if response.content[0].type == "tool_use":
@@ -402,15 +402,22 @@ async def generate_similar_questions_json(
     answers: list[str],
     model_name: str = MODEL_NAME,
     bucket_name: str = BUCKET_NAME,
+    blob_infos: Optional[dict[str, BlobInfo]] = None,
+    file_ids: Optional[dict[str, int]] = None,
 ) -> dict:
     print("generate_content_json started")  # デバッグ用
+    # ファイルの解析や変換の順番をユーザーごとに公平に回すため、依頼したユーザーを記録する
+    ingestion_user.set(uid)
 
     content: list = []
     image_files: list[dict] = []
 
     try:
         client = AnthropicVertex(region=REGION, project_id=PROJECT_ID)
-        all_extracted_text = ""
+        # ファイルの存在とメタデータを1回の一覧取得でまとめて確認
+        if blob_infos is None:
+            blob_infos = await lookup_blobs(bucket_name, uid, files)
+        documents: list[PromptDocument] = []
 
         for file_name in files:
             if not uid or not uid.strip():
@@ -420,18 +427,25 @@ async def generate_similar_questions_json(
             file_name = unicodedata.normalize("NFC", f"{safe_uid}/{file_name}")
             print(f"Processing file: {file_name}")
 
-            if await check_file_exists(bucket_name, file_name):
+            blob_info = blob_infos.get(file_name)
+            if blob_info and blob_info.exists:
                 print(f"File {file_name} exists in bucket {bucket_name}")
 
                 if file_name.lower().endswith(".pdf"):
                     print(f"Extracting text from PDF: {file_name}")
-                    extracted_text = await extract_text_from_pdf(bucket_name, file_name)
-                    print(f"Extracted text length: {len(extracted_text)}")
-                    all_extracted_text += f"\n=== {file_name} ===\n{extracted_text}"
+                    pages = await load_pdf_pages(
+                        bucket_name,
+                        file_name,
+                        blob_info.generation,
+                        # 抽出済みのテキストがあれば再利用する
+                        file_ids.get(file_name) if file_ids else None,
+                    )
+                    print(f"Extracted pages: {len(pages)}")
+                    documents.append(PromptDocument(file_name, pages))
 
                 elif file_name.lower().endswith((".png", ".jpg", ".jpeg")):
                     print(f"Reading image file: {file_name}")
-                    image_file = await read_file(bucket_name, file_name)
+                    image_file = await read_file(bucket_name, file_name, blob_info.generation)
                     file_extension = file_name.split(".")[-1].lower()
                     image_files.append(
                         {
@@ -445,48 +459,51 @@ async def generate_similar_questions_json(
                     )
                     print(f"Added image file: {file_name} to image_files")
 
-                elif file_name.lower().endswith(".mp4"):
-                    logging.info(f"Converting {file_name} to mp3 format.")
-                    if await convert_mp4_to_mp3(bucket_name, file_name):
-                        print(f"Successfully converted {file_name} to mp3 format.")
-                        audio_text = await extract_text_from_audio(bucket_name, file_name)
-                        all_extracted_text += f"\n=== {file_name} ===\n{audio_text}"
-                    else:
-                        logging.error(f"Failed to convert {file_name} to mp3 format.")
-                        raise InternalServerError(f"Failed to convert {file_name} to mp3 format.")
-
-                elif file_name.lower().endswith((".mp3", ".wav")):
-                    audio_text = await extract_text_from_audio(bucket_name, file_name)
-                    all_extracted_text += f"\n=== {file_name} ===\n{audio_text}"
+                elif file_name.lower().endswith((".mp4", ".mp3", ".wav")):
+                    # 動画ファイルはMP3に変換してから文字起こしし、文字起こし済みなら再利用する
+                    audio_text = await transcribe_media(
+                        bucket_name,
+                        file_name,
+                        blob_info.generation,
+                        file_ids.get(file_name) if file_ids else None,
+                    )
+                    documents.append(PromptDocument(file_name, [audio_text], paged=False))
 
-        if all_extracted_text:
-            content.append({"type": "text", "text": f"講義テキスト:\n{all_extracted_text}"})
-            print(f"Added extracted text to content (length: {len(all_extracted_text)})")
+        instruction = (
+            f"上記の講義テキスト{title}の内容に基づいて、"
+            + (
+                "AIが作成した選択問題、ユーザーの解答、正解、正誤、"
+                "解説が10問分、以下に与えられています。\n"
+            )
+            + f"{answers}\n"
+            + (
+                "ユーザーの解答が誤っている問題の分野を見つけて、"
+                "講義テキストから類似問題を作成して下さい。"
+            )
+            + "すでにAIが作成した問題と重複しないように注意して下さい。"
+            + "ユーザーが解答を誤った苦手な分野を集中的に克服することが目的です。"
+            + "AIが作成した問題、ユーザーの解答の正誤、解説を参考にして、"
+            + f"{tool_name}ツールを使用して問題を作成して下さい。"
+        )
+        # 講義テキストをモデルのトークン数の上限に収め、解答した問題に関連するページを優先する
+        packed = prompt_packer.pack(
+            documents,
+            model_name,
+            query="\n".join([title, *answers]),
+            reserved_tokens=estimate_reserved_tokens(
+                instruction, str(tool_definition), image_count=len(image_files)
+            ),
+        )
+        if packed.text:
+            content.append({"type": "text", "text": f"講義テキスト:\n{packed.text}"})
+            print(f"Added extracted text to content (tokens: {packed.estimated_tokens})")
 
         if image_files:
             for i, image in enumerate(image_files, 1):
                 content.extend([{"type": "text", "text": f"Image {i}:"}, image])
             print(f"Added {len(image_files)} images to content")
 
-        content.append(
-            {
-                "type": "text",
-                "text": f"上記の講義テキスト{title}の内容に基づいて、"
-                + (
-                    "AIが作成した選択問題、ユーザーの解答、正解、正誤、"
-                    "解説が10問分、以下に与えられています。\n"
-                )
-                + f"{answers}\n"
-                + (
-                    "ユーザーの解答が誤っている問題の分野を見つけて、"
-                    "講義テキストから類似問題を作成して下さい。"
-                )
-                + "すでにAIが作成した問題と重複しないように注意して下さい。"
-                + "ユーザーが解答を誤った苦手な分野を集中的に克服することが目的です。"
-                + "AIが作成した問題、ユーザーの解答の正誤、解説を参考にして、"
-                + f"{tool_name}ツールを使用して問題を作成して下さい。",
-            }
-        )
+        content.append({"type": "text", "text": instruction})
         print("Added prompt to content")
 
         print("Content structure:")
@@ -518,6 +535,7 @@ async def generate_similar_questions_json(
         response = await retry_create_with_backoff(
             create_request, retryable_status_codes={429, 503, 504}
         )
+        prompt_packer.record_usage(model_name, packed, response)
 
         if response.content and len(response.content) > 0:
             if response.content[0].type == "tool_use":
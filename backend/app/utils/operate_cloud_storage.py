@@ -1,18 +1,32 @@
 import asyncio
-import datetime
-import io
+import base64
+import hashlib
 import logging
 import os
 import unicodedata
+from typing import IO, Any
 
 from dotenv import load_dotenv
 from fastapi import HTTPException, UploadFile
-from google.api_core.exceptions import GoogleAPIError
-from google.cloud import storage
+from google.api_core.exceptions import GoogleAPIError, NotFound, from_http_status
+
+from app.utils.blob_metadata import common_blob_prefix, list_blob_infos
+from app.utils.convert_mp4_to_mp3 import REMUX_PROFILE, get_audio_blob_name, get_mp3_blob_name
+from app.utils.signed_url_cache import get_signed_urls, signed_url_cache
+from app.utils.storage_client import STORAGE_BACKEND, get_storage_client
 
 # 環境変数を読み込む
 load_dotenv()
 
+# 同時にアップロードするファイル数の上限（環境変数で調整可能）
+UPLOAD_CONCURRENCY: int = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+
+# レジューマブルアップロードのチャンクサイズ（256KBの倍数）
+UPLOAD_CHUNK_SIZE: int = 8 * 1024 * 1024
+
+# バッチリクエスト1回あたりの削除件数（Cloud Storageの推奨上限）
+DELETE_BATCH_SIZE: int = 100
+
 
 # ファイルを読み込む関数
 async def post_files(files: list[UploadFile], uid: str) -> dict:
@@ -53,65 +67,133 @@ async def post_files(files: list[UploadFile], uid: str) -> dict:
     return upload_result
 
 
+def compute_md5(file_obj: IO[bytes]) -> str:
+    """
+    ファイルの内容のMD5ハッシュを、Cloud Storageと同じbase64形式で返す
+
+    ファイルはチャンク単位で読み込み、読み込み後は先頭に戻す。
+
+    :param file_obj: ファイルオブジェクト
+    :type file_obj: IO[bytes]
+    :return: base64エンコードされたMD5ハッシュ
+    :rtype: str
+    """
+    md5 = hashlib.md5()
+    file_obj.seek(0)
+    while chunk := file_obj.read(UPLOAD_CHUNK_SIZE):
+        md5.update(chunk)
+    file_obj.seek(0)
+    return base64.b64encode(md5.digest()).decode("utf-8")
+
+
 async def upload_files(ext_correct_files: list[UploadFile], uid: str) -> dict:
     """
     ファイルをGoogle Cloud Storageにアップロードする
 
+    UploadFileのスプールを二重にバッファせずに直接アップロードし、
+    同時実行数を UPLOAD_CONCURRENCY に制限して並列に処理する。
+    既存のブロブと内容のMD5ハッシュが一致するファイルはアップロードをスキップする。
+    成功したファイルの結果には content_hash（MD5ハッシュ）を含める。
+
     :param ext_correct_files: アップロードする正しい拡張子を持つファイルのリスト
     :type ext_correct_files: list[UploadFile]
     :return: アップロード結果を含む辞書
     :rtype: dict
     """
-    success_files, failed_files = [], []  # アップロードに失敗したファイル
-
-    # 環境変数から認証情報を取得
-    credentials = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+    # 環境変数からバケット名を取得
     bucket_name = os.getenv("BUCKET_NAME")
 
-    for file in ext_correct_files:
-        # ブロブ名を正規化
-        if file.filename:
-            # ユーザーIDの検証
-            if not uid or not uid.strip():
-                raise ValueError("Invalid user ID")
-
-            # パスの正規化
-            safe_uid = uid.strip().rstrip("/")
-            normalized_blobname = unicodedata.normalize("NFC", f"{safe_uid}/{file.filename}")
-
-        client = storage.Client.from_service_account_json(credentials)
-        bucket = storage.Bucket(client, bucket_name)
-        file_content = await file.read()
-        file_obj = io.BytesIO(file_content)
-        destination_blob_name = normalized_blobname
-        blob = bucket.blob(destination_blob_name)
-        file_obj.seek(0)
-        try:
-            # アップロードの実行
-            await asyncio.to_thread(blob.upload_from_file, file_obj)
-
-            # アップロードの結果をチェック
-            exists = await asyncio.to_thread(blob.exists)
-            if exists:
-                success_message = f"ファイル {file.filename} のアップロードが成功しました"
-                success_files.append({"message": success_message, "filename": file.filename})
-            else:
-                error_message = f"ファイル {file.filename} のアップロードに失敗しました"
-                failed_files.append(error_message)
+    # アップロード対象がない場合はクライアントを使わずに終了
+    target_files = [file for file in ext_correct_files if file.filename]
+    if not target_files:
+        return {"success": True, "success_files": []}
 
-        # Google Cloud に関連するエラーの処理
-        except GoogleAPIError as e:
-            error_msg_part = f"ファイル {file.filename} のアップロード中にエラーが発生しました: "
-            error_message = error_msg_part + str(e)
-            failed_files.append(error_message)
+    # ユーザーIDの検証
+    if not uid or not uid.strip():
+        raise ValueError("Invalid user ID")
+    safe_uid = uid.strip().rstrip("/")
+
+    # 共有クライアントを全ファイルで使い回す
+    client = get_storage_client()
+    bucket = client.bucket(bucket_name)
+    semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+    # 既存のブロブのハッシュを1回の一覧取得でまとめて取得（キャッシュは使わない）
+    blob_names = {
+        unicodedata.normalize("NFC", f"{safe_uid}/{file.filename}") for file in target_files
+    }
+    try:
+        existing_blobs = await asyncio.to_thread(
+            list_blob_infos,
+            client,
+            bucket.name,
+            common_blob_prefix(safe_uid, blob_names),
+            blob_names,
+        )
+    except Exception as e:
+        # 一覧取得に失敗した場合はスキップ判定を行わずにすべてアップロードする
+        logging.warning(f"既存ファイルの確認に失敗しました: {e}")
+        existing_blobs = {}
 
-        # その他一般的なエラーの処理
-        except Exception as e:
-            base_msg = "ファイルのアップロード中に予期しないエラーが発生しました: "
-            error_detail = str(e)
-            filename_msg = f"{file.filename} "
-            error_message = filename_msg + base_msg + error_detail
-            failed_files.append(error_message)
+    async def upload_file(file: UploadFile) -> tuple[dict | None, str | None]:
+        # ブロブ名を正規化
+        normalized_blobname = unicodedata.normalize("NFC", f"{safe_uid}/{file.filename}")
+        blob = bucket.blob(normalized_blobname, chunk_size=UPLOAD_CHUNK_SIZE)
+
+        async with semaphore:
+            try:
+                content_hash = await asyncio.to_thread(compute_md5, file.file)
+
+                # 内容が変わっていない場合はアップロードしない
+                existing_blob = existing_blobs.get(normalized_blobname)
+                if existing_blob is not None and existing_blob.md5_hash == content_hash:
+                    skip_message = f"ファイル {file.filename} は変更がないためスキップしました"
+                    logging.info(skip_message)
+                    return {
+                        "message": skip_message,
+                        "filename": file.filename,
+                        "content_hash": content_hash,
+                        "skipped": True,
+                    }, None
+
+                # スプールから直接アップロード（大きいファイルはチャンク単位のレジューマブル）
+                await asyncio.to_thread(
+                    blob.upload_from_file,
+                    file.file,
+                    rewind=True,
+                    size=file.size,
+                    content_type=file.content_type,
+                )
+
+                # アップロードのレスポンスに含まれる世代番号で結果をチェック
+                if blob.generation is not None:
+                    success_message = f"ファイル {file.filename} のアップロードが成功しました"
+                    return {
+                        "message": success_message,
+                        "filename": file.filename,
+                        "content_hash": content_hash,
+                        "skipped": False,
+                    }, None
+                return None, f"ファイル {file.filename} のアップロードに失敗しました"
+
+            # Google Cloud に関連するエラーの処理
+            except GoogleAPIError as e:
+                error_msg_part = (
+                    f"ファイル {file.filename} のアップロード中にエラーが発生しました: "
+                )
+                return None, error_msg_part + str(e)
+
+            # その他一般的なエラーの処理
+            except Exception as e:
+                base_msg = "ファイルのアップロード中に予期しないエラーが発生しました: "
+                error_detail = str(e)
+                filename_msg = f"{file.filename} "
+                return None, filename_msg + base_msg + error_detail
+
+    results = await asyncio.gather(*(upload_file(file) for file in target_files))
+
+    success_files = [success for success, _ in results if success is not None]
+    failed_files = [failed for _, failed in results if failed is not None]
 
     if failed_files:
         error_details = "\n".join(failed_files)
@@ -124,64 +206,170 @@ async def upload_files(ext_correct_files: list[UploadFile], uid: str) -> dict:
     return {"success": True, "success_files": success_files}
 
 
+def get_derived_blob_names(blob_name: str) -> list[str]:
+    """
+    元ファイルから生成される派生ファイル（mp3変換結果など）のブロブ名を返す
+
+    :param blob_name: 元ファイルのブロブ名
+    :type blob_name: str
+    :return: 派生ファイルのブロブ名のリスト
+    :rtype: list[str]
+    """
+    derived_names = []
+    if blob_name.lower().endswith(".mp4"):
+        derived_names.append(get_mp3_blob_name(blob_name))
+        # 再エンコードせずに取り出したAACの音声
+        derived_names.append(get_audio_blob_name(blob_name, REMUX_PROFILE))
+    return derived_names
+
+
+def _record_batch_responses(batch: Any) -> list[Any]:
+    """
+    バッチの送信時に finish() が返すリクエストごとのレスポンスを記録するリストを返す
+
+    with 文の終了時に送信されるバッチは finish() の戻り値を返さないため、
+    finish() をラップして戻り値を受け取る。
+
+    :param batch: client.batch() で作成したバッチ
+    :type batch: Any
+    :return: 送信後にリクエストごとのレスポンスが追加されるリスト
+    :rtype: list[Any]
+    """
+    responses: list[Any] = []
+    finish = batch.finish
+
+    def finish_and_record(raise_exception: bool = True) -> list[Any]:
+        result = finish(raise_exception=raise_exception)
+        responses.extend(result)
+        return result
+
+    batch.finish = finish_and_record
+    return responses
+
+
+def _batch_delete(client: Any, bucket: Any, blob_names: list[str]) -> dict[str, Exception | None]:
+    """
+    バッチAPIでブロブをまとめて削除し、ブロブごとの結果を返す
+
+    :param client: Cloud Storageクライアント
+    :type client: Any
+    :param bucket: 対象のバケット
+    :type bucket: Any
+    :param blob_names: 削除するブロブ名のリスト
+    :type blob_names: list[str]
+    :return: ブロブ名をキーとし、成功時はNone、失敗時は例外を値とする辞書
+    :rtype: dict[str, Exception | None]
+    """
+    results: dict[str, Exception | None] = {}
+
+    for i in range(0, len(blob_names), DELETE_BATCH_SIZE):
+        chunk = blob_names[i : i + DELETE_BATCH_SIZE]
+        deferred: list[str] = []
+        try:
+            batch = client.batch(raise_exception=False)
+            responses = _record_batch_responses(batch)
+            with batch:
+                for blob_name in chunk:
+                    try:
+                        bucket.blob(blob_name).delete()
+                        deferred.append(blob_name)
+                    except Exception as e:
+                        results[blob_name] = e
+
+            # バッチのレスポンスは送信したリクエストの順に返される
+            for blob_name, response in zip(deferred, responses, strict=True):
+                if 200 <= response.status_code < 300:
+                    results[blob_name] = None
+                else:
+                    results[blob_name] = from_http_status(
+                        response.status_code, f"{blob_name} の削除に失敗しました"
+                    )
+
+        except Exception as e:
+            # バッチリクエスト全体が失敗した場合は、未確定のブロブをすべて失敗とする
+            for blob_name in chunk:
+                results.setdefault(blob_name, e)
+
+    return results
+
+
 async def delete_files_from_gcs(files: list[str], uid: str) -> dict:
     """
     Google Cloud Storageからファイルを削除します。
+
+    削除リクエストはバッチAPIで DELETE_BATCH_SIZE 件ずつまとめて送信し、
+    mp3/ 配下の変換結果などの派生ファイルも合わせて削除します。
+
+    :param files: 削除するファイル名のリスト
+    :type files: list[str]
+    :param uid: ユーザーID
+    :type uid: str
+    :return: 削除結果を含む辞書
+    :rtype: dict
     """
     success_files, failed_files = [], []
 
     credentials = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
     bucket_name = os.getenv("BUCKET_NAME")
 
-    if not credentials or not bucket_name:
+    # ローカルストレージの場合はサービスアカウントの認証情報は不要
+    if not bucket_name or (STORAGE_BACKEND == "gcs" and not credentials):
         raise ValueError("必要な環境変数が設定されていません")
 
-    client = storage.Client.from_service_account_json(credentials)
-    bucket = storage.Bucket(client, bucket_name)
+    if not uid or not uid.strip():
+        raise ValueError("Invalid user ID")
 
-    for filename in files:
-        if not uid or not uid.strip():
-            raise ValueError("Invalid user ID")
+    safe_uid = uid.strip().rstrip("/")
+    blob_names = [unicodedata.normalize("NFC", f"{safe_uid}/{filename}") for filename in files]
+    derived_names = [
+        derived_name
+        for blob_name in blob_names
+        for derived_name in get_derived_blob_names(blob_name)
+    ]
 
-        safe_uid = uid.strip().rstrip("/")
-        normalized_blobname = unicodedata.normalize("NFC", f"{safe_uid}/{filename}")
-        blob = bucket.blob(normalized_blobname)
+    client = get_storage_client()
+    bucket = client.bucket(bucket_name)
 
-        try:
-            # ファイルの存在確認を追加
-            exists = await asyncio.to_thread(blob.exists)
-            if not exists:
-                error_message = f"ファイル {normalized_blobname} が存在しません"
-                failed_files.append(error_message)
-                logging.warning(error_message)
-                continue
-
-            # メタデータを取得して詳細なログを残す
-            blob_metadata = blob.metadata if blob.metadata else {}
-            logging.info(f"削除開始: {normalized_blobname}, メタデータ: {blob_metadata}")
-
-            await asyncio.to_thread(blob.delete)
+    logging.info(f"削除開始: {blob_names}, 派生ファイル: {derived_names}")
+    results = await asyncio.to_thread(_batch_delete, client, bucket, blob_names + derived_names)
+    signed_url_cache.invalidate(bucket_name, blob_names + derived_names)
+
+    for normalized_blobname in blob_names:
+        error = results.get(normalized_blobname)
+
+        if error is None:
             success_message = f"ファイル {normalized_blobname} が削除されました"
             success_files.append({"message": success_message, "filename": normalized_blobname})
             logging.info(success_message)
 
-        except GoogleAPIError as e:
+        elif isinstance(error, NotFound):
+            error_message = f"ファイル {normalized_blobname} が存在しません"
+            failed_files.append(error_message)
+            logging.warning(error_message)
+
+        elif isinstance(error, GoogleAPIError):
             error_message = (
                 f"GCS API エラー - ファイル: {normalized_blobname}, "
-                f"エラーコード: {getattr(e, 'code', 'unknown')}, "
-                f"詳細: {str(e)}"
+                f"エラーコード: {getattr(error, 'code', 'unknown')}, "
+                f"詳細: {str(error)}"
             )
             failed_files.append(error_message)
             logging.error(error_message)
 
-        except Exception as e:
+        else:
             error_message = (
                 f"予期しないエラー - ファイル: {normalized_blobname}, "
-                f"エラータイプ: {type(e).__name__}, "
-                f"詳細: {str(e)}"
+                f"エラータイプ: {type(error).__name__}, "
+                f"詳細: {str(error)}"
             )
             failed_files.append(error_message)
-            logging.error(error_message, exc_info=True)  # スタックトレースも記録
+            logging.error(error_message, exc_info=error)  # スタックトレースも記録
+
+    # 派生ファイルは存在しない場合も多いため、404以外の失敗のみ記録する
+    for derived_name in derived_names:
+        error = results.get(derived_name)
+        if error is not None and not isinstance(error, NotFound):
+            logging.warning(f"派生ファイル {derived_name} の削除に失敗しました: {error}")
 
     if failed_files:
         error_details = "\n".join(failed_files)
@@ -199,114 +387,81 @@ async def generate_upload_signed_url_v4(files: list[str], uid: str) -> dict:
     指定されたファイルリストに対して、Google Cloud Storageにアップロードするための
     署名付きURLを生成します。
 
+    有効期限が十分に残っている署名付きURLはキャッシュから再利用し、
+    それ以外は並列に署名します。
+
     :param files: アップロードするファイル名のリスト
     :type files: list[str]
     :return: ファイル名をキーとし、署名付きURLを値とする辞書
     :rtype: dict
     """
-    upload_signed_urls = {}
-
-    # 環境変数から認証情報を取得
-    credentials = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+    # 環境変数からバケット名を取得
     bucket_name = os.getenv("BUCKET_NAME")
 
-    client = storage.Client.from_service_account_json(credentials)
-    bucket = storage.Bucket(client, bucket_name)
-    for file in files:
-        # ブロブ名を正規化
-        normalized_blobname = unicodedata.normalize("NFC", uid + "/" + file)
-        blob = bucket.blob(normalized_blobname)
-
-        url = await asyncio.to_thread(
-            blob.generate_signed_url,
-            version="v4",
-            expiration=datetime.timedelta(minutes=15),
-            method="PUT",
-            content_type="application/octet-stream",
-        )
-        """
-        デバッグ用の出力
-        print("Generated PUT signed URL:")
-        print(url)
-        print("You can use this URL with any user agent, for example:")
-        print(
-            "curl -X PUT -H 'Content-Type: application/octet-stream' "
-            "--upload-file my-file '{}'".format(url)
-        )
-        """
-        upload_signed_urls[normalized_blobname] = url
-    return upload_signed_urls
+    bucket = get_storage_client().bucket(bucket_name)
+
+    # ブロブ名を正規化
+    targets = {
+        unicodedata.normalize("NFC", uid + "/" + file): "application/octet-stream" for file in files
+    }
+    return await get_signed_urls(bucket, targets, method="PUT")
+
+
+def get_response_type(filename: str) -> str:
+    """
+    ファイルの拡張子に基づいてダウンロード時のContent-Typeを返す
+
+    :param filename: ファイル名
+    :type filename: str
+    :return: Content-Type
+    :rtype: str
+    """
+    if filename.lower().endswith(".pdf"):
+        return "application/pdf"
+    elif filename.lower().endswith((".png", ".jpg", ".jpeg", ".gif")):
+        return "image/*"
+    elif filename.lower().endswith((".mp4", ".mov", ".avi")):
+        return "video/*"
+    elif filename.lower().endswith((".mp3", ".wav")):
+        return "audio/*"
+    else:
+        return "application/octet-stream"
 
 
 async def generate_download_signed_url_v4(files: list[str], uid: str) -> dict:
-    download_signed_urls = {}
+    """
+    指定されたファイルリストに対して、表示/ダウンロード用の署名付きURLを生成します。
+
+    ファイルの存在確認は呼び出し元（DBのfilesテーブル）で行うため、ここでは行わない。
+    有効期限が十分に残っている署名付きURLはキャッシュから再利用し、
+    それ以外は並列に署名します。
 
+    :param files: 署名付きURLを生成するファイル名のリスト
+    :type files: list[str]
+    :param uid: ユーザーID
+    :type uid: str
+    :return: ブロブ名をキーとし、署名付きURLを値とする辞書
+    :rtype: dict
+    """
     # 環境変数から認証情報を取得
     credentials = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
     bucket_name = os.getenv("BUCKET_NAME")
 
-    if not credentials or not bucket_name:
+    # ローカルストレージの場合はサービスアカウントの認証情報は不要
+    if not bucket_name or (STORAGE_BACKEND == "gcs" and not credentials):
         raise ValueError("必要な環境変数が設定されていません")
 
     # ユーザーIDの検証
     if not uid or not uid.strip():
         raise ValueError("Invalid user ID")
 
-    client = storage.Client.from_service_account_json(credentials)
-    bucket = storage.Bucket(client, bucket_name)
+    bucket = get_storage_client().bucket(bucket_name)
 
-    for filename in files:
-        try:
-            # パスの正規化
-            safe_uid = uid.strip().rstrip("/")
-            normalized_blobname = unicodedata.normalize("NFC", f"{safe_uid}/{filename}")
-            blob = bucket.blob(normalized_blobname)
-
-            # ファイルの存在確認
-            exists = await asyncio.to_thread(blob.exists)
-            if not exists:
-                logging.warning(f"ファイル {normalized_blobname} が存在しません")
-                continue
-
-            # ファイルの拡張子に基づいてContent-Typeを設定
-            if filename.lower().endswith(".pdf"):
-                response_type = "application/pdf"
-            elif filename.lower().endswith((".png", ".jpg", ".jpeg", ".gif")):
-                response_type = "image/*"
-            elif filename.lower().endswith((".mp4", ".mov", ".avi")):
-                response_type = "video/*"
-            elif filename.lower().endswith((".mp3", ".wav")):
-                response_type = "audio/*"
-            else:
-                response_type = "application/octet-stream"
-
-            url = await asyncio.to_thread(
-                blob.generate_signed_url,
-                version="v4",
-                expiration=datetime.timedelta(minutes=15),
-                method="GET",
-                response_disposition="inline",
-                response_type=response_type,
-            )
-
-            download_signed_urls[normalized_blobname] = url
-
-        except GoogleAPIError as e:
-            error_message = (
-                f"GCS API エラー - ファイル: {filename}, "
-                f"エラーコード: {getattr(e, 'code', 'unknown')}, "
-                f"詳細: {str(e)}"
-            )
-            logging.error(error_message)
-            continue
-
-        except Exception as e:
-            error_message = (
-                f"予期しないエラー - ファイル: {filename}, "
-                f"エラータイプ: {type(e).__name__}, "
-                f"詳細: {str(e)}"
-            )
-            logging.error(error_message, exc_info=True)
-            continue
+    # パスの正規化
+    safe_uid = uid.strip().rstrip("/")
+    targets = {
+        unicodedata.normalize("NFC", f"{safe_uid}/{filename}"): get_response_type(filename)
+        for filename in files
+    }
 
-    return download_signed_urls
+    return await get_signed_urls(bucket, targets, method="GET", response_disposition="inline")
@@ -0,0 +1,188 @@
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from app.utils.prompt_packer import estimate_tokens
+
+# 環境変数を読み込む
+load_dotenv()
+
+# 全ページに繰り返し現れるヘッダー・フッターを取り除くかどうか
+PDF_STRIP_BOILERPLATE: bool = os.getenv("PDF_STRIP_BOILERPLATE", "true").lower() == "true"
+
+# ヘッダー・フッターとみなすページの上端・下端からの範囲（ページの高さに対する割合）
+BOILERPLATE_MARGIN: float = float(os.getenv("BOILERPLATE_MARGIN", "0.12"))
+
+# 取り除く行が現れるページの割合の下限
+BOILERPLATE_MIN_RATIO: float = float(os.getenv("BOILERPLATE_MIN_RATIO", "0.5"))
+
+# これより少ないページ数のPDFでは取り除かない（繰り返しかどうか判断できないため）
+BOILERPLATE_MIN_PAGES = 3
+
+# 取り除く行の判定方法のバージョン（判定方法を変えたら上げて、保存済みの抽出結果を使わない）
+BOILERPLATE_VERSION = 1
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+# テキストブロック（ページの高さに対するブロックの中心の位置, テキスト）
+TextBlock = tuple[float, str]
+
+_DIGITS = re.compile(r"\d+")
+_SPACES = re.compile(r"\s+")
+
+
+def line_band(position: float, margin: float = BOILERPLATE_MARGIN) -> Optional[str]:
+    """
+    ブロックの位置から、ヘッダーかフッターかを判定する
+
+    :param position: ページの高さに対するブロックの中心の位置（0が上端、1が下端）
+    :type position: float
+    :param margin: ヘッダー・フッターとみなす範囲（ページの高さに対する割合）
+    :type margin: float
+    :return: header または footer。本文の場合はNone
+    :rtype: Optional[str]
+    """
+    if position <= margin:
+        return "header"
+    if position >= 1 - margin:
+        return "footer"
+    return None
+
+
+def normalize_line(line: str) -> str:
+    """
+    ページ番号や空白の違いを無視して比較できるように行を正規化する
+
+    :param line: 行のテキスト
+    :type line: str
+    :return: 数字を # に置き換え、空白をまとめた行
+    :rtype: str
+    """
+    return _SPACES.sub(" ", _DIGITS.sub("#", line)).strip()
+
+
+def strip_boilerplate(
+    pages: list[list[TextBlock]],
+    margin: float = BOILERPLATE_MARGIN,
+    min_ratio: float = BOILERPLATE_MIN_RATIO,
+) -> tuple[list[str], int]:
+    """
+    多くのページのヘッダー・フッターに繰り返し現れる行を取り除き、ページごとのテキストを返す
+
+    講義スライドの講義名、著作権表示、ページ番号などを想定している。
+    ページの上端・下端にある行だけを対象にし、数字を無視して同じ内容の行が
+    min_ratio 以上のページに現れる場合に取り除く。本文の行は取り除かない。
+
+    :param pages: ページごとのテキストブロックのリスト
+    :type pages: list[list[TextBlock]]
+    :param margin: ヘッダー・フッターとみなす範囲（ページの高さに対する割合）
+    :type margin: float
+    :param min_ratio: 取り除く行が現れるページの割合の下限
+    :type min_ratio: float
+    :return: ページごとのテキストのリストと、取り除いた行数
+    :rtype: tuple[list[str], int]
+    """
+    if len(pages) < BOILERPLATE_MIN_PAGES:
+        return ["".join(text for _, text in blocks) for blocks in pages], 0
+
+    # 行ごとに、ヘッダー・フッターとして現れるページ数を数える
+    counts: Counter[tuple[str, str]] = Counter()
+    for blocks in pages:
+        keys = set()
+        for position, text in blocks:
+            band = line_band(position, margin)
+            if band is None:
+                continue
+            for line in text.splitlines():
+                normalized = normalize_line(line)
+                if normalized:
+                    keys.add((band, normalized))
+        counts.update(keys)
+    threshold = max(2, math.ceil(len(pages) * min_ratio))
+    repeated = {key for key, count in counts.items() if count >= threshold}
+
+    stripped_pages = []
+    removed = 0
+    for blocks in pages:
+        parts = []
+        for position, text in blocks:
+            band = line_band(position, margin)
+            if band is None:
+                parts.append(text)
+                continue
+            lines = text.splitlines()
+            kept = [line for line in lines if (band, normalize_line(line)) not in repeated]
+            removed += len(lines) - len(kept)
+            if kept:
+                parts.append("\n".join(kept) + "\n")
+        stripped_pages.append("".join(parts))
+    return stripped_pages, removed
+
+
+class BoilerplateStats:
+    """
+    ヘッダー・フッターを取り除いた結果を集計するクラス
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.pages = 0
+        self.removed_lines = 0
+        self.original_tokens = 0
+        self.removed_tokens = 0
+
+    def record(self, original: list[str], stripped: list[str], removed_lines: int) -> int:
+        """
+        1つのPDFで取り除いた行数と、削減できたトークン数の見積もりを記録する
+
+        :param original: 取り除く前のページごとのテキスト
+        :type original: list[str]
+        :param stripped: 取り除いた後のページごとのテキスト
+        :type stripped: list[str]
+        :param removed_lines: 取り除いた行数
+        :type removed_lines: int
+        :return: 削減できたトークン数の見積もり
+        :rtype: int
+        """
+        original_tokens = sum(estimate_tokens(text) for text in original)
+        removed_tokens = original_tokens - sum(estimate_tokens(text) for text in stripped)
+        with self._lock:
+            self.documents += 1
+            self.pages += len(original)
+            self.removed_lines += removed_lines
+            self.original_tokens += original_tokens
+            self.removed_tokens += removed_tokens
+        return removed_tokens
+
+    def stats(self) -> dict[str, float]:
+        """
+        集計結果を返す
+
+        :return: PDFの数、ページ数、取り除いた行数、削減できたトークン数の見積もりを含む辞書
+        :rtype: dict[str, float]
+        """
+        with self._lock:
+            return {
+                "documents": self.documents,
+                "pages": self.pages,
+                "removed_lines": self.removed_lines,
+                "original_tokens": self.original_tokens,
+                "removed_tokens": self.removed_tokens,
+                "removed_ratio": (
+                    round(self.removed_tokens / self.original_tokens, 3)
+                    if self.original_tokens
+                    else 0.0
+                ),
+            }
+
+
+# プロセス内で共有する集計
+boilerplate_stats = BoilerplateStats()
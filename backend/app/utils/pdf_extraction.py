@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from app.utils.blob_cache import open_blob_path
+from app.utils.file_extract_store import file_extract_store
+from app.utils.in_flight import InFlightRequests
+from app.utils.ingestion_governor import ingestion_governor
+from app.utils.media_workers import available_cpus
+from app.utils.pdf_boilerplate import (
+    BOILERPLATE_MARGIN,
+    BOILERPLATE_MIN_RATIO,
+    BOILERPLATE_VERSION,
+    PDF_STRIP_BOILERPLATE,
+    boilerplate_stats,
+    strip_boilerplate,
+)
+from app.utils.pdf_pages import count_pages, extract_page_range
+from app.utils.storage_client import get_storage_client
+
+# 環境変数を読み込む
+load_dotenv()
+
+# テキスト抽出に使うプロセス数（0の場合はプロセスプールを使わずスレッドで抽出する）
+# （プロセスプールはAPIのワーカーごとに生成されるため、少ない数にする）
+PDF_EXTRACTION_WORKERS: int = int(
+    os.getenv("PDF_EXTRACTION_WORKERS", str(min(available_cpus(), 2)))
+)
+
+# 1つのタスクで抽出するページ数（大きいPDFはこの単位で複数のプロセスに分割する）
+PDF_PAGES_PER_TASK: int = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+# プロセス内で実行中のテキスト抽出（前処理と問題生成のリクエストで共有する）
+pdf_extractions = InFlightRequests()
+
+# プロセス内で共有するプロセスプール
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_extraction_executor() -> Optional[Executor]:
+    """
+    テキスト抽出に使うプロセスプールを取得する
+
+    未生成の場合は初回呼び出し時に生成する。PyMuPDFはページの解析中にGILを解放しないため、
+    別プロセスで解析することでイベントループや他のリクエストのスレッドを止めないようにする。
+
+    :return: プロセスプール。PDF_EXTRACTION_WORKERS が0の場合はNone（デフォルトのスレッドプール）
+    :rtype: Optional[Executor]
+    """
+    global _executor
+    if PDF_EXTRACTION_WORKERS <= 0:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # スレッドを持つプロセスをforkしないようにspawnで起動する
+                _executor = ProcessPoolExecutor(
+                    max_workers=PDF_EXTRACTION_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                logging.info(
+                    f"テキスト抽出のプロセスプールを生成しました (workers={PDF_EXTRACTION_WORKERS})"
+                )
+    return _executor
+
+
+def shutdown_extraction_executor() -> None:
+    """
+    アプリケーション終了時にプロセスプールを停止する
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+def join_pages(pages: list[str]) -> str:
+    """
+    ページごとのテキストを、ページ番号の見出しを付けて1つの文字列に結合する
+
+    :param pages: ページごとのテキストのリスト
+    :type pages: list[str]
+    :return: 結合したテキスト
+    :rtype: str
+    """
+    return "".join(f"\n# {i}ページ\n{text}" for i, text in enumerate(pages, 1))
+
+
+async def extract_pages_from_path(pdf_path: str, strip: bool = PDF_STRIP_BOILERPLATE) -> list[str]:
+    """
+    ローカルのPDFファイルからページごとのテキストを抽出する
+
+    ページを PDF_PAGES_PER_TASK ページずつに分割し、プロセスプールで並列に抽出する。
+    PDF_STRIP_BOILERPLATE が有効な場合は、繰り返し現れるヘッダー・フッターを取り除く。
+
+    :param pdf_path: PDFファイルのパス
+    :type pdf_path: str
+    :param strip: ヘッダー・フッターを取り除くかどうか
+    :type strip: bool
+    :return: ページごとのテキストのリスト
+    :rtype: list[str]
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_extraction_executor()
+
+    page_count = await loop.run_in_executor(executor, count_pages, pdf_path)
+    step = max(PDF_PAGES_PER_TASK, 1)
+    chunks = await asyncio.gather(
+        *[
+            loop.run_in_executor(
+                executor, extract_page_range, pdf_path, start, min(start + step, page_count)
+            )
+            for start in range(0, page_count, step)
+        ]
+    )
+    blocks = [page for chunk in chunks for page in chunk]
+    pages = ["".join(text for _, text in page) for page in blocks]
+    if not strip:
+        return pages
+
+    # 全ページの行を比較するため、イベントループを止めないようにスレッドで実行する
+    stripped, removed_lines = await asyncio.to_thread(strip_boilerplate, blocks)
+    removed_tokens = await asyncio.to_thread(
+        boilerplate_stats.record, pages, stripped, removed_lines
+    )
+    if removed_lines:
+        logging.info(
+            f"ヘッダー・フッターを取り除きました: {pdf_path} "
+            f"(lines={removed_lines}, tokens={removed_tokens})"
+        )
+    return stripped
+
+
+async def extract_pages_from_pdf(
+    bucket_name: str,
+    file_name: str,
+    generation: Optional[int] = None,
+    strip: bool = PDF_STRIP_BOILERPLATE,
+) -> list[str]:
+    """
+    Cloud Storage上のPDFファイルからページごとのテキストを抽出する
+
+    :param bucket_name: バケット名
+    :type bucket_name: str
+    :param file_name: PDFファイル名
+    :type file_name: str
+    :param generation: ブロブの世代番号（指定した場合はローカルキャッシュを利用）
+    :type generation: Optional[int]
+    :param strip: ヘッダー・フッターを取り除くかどうか
+    :type strip: bool
+    :return: ページごとのテキストのリスト
+    :rtype: list[str]
+    """
+    client = get_storage_client()
+    bucket = client.bucket(bucket_name)
+    # ファイル全体をメモリに読み込まず、ローカルファイル（キャッシュまたは一時ファイル）のパスで開く
+    async with open_blob_path(bucket, file_name, generation) as pdf_path:
+        # 解析中のファイルの合計サイズが上限を超えないように、順番を待ってから解析する
+        size = await asyncio.to_thread(os.path.getsize, pdf_path)
+        async with ingestion_governor.slot(size):
+            return await extract_pages_from_path(pdf_path, strip)
+
+
+def pdf_variant(strip: Optional[bool] = None) -> str:
+    """
+    PDFのテキストを保存するときの抽出方法を返す
+
+    ヘッダー・フッターを取り除くかどうかと判定方法を含めるため、設定を変えると抽出し直す。
+
+    :param strip: ヘッダー・フッターを取り除くかどうか（省略した場合は設定に従う）
+    :type strip: Optional[bool]
+    :return: 抽出方法
+    :rtype: str
+    """
+    if strip is None:
+        strip = PDF_STRIP_BOILERPLATE
+    if not strip:
+        return "pdf:raw"
+    return f"pdf:strip-v{BOILERPLATE_VERSION}({BOILERPLATE_MARGIN},{BOILERPLATE_MIN_RATIO})"
+
+
+async def load_pdf_pages(
+    bucket_name: str,
+    file_name: str,
+    generation: Optional[int] = None,
+    file_id: Optional[int] = None,
+) -> list[str]:
+    """
+    指定されたPDFファイルからページごとのテキストを抽出して返す
+
+    ファイルIDと世代番号が分かる場合は、同じ抽出方法（pdf_variant）で保存済みの抽出結果を
+    優先して使い、ない場合は抽出した結果を保存する。同じファイルの抽出が実行中の場合は、
+    新しく抽出せずにその結果を待つ。
+
+    :param bucket_name: バケット名
+    :type bucket_name: str
+    :param file_name: PDFファイル名
+    :type file_name: str
+    :param generation: ブロブの世代番号（指定した場合はローカルキャッシュを利用）
+    :type generation: Optional[int]
+    :param file_id: filesテーブルのファイルID（指定した場合は抽出結果を保存して再利用）
+    :type file_id: Optional[int]
+    :return: ページごとのテキストのリスト
+    :rtype: list[str]
+    """
+    strip = PDF_STRIP_BOILERPLATE
+    if file_id is None or generation is None:
+        return await extract_pages_from_pdf(bucket_name, file_name, generation, strip)
+    variant = pdf_variant(strip)
+    return await pdf_extractions.run(
+        (bucket_name, file_id, generation, variant),
+        lambda: _load_pdf_pages(bucket_name, file_name, generation, file_id, strip, variant),
+    )
+
+
+async def _load_pdf_pages(
+    bucket_name: str, file_name: str, generation: int, file_id: int, strip: bool, variant: str
+) -> list[str]:
+    pages = await file_extract_store.load(bucket_name, file_id, generation, variant)
+    if pages is None:
+        pages = await extract_pages_from_pdf(bucket_name, file_name, generation, strip)
+        await file_extract_store.save(bucket_name, file_id, generation, pages, variant)
+    return pages
+
+
+async def extract_text_from_pdf(
+    bucket_name: str,
+    file_name: str,
+    generation: Optional[int] = None,
+    file_id: Optional[int] = None,
+) -> str:
+    """
+    指定されたPDFファイルからテキストを抽出して返す
+
+    :param bucket_name: バケット名
+    :type bucket_name: str
+    :param file_name: PDFファイル名
+    :type file_name: str
+    :param generation: ブロブの世代番号（指定した場合はローカルキャッシュを利用）
+    :type generation: Optional[int]
+    :param file_id: filesテーブルのファイルID（指定した場合は抽出結果を保存して再利用）
+    :type file_id: Optional[int]
+    :return: ページ番号の見出しを付けて結合したテキスト
+    :rtype: str
+    """
+    return join_pages(await load_pdf_pages(bucket_name, file_name, generation, file_id))
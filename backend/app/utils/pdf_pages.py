@@ -0,0 +1,57 @@
+import fitz
+
+from app.utils.pdf_boilerplate import TextBlock
+
+# テキスト抽出のプロセスプールで実行する関数
+# （spawnで起動したプロセスは実行する関数のモジュールを読み込むため、
+# vertexai、anthropic、sqlalchemy などを読み込むモジュールをインポートしない）
+
+
+def count_pages(pdf_path: str) -> int:
+    """
+    PDFのページ数を返す
+
+    :param pdf_path: PDFファイルのパス
+    :type pdf_path: str
+    :return: ページ数
+    :rtype: int
+    """
+    doc = fitz.open(pdf_path, filetype="pdf")
+    try:
+        return int(doc.page_count)
+    finally:
+        doc.close()
+
+
+def extract_page_range(pdf_path: str, start: int, stop: int) -> list[list[TextBlock]]:
+    """
+    PDFの指定した範囲のページからテキストブロックを抽出する（プロセスプールで実行する）
+
+    ヘッダー・フッターを判定できるように、ブロックごとにページ内の位置を付けて返す。
+
+    :param pdf_path: PDFファイルのパス
+    :type pdf_path: str
+    :param start: 最初のページ番号（0始まり）
+    :type start: int
+    :param stop: 最後のページ番号の次の番号
+    :type stop: int
+    :return: ページごとの (ページの高さに対するブロックの中心の位置, テキスト) のリスト
+    :rtype: list[list[TextBlock]]
+    """
+    doc = fitz.open(pdf_path, filetype="pdf")
+    try:
+        pages = []
+        for i in range(start, stop):
+            page = doc.load_page(i)
+            height = page.rect.height or 1.0
+            # 画像のブロック（ブロックの種類が1）は get_text() と同じく含めない
+            pages.append(
+                [
+                    ((y0 + y1) / 2 / height, text)
+                    for _, y0, _, y1, text, _, block_type in page.get_text("blocks")
+                    if block_type == 0
+                ]
+            )
+        return pages
+    finally:
+        doc.close()
@@ -0,0 +1,368 @@
+import logging
+import math
+import os
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+# 環境変数を読み込む
+load_dotenv()
+
+# 講義テキストに使うトークン数の上限（モデルごとの指定がない場合）
+PROMPT_TOKEN_BUDGET: int = int(os.getenv("PROMPT_TOKEN_BUDGET", "60000"))
+
+# 画像1枚あたりのトークン数の見積もり（長辺1568pxの画像で約1600トークン）
+IMAGE_TOKEN_ESTIMATE: int = int(os.getenv("IMAGE_TOKEN_ESTIMATE", "1600"))
+
+# 切り詰めたページの末尾に付ける文字列
+TRUNCATION_MARK = "\n…（以下省略）"
+
+# 切り詰めてでも含める最小のトークン数
+MIN_TRUNCATED_TOKENS = 200
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+# 日本語の文字（ひらがな、カタカナ、漢字、半角カタカナ）
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff66-\uff9f]")
+
+# 関連度の計算で無視する文字（空白や記号）
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def parse_token_budgets(value: str) -> dict[str, int]:
+    """
+    "モデル名=トークン数" をカンマ区切りで並べた文字列を辞書に変換する
+
+    :param value: 環境変数の値
+    :type value: str
+    :return: モデル名をキーとし、トークン数を値とする辞書
+    :rtype: dict[str, int]
+    """
+    budgets: dict[str, int] = {}
+    for item in value.split(","):
+        model_name, _, tokens = item.strip().rpartition("=")
+        if model_name and tokens.strip().isdigit():
+            budgets[model_name.strip()] = int(tokens)
+    return budgets
+
+
+# モデルごとのトークン数の上限（例: claude-3-5-sonnet-v2@20241022=60000）
+PROMPT_TOKEN_BUDGETS: dict[str, int] = parse_token_budgets(os.getenv("PROMPT_TOKEN_BUDGETS", ""))
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    テキストのトークン数を見積もる
+
+    日本語の文字は1文字あたり約1トークン、英数字や記号は約4文字で1トークンとして数える。
+    トークナイザーを呼び出さずに上限の判定に使うための、多めの見積もり。
+
+    :param text: テキスト
+    :type text: str
+    :return: 見積もったトークン数
+    :rtype: int
+    """
+    if not text:
+        return 0
+    non_cjk_length = len(_CJK_RE.sub("", text))
+    return len(text) - non_cjk_length + math.ceil(non_cjk_length / 4)
+
+
+def estimate_reserved_tokens(*texts: str, image_count: int = 0) -> int:
+    """
+    講義テキスト以外（指示文、ツール定義、画像）のトークン数を見積もる
+
+    :param texts: 講義テキスト以外のテキスト
+    :type texts: str
+    :param image_count: 画像の枚数
+    :type image_count: int
+    :return: 見積もったトークン数
+    :rtype: int
+    """
+    return sum(estimate_tokens(text) for text in texts) + image_count * IMAGE_TOKEN_ESTIMATE
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    見積もりのトークン数が上限以下になるようにテキストの末尾を切り詰める
+
+    :param text: テキスト
+    :type text: str
+    :param max_tokens: トークン数の上限
+    :type max_tokens: int
+    :return: 切り詰めたテキスト
+    :rtype: str
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max_tokens - estimate_tokens(TRUNCATION_MARK)
+    # 上限に収まる最長の先頭部分を二分探索する
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= limit:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + TRUNCATION_MARK
+
+
+def _bigrams(text: str) -> set[str]:
+    normalized = _NON_WORD_RE.sub("", unicodedata.normalize("NFKC", text).lower())
+    return {normalized[i : i + 2] for i in range(len(normalized) - 1)}
+
+
+@dataclass
+class PromptDocument:
+    """
+    プロンプトに含めるファイルのテキスト
+
+    :param name: ファイル名
+    :type name: str
+    :param pages: ページごとのテキスト（音声の文字起こしは1要素）
+    :type pages: list[str]
+    :param paged: ページ番号の見出しを付けるかどうか
+    :type paged: bool
+    """
+
+    name: str
+    pages: list[str]
+    paged: bool = True
+
+    def header(self) -> str:
+        """ファイル名の見出しを返す"""
+        return f"\n=== {self.name} ===\n"
+
+    def render_page(self, index: int, text: str) -> str:
+        """ページ番号の見出しを付けたページのテキストを返す"""
+        return f"\n# {index + 1}ページ\n{text}" if self.paged else text
+
+
+@dataclass
+class PackedPrompt:
+    """
+    トークン数の上限に収めた講義テキスト
+
+    :param text: 講義テキスト
+    :type text: str
+    :param estimated_tokens: 講義テキストの見積もりのトークン数
+    :type estimated_tokens: int
+    :param total_tokens: 上限を適用する前の見積もりのトークン数
+    :type total_tokens: int
+    :param budget: 講義テキストに使えるトークン数
+    :type budget: int
+    :param pages_kept: 含めたページ数
+    :type pages_kept: int
+    :param pages_total: 全ページ数
+    :type pages_total: int
+    """
+
+    text: str
+    estimated_tokens: int
+    total_tokens: int
+    budget: int
+    pages_kept: int
+    pages_total: int
+
+    @property
+    def trimmed(self) -> bool:
+        """ページを省略または切り詰めたかどうか"""
+        return self.pages_kept < self.pages_total or self.estimated_tokens < self.total_tokens
+
+
+def pack_documents(documents: list[PromptDocument], budget: int, query: str = "") -> PackedPrompt:
+    """
+    講義テキストをトークン数の上限に収まるようにページ単位で選ぶ
+
+    上限に収まる場合はすべてのページを含める。収まらない場合は、各ファイルのページを
+    問題のタイトルなど query との関連度（文字バイグラムの一致率）の順に並べ、すべての
+    ファイルが含まれるように、ファイルごとに1ページずつ順番に選ぶ。選んだページは
+    元のページ順に並べ、ページ番号の見出しは元の番号のままにする。
+
+    :param documents: ファイルごとのテキスト
+    :type documents: list[PromptDocument]
+    :param budget: 講義テキストに使えるトークン数
+    :type budget: int
+    :param query: 関連度の計算に使うテキスト
+    :type query: str
+    :return: 上限に収めた講義テキスト
+    :rtype: PackedPrompt
+    """
+    page_texts = [
+        [document.render_page(i, page) for i, page in enumerate(document.pages)]
+        for document in documents
+    ]
+    page_tokens = [[estimate_tokens(text) for text in texts] for texts in page_texts]
+    header_tokens = [estimate_tokens(document.header()) for document in documents]
+    total_tokens = sum(header_tokens) + sum(sum(tokens) for tokens in page_tokens)
+    pages_total = sum(len(texts) for texts in page_texts)
+
+    if total_tokens <= budget:
+        text = "".join(
+            document.header() + "".join(texts)
+            for document, texts in zip(documents, page_texts, strict=True)
+        )
+        return PackedPrompt(text, total_tokens, total_tokens, budget, pages_total, pages_total)
+
+    # ファイルごとに、関連度の高い順（同じ場合はページ順）にページを並べる
+    query_bigrams = _bigrams(query)
+
+    def relevance(text: str) -> float:
+        if not query_bigrams:
+            return 0.0
+        return len(query_bigrams & _bigrams(text)) / len(query_bigrams)
+
+    ranked: list[list[int]] = []
+    for texts in page_texts:
+        scores = [relevance(text) for text in texts]
+        ranked.append(sorted(range(len(texts)), key=lambda i: (-scores[i], i)))
+
+    selected: list[dict[int, str]] = [{} for _ in documents]
+    used = 0
+    # 切り詰める場合も、1ファイルで上限を使い切らないように均等な割り当てを上限にする
+    fair_share = budget // max(len(documents), 1)
+    for rank in range(max((len(order) for order in ranked), default=0)):
+        for d, order in enumerate(ranked):
+            if rank >= len(order):
+                continue
+            index = order[rank]
+            header = 0 if selected[d] else header_tokens[d]
+            cost = header + page_tokens[d][index]
+            if used + cost <= budget:
+                selected[d][index] = page_texts[d][index]
+                used += cost
+                continue
+            # 最も関連するページが収まらない場合は、切り詰めてでもファイルを含める
+            allowance = min(budget - used, fair_share) - header
+            if rank == 0 and allowance >= MIN_TRUNCATED_TOKENS:
+                truncated = truncate_to_tokens(page_texts[d][index], allowance)
+                selected[d][index] = truncated
+                used += header + estimate_tokens(truncated)
+
+    text = "".join(
+        document.header() + "".join(pages[i] for i in sorted(pages))
+        for document, pages in zip(documents, selected, strict=True)
+        if pages
+    )
+    pages_kept = sum(len(pages) for pages in selected)
+    return PackedPrompt(text, used, total_tokens, budget, pages_kept, pages_total)
+
+
+class PromptPacker:
+    """
+    モデルごとのトークン数の上限に講義テキストを収め、リクエストごとのトークン数を記録するクラス
+
+    :param default_budget: モデルごとの指定がない場合のトークン数の上限
+    :type default_budget: int
+    :param budgets: モデル名をキーとし、トークン数の上限を値とする辞書
+    :type budgets: Optional[dict[str, int]]
+    """
+
+    def __init__(
+        self,
+        default_budget: int = PROMPT_TOKEN_BUDGET,
+        budgets: Optional[dict[str, int]] = None,
+    ) -> None:
+        self.default_budget = default_budget
+        self.budgets = PROMPT_TOKEN_BUDGETS if budgets is None else budgets
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.trimmed_requests = 0
+        self.estimated_tokens = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def budget_for(self, model_name: str) -> int:
+        """
+        モデルのトークン数の上限を返す
+
+        :param model_name: モデル名
+        :type model_name: str
+        :return: トークン数の上限
+        :rtype: int
+        """
+        return self.budgets.get(model_name, self.default_budget)
+
+    def pack(
+        self,
+        documents: list[PromptDocument],
+        model_name: str,
+        query: str = "",
+        reserved_tokens: int = 0,
+    ) -> PackedPrompt:
+        """
+        講義テキストをモデルのトークン数の上限に収める
+
+        :param documents: ファイルごとのテキスト
+        :type documents: list[PromptDocument]
+        :param model_name: モデル名
+        :type model_name: str
+        :param query: 関連度の計算に使うテキスト
+        :type query: str
+        :param reserved_tokens: 講義テキスト以外に使うトークン数
+        :type reserved_tokens: int
+        :return: 上限に収めた講義テキスト
+        :rtype: PackedPrompt
+        """
+        budget = max(self.budget_for(model_name) - reserved_tokens, 0)
+        packed = pack_documents(documents, budget, query)
+        with self._lock:
+            self.requests += 1
+            self.trimmed_requests += int(packed.trimmed)
+            self.estimated_tokens += packed.estimated_tokens + reserved_tokens
+        if packed.trimmed:
+            logging.info(
+                f"講義テキストを {packed.total_tokens} から {packed.estimated_tokens} トークンに"
+                f"削減しました (pages={packed.pages_kept}/{packed.pages_total}, budget={budget})"
+            )
+        return packed
+
+    def record_usage(self, model_name: str, packed: PackedPrompt, response: Any) -> None:
+        """
+        レスポンスに含まれる実際のトークン数を記録する
+
+        :param model_name: モデル名
+        :type model_name: str
+        :param packed: リクエストに含めた講義テキスト
+        :type packed: PackedPrompt
+        :param response: Anthropic APIのレスポンス
+        :type response: Any
+        """
+        usage = getattr(response, "usage", None)
+        input_tokens = getattr(usage, "input_tokens", None)
+        output_tokens = getattr(usage, "output_tokens", None)
+        if not isinstance(input_tokens, int) or not isinstance(output_tokens, int):
+            return
+        with self._lock:
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+        logging.info(
+            f"トークン数 (model={model_name}): input={input_tokens}, output={output_tokens}, "
+            f"講義テキストの見積もり={packed.estimated_tokens}, "
+            f"pages={packed.pages_kept}/{packed.pages_total}"
+        )
+
+    def stats(self) -> dict[str, float]:
+        """
+        リクエストのトークン数の統計を返す
+
+        :return: リクエスト数、削減したリクエスト数、見積もりと実際のトークン数を含む辞書
+        :rtype: dict[str, float]
+        """
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "trimmed_requests": self.trimmed_requests,
+                "estimated_tokens": self.estimated_tokens,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+            }
+
+
+# プロセス内で共有するプロンプトの組み立て
+prompt_packer = PromptPacker()
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+
+class RateLimiter:
+    """
+    外部APIへのリクエストの同時実行数と、1分あたりのリクエスト数を制限するクラス
+
+    同じAPIを呼び出す複数の処理で1つのインスタンスを共有し、処理の合計で上限を守る。
+    イベントループのスレッドからのみ使う。
+
+    :param concurrency: 同時に実行するリクエストの数
+    :type concurrency: int
+    :param requests_per_minute: 1分あたりのリクエスト数の上限（0の場合は制限しない）
+    :type requests_per_minute: float
+    """
+
+    def __init__(self, concurrency: int, requests_per_minute: float = 0) -> None:
+        self.concurrency = max(concurrency, 1)
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._next_start = 0.0
+        self._lock = threading.Lock()
+        self.active = 0
+        self.acquired = 0
+        self.waited = 0
+        self.total_wait_seconds = 0.0
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        """
+        リクエストを開始できるまで待機し、リクエストが終わるまで枠を確保する
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        async with self._semaphore:
+            if self.interval:
+                # 前のリクエストの開始から一定の間隔を空ける
+                now = time.monotonic()
+                start_at = max(now, self._next_start)
+                self._next_start = start_at + self.interval
+                if start_at > now:
+                    await asyncio.sleep(start_at - now)
+            wait_seconds = time.monotonic() - started
+            with self._lock:
+                self.active += 1
+                self.acquired += 1
+                if wait_seconds > 0.001:
+                    self.waited += 1
+                    self.total_wait_seconds += wait_seconds
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self.active -= 1
+
+    def stats(self) -> dict[str, float]:
+        """
+        リクエストの統計を返す
+
+        :return: 実行中のリクエスト数、リクエスト数、待機したリクエスト数と待機時間の合計を含む辞書
+        :rtype: dict[str, float]
+        """
+        with self._lock:
+            return {
+                "active": self.active,
+                "acquired": self.acquired,
+                "waited": self.waited,
+                "total_wait_seconds": round(self.total_wait_seconds, 3),
+            }
@@ -0,0 +1,199 @@
+import asyncio
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+# 環境変数を読み込む
+load_dotenv()
+
+# 署名付きURLの有効期限
+SIGNED_URL_EXPIRATION = datetime.timedelta(minutes=15)
+
+# 残り有効期間がこの値を下回ったURLは再利用せずに署名し直す
+SIGNED_URL_MIN_REMAINING = datetime.timedelta(minutes=5)
+
+# キャッシュする署名付きURLの最大件数
+SIGNED_URL_CACHE_SIZE: int = int(os.getenv("SIGNED_URL_CACHE_SIZE", "10000"))
+
+# 署名を並列に実行する最大数
+SIGNING_CONCURRENCY: int = int(os.getenv("SIGNING_CONCURRENCY", "8"))
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+
+class SignedUrlCache:
+    """
+    署名付きURLを有効期限が近づくまで再利用するためのLRUキャッシュ
+
+    キーは (バケット名, ブロブ名, HTTPメソッド, Content-Type) の組。
+
+    :param max_entries: キャッシュする最大件数
+    :type max_entries: int
+    :param min_remaining: 再利用に必要な残り有効期間
+    :type min_remaining: datetime.timedelta
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SIGNED_URL_CACHE_SIZE,
+        min_remaining: datetime.timedelta = SIGNED_URL_MIN_REMAINING,
+    ) -> None:
+        self.max_entries = max_entries
+        self.min_remaining = min_remaining.total_seconds()
+        self._entries: OrderedDict[tuple[str, str, str, str], tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple[str, str, str, str]) -> Optional[str]:
+        """
+        残り有効期間が十分な署名付きURLを取得する
+
+        :param key: (バケット名, ブロブ名, HTTPメソッド, Content-Type)
+        :type key: tuple[str, str, str, str]
+        :return: 署名付きURL。キャッシュにない場合や期限が近い場合はNone
+        :rtype: Optional[str]
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] - time.time() < self.min_remaining:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple[str, str, str, str], url: str, expires_at: float) -> None:
+        """
+        署名付きURLをキャッシュに保存する
+
+        :param key: (バケット名, ブロブ名, HTTPメソッド, Content-Type)
+        :type key: tuple[str, str, str, str]
+        :param url: 署名付きURL
+        :type url: str
+        :param expires_at: URLの有効期限（UNIX時間）
+        :type expires_at: float
+        """
+        with self._lock:
+            self._entries[key] = (url, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, bucket_name: str, blob_names: list[str]) -> None:
+        """
+        指定したブロブの署名付きURLをすべて破棄する
+
+        :param bucket_name: バケット名
+        :type bucket_name: str
+        :param blob_names: ブロブ名のリスト
+        :type blob_names: list[str]
+        """
+        targets = set(blob_names)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == bucket_name and k[1] in targets]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        """
+        キャッシュと統計をすべて破棄する
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        """
+        キャッシュの統計を返す
+
+        :return: ヒット数、ミス数、エントリ数を含む辞書
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+# プロセス内で共有するキャッシュ
+signed_url_cache = SignedUrlCache()
+
+
+async def get_signed_urls(
+    bucket: Any, targets: dict[str, str], method: str, **kwargs: Any
+) -> dict[str, str]:
+    """
+    ブロブごとの署名付きURLを取得する
+
+    キャッシュにある有効なURLは再利用し、それ以外は並列に署名する。
+    署名に失敗したブロブは結果に含めない。
+
+    :param bucket: 対象のバケット
+    :type bucket: Any
+    :param targets: ブロブ名をキーとし、Content-Typeを値とする辞書
+    :type targets: dict[str, str]
+    :param method: HTTPメソッド（GET, PUTなど）
+    :type method: str
+    :param kwargs: generate_signed_url に渡す追加の引数
+    :type kwargs: Any
+    :return: ブロブ名をキーとし、署名付きURLを値とする辞書
+    :rtype: dict[str, str]
+    """
+    signed_urls: dict[str, str] = {}
+    misses: dict[str, str] = {}
+
+    for blob_name, content_type in targets.items():
+        url = signed_url_cache.get((bucket.name, blob_name, method, content_type))
+        if url is not None:
+            signed_urls[blob_name] = url
+        else:
+            misses[blob_name] = content_type
+
+    semaphore = asyncio.Semaphore(SIGNING_CONCURRENCY)
+
+    async def sign(blob_name: str, content_type: str) -> Optional[str]:
+        async with semaphore:
+            expires_at = time.time() + SIGNED_URL_EXPIRATION.total_seconds()
+            # GETではレスポンスのContent-Type、PUTではリクエストのContent-Typeを指定する
+            type_option = (
+                {"response_type": content_type}
+                if method == "GET"
+                else {"content_type": content_type}
+            )
+            try:
+                url = await asyncio.to_thread(
+                    bucket.blob(blob_name).generate_signed_url,
+                    version="v4",
+                    expiration=SIGNED_URL_EXPIRATION,
+                    method=method,
+                    **type_option,
+                    **kwargs,
+                )
+            except Exception as e:
+                logging.error(
+                    f"署名付きURLの生成に失敗しました - ファイル: {blob_name}, "
+                    f"エラータイプ: {type(e).__name__}, 詳細: {str(e)}"
+                )
+                return None
+
+            signed_url_cache.put((bucket.name, blob_name, method, content_type), url, expires_at)
+            return url
+
+    results = await asyncio.gather(
+        *(sign(blob_name, content_type) for blob_name, content_type in misses.items())
+    )
+    for blob_name, url in zip(misses, results, strict=True):
+        if url is not None:
+            signed_urls[blob_name] = url
+
+    reused = len(targets) - len(misses)
+    logging.info(f"署名付きURL {len(targets)} 件中 {reused} 件をキャッシュから再利用しました")
+    # 呼び出し元の指定順に並べて返す
+    return {blob_name: signed_urls[blob_name] for blob_name in targets if blob_name in signed_urls}
@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+
+from dotenv import load_dotenv
+
+# 環境変数を読み込む
+load_dotenv()
+
+# MP4を変換するときに、長い無音を取り除くかどうか
+SILENCE_TRIM: bool = os.getenv("SILENCE_TRIM", "false").lower() == "true"
+
+# 無音とみなす音量の上限（dB）
+SILENCE_THRESHOLD_DB: float = float(os.getenv("SILENCE_THRESHOLD_DB", "-40"))
+
+# 取り除く無音の長さの下限（秒）
+SILENCE_MIN_SECONDS: float = float(os.getenv("SILENCE_MIN_SECONDS", "2.0"))
+
+# 取り除いた無音の代わりに残す無音の長さ（秒、話の区切りが分かるように少し残す）
+SILENCE_KEEP_SECONDS: float = float(os.getenv("SILENCE_KEEP_SECONDS", "0.5"))
+
+# Geminiが音声1秒あたりに使うトークン数（削減できたトークン数の見積もりに使う）
+AUDIO_TOKENS_PER_SECOND = 32
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+
+def silence_filter(
+    threshold_db: float = SILENCE_THRESHOLD_DB,
+    min_seconds: float = SILENCE_MIN_SECONDS,
+    keep_seconds: float = SILENCE_KEEP_SECONDS,
+) -> str:
+    """
+    長い無音を取り除くffmpegの音声フィルタを返す
+
+    先頭の無音と、途中の min_seconds 秒以上の無音を keep_seconds 秒に縮める。
+
+    :param threshold_db: 無音とみなす音量の上限（dB）
+    :type threshold_db: float
+    :param min_seconds: 取り除く無音の長さの下限（秒）
+    :type min_seconds: float
+    :param keep_seconds: 取り除いた無音の代わりに残す無音の長さ（秒）
+    :type keep_seconds: float
+    :return: silenceremove フィルタ
+    :rtype: str
+    """
+    keep_seconds = min(keep_seconds, min_seconds)
+    return (
+        "silenceremove="
+        f"start_periods=1:start_threshold={threshold_db}dB:start_silence={keep_seconds}:"
+        f"stop_periods=-1:stop_duration={min_seconds}:stop_threshold={threshold_db}dB:"
+        f"stop_silence={keep_seconds}"
+    )
+
+
+def silence_trim_tag(
+    threshold_db: float = SILENCE_THRESHOLD_DB, min_seconds: float = SILENCE_MIN_SECONDS
+) -> str:
+    """
+    無音を取り除いた変換結果を区別するためのタグを返す（設定を変えると変換し直す）
+
+    :param threshold_db: 無音とみなす音量の上限（dB）
+    :type threshold_db: float
+    :param min_seconds: 取り除く無音の長さの下限（秒）
+    :type min_seconds: float
+    :return: タグ
+    :rtype: str
+    """
+    return f"trim({threshold_db}dB,{min_seconds}s)"
+
+
+class SilenceTrimStats:
+    """
+    無音を取り除いた結果を集計するクラス
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.files = 0
+        self.source_seconds = 0.0
+        self.trimmed_seconds = 0.0
+
+    def record(self, file_name: str, source_seconds: float, output_seconds: float) -> float:
+        """
+        1つのファイルで取り除いた無音の長さを記録する
+
+        :param file_name: ファイル名
+        :type file_name: str
+        :param source_seconds: 変換前の長さ（秒）
+        :type source_seconds: float
+        :param output_seconds: 変換後の長さ（秒）
+        :type output_seconds: float
+        :return: 取り除いた長さ（秒）
+        :rtype: float
+        """
+        trimmed_seconds = max(source_seconds - output_seconds, 0.0)
+        with self._lock:
+            self.files += 1
+            self.source_seconds += source_seconds
+            self.trimmed_seconds += trimmed_seconds
+        logging.info(
+            f"{file_name} の無音を取り除きました: {source_seconds:.0f}秒 → {output_seconds:.0f}秒 "
+            f"（約{round(trimmed_seconds * AUDIO_TOKENS_PER_SECOND)}トークン削減）"
+        )
+        return trimmed_seconds
+
+    def stats(self) -> dict[str, float]:
+        """
+        集計結果を返す
+
+        :return: ファイル数、変換前の長さ、取り除いた長さ、削減できたトークン数の見積もりを含む辞書
+        :rtype: dict[str, float]
+        """
+        with self._lock:
+            return {
+                "files": self.files,
+                "source_seconds": round(self.source_seconds, 1),
+                "trimmed_seconds": round(self.trimmed_seconds, 1),
+                "saved_tokens": round(self.trimmed_seconds * AUDIO_TOKENS_PER_SECOND),
+                "trimmed_ratio": (
+                    round(self.trimmed_seconds / self.source_seconds, 3)
+                    if self.source_seconds
+                    else 0.0
+                ),
+            }
+
+
+# プロセス内で共有する集計
+silence_trim_stats = SilenceTrimStats()
@@ -0,0 +1,119 @@
+import logging
+import os
+import threading
+from typing import Any
+
+import google.auth
+from dotenv import load_dotenv
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import storage
+from google.oauth2 import service_account
+from requests.adapters import HTTPAdapter
+
+from app.utils.local_storage import LocalStorageClient
+
+# 環境変数を読み込む
+load_dotenv()
+
+# HTTPコネクションプールのサイズ（環境変数で調整可能）
+GCS_HTTP_POOL_SIZE: int = int(os.getenv("GCS_HTTP_POOL_SIZE", "32"))
+
+# ストレージのバックエンド（gcs: Cloud Storage, local: ローカルファイルシステム）
+STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "gcs")
+
+# Cloud Storageのスコープ
+STORAGE_SCOPES = ["https://www.googleapis.com/auth/devstorage.read_write"]
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO)
+
+# プロセス内で共有するクライアント
+_client: Any = None
+_client_lock = threading.Lock()
+
+
+def _build_client(pool_size: int = GCS_HTTP_POOL_SIZE) -> storage.Client:
+    """
+    コネクションプールを設定したCloud Storageクライアントを生成する
+
+    認証情報とAuthorizedSessionを1つだけ作成し、トークンは有効期限が切れるまで再利用する。
+    STORAGE_BACKEND が local の場合は、ローカルファイルシステムのクライアントを生成する。
+
+    :param pool_size: HTTPコネクションプールのサイズ
+    :type pool_size: int
+    :return: Cloud Storageクライアント
+    :rtype: storage.Client
+    """
+    if STORAGE_BACKEND == "local":
+        logging.info("ローカルファイルシステムのストレージクライアントを生成しました")
+        return LocalStorageClient()  # type: ignore[return-value]
+
+    credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+    if credentials_path and os.path.exists(credentials_path):
+        credentials = service_account.Credentials.from_service_account_file(
+            credentials_path, scopes=STORAGE_SCOPES
+        )
+        project = credentials.project_id
+    else:
+        credentials, project = google.auth.default(scopes=STORAGE_SCOPES)
+
+    # 認証済みセッションにコネクションプールを設定
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+
+    logging.info(f"Cloud Storageクライアントを生成しました (pool_size={pool_size})")
+    return storage.Client(project=project, credentials=credentials, _http=session)
+
+
+def get_storage_client() -> storage.Client:
+    """
+    プロセス内で共有するCloud Storageクライアントを取得する
+
+    未生成の場合は初回呼び出し時に生成する。
+
+    :return: Cloud Storageクライアント
+    :rtype: storage.Client
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+def set_storage_client(client: Any) -> None:
+    """
+    共有クライアントを差し替える（テストでインメモリ実装を使う場合など）
+
+    :param client: 差し替えるクライアント。Noneの場合は次回呼び出し時に再生成する
+    :type client: Any
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def init_storage_client() -> None:
+    """
+    アプリケーション起動時に共有クライアントを生成する
+    """
+    try:
+        get_storage_client()
+    except Exception as e:
+        # 認証情報がない環境でも起動できるように、初回利用時の生成に任せる
+        logging.warning(f"Cloud Storageクライアントの事前生成に失敗しました: {e}")
+
+
+def close_storage_client() -> None:
+    """
+    アプリケーション終了時に共有クライアントのHTTPセッションを閉じる
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            http = getattr(_client, "_http_internal", None)
+            if http is not None:
+                http.close()
+        _client = None
@@ -0,0 +1,369 @@
+"""
+ファイル取り込み処理のスループット・レイテンシ・ピークRSSを計測するベンチマーク
+
+合成した講義資料（PDF、画像、音声）をローカルストレージに保存し、以下の処理を
+実際のアプリケーションと同じ関数で実行したときの結果をJSONで出力する。
+外部のサービスには接続しない。
+
+- pdf: pdf_extraction.extract_pages_from_pdf でページごとのテキストを抽出する
+- image: image_normalization.read_image_base64 で縮小・再エンコードする
+- audio: convert_mp4_to_mp3.convert_mp4_to_mp3 でMP4をMP3に変換する（ffmpegが必要）
+  合成音声はAACのため、既定では再エンコードせずに取り出す。変換と比べる場合は
+  CONVERSION_REMUX_AAC=false や CONVERSION_PROFILE=speech を指定して実行する。
+
+処理ごとに別プロセスで実行し、プロセスプールや ffmpeg の子プロセスを含むピークRSSを計測する。
+--baseline に以前の出力を指定すると、レイテンシの中央値・スループット・ピークRSSの変化率を追加する。
+
+実行例（backendディレクトリで実行）::
+
+    python -m benchmarks.ingestion_suite --pdf-pages 200 --iterations 20 --output result.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Optional
+
+import fitz
+
+# 出力するJSONの形式のバージョン（項目を変更した場合に上げる）
+RESULT_VERSION = 1
+
+# ベンチマークに使うバケット名
+BUCKET_NAME = "benchmark-bucket"
+
+# 1ページに書き込む行
+LINE = "データベースの正規化と関係モデル Relational model and normalization "
+
+
+def build_pdf(path: str, pages: int) -> None:
+    """
+    講義名やページ番号のヘッダー・フッターを含む、スライド形式の合成PDFを作成する
+
+    :param path: 出力先のパス
+    :type path: str
+    :param pages: ページ数
+    :type pages: int
+    """
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page(width=720, height=540)
+        page.insert_text((36, 30), "情報システム特論 2024", fontname="japan", fontsize=10)
+        text = "\n".join(f"{i + 1}-{j} {LINE}" for j in range(20))
+        page.insert_textbox(fitz.Rect(36, 60, 684, 500), text, fontname="japan", fontsize=9)
+        page.insert_text((640, 525), f"{i + 1} / {pages}", fontsize=10)
+    doc.save(path)
+    doc.close()
+
+
+def build_image(path: str, scale: float) -> None:
+    """
+    色の付いた図形を描いた写真のような合成画像（JPEG）を作成する
+
+    :param path: 出力先のパス
+    :type path: str
+    :param scale: 640x480 に対する倍率
+    :type scale: float
+    """
+    doc = fitz.open()
+    page = doc.new_page(width=640, height=480)
+    rng = random.Random(0)
+    for _ in range(200):
+        center = (rng.uniform(0, 640), rng.uniform(0, 480))
+        fill = (rng.random(), rng.random(), rng.random())
+        page.draw_circle(center, rng.uniform(5, 60), color=None, fill=fill)
+    page.insert_text((50, 240), "Lecture whiteboard", fontsize=40)
+    pixmap = page.get_pixmap(matrix=fitz.Matrix(scale, scale))
+    pixmap.save(path, output="jpeg", jpg_quality=95)
+    doc.close()
+
+
+def build_audio(path: str, seconds: int) -> None:
+    """
+    音声だけを含む合成MP4を ffmpeg で作成する
+
+    :param path: 出力先のパス
+    :type path: str
+    :param seconds: 音声の長さ（秒）
+    :type seconds: int
+    """
+    import ffmpeg
+
+    (
+        ffmpeg.input(f"sine=frequency=440:duration={seconds}", f="lavfi")
+        .output(path, acodec="aac", format="mp4")
+        .overwrite_output()
+        .run(quiet=True)
+    )
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    最近傍順位法でパーセンタイルを求める
+
+    :param values: 値のリスト
+    :type values: list[float]
+    :param q: パーセンタイル（0〜100）
+    :type q: float
+    :return: パーセンタイルの値
+    :rtype: float
+    """
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+async def measure(
+    operation: Callable[[int], Awaitable[Any]], iterations: int, concurrency: int
+) -> dict[str, float]:
+    """
+    処理を iterations 回、最大 concurrency 件並行して実行し、レイテンシとスループットを計測する
+
+    :param operation: 実行回数の番号を受け取って処理を実行する関数
+    :type operation: Callable[[int], Awaitable[Any]]
+    :param iterations: 実行回数
+    :type iterations: int
+    :param concurrency: 並行して実行する件数
+    :type concurrency: int
+    :return: 実行回数、経過時間、スループット、レイテンシの統計を含む辞書
+    :rtype: dict[str, float]
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    latencies: list[float] = []
+
+    async def timed(index: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await operation(index)
+            latencies.append(time.perf_counter() - started)
+
+    # プロセスの起動時間などを計測に含めないように、1回ウォームアップする
+    await operation(-1)
+    started = time.perf_counter()
+    await asyncio.gather(*[timed(i) for i in range(iterations)])
+    elapsed = time.perf_counter() - started
+    return {
+        "iterations": iterations,
+        "elapsed_seconds": round(elapsed, 3),
+        "ops_per_second": round(iterations / elapsed, 2),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "latency_p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "latency_max_ms": round(max(latencies) * 1000, 1),
+    }
+
+
+async def run_scenario(name: str, config: dict[str, Any]) -> dict[str, float]:
+    """
+    ローカルストレージに保存した合成ファイルに対して、1つの処理を計測する
+
+    :param name: pdf, image, audio のいずれか
+    :type name: str
+    :param config: コマンドライン引数から作成した設定
+    :type config: dict[str, Any]
+    :return: 計測結果
+    :rtype: dict[str, float]
+    """
+    from app.utils.convert_mp4_to_mp3 import convert_mp4_to_mp3
+    from app.utils.image_normalization import read_image_base64
+    from app.utils.pdf_extraction import extract_pages_from_pdf
+    from app.utils.storage_client import get_storage_client
+
+    bucket = get_storage_client().bucket(BUCKET_NAME)
+    iterations = config["iterations"]
+    concurrency = config["concurrency"]
+
+    if name == "pdf":
+        path = bucket.blob("bench/lecture.pdf").path
+
+        async def extract(index: int) -> Any:
+            return await extract_pages_from_pdf(BUCKET_NAME, "bench/lecture.pdf")
+
+        result = await measure(extract, iterations, concurrency)
+        result["pages_per_second"] = round(result["ops_per_second"] * config["pdf_pages"], 1)
+    elif name == "image":
+        path = bucket.blob("bench/photo.jpg").path
+
+        async def normalize(index: int) -> Any:
+            return await read_image_base64(bucket, "bench/photo.jpg")
+
+        result = await measure(normalize, iterations, concurrency)
+    else:
+        path = bucket.blob("bench/lecture_0.mp4").path
+
+        async def convert(index: int) -> Any:
+            # 変換先の一時ファイルが重ならないように、実行ごとに別のファイルを変換する
+            return await convert_mp4_to_mp3(BUCKET_NAME, f"bench/lecture_{index + 1}.mp4")
+
+        result = await measure(convert, iterations, concurrency)
+
+    file_size = os.path.getsize(path)
+    result["file_size_mb"] = round(file_size / 1024 / 1024, 3)
+    result["mb_per_second"] = round(result["ops_per_second"] * file_size / 1024 / 1024, 2)
+    return result
+
+
+def run_in_process(
+    name: str, config: dict[str, Any], root: str, queue: multiprocessing.Queue
+) -> None:
+    """
+    子プロセスで1つの処理を計測し、計測結果とピークRSSをキューに入れる
+    """
+    from app.utils.local_storage import LocalStorageClient
+    from app.utils.pdf_extraction import shutdown_extraction_executor
+    from app.utils.storage_client import set_storage_client
+
+    set_storage_client(LocalStorageClient(root))
+    try:
+        result = asyncio.run(run_scenario(name, config))
+    finally:
+        # プロセスプールを停止し、子プロセスのピークRSSを集計できるようにする
+        shutdown_extraction_executor()
+    result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    result["children_peak_rss_mb"] = round(
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1
+    )
+    queue.put(result)
+
+
+def measure_in_process(name: str, config: dict[str, Any], root: str) -> dict[str, float]:
+    """
+    新しいプロセスで1つの処理を計測する
+
+    :param name: pdf, image, audio のいずれか
+    :type name: str
+    :param config: コマンドライン引数から作成した設定
+    :type config: dict[str, Any]
+    :param root: ローカルストレージのルートディレクトリ
+    :type root: str
+    :return: 計測結果
+    :rtype: dict[str, float]
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=run_in_process, args=(name, config, root, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"{name} の計測に失敗しました (exitcode={process.exitcode})")
+    result: dict[str, float] = queue.get()
+    return result
+
+
+def prepare_corpus(name: str, config: dict[str, Any], root: str) -> None:
+    """
+    処理に使う合成ファイルを作成し、ローカルストレージに保存する
+
+    :param name: pdf, image, audio のいずれか
+    :type name: str
+    :param config: コマンドライン引数から作成した設定
+    :type config: dict[str, Any]
+    :param root: ローカルストレージのルートディレクトリ
+    :type root: str
+    """
+    from app.utils.local_storage import LocalStorageClient
+
+    bucket = LocalStorageClient(root).bucket(BUCKET_NAME)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if name == "pdf":
+            path = os.path.join(temp_dir, "lecture.pdf")
+            build_pdf(path, config["pdf_pages"])
+            bucket.blob("bench/lecture.pdf").upload_from_filename(path)
+        elif name == "image":
+            path = os.path.join(temp_dir, "photo.jpg")
+            build_image(path, config["image_scale"])
+            bucket.blob("bench/photo.jpg").upload_from_filename(path)
+        else:
+            path = os.path.join(temp_dir, "lecture.mp4")
+            build_audio(path, config["audio_seconds"])
+            # ウォームアップの分を含めて、実行ごとに別のファイルを用意する
+            for i in range(config["iterations"] + 1):
+                bucket.blob(f"bench/lecture_{i}.mp4").upload_from_filename(path)
+
+
+def compare(result: dict[str, Any], baseline: dict[str, Any]) -> None:
+    """
+    以前の計測結果と比べたレイテンシの中央値とスループットの変化率を追加する
+
+    :param result: 今回の計測結果
+    :type result: dict[str, Any]
+    :param baseline: 以前の計測結果
+    :type baseline: dict[str, Any]
+    """
+    for name, scenario in result["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name, {})
+        for key in ("latency_p50_ms", "ops_per_second", "peak_rss_mb"):
+            if scenario.get(key) and previous.get(key):
+                scenario.setdefault("change", {})[key] = round(scenario[key] / previous[key] - 1, 3)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--scenarios", default="pdf,image,audio", help="計測する処理（カンマ区切り）"
+    )
+    parser.add_argument("--pdf-pages", type=int, default=100, help="合成PDFのページ数")
+    parser.add_argument(
+        "--image-scale", type=float, default=5.0, help="合成画像の640x480に対する倍率"
+    )
+    parser.add_argument("--audio-seconds", type=int, default=60, help="合成音声の長さ（秒）")
+    parser.add_argument("--iterations", type=int, default=10, help="処理ごとの実行回数")
+    parser.add_argument("--concurrency", type=int, default=2, help="並行して実行する件数")
+    parser.add_argument("--output", help="計測結果のJSONを保存するパス（省略時は標準出力）")
+    parser.add_argument("--baseline", help="比較する以前の計測結果のJSONのパス")
+    args = parser.parse_args()
+
+    config = {
+        "pdf_pages": args.pdf_pages,
+        "image_scale": args.image_scale,
+        "audio_seconds": args.audio_seconds,
+        "iterations": args.iterations,
+        "concurrency": args.concurrency,
+    }
+    ffmpeg_path: Optional[str] = shutil.which("ffmpeg")
+    result: dict[str, Any] = {
+        "version": RESULT_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count() or 1,
+            "pymupdf": fitz.VersionBind,
+            "ffmpeg": ffmpeg_path is not None,
+        },
+        "config": config,
+        "scenarios": {},
+    }
+
+    with tempfile.TemporaryDirectory() as root:
+        for name in [name.strip() for name in args.scenarios.split(",") if name.strip()]:
+            if name not in ("pdf", "image", "audio"):
+                parser.error(f"不明な処理です: {name}")
+            if name == "audio" and ffmpeg_path is None:
+                result["scenarios"][name] = {"skipped": "ffmpeg が見つかりません"}
+                continue
+            prepare_corpus(name, config, root)
+            result["scenarios"][name] = measure_in_process(name, config, root)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
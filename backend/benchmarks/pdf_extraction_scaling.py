@@ -0,0 +1,156 @@
+"""
+PDFのテキスト抽出のプロセス数ごとのスループットを計測するベンチマーク
+
+テキストの多い合成PDFを作成し、以下の方式で全ページのテキストを抽出したときの
+ページ/秒をJSONで出力する。
+
+- threads: ページごとに asyncio.to_thread で抽出する（変更前の方式）
+- processes_N: N プロセスのプロセスプールで PDF_PAGES_PER_TASK ページずつ抽出する
+
+同時に複数のPDFを抽出する状況を再現するため、同じPDFを --concurrency 件並行して抽出する。
+
+実行例（backendディレクトリで実行）::
+
+    python -m benchmarks.pdf_extraction_scaling --pages 400 --concurrency 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+import fitz
+
+from app.utils import pdf_extraction
+
+# 1ページに書き込む行
+LINE = "ソフトウェア工学の講義資料 Software Engineering lecture note " * 2
+
+
+def build_pdf(path: str, pages: int) -> None:
+    """
+    テキストだけのページからなる合成PDFを作成する
+
+    :param path: 出力先のパス
+    :type path: str
+    :param pages: ページ数
+    :type pages: int
+    """
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        text = "\n".join(f"{i + 1}-{j} {LINE}" for j in range(50))
+        page.insert_textbox(fitz.Rect(36, 36, 560, 800), text, fontname="japan", fontsize=7)
+    doc.save(path)
+    doc.close()
+
+
+async def extract_with_threads(path: str) -> int:
+    """
+    変更前の方式（ページごとにスレッドで抽出）で全ページを抽出する
+
+    :param path: PDFのパス
+    :type path: str
+    :return: 抽出したページ数
+    :rtype: int
+    """
+    doc = await asyncio.to_thread(fitz.open, path, filetype="pdf")
+    extracted_text = ""
+    try:
+        for i, page in enumerate(doc):
+            page_text = await asyncio.to_thread(page.get_text)
+            extracted_text += f"\n# {i+1}ページ\n{page_text}"
+        return int(doc.page_count)
+    finally:
+        doc.close()
+
+
+async def extract_with_processes(path: str) -> int:
+    """
+    プロセスプールで全ページを抽出する
+
+    :param path: PDFのパス
+    :type path: str
+    :return: 抽出したページ数
+    :rtype: int
+    """
+    pages = await pdf_extraction.extract_pages_from_path(path)
+    pdf_extraction.join_pages(pages)
+    return len(pages)
+
+
+async def measure(path: str, mode: str, concurrency: int) -> float:
+    """
+    同じPDFを concurrency 件並行して抽出し、ページ/秒を計測する
+
+    :param path: PDFのパス
+    :type path: str
+    :param mode: threads または processes
+    :type mode: str
+    :param concurrency: 並行して抽出する件数
+    :type concurrency: int
+    :return: ページ/秒
+    :rtype: float
+    """
+    extract = extract_with_threads if mode == "threads" else extract_with_processes
+    # プロセスの起動時間を計測に含めないように、1回ウォームアップする
+    await extract(path)
+    started = time.perf_counter()
+    pages = await asyncio.gather(*[extract(path) for _ in range(concurrency)])
+    return sum(pages) / (time.perf_counter() - started)
+
+
+async def run(path: str, workers: list[int], concurrency: int) -> dict[str, float]:
+    """
+    各方式でページ/秒を計測する
+
+    :param path: PDFのパス
+    :type path: str
+    :param workers: 計測するプロセス数のリスト
+    :type workers: list[int]
+    :param concurrency: 並行して抽出する件数
+    :type concurrency: int
+    :return: 方式をキーとし、ページ/秒を値とする辞書
+    :rtype: dict[str, float]
+    """
+    results = {"threads": round(await measure(path, "threads", concurrency), 1)}
+    for count in workers:
+        with patch.object(pdf_extraction, "PDF_EXTRACTION_WORKERS", count):
+            try:
+                pages_per_second = await measure(path, "processes", concurrency)
+            finally:
+                pdf_extraction.shutdown_extraction_executor()
+        results[f"processes_{count}"] = round(pages_per_second, 1)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=400, help="合成PDFのページ数")
+    parser.add_argument("--concurrency", type=int, default=4, help="並行して抽出するPDFの数")
+    parser.add_argument("--pdf", help="合成PDFの代わりに使うPDFのパス")
+    args = parser.parse_args()
+
+    cpu_count = os.cpu_count() or 1
+    workers = sorted({1, 2, 4, cpu_count} & set(range(1, cpu_count + 1)))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = args.pdf
+        if path is None:
+            path = os.path.join(temp_dir, "benchmark.pdf")
+            build_pdf(path, args.pages)
+
+        result = {
+            "pages": fitz.open(path).page_count,
+            "concurrency": args.concurrency,
+            "cpu_count": cpu_count,
+            "pages_per_second": asyncio.run(run(path, workers, args.concurrency)),
+        }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
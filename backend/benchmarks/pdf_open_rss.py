@@ -0,0 +1,124 @@
+"""
+PDFの開き方ごとのピークRSSを比較するベンチマーク
+
+合成した画像入りPDFを、以下の2通りで開いて全ページのテキストを抽出し、
+それぞれ別プロセスで実行したときのピークRSS（最大常駐メモリ）をJSONで出力する。
+
+- bytes: ファイル全体を bytes に読み込み、io.BytesIO 経由で開く（変更前の方式）
+- path: ローカルファイルのパスで開く（変更後の方式）
+
+実行例（backendディレクトリで実行）::
+
+    python -m benchmarks.pdf_open_rss --size-mb 200 --pages 100
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+
+import fitz
+
+
+def build_pdf(path: str, size_mb: int, pages: int) -> None:
+    """
+    圧縮が効かない画像を埋め込んだ合成PDFを作成する
+
+    :param path: 出力先のパス
+    :type path: str
+    :param size_mb: おおよそのファイルサイズ（MB）
+    :type size_mb: int
+    :param pages: ページ数
+    :type pages: int
+    """
+    # 1ページあたりの画像サイズ（RGBで1ピクセル3バイト）
+    side = max(16, int((size_mb * 1024 * 1024 / pages / 3) ** 0.5))
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"ベンチマーク用のページ {i + 1}", fontname="japan")
+        samples = os.urandom(side * side * 3)
+        pixmap = fitz.Pixmap(fitz.csRGB, side, side, samples, False)
+        page.insert_image(fitz.Rect(72, 100, 500, 528), pixmap=pixmap)
+    doc.save(path, deflate=False)
+    doc.close()
+
+
+def extract(path: str, mode: str) -> int:
+    """
+    指定した方式でPDFを開き、全ページのテキストを抽出する
+
+    :param path: PDFのパス
+    :type path: str
+    :param mode: bytes または path
+    :type mode: str
+    :return: 抽出したテキストの文字数
+    :rtype: int
+    """
+    if mode == "bytes":
+        with open(path, "rb") as f:
+            content = f.read()
+        doc = fitz.open(stream=io.BytesIO(content), filetype="pdf")
+    else:
+        doc = fitz.open(path, filetype="pdf")
+    texts = [page.get_text() for page in doc]
+    doc.close()
+    return sum(len(text) for text in texts)
+
+
+def run(path: str, mode: str, queue: multiprocessing.Queue) -> None:
+    """
+    子プロセスで抽出を実行し、ピークRSS（KB）を返す
+    """
+    if mode != "baseline":
+        extract(path, mode)
+    queue.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def measure(path: str, mode: str) -> int:
+    """
+    新しいプロセスで抽出を実行したときのピークRSS（KB）を計測する
+
+    :param path: PDFのパス
+    :type path: str
+    :param mode: baseline, bytes, path のいずれか
+    :type mode: str
+    :return: ピークRSS（KB）
+    :rtype: int
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=run, args=(path, mode, queue))
+    process.start()
+    peak_rss: int = queue.get()
+    process.join()
+    return peak_rss
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mb", type=int, default=200, help="合成PDFのおおよそのサイズ（MB）")
+    parser.add_argument("--pages", type=int, default=100, help="合成PDFのページ数")
+    parser.add_argument("--pdf", help="合成PDFの代わりに使うPDFのパス")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = args.pdf
+        if path is None:
+            path = os.path.join(temp_dir, "benchmark.pdf")
+            build_pdf(path, args.size_mb, args.pages)
+
+        result = {
+            "file_size_mb": round(os.path.getsize(path) / 1024 / 1024, 1),
+            "peak_rss_mb": {
+                mode: round(measure(path, mode) / 1024, 1) for mode in ("baseline", "bytes", "path")
+            },
+        }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ from app.models.exercises import Exercise
 from app.models.exercises_files import exercise_file
 from app.models.exercises_user_answer import ExerciseUserAnswer
 from app.models.outputs_files import output_file
+from app.utils.ingestion import ingestion_manager
 from unittest.mock import Mock, patch
 from fastapi import Request
 from fastapi.security import HTTPAuthorizationCredentials
@@ -155,6 +156,13 @@ def mock_auth() -> Generator:
         yield
 
 
+# アップロード時のバックグラウンドの前処理を無効にするフィクスチャ
+@pytest.fixture(autouse=True)
+def disable_ingestion() -> Generator:
+    with patch.object(ingestion_manager, "enabled", False):
+        yield
+
+
 # AsyncClientを提供するフィクスチャ
 @pytest.fixture
 async def async_client() -> AsyncGenerator[AsyncClient, None]:
@@ -0,0 +1,83 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from app.utils.audio_segments import AudioSegment, cut_segment, delete_segments, plan_segments
+from app.utils.in_memory_storage import InMemoryStorageClient
+from app.utils.media_workers import media_workers
+from app.utils.rate_limiter import RateLimiter
+
+
+def test_plan_segments() -> None:
+    """音声を均等な長さの重なりのある区間に分割することをテスト"""
+    # 90分の講義を10分程度の区間に分割する
+    segments = plan_segments(5400, segment_seconds=600, overlap_seconds=15)
+    assert len(segments) == 9
+    assert segments[0] == AudioSegment(0, 0.0, 600.0, 0.0)
+    assert segments[1] == AudioSegment(1, 585.0, 1200.0, 15.0)
+    assert segments[-1].end == 5400
+
+    # 区間の境目は前の区間の終了位置と重なる
+    for previous, segment in zip(segments, segments[1:], strict=False):
+        assert segment.start + segment.overlap == previous.end
+
+    # 最後の区間だけが短くならない
+    segments = plan_segments(650, segment_seconds=600, overlap_seconds=15)
+    assert [round(segment.end - segment.overlap - segment.start) for segment in segments] == [
+        325,
+        325,
+    ]
+
+    assert plan_segments(300, segment_seconds=600) == [AudioSegment(0, 0.0, 300.0, 0.0)]
+    assert plan_segments(0) == []
+    # 重なりは区間の半分までに抑える
+    assert plan_segments(20, segment_seconds=10, overlap_seconds=30)[1].overlap == 5
+
+
+@pytest.mark.asyncio
+async def test_cut_segment_and_delete() -> None:
+    """区間を切り出してMP3として保存し、削除できることをテスト"""
+    client = InMemoryStorageClient()
+    bucket = client.bucket("test-bucket")
+    source = bucket.blob("test_user/lecture.mp3")
+    source.upload_from_string(b"mp3")
+
+    with mock.patch("app.utils.audio_segments.ffmpeg") as mock_ffmpeg:
+        mock_ffmpeg.input.return_value.output.return_value.run.return_value = (b"segment", b"")
+        segment = AudioSegment(1, 585.0, 1200.0, 15.0)
+        blob = await cut_segment(bucket, source, segment, "segments/run/0001.mp3")
+
+    assert mock_ffmpeg.input.call_args.kwargs == {"ss": 585.0, "t": 615.0}
+    # MP3は再エンコードせずに切り出す
+    mock_ffmpeg.input.return_value.output.assert_called_once_with(
+        "pipe:", format="mp3", acodec="copy", threads=media_workers.threads_per_job
+    )
+    assert blob.download_as_bytes() == b"segment"
+
+    await delete_segments(bucket, ["segments/run/0001.mp3", "segments/run/missing.mp3"])
+    assert not blob.exists()
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_limits_concurrency() -> None:
+    """共有する制限の範囲でリクエストを同時に実行することをテスト"""
+    limiter = RateLimiter(concurrency=2)
+    running = 0
+    max_running = 0
+
+    async def request() -> None:
+        nonlocal running, max_running
+        async with limiter.acquire():
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    await asyncio.gather(*[request() for _ in range(5)])
+
+    assert max_running == 2
+    stats = limiter.stats()
+    assert stats["active"] == 0
+    assert stats["acquired"] == 5
+    assert stats["waited"] == 3
@@ -0,0 +1,161 @@
+import os
+from pathlib import Path
+from typing import Generator
+from unittest.mock import patch
+
+import pytest
+
+from app.utils import blob_cache as blob_cache_module
+from app.utils.blob_cache import TEMP_PREFIX, BlobDiskCache, open_blob_path, read_blob_bytes
+from app.utils.in_memory_storage import InMemoryBlob, InMemoryBucket, InMemoryStorageClient
+
+MOCK_BUCKET_NAME = "test-bucket"
+
+
+# 一時ディレクトリのキャッシュを共有キャッシュとして使うフィクスチャ
+@pytest.fixture
+def disk_cache(tmp_path: Path) -> Generator[BlobDiskCache, None, None]:
+    cache = BlobDiskCache(directory=str(tmp_path), max_bytes=1024)
+    with patch.object(blob_cache_module, "blob_cache", cache):
+        yield cache
+
+
+@pytest.fixture
+def bucket() -> InMemoryBucket:
+    bucket = InMemoryStorageClient().bucket(MOCK_BUCKET_NAME)
+    bucket.blob("test_user/a.pdf").upload_from_string(b"a" * 100)
+    return bucket
+
+
+@pytest.mark.asyncio
+async def test_read_blob_bytes_uses_disk_cache(
+    disk_cache: BlobDiskCache, bucket: InMemoryBucket
+) -> None:
+    """同じ世代のブロブは2回目以降ディスクから読み込まれることをテスト"""
+    generation = bucket.blob("test_user/a.pdf").generation
+
+    with patch.object(
+        InMemoryBlob, "download_to_file", autospec=True, side_effect=InMemoryBlob.download_to_file
+    ) as mock_download:
+        first = await read_blob_bytes(bucket, "test_user/a.pdf", generation)
+        second = await read_blob_bytes(bucket, "test_user/a.pdf", generation)
+
+    assert first == second == b"a" * 100
+    mock_download.assert_called_once()
+    assert disk_cache.stats() == {"hits": 1, "misses": 1, "hit_ratio": 0.5, "bytes_saved": 100}
+    assert os.path.exists(disk_cache.path_for(MOCK_BUCKET_NAME, "test_user/a.pdf", generation))
+
+    # 再アップロードで世代が変わると、新しい内容がダウンロードされる
+    bucket.blob("test_user/a.pdf").upload_from_string(b"b" * 10)
+    new_generation = bucket.blob("test_user/a.pdf").generation
+    assert await read_blob_bytes(bucket, "test_user/a.pdf", new_generation) == b"b" * 10
+
+
+@pytest.mark.asyncio
+async def test_read_blob_bytes_without_generation(
+    disk_cache: BlobDiskCache, bucket: InMemoryBucket
+) -> None:
+    """世代番号が不明な場合はキャッシュを使わずにダウンロードすることをテスト"""
+    assert await read_blob_bytes(bucket, "test_user/a.pdf") == b"a" * 100
+    assert disk_cache.stats()["misses"] == 0
+    assert list(Path(disk_cache.directory).rglob("*")) == []
+
+
+def test_blob_disk_cache_eviction_and_atomic_write(
+    disk_cache: BlobDiskCache, bucket: InMemoryBucket
+) -> None:
+    """上限を超えると古いファイルから削除され、失敗した書き込みは残らないことをテスト"""
+    for i in range(3):
+        name = f"test_user/{i}.pdf"
+        bucket.blob(name).upload_from_string(bytes(400))
+        path, cached = disk_cache.download(bucket.blob(name), MOCK_BUCKET_NAME, name, 1)
+        assert cached
+        os.utime(path, (i, i))
+
+    # 最も古いファイルが削除され、合計サイズが上限以下になる
+    assert disk_cache.get(MOCK_BUCKET_NAME, "test_user/0.pdf", 1) is None
+    assert disk_cache.get(MOCK_BUCKET_NAME, "test_user/1.pdf", 1) is not None
+    assert disk_cache.get(MOCK_BUCKET_NAME, "test_user/2.pdf", 1) is not None
+
+    with pytest.raises(Exception):
+        disk_cache.download(bucket.blob("test_user/missing.pdf"), MOCK_BUCKET_NAME, "x", 1)
+    assert disk_cache.get(MOCK_BUCKET_NAME, "x", 1) is None
+    assert not [p for p in Path(disk_cache.directory).rglob(f"{TEMP_PREFIX}*")]
+
+
+def test_blob_disk_cache_scans_directory_only_when_needed(
+    disk_cache: BlobDiskCache, bucket: InMemoryBucket
+) -> None:
+    """合計サイズをプロセス内で保持し、最初の保存時と上限を超えたときだけ走査することをテスト"""
+    with patch.object(blob_cache_module.os, "walk", side_effect=os.walk) as mock_walk:
+        for i in range(2):
+            name = f"test_user/{i}.pdf"
+            bucket.blob(name).upload_from_string(bytes(400))
+            disk_cache.download(bucket.blob(name), MOCK_BUCKET_NAME, name, 1)
+        assert mock_walk.call_count == 1
+
+        # 同じファイルを上書きしても合計サイズは増えない
+        disk_cache.download(bucket.blob("test_user/1.pdf"), MOCK_BUCKET_NAME, "test_user/1.pdf", 1)
+        assert mock_walk.call_count == 1
+
+        bucket.blob("test_user/2.pdf").upload_from_string(bytes(400))
+        disk_cache.download(bucket.blob("test_user/2.pdf"), MOCK_BUCKET_NAME, "test_user/2.pdf", 1)
+        assert mock_walk.call_count == 2
+    assert disk_cache._total_bytes == 800
+
+
+@pytest.mark.asyncio
+async def test_blob_larger_than_limit_is_not_cached(
+    disk_cache: BlobDiskCache, bucket: InMemoryBucket
+) -> None:
+    """上限より大きいブロブはキャッシュせず、一時ファイルから読み込めることをテスト"""
+    bucket.blob("test_user/large.pdf").upload_from_string(b"l" * 2048)
+    generation = bucket.blob("test_user/large.pdf").generation
+
+    assert await read_blob_bytes(bucket, "test_user/large.pdf", generation) == b"l" * 2048
+    async with open_blob_path(bucket, "test_user/large.pdf", generation) as path:
+        assert Path(path).read_bytes() == b"l" * 2048
+    assert not os.path.exists(path)
+    assert disk_cache.get(MOCK_BUCKET_NAME, "test_user/large.pdf", generation) is None
+    assert list(Path(disk_cache.directory).rglob("*.pdf")) == []
+    assert not [p for p in Path(disk_cache.directory).rglob(f"{TEMP_PREFIX}*")]
+
+
+@pytest.mark.asyncio
+async def test_evict_keeps_files_in_use(disk_cache: BlobDiskCache, bucket: InMemoryBucket) -> None:
+    """使用中のファイルは削除せず、古い書き込み途中のファイルは削除することをテスト"""
+    generation = bucket.blob("test_user/a.pdf").generation
+    stale_temp = Path(disk_cache.directory) / "00" / f"{TEMP_PREFIX}stale"
+    stale_temp.parent.mkdir(parents=True, exist_ok=True)
+    stale_temp.write_bytes(b"partial")
+    os.utime(stale_temp, (0, 0))
+    fresh_temp = stale_temp.with_name(f"{TEMP_PREFIX}fresh")
+    fresh_temp.write_bytes(b"partial")
+
+    async with open_blob_path(bucket, "test_user/a.pdf", generation) as path:
+        os.utime(path, (0, 0))
+        # 他のリクエストの保存で上限を超えても、使用中のファイルは削除されない
+        for i in range(3):
+            name = f"test_user/{i}.pdf"
+            bucket.blob(name).upload_from_string(bytes(400))
+            disk_cache.download(bucket.blob(name), MOCK_BUCKET_NAME, name, 1)
+        assert Path(path).read_bytes() == b"a" * 100
+
+    assert not stale_temp.exists()
+    assert fresh_temp.exists()
+    assert disk_cache._total_bytes is not None
+    assert disk_cache._total_bytes <= disk_cache.max_bytes
+
+
+@pytest.mark.asyncio
+async def test_open_blob_path(disk_cache: BlobDiskCache, bucket: InMemoryBucket) -> None:
+    """ブロブがローカルファイルとして参照でき、一時ファイルは後で削除されることをテスト"""
+    async with open_blob_path(bucket, "test_user/a.pdf") as temp_path:
+        assert temp_path.endswith(".pdf")
+        assert Path(temp_path).read_bytes() == b"a" * 100
+    assert not os.path.exists(temp_path)
+
+    generation = bucket.blob("test_user/a.pdf").generation
+    async with open_blob_path(bucket, "test_user/a.pdf", generation) as cached_path:
+        assert cached_path == disk_cache.path_for(MOCK_BUCKET_NAME, "test_user/a.pdf", generation)
+    assert os.path.exists(cached_path)
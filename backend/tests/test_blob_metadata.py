@@ -0,0 +1,120 @@
+import time
+import unicodedata
+from typing import Generator
+from unittest.mock import patch
+
+import pytest
+
+from app.utils.blob_metadata import (
+    BlobInfo,
+    BlobMetadataCache,
+    blob_metadata_cache,
+    invalidate_blob_metadata,
+    lookup_blobs,
+    to_blob_name,
+)
+from app.utils.in_memory_storage import InMemoryStorageClient
+from app.utils.storage_client import set_storage_client
+
+MOCK_BUCKET_NAME = "test-bucket"
+MOCK_UID = "test_user"
+
+
+# インメモリのストレージを共有クライアントとして使うフィクスチャ
+@pytest.fixture
+def in_memory_client() -> Generator[InMemoryStorageClient, None, None]:
+    client = InMemoryStorageClient()
+    set_storage_client(client)
+    blob_metadata_cache.clear()
+    yield client
+    set_storage_client(None)
+    blob_metadata_cache.clear()
+
+
+def test_to_blob_name() -> None:
+    """ブロブ名がNFC正規化されることをテスト"""
+    nfd_filename = "テスト" + "\u3099" + "ファイル.pdf"
+    blob_name = to_blob_name(" test_user/ ", nfd_filename)
+
+    assert blob_name == "test_user/" + unicodedata.normalize("NFC", nfd_filename)
+    assert unicodedata.is_normalized("NFC", blob_name)
+
+    with pytest.raises(ValueError, match="Invalid user ID"):
+        to_blob_name("  ", "test.pdf")
+
+
+@pytest.mark.asyncio
+async def test_lookup_blobs(in_memory_client: InMemoryStorageClient) -> None:
+    """複数ファイルの存在とメタデータが1回の一覧取得で返されることをテスト"""
+    bucket = in_memory_client.bucket(MOCK_BUCKET_NAME)
+    bucket.blob("test_user/a.pdf").upload_from_string(b"pdf", content_type="application/pdf")
+    bucket.blob("test_user/b.png").upload_from_string(b"image", content_type="image/png")
+    bucket.blob("other_user/a.pdf").upload_from_string(b"other")
+
+    with patch.object(
+        in_memory_client, "list_blobs", wraps=in_memory_client.list_blobs
+    ) as mock_list:
+        result = await lookup_blobs(MOCK_BUCKET_NAME, MOCK_UID, ["a.pdf", "b.png", "c.pdf"])
+
+    mock_list.assert_called_once()
+    assert mock_list.call_args.kwargs["prefix"].startswith("test_user/")
+    assert result["test_user/a.pdf"].exists is True
+    assert result["test_user/a.pdf"].size == 3
+    assert result["test_user/a.pdf"].content_type == "application/pdf"
+    assert result["test_user/a.pdf"].generation is not None
+    assert result["test_user/b.png"].size == 5
+    assert result["test_user/c.pdf"] == BlobInfo(name="test_user/c.pdf", exists=False)
+
+
+@pytest.mark.asyncio
+async def test_lookup_blobs_empty(in_memory_client: InMemoryStorageClient) -> None:
+    """ファイル指定がない場合は一覧取得を行わないことをテスト"""
+    with patch.object(in_memory_client, "list_blobs") as mock_list:
+        result = await lookup_blobs(MOCK_BUCKET_NAME, MOCK_UID, [])
+
+    assert result == {}
+    mock_list.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_lookup_blobs_uses_cache(in_memory_client: InMemoryStorageClient) -> None:
+    """キャッシュ済みのブロブは一覧取得されず、破棄後は再取得されることをテスト"""
+    bucket = in_memory_client.bucket(MOCK_BUCKET_NAME)
+    bucket.blob("test_user/a.pdf").upload_from_string(b"pdf")
+
+    with (
+        patch.object(
+            in_memory_client, "list_blobs", wraps=in_memory_client.list_blobs
+        ) as mock_list,
+        patch.dict("os.environ", {"BUCKET_NAME": MOCK_BUCKET_NAME}),
+    ):
+        first = await lookup_blobs(MOCK_BUCKET_NAME, MOCK_UID, ["a.pdf"])
+        second = await lookup_blobs(MOCK_BUCKET_NAME, MOCK_UID, ["a.pdf"])
+        assert mock_list.call_count == 1
+        assert first == second
+
+        # 再アップロード後に破棄すると新しい世代が取得される
+        bucket.blob("test_user/a.pdf").upload_from_string(b"new pdf")
+        invalidate_blob_metadata(MOCK_UID, ["a.pdf"])
+        third = await lookup_blobs(MOCK_BUCKET_NAME, MOCK_UID, ["a.pdf"])
+
+    assert mock_list.call_count == 2
+    assert third["test_user/a.pdf"].generation != first["test_user/a.pdf"].generation
+    assert blob_metadata_cache.stats() == {"hits": 1, "misses": 2, "entries": 1}
+
+
+def test_blob_metadata_cache_generation_and_ttl() -> None:
+    """世代番号の不一致と有効期限切れがミスになることをテスト"""
+    cache = BlobMetadataCache(max_entries=2, ttl=60)
+    info = BlobInfo(name="test_user/a.pdf", exists=True, generation=1)
+    cache.put(MOCK_BUCKET_NAME, info)
+    cache.put(MOCK_BUCKET_NAME, BlobInfo(name="test_user/missing.pdf", exists=False))
+
+    assert cache.get(MOCK_BUCKET_NAME, "test_user/a.pdf", generation=1) == info
+    assert cache.get(MOCK_BUCKET_NAME, "test_user/missing.pdf") is None
+    assert cache.get(MOCK_BUCKET_NAME, "test_user/a.pdf", generation=2) is None
+    assert cache.get(MOCK_BUCKET_NAME, "test_user/a.pdf") is None
+
+    cache.put(MOCK_BUCKET_NAME, info)
+    with patch("app.utils.blob_metadata.time.monotonic", return_value=time.monotonic() + 120):
+        assert cache.get(MOCK_BUCKET_NAME, "test_user/a.pdf") is None
@@ -17,10 +17,10 @@ def mock_env_vars(monkeypatch: MonkeyPatch) -> None:
     monkeypatch.setenv("BUCKET_NAME", "test-bucket-name")
 
 
-# storage.Clientのモック
+# 共有Cloud Storageクライアントのモック
 @pytest.fixture
 def mock_storage_client() -> Generator:
-    with mock.patch("app.utils.claude_request_stream.storage.Client") as mock_client:
+    with mock.patch("app.utils.claude_request_stream.get_storage_client") as mock_client:
         yield mock_client
 
 
@@ -41,26 +41,6 @@ class AsyncContextManager:
         pass
 
 
-# check_file_exists関数のテスト
-@pytest.mark.asyncio
-async def test_check_file_exists(mock_storage_client: Mock) -> None:
-    mock_bucket = mock.Mock()
-    mock_blob = mock.Mock()
-
-    # bucket.blob(file_name).exists()の戻り値をTrueに設定
-    mock_blob.exists.return_value = True
-    mock_bucket.blob.return_value = mock_blob
-    mock_storage_client.return_value.bucket.return_value = mock_bucket
-
-    result = await claude_request_stream.check_file_exists("test-bucket-name", "test-file.pdf")
-    assert result == True
-
-    # bucket.blob(file_name).exists()の戻り値をFalseに設定
-    mock_blob.exists.return_value = False
-    result = await claude_request_stream.check_file_exists("test-bucket-name", "test-file.pdf")
-    assert result == False
-
-
 # read_file関数のテスト
 @pytest.mark.asyncio
 async def test_read_file(mock_storage_client: Mock) -> None:
@@ -95,10 +75,18 @@ async def test_extract_text_from_pdf(mock_storage_client: Mock) -> None:
     mock_bucket.blob.return_value = mock_blob
     mock_storage_client.return_value.bucket.return_value = mock_bucket
 
-    with mock.patch("app.utils.claude_request_stream.fitz.open") as mock_open:
+    # モックを使えるように、プロセスプールではなくスレッドで抽出する
+    with (
+        mock.patch("app.utils.pdf_extraction.get_storage_client", new=mock_storage_client),
+        mock.patch("app.utils.pdf_extraction.get_extraction_executor", return_value=None),
+        mock.patch("app.utils.pdf_pages.fitz.open") as mock_open,
+    ):
         mock_page = mock.Mock()
-        mock_page.get_text.return_value = "Mock Page Text"
-        mock_open.return_value.__iter__.return_value = [mock_page]
+        # テキストブロック (x0, y0, x1, y1, テキスト, ブロック番号, ブロックの種類) を返す
+        mock_page.get_text.return_value = [(0, 40, 100, 60, "Mock Page Text", 0, 0)]
+        mock_page.rect.height = 100
+        mock_open.return_value.page_count = 1
+        mock_open.return_value.load_page.return_value = mock_page
 
         result = await claude_request_stream.extract_text_from_pdf(
             "test-bucket-name", "test-file.pdf"
@@ -1,103 +1,343 @@
-import pytest
+import asyncio
+import io
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Any, Generator, Tuple
 from unittest import mock
-from app.utils.convert_mp4_to_mp3 import convert_mp4_to_mp3
-from typing import Generator
 
+import ffmpeg
+import pytest
 
-@pytest.fixture
-def mock_storage_client() -> Generator[mock.MagicMock, None, None]:
-    with mock.patch("app.utils.convert_mp4_to_mp3.storage.Client") as mock_client:
-        yield mock_client
+from app.utils import convert_mp4_to_mp3 as convert_module
+from app.utils.convert_mp4_to_mp3 import (
+    AudioArtifact,
+    Mp3Converter,
+    convert_mp4_to_audio,
+    convert_mp4_to_mp3,
+    is_streamable_mp4,
+)
+from app.utils.in_memory_storage import InMemoryBlob, InMemoryStorageClient
+from app.utils.media_workers import media_workers
+from app.utils.silence_trim import SilenceTrimStats
 
 
-@pytest.fixture
-def mock_ffmpeg() -> Generator[mock.MagicMock, None, None]:
-    with mock.patch("app.utils.convert_mp4_to_mp3.ffmpeg") as mock_ffmpeg:
-        yield mock_ffmpeg
+def box(box_type: bytes, payload: bytes = b"") -> bytes:
+    """MP4のボックスを作成する"""
+    return (8 + len(payload)).to_bytes(4, "big") + box_type + payload
+
+
+# moov ボックスが先頭にある（標準入力から変換できる）MP4
+FASTSTART_MP4 = box(b"ftyp", b"isom") + box(b"moov", b"index") + box(b"mdat", b"audio" * 100)
+
+# moov ボックスが末尾にある（シークが必要な）MP4
+MOOV_AT_END_MP4 = box(b"ftyp", b"isom") + box(b"mdat", b"audio" * 100) + box(b"moov", b"index")
 
 
 @pytest.fixture
-def mock_os() -> Generator[mock.MagicMock, None, None]:
-    with mock.patch("app.utils.convert_mp4_to_mp3.os") as mock_os:
-        yield mock_os
+def in_memory_converter() -> Generator[Tuple[InMemoryStorageClient, mock.MagicMock], None, None]:
+    """
+    インメモリのストレージと、ffmpegの代わりに入力をそのまま出力するプロセスを使うフィクスチャ
+
+    標準入力から読み込む場合は cat で入力をそのまま出力し、URLから読み込む場合はURLを出力する。
+    """
+    client = InMemoryStorageClient()
+
+    def output(path: str, **kwargs: str) -> mock.MagicMock:
+        stream = mock.MagicMock()
+        input_spec = mock_ffmpeg.input.call_args.args[0]
+
+        def run_async(
+            cmd: Any = "ffmpeg", pipe_stdin: bool = False, pipe_stdout: bool = False
+        ) -> subprocess.Popen:
+            command = ["cat"] if pipe_stdin else ["printf", "%s", input_spec]
+            return subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE if pipe_stdin else None,
+                stdout=subprocess.PIPE,
+            )
+
+        stream.run_async.side_effect = run_async
+        stream.run.side_effect = lambda **kwargs: Path(path).write_bytes(b"mp3 content")
+        mock_ffmpeg.streams.append(stream)
+        return stream
+
+    with (
+        mock.patch("app.utils.convert_mp4_to_mp3.get_storage_client", return_value=client),
+        mock.patch("app.utils.convert_mp4_to_mp3.ffmpeg") as mock_ffmpeg,
+        mock.patch("app.utils.convert_mp4_to_mp3.mp3_converter", Mp3Converter()),
+    ):
+        mock_ffmpeg.Error = ffmpeg.Error
+        mock_ffmpeg.streams = []
+        # 音声のコーデックはMP3（再エンコードせずに取り出さない）
+        mock_ffmpeg.probe.return_value = {"streams": [{"codec_name": "mp3"}]}
+        mock_ffmpeg.input.return_value.output.side_effect = output
+        yield client, mock_ffmpeg
+
+
+def read_blob(client: InMemoryStorageClient, blob_name: str) -> Any:
+    blob = client.bucket("test-bucket").blob(blob_name)
+    blob.reload()
+    return blob
+
+
+def test_is_streamable_mp4() -> None:
+    """moov ボックスが mdat ボックスより前にあるかどうかを判定できることをテスト"""
+    assert is_streamable_mp4(io.BytesIO(FASTSTART_MP4))
+    assert not is_streamable_mp4(io.BytesIO(MOOV_AT_END_MP4))
+    assert not is_streamable_mp4(io.BytesIO(b"broken"))
+    # 64ビットのサイズを持つボックスを読み飛ばせる
+    large_free = (1).to_bytes(4, "big") + b"free" + (24).to_bytes(8, "big") + b"\0" * 8
+    assert is_streamable_mp4(io.BytesIO(large_free + box(b"moov")))
+
+
+@pytest.mark.asyncio
+async def test_convert_mp4_to_mp3_streams_through_pipes(
+    in_memory_converter: Tuple[InMemoryStorageClient, mock.MagicMock],
+) -> None:
+    """一時ファイルを使わず、ダウンロードをffmpegの標準入力に、標準出力をアップロードにつなぐことをテスト"""
+    client, mock_ffmpeg = in_memory_converter
+    blob = client.bucket("test-bucket").blob("test_user/lecture.mp4")
+    blob.upload_from_string(FASTSTART_MP4)
+
+    with mock.patch.object(convert_module, "CONVERSION_CHUNK_SIZE", 64):
+        assert await convert_mp4_to_mp3("test-bucket", "test_user/lecture.mp4")
+
+    mock_ffmpeg.input.assert_called_once_with("pipe:")
+    mock_ffmpeg.input.return_value.output.assert_called_once_with(
+        "pipe:", format="mp3", acodec="libmp3lame", threads=media_workers.threads_per_job
+    )
+    # ffmpegは優先度を下げて起動する
+    assert mock_ffmpeg.streams[0].run_async.call_args.kwargs["cmd"] == media_workers.ffmpeg_cmd()
+    mp3_blob = read_blob(client, "mp3/test_user/lecture.mp3")
+    assert mp3_blob.download_as_bytes() == FASTSTART_MP4
+    assert mp3_blob.metadata == {
+        "source_generation": str(blob.generation),
+        "conversion_profile": "standard",
+    }
+
+
+@pytest.mark.asyncio
+async def test_convert_mp4_to_mp3_reads_moov_at_end_by_signed_url(
+    in_memory_converter: Tuple[InMemoryStorageClient, mock.MagicMock],
+) -> None:
+    """シークが必要なMP4は、署名付きURLでffmpegに読み込ませることをテスト"""
+    client, mock_ffmpeg = in_memory_converter
+    blob = client.bucket("test-bucket").blob("test_user/lecture.mp4")
+    blob.upload_from_string(MOOV_AT_END_MP4)
+
+    assert await convert_mp4_to_mp3("test-bucket", "test_user/lecture.mp4")
+
+    signed_url = mock_ffmpeg.input.call_args.args[0]
+    assert signed_url.startswith("https://storage.example.com/test-bucket/test_user/lecture.mp4")
+    assert read_blob(client, "mp3/test_user/lecture.mp3").download_as_bytes() == (
+        signed_url.encode("utf-8")
+    )
+
+
+class UploadingWriter(io.BytesIO):
+    """GCSの書き込みと同じく、破棄できずに close() でアップロードする書き込み先"""
+
+    def __init__(self, blob: InMemoryBlob) -> None:
+        super().__init__()
+        self._blob = blob
+
+    def close(self) -> None:
+        if not self.closed:
+            self._blob.upload_from_string(self.getvalue())
+        super().close()
 
 
 @pytest.mark.asyncio
-async def test_convert_mp4_to_mp3_success(
-    mock_storage_client: mock.MagicMock, mock_ffmpeg: mock.MagicMock, mock_os: mock.MagicMock
+@pytest.mark.parametrize("abortable", [True, False])
+async def test_convert_mp4_to_mp3_failure_is_not_saved(
+    in_memory_converter: Tuple[InMemoryStorageClient, mock.MagicMock], abortable: bool
 ) -> None:
-    bucket_name = "test-bucket"
-    file_name = "test_video.mp4"
-
-    # モックのセットアップ
-    mock_client = mock_storage_client.return_value
-    mock_bucket = mock_client.bucket.return_value
-    # blob は複数回呼ばれるため、それぞれの場合に対応するように side_effect を使用
-    mock_blob = mock_bucket.blob.return_value
-    mock_blob.exists.return_value = True
-
-    # OSのパス関連モック
-    mock_os.path.basename.return_value = "test_video.mp4"
-    mock_os.path.normpath.side_effect = lambda x: x
-    mock_os.path.startswith.return_value = True
-
-    # FFmpegのモック設定
-    mock_input = mock.MagicMock()
-    mock_output = mock.MagicMock()
-    mock_ffmpeg.input.return_value = mock_input
-    mock_input.output.return_value = mock_output
-    mock_output.run.return_value = None
-
-    # テスト対象の関数を呼び出し
-    result = await convert_mp4_to_mp3(bucket_name, file_name)
-
-    # 呼び出しの検証
-    mock_storage_client.assert_called_once()
-    mock_client.bucket.assert_called_once_with(bucket_name)
-    mock_bucket.blob.assert_any_call(file_name)
-    mock_blob.download_to_filename.assert_called_once()
-
-    mock_ffmpeg.input.assert_called_once_with("/tmp/test_video.mp4")
-    mock_input.output.assert_called_once_with(
-        "/tmp/test_video.mp3", format="mp3", acodec="libmp3lame"
+    """ffmpegが失敗した場合は、途中までのMP3や一時ファイルを残さずにエラーを送出することをテスト"""
+    client, mock_ffmpeg = in_memory_converter
+    client.bucket("test-bucket").blob("test_user/lecture.mp4").upload_from_string(FASTSTART_MP4)
+    stream = mock.MagicMock()
+    stream.run_async.side_effect = lambda **kwargs: subprocess.Popen(
+        ["sh", "-c", "cat > /dev/null; printf partial; exit 1"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
     )
-    mock_output.run.assert_called_once()
+    mock_ffmpeg.input.return_value.output.side_effect = None
+    mock_ffmpeg.input.return_value.output.return_value = stream
+    open_blob = InMemoryBlob.open
 
-    mock_bucket.blob.assert_any_call("mp3/test_video.mp3")
-    mock_blob.upload_from_filename.assert_called_once()
+    def open_without_abort(blob: InMemoryBlob, mode: str = "rb", **kwargs: Any) -> Any:
+        return UploadingWriter(blob) if mode == "wb" else open_blob(blob, mode, **kwargs)
 
-    mock_os.remove.assert_any_call("/tmp/test_video.mp4")
-    mock_os.remove.assert_any_call("/tmp/test_video.mp3")
+    with mock.patch.object(InMemoryBlob, "open", open_blob if abortable else open_without_abort):
+        with pytest.raises(ffmpeg.Error):
+            await convert_mp4_to_mp3("test-bucket", "test_user/lecture.mp4")
 
-    assert result is True
+    blob_names = [blob.name for blob in client.bucket("test-bucket").list_blobs()]
+    assert blob_names == ["test_user/lecture.mp4"]
+    assert convert_module.mp3_converter.stats()["failed"] == 1
 
 
 @pytest.mark.asyncio
-async def test_convert_mp4_to_mp3_upload_failure(
-    mock_storage_client: mock.MagicMock, mock_ffmpeg: mock.MagicMock, mock_os: mock.MagicMock
+async def test_convert_mp4_to_mp3_with_temporary_files(
+    in_memory_converter: Tuple[InMemoryStorageClient, mock.MagicMock],
 ) -> None:
-    bucket_name = "test-bucket"
-    file_name = "test_video.mp4"
-
-    # モックのセットアップ
-    mock_client = mock_storage_client.return_value
-    mock_bucket = mock_client.bucket.return_value
-    # blob は複数回呼ばれるため、それぞれの場合に対応するように side_effect を使用
-    mock_blob = mock_bucket.blob.return_value
-    mock_blob.exists.return_value = False
-
-    # OSのパス関連モック
-    mock_os.path.basename.return_value = "test_video.mp4"
-    mock_os.path.normpath.side_effect = lambda x: x
-    mock_os.path.startswith.return_value = True
-
-    # FFmpegのモック設定
-    mock_input = mock.MagicMock()
-    mock_output = mock.MagicMock()
-    mock_ffmpeg.input.return_value = mock_input
-    mock_input.output.return_value = mock_output
-    mock_output.run.return_value = None
-
-    result = await convert_mp4_to_mp3(bucket_name, file_name)
-
-    assert result is False
+    """一時ファイルを使う場合は、変換ごとの一時ディレクトリを使って後で削除することをテスト"""
+    client, mock_ffmpeg = in_memory_converter
+    client.bucket("test-bucket").blob("test_user/lecture.mp4").upload_from_string(FASTSTART_MP4)
+    temp_root = Path(tempfile.gettempdir())
+    before = set(temp_root.glob("convert-*"))
+
+    with mock.patch.object(convert_module, "CONVERSION_STREAMING", False):
+        assert await convert_mp4_to_mp3("test-bucket", "test_user/lecture.mp4")
+
+    mp4_path = mock_ffmpeg.input.call_args.args[0]
+    assert Path(mp4_path).parent.name.startswith("convert-")
+    assert set(temp_root.glob("convert-*")) == before
+    mp3_blob = read_blob(client, "mp3/test_user/lecture.mp3")
+    assert mp3_blob.download_as_bytes() == b"mp3 content"
+
+
+@pytest.mark.asyncio
+async def test_convert_mp4_to_mp3_reuses_current_mp3(
+    in_memory_converter: Tuple[InMemoryStorageClient, mock.MagicMock],
+) -> None:
+    """変換元の世代番号が同じ場合は変換せず、更新された場合は変換し直すことをテスト"""
+    client, mock_ffmpeg = in_memory_converter
+    blob = client.bucket("test-bucket").blob("test_user/lecture_reuse.mp4")
+    blob.upload_from_string(FASTSTART_MP4)
+
+    assert await convert_mp4_to_mp3("test-bucket", "test_user/lecture_reuse.mp4")
+    assert await convert_mp4_to_mp3("test-bucket", "test_user/lecture_reuse.mp4", blob.generation)
+    assert mock_ffmpeg.input.call_count == 1
+
+    blob.upload_from_string(FASTSTART_MP4 + box(b"free"))
+    assert await convert_mp4_to_mp3("test-bucket", "test_user/lecture_reuse.mp4")
+    assert mock_ffmpeg.input.call_count == 2
+    mp3_blob = read_blob(client, "mp3/test_user/lecture_reuse.mp3")
+    assert mp3_blob.metadata == {
+        "source_generation": str(blob.generation),
+        "conversion_profile": "standard",
+    }
+
+
+@pytest.mark.asyncio
+async def test_convert_mp4_to_mp3_coalesces_concurrent_requests(
+    in_memory_converter: Tuple[InMemoryStorageClient, mock.MagicMock],
+) -> None:
+    """同じファイルの変換が同時に要求された場合は、1回だけ変換することをテスト"""
+    client, mock_ffmpeg = in_memory_converter
+    blob = client.bucket("test-bucket").blob("test_user/lecture_coalesce.mp4")
+    blob.upload_from_string(FASTSTART_MP4)
+
+    results = await asyncio.gather(
+        *[
+            convert_mp4_to_mp3("test-bucket", "test_user/lecture_coalesce.mp4", blob.generation)
+            for _ in range(3)
+        ]
+    )
+
+    assert results == [True, True, True]
+    assert mock_ffmpeg.input.call_count == 1
+    stats = convert_module.mp3_converter.stats()
+    assert stats["converted"] == 1
+    assert stats["coalesced"] == 2
+    assert stats["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_convert_mp4_to_audio_remuxes_aac(
+    in_memory_converter: Tuple[InMemoryStorageClient, mock.MagicMock],
+) -> None:
+    """元の音声がAACの場合は、再エンコードせずにADTS形式で取り出すことをテスト"""
+    client, mock_ffmpeg = in_memory_converter
+    blob = client.bucket("test-bucket").blob("test_user/lecture.mp4")
+    blob.upload_from_string(FASTSTART_MP4)
+    mock_ffmpeg.probe.return_value = {"streams": [{"codec_name": "aac"}]}
+
+    artifact = await convert_mp4_to_audio("test-bucket", "test_user/lecture.mp4")
+
+    assert artifact == AudioArtifact("mp3/test_user/lecture.aac", "audio/aac", "remux")
+    mock_ffmpeg.input.return_value.output.assert_called_once_with(
+        "pipe:", format="adts", acodec="copy", threads=media_workers.threads_per_job
+    )
+    aac_blob = read_blob(client, "mp3/test_user/lecture.aac")
+    assert aac_blob.content_type == "audio/aac"
+    assert aac_blob.metadata["conversion_profile"] == "remux"
+    assert not client.bucket("test-bucket").blob("mp3/test_user/lecture.mp3").exists()
+
+    # 取り出したAACを再利用する
+    assert await convert_mp4_to_audio("test-bucket", "test_user/lecture.mp4") == artifact
+    stats = convert_module.mp3_converter.stats()
+    assert stats["remuxed"] == 1
+    assert stats["reused"] == 1
+
+
+@pytest.mark.asyncio
+async def test_convert_mp4_to_audio_speech_profile(
+    in_memory_converter: Tuple[InMemoryStorageClient, mock.MagicMock],
+) -> None:
+    """speech プロファイルではモノラル・低ビットレートのMP3に変換し、プロファイルを変えると変換し直すことをテスト"""
+    client, mock_ffmpeg = in_memory_converter
+    client.bucket("test-bucket").blob("test_user/lecture.mp4").upload_from_string(FASTSTART_MP4)
+
+    assert await convert_mp4_to_mp3("test-bucket", "test_user/lecture.mp4")
+    with (
+        mock.patch.object(convert_module, "CONVERSION_PROFILE", "speech"),
+        mock.patch.object(convert_module, "CONVERSION_REMUX_AAC", False),
+    ):
+        artifact = await convert_mp4_to_audio("test-bucket", "test_user/lecture.mp4")
+
+    assert artifact == AudioArtifact("mp3/test_user/lecture.mp3", "audio/mp3", "speech")
+    assert mock_ffmpeg.input.call_count == 2
+    assert mock_ffmpeg.input.return_value.output.call_args.kwargs == {
+        "format": "mp3",
+        "acodec": "libmp3lame",
+        "ac": 1,
+        "ar": 22050,
+        "audio_bitrate": "48k",
+        "threads": media_workers.threads_per_job,
+    }
+    mock_ffmpeg.probe.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_convert_mp4_to_audio_trims_silence(
+    in_memory_converter: Tuple[InMemoryStorageClient, mock.MagicMock],
+) -> None:
+    """無音を取り除く場合は再エンコードし、取り除いた長さを記録することをテスト"""
+    client, mock_ffmpeg = in_memory_converter
+    client.bucket("test-bucket").blob("test_user/lecture.mp4").upload_from_string(FASTSTART_MP4)
+
+    def probe(input_url: str, **kwargs: str) -> dict:
+        if kwargs:
+            return {"streams": [{"codec_name": "aac"}]}
+        duration = "5400.0" if "lecture.mp4" in input_url else "4800.0"
+        return {"format": {"duration": duration}}
+
+    mock_ffmpeg.probe.side_effect = probe
+    stats = SilenceTrimStats()
+    with (
+        mock.patch.object(convert_module, "SILENCE_TRIM", True),
+        mock.patch.object(convert_module, "silence_trim_stats", stats),
+    ):
+        artifact = await convert_mp4_to_audio("test-bucket", "test_user/lecture.mp4")
+        # 設定が同じ場合は再利用する
+        assert await convert_mp4_to_audio("test-bucket", "test_user/lecture.mp4") == artifact
+
+    # AACでも取り出さずに、無音を取り除くフィルタを付けて変換する
+    assert artifact is not None
+    assert artifact.blob_name == "mp3/test_user/lecture.mp3"
+    assert mock_ffmpeg.input.call_count == 1
+    output_kwargs = mock_ffmpeg.input.return_value.output.call_args.kwargs
+    assert output_kwargs["acodec"] == "libmp3lame"
+    assert output_kwargs["af"].startswith("silenceremove=")
+    metadata = read_blob(client, "mp3/test_user/lecture.mp3").metadata
+    assert metadata["conversion_profile"].startswith("standard+trim")
+    assert metadata["source_duration"] == "5400.0"
+    assert metadata["duration"] == "4800.0"
+    assert stats.stats()["trimmed_seconds"] == 600
+    assert stats.stats()["saved_tokens"] == 600 * 32
+
+    # 無音を取り除かない設定に戻すと変換し直す
+    assert await convert_mp4_to_audio("test-bucket", "test_user/lecture.mp4") != artifact
@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta, timezone
+from typing import AsyncGenerator
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import app.cruds.file_extracts as file_extracts_cruds
+import app.cruds.files as files_cruds
+import app.schemas.files as files_schemas
+
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+
+# sessionフィクスチャを提供するフィクスチャを定義
+@pytest.fixture
+async def session(
+    setup_and_teardown_database: AsyncGenerator[AsyncSession, None],
+) -> AsyncGenerator[AsyncSession, None]:
+    """
+    データベースのセットアップとテアダウンを行う非同期セッションフィクスチャ。
+
+    :param setup_and_teardown_database: データベースのセットアップとテアダウンを行う非同期ジェネレータ
+    :type setup_and_teardown_database: AsyncGenerator[AsyncSession, None]
+    :yield: 非同期セッション
+    :rtype: AsyncGenerator[AsyncSession, None]
+    """
+    async with setup_and_teardown_database as session:  # type: ignore
+        yield session
+
+
+async def create_test_file(session: AsyncSession, uid: str) -> int:
+    """
+    テスト用のファイルを作成し、そのIDを返す。
+
+    :param session: 非同期セッション
+    :type session: AsyncSession
+    :param uid: ユーザーID
+    :type uid: str
+    :return: ファイルID
+    :rtype: int
+    """
+    file_create = files_schemas.FileCreate(
+        file_name="test_file.pdf",
+        file_size=12345,
+        user_id=uid,
+        created_at=datetime.now(JST),
+        updated_at=datetime.now(JST),
+    )
+    file = await files_cruds.create_file(session, file_create, uid)
+    return int(file.id)
+
+
+# 抽出結果の保存と取得のテスト
+@pytest.mark.asyncio
+async def test_save_and_get_file_extract(session: AsyncSession, test_user_id: str) -> None:
+    """
+    抽出結果を保存し、ファイルIDと世代番号で取得できることのテスト。
+
+    :param session: 非同期セッション
+    :type session: AsyncSession
+    :param test_user_id: テストユーザーのID
+    :type test_user_id: str
+    :return: None
+    """
+    file_id = await create_test_file(session, test_user_id)
+
+    saved = await file_extracts_cruds.save_file_extract(
+        session, file_id, 1, ["1ページ目", "2ページ目"]
+    )
+    assert saved is not None
+    assert saved.page_count == 2
+
+    file_extract = await file_extracts_cruds.get_file_extract(session, file_id, 1)
+    assert file_extract is not None
+    assert file_extract.pages == ["1ページ目", "2ページ目"]
+    assert await file_extracts_cruds.get_file_extract(session, file_id, 2) is None
+
+
+# 新しい世代の保存で古い世代が削除されることのテスト
+@pytest.mark.asyncio
+async def test_save_file_extract_replaces_old_generation(
+    session: AsyncSession, test_user_id: str
+) -> None:
+    """
+    新しい世代の抽出結果を保存すると、古い世代の抽出結果が削除されることのテスト。
+
+    :param session: 非同期セッション
+    :type session: AsyncSession
+    :param test_user_id: テストユーザーのID
+    :type test_user_id: str
+    :return: None
+    """
+    file_id = await create_test_file(session, test_user_id)
+
+    await file_extracts_cruds.save_file_extract(session, file_id, 1, ["古い内容"])
+    await file_extracts_cruds.save_file_extract(session, file_id, 2, ["新しい内容"])
+    # 同じ世代を保存し直しても既存の行が返される
+    duplicate = await file_extracts_cruds.save_file_extract(session, file_id, 2, ["新しい内容"])
+
+    assert duplicate is not None
+    assert duplicate.pages == ["新しい内容"]
+    assert await file_extracts_cruds.get_file_extract(session, file_id, 1) is None
+
+
+# 同じ世代でも抽出方法ごとに保存されることのテスト
+@pytest.mark.asyncio
+async def test_save_file_extract_variants(session: AsyncSession, test_user_id: str) -> None:
+    """
+    同じ世代の抽出結果を抽出方法ごとに保存し、取得できることのテスト。
+
+    :param session: 非同期セッション
+    :type session: AsyncSession
+    :param test_user_id: テストユーザーのID
+    :type test_user_id: str
+    :return: None
+    """
+    file_id = await create_test_file(session, test_user_id)
+    variant = "transcript:gemini-1.5-flash:0123456789ab"
+
+    await file_extracts_cruds.save_file_extract(session, file_id, 1, ["PDFのテキスト"])
+    await file_extracts_cruds.save_file_extract(session, file_id, 1, ["文字起こし"], variant)
+
+    pdf_extract = await file_extracts_cruds.get_file_extract(session, file_id, 1)
+    transcript = await file_extracts_cruds.get_file_extract(session, file_id, 1, variant)
+    assert pdf_extract is not None
+    assert pdf_extract.pages == ["PDFのテキスト"]
+    assert transcript is not None
+    assert transcript.pages == ["文字起こし"]
+    assert await file_extracts_cruds.get_file_extract(session, file_id, 1, "other") is None
@@ -155,6 +155,67 @@ async def test_delete_file_by_name(session: AsyncSession, test_user_id: str) ->
     assert retrieved_file is None
 
 
+# 複数ファイルの一括削除のテスト
+@pytest.mark.asyncio
+async def test_delete_files_by_names(session: AsyncSession, test_user_id: str) -> None:
+    """
+    複数ファイルの一括削除のテスト。
+
+    :param session: 非同期セッション
+    :type session: AsyncSession
+    :param test_user_id: テストユーザーのID
+    :type test_user_id: str
+    :return: None
+    """
+    file_ids = []
+    for file_name in ["test_file1.pdf", "test_file2.pdf", "test_file3.pdf"]:
+        file_create = files_schemas.FileCreate(
+            file_name=file_name,
+            file_size=12345,
+            user_id=test_user_id,
+            created_at=datetime.now(JST),
+            updated_at=datetime.now(JST),
+        )
+        file = await files_cruds.create_file(session, file_create, test_user_id)
+        file_ids.append(int(file.id))
+
+    await files_cruds.delete_files_by_names_and_userid(
+        session, ["test_file1.pdf", "test_file2.pdf"], test_user_id
+    )
+
+    assert await files_cruds.get_file_by_id_and_user_id(session, file_ids[0], test_user_id) is None
+    assert await files_cruds.get_file_by_id_and_user_id(session, file_ids[1], test_user_id) is None
+    assert await files_cruds.get_file_by_id_and_user_id(session, file_ids[2], test_user_id)
+
+
+# get_file_by_name_and_userid関数のテスト
+@pytest.mark.asyncio
+async def test_get_file_by_name_and_userid(session: AsyncSession, test_user_id: str) -> None:
+    """
+    ファイル名による取得で、内容のハッシュが保存されていることのテスト。
+
+    :param session: 非同期セッション
+    :type session: AsyncSession
+    :param test_user_id: テストユーザーのID
+    :type test_user_id: str
+    :return: None
+    """
+    file_create = files_schemas.FileCreate(
+        file_name="test_file.pdf",
+        file_size=12345,
+        content_hash="1B2M2Y8AsgTpgAmY7PhCfg==",
+        user_id=test_user_id,
+        created_at=datetime.now(JST),
+        updated_at=datetime.now(JST),
+    )
+    await files_cruds.create_file(session, file_create, test_user_id)
+
+    file = await files_cruds.get_file_by_name_and_userid(session, "test_file.pdf", test_user_id)
+    assert file is not None
+    assert file.content_hash == "1B2M2Y8AsgTpgAmY7PhCfg=="
+    assert await files_cruds.get_file_by_name_and_userid(session, "none.pdf", test_user_id) is None
+
+
 # update_file関数のテスト
 @pytest.mark.asyncio
 async def test_update_file(session: AsyncSession, test_user_id: str) -> None:
@@ -4,10 +4,10 @@ from unittest.mock import AsyncMock, MagicMock, patch
 from google.api_core.exceptions import GoogleAPIError, InternalServerError
 import base64
 
+from app.utils.blob_metadata import BlobInfo
+from app.utils.pdf_extraction import extract_text_from_pdf
 from app.utils.essay_question import (
-    check_file_exists,
     read_file,
-    extract_text_from_pdf,
     generate_essay_json,
 )
 
@@ -64,7 +64,10 @@ def mock_env_vars() -> Generator[None, None, None]:
 @pytest.fixture
 def mock_storage_client() -> Generator[Tuple[MagicMock, MagicMock], None, None]:
     """Mock Google Cloud Storage client"""
-    with patch("app.utils.essay_question.storage.Client") as mock_client:
+    with (
+        patch("app.utils.essay_question.get_storage_client") as mock_client,
+        patch("app.utils.pdf_extraction.get_storage_client", new=mock_client),
+    ):
         mock_blob = MagicMock()
         mock_bucket = MagicMock()
         mock_bucket.blob.return_value = mock_blob
@@ -72,6 +75,19 @@ def mock_storage_client() -> Generator[Tuple[MagicMock, MagicMock], None, None]:
         yield mock_client, mock_blob
 
 
+@pytest.fixture
+def mock_lookup_blobs() -> Generator[AsyncMock, None, None]:
+    """Mock bulk blob lookup"""
+    with patch("app.utils.essay_question.lookup_blobs", new_callable=AsyncMock) as mock_lookup:
+        yield mock_lookup
+
+
+def make_blob_infos(files: list[str], exists: bool) -> dict[str, BlobInfo]:
+    """Build lookup_blobs result for the given files"""
+    names = [f"{MOCK_UID}/{file_name}" for file_name in files]
+    return {name: BlobInfo(name=name, exists=exists) for name in names}
+
+
 @pytest.fixture
 def mock_anthropic_client() -> Generator[MagicMock, None, None]:
     """Mock Anthropic client"""
@@ -86,11 +102,18 @@ def mock_anthropic_client() -> Generator[MagicMock, None, None]:
 @pytest.fixture(autouse=True)
 def mock_fitz() -> Generator[MagicMock, None, None]:
     """Mock PyMuPDF (fitz) for PDF processing - automatically used in all tests"""
-    with patch("app.utils.essay_question.fitz.open") as mock_fitz:
+    # モックを使えるように、プロセスプールではなくスレッドで抽出する
+    with (
+        patch("app.utils.pdf_pages.fitz.open") as mock_fitz,
+        patch("app.utils.pdf_extraction.get_extraction_executor", return_value=None),
+    ):
         mock_doc = MagicMock()
         mock_page = MagicMock()
-        mock_page.get_text.return_value = "Test PDF content"
-        mock_doc.__iter__.return_value = [mock_page]
+        # テキストブロック (x0, y0, x1, y1, テキスト, ブロック番号, ブロックの種類) を返す
+        mock_page.get_text.return_value = [(0, 40, 100, 60, "Test PDF content", 0, 0)]
+        mock_page.rect.height = 100
+        mock_doc.page_count = 1
+        mock_doc.load_page.return_value = mock_page
         mock_fitz.return_value = mock_doc
         yield mock_fitz
 
@@ -98,10 +121,11 @@ def mock_fitz() -> Generator[MagicMock, None, None]:
 @pytest.mark.asyncio
 async def test_generate_essay_json_internal_server_error(
     mock_storage_client: Tuple[MagicMock, MagicMock],
+    mock_lookup_blobs: AsyncMock,
 ) -> None:
     """Test generate_essay_json when internal server error occurs"""
     mock_client, mock_blob = mock_storage_client
-    mock_blob.exists.return_value = True
+    mock_lookup_blobs.return_value = make_blob_infos(["test.pdf"], exists=True)
     mock_blob.download_as_bytes.return_value = b"test content"
 
     with patch("app.utils.essay_question.AnthropicVertex") as mock_anthropic:
@@ -119,34 +143,6 @@ async def test_generate_essay_json_internal_server_error(
             )
 
 
-@pytest.mark.asyncio
-async def test_check_file_exists_true(
-    mock_storage_client: Tuple[MagicMock, MagicMock],
-) -> None:
-    """Test check_file_exists when file exists"""
-    mock_client, mock_blob = mock_storage_client
-    mock_blob.exists.return_value = True
-
-    result = await check_file_exists(MOCK_BUCKET_NAME, "test.pdf")
-
-    assert result is True
-    mock_client.return_value.bucket.assert_called_once_with(MOCK_BUCKET_NAME)
-    mock_blob.exists.assert_called_once()
-
-
-@pytest.mark.asyncio
-async def test_check_file_exists_false(
-    mock_storage_client: Tuple[MagicMock, MagicMock],
-) -> None:
-    """Test check_file_exists when file does not exist"""
-    mock_client, mock_blob = mock_storage_client
-    mock_blob.exists.return_value = False
-
-    result = await check_file_exists(MOCK_BUCKET_NAME, "nonexistent.pdf")
-
-    assert result is False
-
-
 @pytest.mark.asyncio
 async def test_read_file(
     mock_storage_client: Tuple[MagicMock, MagicMock],
@@ -170,22 +166,25 @@ async def test_extract_text_from_pdf(
 ) -> None:
     """Test extract_text_from_pdf function"""
     mock_client, mock_blob = mock_storage_client
-    mock_blob.download_as_bytes.return_value = b"mock pdf content"
+    # PDFは一時ファイルにストリーミングでダウンロードされる
+    mock_blob.download_to_file.side_effect = lambda f, **kwargs: f.write(b"mock pdf content")
 
     result = await extract_text_from_pdf(MOCK_BUCKET_NAME, "test.pdf")
 
     assert "Test PDF content" in result
-    mock_blob.download_as_bytes.assert_called_once()
+    mock_blob.download_to_file.assert_called_once()
 
 
 @pytest.mark.asyncio
 async def test_generate_essay_json_pdf(
     mock_storage_client: Tuple[MagicMock, MagicMock],
+    mock_lookup_blobs: AsyncMock,
 ) -> None:
     """Test generate_essay_json with PDF file"""
     mock_client, mock_blob = mock_storage_client
-    mock_blob.exists.return_value = True
-    mock_blob.download_as_bytes.return_value = b"mock pdf content"
+    mock_lookup_blobs.return_value = make_blob_infos(["test.pdf"], exists=True)
+    # PDFは一時ファイルにストリーミングでダウンロードされる
+    mock_blob.download_to_file.side_effect = lambda f, **kwargs: f.write(b"mock pdf content")
 
     with patch("app.utils.essay_question.AnthropicVertex") as mock_anthropic:
         mock_instance = mock_anthropic.return_value
@@ -203,18 +202,19 @@ async def test_generate_essay_json_pdf(
         )
 
         assert result == MOCK_ANTHROPIC_RESPONSE
-        mock_blob.exists.assert_called_once()
-        mock_blob.download_as_bytes.assert_called_once()
+        mock_lookup_blobs.assert_awaited_once()
+        mock_blob.download_to_file.assert_called_once()
         mock_instance.messages.create.assert_called_once()
 
 
 @pytest.mark.asyncio
 async def test_generate_essay_json_image(
     mock_storage_client: Tuple[MagicMock, MagicMock],
+    mock_lookup_blobs: AsyncMock,
 ) -> None:
     """Test generate_essay_json with image file"""
     mock_client, mock_blob = mock_storage_client
-    mock_blob.exists.return_value = True
+    mock_lookup_blobs.return_value = make_blob_infos(["test.png"], exists=True)
     test_content = b"test image content"
     mock_blob.download_as_bytes.return_value = test_content
 
@@ -234,17 +234,18 @@ async def test_generate_essay_json_image(
         )
 
         assert result == MOCK_ANTHROPIC_RESPONSE
-        mock_blob.exists.assert_called_once()
+        mock_lookup_blobs.assert_awaited_once()
         mock_instance.messages.create.assert_called_once()
 
 
 @pytest.mark.asyncio
 async def test_generate_essay_json_file_not_found(
     mock_storage_client: Tuple[MagicMock, MagicMock],
+    mock_lookup_blobs: AsyncMock,
 ) -> None:
     """Test generate_essay_json when file does not exist"""
     mock_client, mock_blob = mock_storage_client
-    mock_blob.exists.return_value = False
+    mock_lookup_blobs.return_value = make_blob_infos(["nonexistent.pdf"], exists=False)
 
     with pytest.raises(Exception):
         await generate_essay_json(
@@ -260,10 +261,11 @@ async def test_generate_essay_json_file_not_found(
 @pytest.mark.asyncio
 async def test_generate_essay_json_google_api_error(
     mock_storage_client: Tuple[MagicMock, MagicMock],
+    mock_lookup_blobs: AsyncMock,
 ) -> None:
     """Test generate_essay_json when Google API error occurs"""
     mock_client, mock_blob = mock_storage_client
-    mock_blob.exists.side_effect = GoogleAPIError("API Error")
+    mock_lookup_blobs.side_effect = GoogleAPIError("API Error")
 
     with pytest.raises(GoogleAPIError):
         await generate_essay_json(
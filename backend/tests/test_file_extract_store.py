@@ -0,0 +1,101 @@
+from typing import Generator
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.utils import pdf_extraction
+from app.utils.file_extract_store import FileExtractStore, sidecar_blob_name
+from app.utils.in_memory_storage import InMemoryStorageClient
+from app.utils.storage_client import set_storage_client
+
+MOCK_BUCKET_NAME = "test-bucket"
+
+
+# インメモリのストレージを使い、データベースには接続できない状態にするフィクスチャ
+@pytest.fixture
+def in_memory_client() -> Generator[InMemoryStorageClient, None, None]:
+    client = InMemoryStorageClient()
+    set_storage_client(client)
+    with patch(
+        "app.utils.file_extract_store.async_session",
+        side_effect=ConnectionError("DBに接続できません"),
+    ):
+        yield client
+    set_storage_client(None)
+
+
+@pytest.mark.asyncio
+async def test_extract_text_from_pdf_reads_store_first() -> None:
+    """保存済みの抽出結果がある場合はPDFを抽出しないことをテスト"""
+    with (
+        patch.object(pdf_extraction.file_extract_store, "load", new_callable=AsyncMock) as load,
+        patch.object(pdf_extraction.file_extract_store, "save", new_callable=AsyncMock) as save,
+        patch.object(pdf_extraction, "extract_pages_from_pdf", new_callable=AsyncMock) as extract,
+    ):
+        load.return_value = ["保存済み"]
+        text = await pdf_extraction.extract_text_from_pdf(MOCK_BUCKET_NAME, "u/a.pdf", 5, 1)
+        assert text == "\n# 1ページ\n保存済み"
+        extract.assert_not_awaited()
+
+        # 保存されていない場合は抽出して保存する
+        load.return_value = None
+        extract.return_value = ["抽出"]
+        text = await pdf_extraction.extract_text_from_pdf(MOCK_BUCKET_NAME, "u/a.pdf", 5, 1)
+        assert text == "\n# 1ページ\n抽出"
+        variant = pdf_extraction.pdf_variant()
+        save.assert_awaited_once_with(MOCK_BUCKET_NAME, 1, 5, ["抽出"], variant)
+
+        # ヘッダー・フッターを取り除くかどうかを変えると、別の抽出方法として抽出し直す
+        with patch.object(pdf_extraction, "PDF_STRIP_BOILERPLATE", not extract.await_args.args[3]):
+            await pdf_extraction.extract_text_from_pdf(MOCK_BUCKET_NAME, "u/a.pdf", 5, 1)
+        assert load.await_args.args[3] not in ("", variant)
+        assert extract.await_args.args[3] != pdf_extraction.PDF_STRIP_BOILERPLATE
+        assert {pdf_extraction.pdf_variant(True), pdf_extraction.pdf_variant(False)} == {
+            variant,
+            load.await_args.args[3],
+        }
+
+        # ファイルIDが不明な場合はストアを使わない
+        load.reset_mock()
+        await pdf_extraction.extract_text_from_pdf(MOCK_BUCKET_NAME, "u/a.pdf", 5)
+        load.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_file_extract_store_sidecar(in_memory_client: InMemoryStorageClient) -> None:
+    """データベースが使えない場合でも、Cloud Storageのファイルから抽出結果を読み込めることをテスト"""
+    store = FileExtractStore(sidecar=True)
+    bucket = in_memory_client.bucket(MOCK_BUCKET_NAME)
+
+    assert await store.load(MOCK_BUCKET_NAME, 1, 10) is None
+    await store.save(MOCK_BUCKET_NAME, 1, 10, ["1ページ目", "2ページ目"])
+    assert await store.load(MOCK_BUCKET_NAME, 1, 10) == ["1ページ目", "2ページ目"]
+
+    # 新しい世代を保存すると、古い世代のファイルは削除される
+    await store.save(MOCK_BUCKET_NAME, 1, 11, ["新しい内容"])
+    assert not bucket.blob(sidecar_blob_name(1, 10)).exists()
+    assert bucket.blob(sidecar_blob_name(1, 11)).exists()
+
+    await store.delete_sidecars(MOCK_BUCKET_NAME, [1])
+    assert not bucket.blob(sidecar_blob_name(1, 11)).exists()
+    assert store.stats() == {"hits": 0, "sidecar_hits": 1, "misses": 1, "hit_ratio": 0.5}
+
+
+@pytest.mark.asyncio
+async def test_file_extract_store_variants(in_memory_client: InMemoryStorageClient) -> None:
+    """同じ世代でも抽出方法ごとに保存され、古い世代は抽出方法によらず削除されることをテスト"""
+    store = FileExtractStore(sidecar=True)
+    bucket = in_memory_client.bucket(MOCK_BUCKET_NAME)
+    variant = "transcript:gemini-1.5-flash:abc/123"
+
+    await store.save(MOCK_BUCKET_NAME, 1, 10, ["PDFのテキスト"])
+    await store.save(MOCK_BUCKET_NAME, 1, 10, ["文字起こし"], variant)
+    assert await store.load(MOCK_BUCKET_NAME, 1, 10) == ["PDFのテキスト"]
+    assert await store.load(MOCK_BUCKET_NAME, 1, 10, variant) == ["文字起こし"]
+    assert await store.load(MOCK_BUCKET_NAME, 1, 10, "transcript:other") is None
+    assert sidecar_blob_name(1, 10, variant).count("/") == sidecar_blob_name(1, 10).count("/")
+
+    await store.save(MOCK_BUCKET_NAME, 1, 11, ["新しい文字起こし"], variant)
+    assert not bucket.blob(sidecar_blob_name(1, 10)).exists()
+    assert not bucket.blob(sidecar_blob_name(1, 10, variant)).exists()
+    assert bucket.blob(sidecar_blob_name(1, 11, variant)).exists()
@@ -1,7 +1,13 @@
+import re
+import time
+
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import AsyncMock, patch, MagicMock
 from google.api_core.exceptions import InternalServerError
 
+from app.utils.convert_mp4_to_mp3 import AudioArtifact
+from app.utils.in_memory_storage import InMemoryStorageClient
+
 # モジュールの再読み込みのためにimportlibをインポート
 import importlib
 
@@ -11,7 +17,7 @@ with patch("app.utils.gemini_extract_text_from_audio.vertexai.init") as mock_ver
     import app.utils.gemini_extract_text_from_audio
 
     importlib.reload(app.utils.gemini_extract_text_from_audio)
-    from app.utils.gemini_extract_text_from_audio import extract_text_from_audio
+    from app.utils.gemini_extract_text_from_audio import extract_text_from_audio, transcribe_media
 
     @pytest.mark.asyncio
     @patch("app.utils.gemini_extract_text_from_audio.GenerativeModel")
@@ -45,3 +51,84 @@ with patch("app.utils.gemini_extract_text_from_audio.vertexai.init") as mock_ver
 
         with pytest.raises(InternalServerError, match="音声の文字起こしエラー: Test error"):
             await extract_text_from_audio("test_bucket", "test_audio.mp3")
+
+    @pytest.mark.asyncio
+    async def test_transcribe_media_reuses_saved_transcript() -> None:
+        """保存済みの文字起こし結果があれば変換と文字起こしを行わないことをテスト"""
+        module = app.utils.gemini_extract_text_from_audio
+        with (
+            patch.object(module.file_extract_store, "load", new_callable=AsyncMock) as load,
+            patch.object(module.file_extract_store, "save", new_callable=AsyncMock) as save,
+            patch.object(module, "convert_mp4_to_audio", new_callable=AsyncMock) as convert,
+            patch.object(module, "extract_text_from_audio", new_callable=AsyncMock) as extract,
+            patch.object(module, "TRANSCRIPTION_SEGMENTED", False),
+        ):
+            load.return_value = ["保存済み"]
+            assert await transcribe_media("test_bucket", "u/a.mp4", 3, 1) == "保存済み"
+            convert.assert_not_awaited()
+
+            # 保存されていない場合は変換して文字起こしし、結果を保存する
+            load.return_value = None
+            convert.return_value = AudioArtifact("mp3/u/a.aac", "audio/aac", "remux")
+            extract.return_value = "文字起こし"
+            assert await transcribe_media("test_bucket", "u/a.mp4", 3, 1) == "文字起こし"
+            # 変換した音声ファイルを文字起こしする
+            assert extract.await_args.args[1] == "mp3/u/a.aac"
+            variant = module.transcript_variant()
+            load.assert_awaited_with("test_bucket", 1, 3, variant)
+            save.assert_awaited_once_with("test_bucket", 1, 3, ["文字起こし"], variant)
+
+            # 変換に失敗した場合はエラーを送出する
+            convert.return_value = None
+            with pytest.raises(InternalServerError, match="Failed to convert"):
+                await transcribe_media("test_bucket", "u/a.mp4", 3, 1)
+
+    @pytest.mark.asyncio
+    @patch("app.utils.gemini_extract_text_from_audio.GenerativeModel")
+    async def test_transcribe_segmented(mock_model_class: MagicMock) -> None:
+        """長い音声を区間に分割して並行して要約し、区間の順につなげることをテスト"""
+        module = app.utils.gemini_extract_text_from_audio
+        client = InMemoryStorageClient()
+
+        def generate_content(contents: list, **kwargs: object) -> MagicMock:
+            # 後の区間ほど早く終わっても、結果は区間の順に並ぶ
+            number = int(re.findall(r"(\d+)番目", contents[1])[0])
+            time.sleep(0.01 * (4 - number))
+            return MagicMock(text=f" 区間{number} ")
+
+        mock_model_class.return_value.generate_content.side_effect = generate_content
+        with (
+            patch.object(module, "get_storage_client", return_value=client),
+            patch.object(module, "probe_duration", new_callable=AsyncMock, return_value=1800),
+            patch.object(module, "cut_segment", new_callable=AsyncMock) as cut,
+        ):
+            cut.side_effect = lambda bucket, source, segment, name: bucket.blob(
+                name
+            ).upload_from_string(b"segment")
+            text = await module.transcribe_segmented("test_bucket", "u/lecture.mp4")
+
+        assert text == "区間1\n\n区間2\n\n区間3"
+        assert cut.await_count == 3
+        # 切り出した音声は変換済みのMP3から作り、要約の後に削除する
+        assert cut.await_args_list[0].args[1].name == "mp3/u/lecture.mp3"
+        prompts = [
+            call.args[0][1]
+            for call in mock_model_class.return_value.generate_content.call_args_list
+        ]
+        assert all("重複" in prompt for prompt in prompts if "1番目" not in prompt)
+        assert cut.await_args_list[2].args[2].overlap > 0
+        # 切り出した音声はライフサイクルルールの対象の接頭辞に保存する
+        assert cut.await_args_list[0].args[3].startswith("tmp/segments/")
+        assert list(client.bucket("test_bucket").list_blobs(prefix="tmp/")) == []
+
+    def test_segment_prompt_omits_lecture_time_for_trimmed_audio() -> None:
+        """無音を取り除いた音声では、区間の位置を講義の時刻として伝えないことをテスト"""
+        module = app.utils.gemini_extract_text_from_audio
+        segment = module.AudioSegment(1, 585.0, 1200.0, 15.0)
+
+        prompt = module.segment_prompt(segment, 3)
+        assert "2番目の区間（講義の9分45秒から20分00秒まで）です。" in prompt
+
+        prompt = module.segment_prompt(segment, 3, trimmed=True)
+        assert "2番目の区間です。" in prompt
+        assert "9分45秒" not in prompt
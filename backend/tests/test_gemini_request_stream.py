@@ -1,13 +1,22 @@
 import pytest
 from unittest.mock import AsyncMock, patch, Mock
 from google.api_core.exceptions import GoogleAPIError, InvalidArgument, NotFound
-from app.utils.gemini_request_stream import generate_content_stream, check_file_exists
+from app.utils.blob_metadata import BlobInfo
+from app.utils.gemini_request_stream import generate_content_stream
 from pytest import MonkeyPatch
 import json
-from typing import Generator
+from typing import Callable, Generator
 from vertexai.generative_models import GenerationConfig
 
 
+# lookup_blobsの代わりに、全ファイルの存在有無を返す関数を作成する
+def mock_lookup(exists: bool) -> Callable:
+    async def _lookup(bucket_name: str, uid: str, files: list[str]) -> dict[str, BlobInfo]:
+        return {f"{uid}/{f}": BlobInfo(name=f"{uid}/{f}", exists=exists) for f in files}
+
+    return _lookup
+
+
 # 環境変数を設定するフィクスチャ
 @pytest.fixture
 def mock_env_vars(monkeypatch: MonkeyPatch) -> None:
@@ -25,16 +34,16 @@ def mock_env_vars(monkeypatch: MonkeyPatch) -> None:
 
 # 正常系のテスト
 @patch("app.utils.gemini_request_stream.GenerativeModel", autospec=True)
-@patch("app.utils.gemini_request_stream.check_file_exists", return_value=True)
+@patch("app.utils.gemini_request_stream.lookup_blobs", side_effect=mock_lookup(True))
 @pytest.mark.asyncio
 async def test_generate_content_stream_success(
-    mock_check_file_exists: Mock, mock_GenerativeModel: Mock, mock_env_vars: None
+    mock_lookup_blobs: Mock, mock_GenerativeModel: Mock, mock_env_vars: None
 ) -> None:
     """
     正常系のテスト
 
-    :param mock_check_file_exists: ファイル存在確認のモック
-    :type mock_check_file_exists: Mock
+    :param mock_lookup_blobs: ファイル存在確認（一括）のモック
+    :type mock_lookup_blobs: Mock
     :param mock_GenerativeModel: GenerativeModelのモック
     :type mock_GenerativeModel: Mock
     :param mock_env_vars: 環境変数のモックフィクスチャ
@@ -89,16 +98,16 @@ async def test_generate_content_stream_success(
 
 # ファイルが見つからない場合のエラーハンドリングのテスト
 @patch("app.utils.gemini_request_stream.GenerativeModel", autospec=True)
-@patch("app.utils.gemini_request_stream.check_file_exists", return_value=False)
+@patch("app.utils.gemini_request_stream.lookup_blobs", side_effect=mock_lookup(False))
 @pytest.mark.asyncio
 async def test_generate_content_stream_not_found(
-    mock_check_file_exists: Mock, mock_GenerativeModel: Mock, mock_env_vars: None
+    mock_lookup_blobs: Mock, mock_GenerativeModel: Mock, mock_env_vars: None
 ) -> None:
     """
     ファイルが見つからない場合のエラーハンドリングのテスト
 
-    :param mock_check_file_exists: ファイル存在確認のモック
-    :type mock_check_file_exists: Mock
+    :param mock_lookup_blobs: ファイル存在確認（一括）のモック
+    :type mock_lookup_blobs: Mock
     :param mock_GenerativeModel: GenerativeModelのモック
     :type mock_GenerativeModel: Mock
     :param mock_env_vars: 環境変数のモックフィクスチャ
@@ -118,16 +127,16 @@ async def test_generate_content_stream_not_found(
 
 # 無効な引数の場合のエラーハンドリングのテスト
 @patch("app.utils.gemini_request_stream.GenerativeModel", autospec=True)
-@patch("app.utils.gemini_request_stream.check_file_exists", return_value=True)
+@patch("app.utils.gemini_request_stream.lookup_blobs", side_effect=mock_lookup(True))
 @pytest.mark.asyncio
 async def test_generate_content_stream_invalid_argument(
-    mock_check_file_exists: Mock, mock_GenerativeModel: Mock, mock_env_vars: None
+    mock_lookup_blobs: Mock, mock_GenerativeModel: Mock, mock_env_vars: None
 ) -> None:
     """
     無効な引数の場合のエラーハンドリングのテスト
 
-    :param mock_check_file_exists: ファイル存在確認のモック
-    :type mock_check_file_exists: Mock
+    :param mock_lookup_blobs: ファイル存在確認（一括）のモック
+    :type mock_lookup_blobs: Mock
     :param mock_GenerativeModel: GenerativeModelのモック
     :type mock_GenerativeModel: Mock
     :param mock_env_vars: 環境変数のモックフィクスチャ
@@ -149,16 +158,16 @@ async def test_generate_content_stream_invalid_argument(
 
 # Google APIエラーの場合のエラーハンドリングのテスト
 @patch("app.utils.gemini_request_stream.GenerativeModel", autospec=True)
-@patch("app.utils.gemini_request_stream.check_file_exists", return_value=True)
+@patch("app.utils.gemini_request_stream.lookup_blobs", side_effect=mock_lookup(True))
 @pytest.mark.asyncio
 async def test_generate_content_stream_google_api_error(
-    mock_check_file_exists: Mock, mock_GenerativeModel: Mock, mock_env_vars: None
+    mock_lookup_blobs: Mock, mock_GenerativeModel: Mock, mock_env_vars: None
 ) -> None:
     """
     Google APIエラーの場合のエラーハンドリングのテスト
 
-    :param mock_check_file_exists: ファイル存在確認のモック
-    :type mock_check_file_exists: Mock
+    :param mock_lookup_blobs: ファイル存在確認（一括）のモック
+    :type mock_lookup_blobs: Mock
     :param mock_GenerativeModel: GenerativeModelのモック
     :type mock_GenerativeModel: Mock
     :param mock_env_vars: 環境変数のモックフィクスチャ
@@ -180,16 +189,16 @@ async def test_generate_content_stream_google_api_error(
 
 # その他の予期しないエラーの場合のエラーハンドリングのテスト
 @patch("app.utils.gemini_request_stream.GenerativeModel", autospec=True)
-@patch("app.utils.gemini_request_stream.check_file_exists", return_value=True)
+@patch("app.utils.gemini_request_stream.lookup_blobs", side_effect=mock_lookup(True))
 @pytest.mark.asyncio
 async def test_generate_content_stream_unexpected_error(
-    mock_check_file_exists: Mock, mock_GenerativeModel: Mock, mock_env_vars: None
+    mock_lookup_blobs: Mock, mock_GenerativeModel: Mock, mock_env_vars: None
 ) -> None:
     """
     その他の予期しないエラーの場合のエラーハンドリングのテスト
 
-    :param mock_check_file_exists: ファイル存在確認のモック
-    :type mock_check_file_exists: Mock
+    :param mock_lookup_blobs: ファイル存在確認（一括）のモック
+    :type mock_lookup_blobs: Mock
     :param mock_GenerativeModel: GenerativeModelのモック
     :type mock_GenerativeModel: Mock
     :param mock_env_vars: 環境変数のモックフィクスチャ
@@ -209,16 +218,16 @@ async def test_generate_content_stream_unexpected_error(
 
 # エラーハンドリングのテスト（モデル属性エラー）
 @patch("app.utils.gemini_request_stream.GenerativeModel", autospec=True)
-@patch("app.utils.gemini_request_stream.check_file_exists", return_value=True)
+@patch("app.utils.gemini_request_stream.lookup_blobs", side_effect=mock_lookup(True))
 @pytest.mark.asyncio
 async def test_generate_content_stream_attribute_error(
-    mock_check_file_exists: Mock, mock_GenerativeModel: Mock, mock_env_vars: None
+    mock_lookup_blobs: Mock, mock_GenerativeModel: Mock, mock_env_vars: None
 ) -> None:
     """
     エラーハンドリングのテスト（モデル属性エラー）
 
-    :param mock_check_file_exists: ファイル存在確認のモック
-    :type mock_check_file_exists: Mock
+    :param mock_lookup_blobs: ファイル存在確認（一括）のモック
+    :type mock_lookup_blobs: Mock
     :param mock_GenerativeModel: GenerativeModelのモック
     :type mock_GenerativeModel: Mock
     :param mock_env_vars: 環境変数のモックフィクスチャ
@@ -240,16 +249,16 @@ async def test_generate_content_stream_attribute_error(
 
 # エラーハンドリングのテスト（タイプエラー）
 @patch("app.utils.gemini_request_stream.GenerativeModel", autospec=True)
-@patch("app.utils.gemini_request_stream.check_file_exists", return_value=True)
+@patch("app.utils.gemini_request_stream.lookup_blobs", side_effect=mock_lookup(True))
 @pytest.mark.asyncio
 async def test_generate_content_stream_type_error(
-    mock_check_file_exists: Mock, mock_GenerativeModel: Mock, mock_env_vars: None
+    mock_lookup_blobs: Mock, mock_GenerativeModel: Mock, mock_env_vars: None
 ) -> None:
     """
     エラーハンドリングのテスト（タイプエラー）
 
-    :param mock_check_file_exists: ファイル存在確認のモック
-    :type mock_check_file_exists: Mock
+    :param mock_lookup_blobs: ファイル存在確認（一括）のモック
+    :type mock_lookup_blobs: Mock
     :param mock_GenerativeModel: GenerativeModelのモック
     :type mock_GenerativeModel: Mock
     :param mock_env_vars: 環境変数のモックフィクスチャ
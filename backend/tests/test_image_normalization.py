@@ -0,0 +1,101 @@
+import base64
+import random
+import subprocess
+import sys
+from pathlib import Path
+from typing import Generator
+from unittest.mock import patch
+
+import fitz
+import pytest
+
+from app.utils import blob_cache as blob_cache_module
+from app.utils import image_normalization
+from app.utils.blob_cache import BlobDiskCache
+from app.utils.image_normalization import NormalizedImageCache, read_image_base64
+from app.utils.image_resize import detect_image_format, normalize_image
+from app.utils.in_memory_storage import InMemoryStorageClient
+
+MOCK_BUCKET_NAME = "test-bucket"
+
+
+def make_photo(scale: float, image_format: str, alpha: bool = False) -> bytes:
+    """色の付いた図形と文字を描いたスライドの写真のような画像を作成する"""
+    doc = fitz.open()
+    page = doc.new_page(width=640, height=480)
+    rng = random.Random(0)
+    for _ in range(200):
+        center = (rng.uniform(0, 640), rng.uniform(0, 480))
+        fill = (rng.random(), rng.random(), rng.random())
+        page.draw_circle(center, rng.uniform(5, 60), color=None, fill=fill)
+    page.insert_text((50, 240), "Lecture slide", fontsize=40)
+    pixmap = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=alpha)
+    if image_format == "jpeg":
+        return bytes(pixmap.tobytes("jpeg", jpg_quality=95))
+    return bytes(pixmap.tobytes("png"))
+
+
+# 変換をスレッドで実行し、一時ディレクトリのキャッシュを使うフィクスチャ
+@pytest.fixture
+def image_env(tmp_path: Path) -> Generator[NormalizedImageCache, None, None]:
+    cache = NormalizedImageCache(max_bytes=10 * 1024 * 1024)
+    with (
+        patch.object(image_normalization, "get_extraction_executor", return_value=None),
+        patch.object(image_normalization, "image_cache", cache),
+        patch.object(blob_cache_module, "blob_cache", BlobDiskCache(directory=str(tmp_path))),
+    ):
+        yield cache
+
+
+def test_normalize_image_resizes_and_keeps_format() -> None:
+    """大きい画像が最大サイズまで縮小され、元の形式のまま小さくなることをテスト"""
+    original = make_photo(5, "jpeg")
+    normalized = normalize_image(original)
+
+    assert detect_image_format(normalized) == "jpeg"
+    assert len(normalized) * 3 < len(original)
+    pixmap = fitz.Pixmap(normalized)
+    assert max(pixmap.width, pixmap.height) <= 1568
+    assert pixmap.width * pixmap.height <= 1150000
+
+    png = make_photo(4, "png", alpha=True)
+    normalized_png = normalize_image(png)
+    assert detect_image_format(normalized_png) == "png"
+    assert fitz.Pixmap(normalized_png).width == 1238
+
+
+def test_normalize_image_keeps_unsupported_data() -> None:
+    """変換できない内容はそのまま返すことをテスト"""
+    assert normalize_image(b"GIF89a...") == b"GIF89a..."
+    assert normalize_image(b"\x89PNG\r\n\x1a\nbroken") == b"\x89PNG\r\n\x1a\nbroken"
+
+
+def test_worker_module_does_not_import_api_clients() -> None:
+    """プロセスプールで読み込む変換のモジュールが、APIやDBのモジュールを読み込まないことをテスト"""
+    code = (
+        "import sys, app.utils.image_resize; "
+        "print(sorted(m for m in ('vertexai', 'anthropic', 'sqlalchemy') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip().splitlines()[-1] == "[]"
+
+
+@pytest.mark.asyncio
+async def test_read_image_base64_caches_by_generation(image_env: NormalizedImageCache) -> None:
+    """変換結果が世代番号ごとにキャッシュされることをテスト"""
+    bucket = InMemoryStorageClient().bucket(MOCK_BUCKET_NAME)
+    blob = bucket.blob("test_user/photo.jpg")
+    blob.upload_from_string(make_photo(5, "jpeg"))
+    generation = blob.generation
+
+    first = await read_image_base64(bucket, "test_user/photo.jpg", generation)
+    second = await read_image_base64(bucket, "test_user/photo.jpg", generation)
+
+    assert first == second
+    assert max(fitz.Pixmap(base64.b64decode(first)).irect[2:]) <= 1568
+    stats = image_env.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["normalized_bytes"] * 3 < stats["original_bytes"]
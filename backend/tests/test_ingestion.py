@@ -0,0 +1,106 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.utils import ingestion
+from app.utils.blob_metadata import BlobInfo
+from app.utils.ingestion import IngestionManager, ingestion_step
+
+MOCK_BUCKET_NAME = "test-bucket"
+
+
+async def wait_for_tasks(manager: IngestionManager) -> None:
+    await asyncio.gather(*list(manager._tasks.values()), return_exceptions=True)
+
+
+def test_ingestion_step() -> None:
+    """拡張子ごとに前処理の内容が決まることをテスト"""
+    assert ingestion_step("lecture.PDF") == "extract_text"
+    assert ingestion_step("lecture.mp4") == "transcribe"
+    assert ingestion_step("lecture.wav") == "transcribe"
+    assert ingestion_step("slide.png") is None
+
+
+@pytest.mark.asyncio
+async def test_enqueue_runs_ingestion_in_background() -> None:
+    """PDFはテキスト抽出、動画は文字起こしがバックグラウンドで実行されることをテスト"""
+    manager = IngestionManager(enabled=True, concurrency=2)
+    blob_infos = {
+        "u/a.pdf": BlobInfo(name="u/a.pdf", exists=True, generation=5),
+        "u/b.mp4": BlobInfo(name="u/b.mp4", exists=True, generation=7),
+    }
+    with (
+        patch.object(ingestion, "lookup_blobs", new_callable=AsyncMock) as lookup,
+        patch.object(ingestion, "extract_text_from_pdf", new_callable=AsyncMock) as extract,
+        patch.object(ingestion, "transcribe_media", new_callable=AsyncMock) as transcribe,
+    ):
+        lookup.side_effect = lambda bucket, uid, files: {
+            f"{uid}/{name}": blob_infos[f"{uid}/{name}"] for name in files
+        }
+        status = manager.enqueue(MOCK_BUCKET_NAME, "u", "a.pdf", 1)
+        assert status is not None and status.state == "queued"
+        manager.enqueue(MOCK_BUCKET_NAME, "u", "b.mp4", 2)
+        await wait_for_tasks(manager)
+
+    extract.assert_awaited_once_with(MOCK_BUCKET_NAME, "u/a.pdf", 5, 1)
+    transcribe.assert_awaited_once_with(MOCK_BUCKET_NAME, "u/b.mp4", 7, 2)
+    pdf_status = manager.get_status(1)
+    assert pdf_status is not None
+    assert pdf_status.state == "completed"
+    assert pdf_status.generation == 5
+    assert manager.stats() == {"enqueued": 2, "completed": 2, "failed": 0, "pending": 0}
+
+
+@pytest.mark.asyncio
+async def test_enqueue_records_failures_and_skips() -> None:
+    """前処理の失敗、前処理が不要なファイル、無効化した場合の状態をテスト"""
+    manager = IngestionManager(enabled=True)
+    with patch.object(ingestion, "lookup_blobs", new_callable=AsyncMock) as lookup:
+        lookup.return_value = {}
+        manager.enqueue(MOCK_BUCKET_NAME, "u", "missing.pdf", 1)
+        await wait_for_tasks(manager)
+
+    failed = manager.get_status(1)
+    assert failed is not None
+    assert failed.state == "failed"
+    assert failed.error is not None and "missing.pdf" in failed.error
+
+    image = manager.enqueue(MOCK_BUCKET_NAME, "u", "slide.png", 2)
+    assert image is not None and image.state == "not_required"
+    assert manager.get_status(3) is None
+
+    assert IngestionManager(enabled=False).enqueue(MOCK_BUCKET_NAME, "u", "a.pdf", 4) is None
+
+
+@pytest.mark.asyncio
+async def test_check_status_uses_saved_extracts() -> None:
+    """前処理の完了を保存済みの抽出結果から判断し、他のプロセスで完了した場合も ready になることをテスト"""
+    manager = IngestionManager(enabled=True)
+    blob_infos = {
+        "u/a.pdf": BlobInfo(name="u/a.pdf", exists=True, generation=5),
+        "u/b.mp4": BlobInfo(name="u/b.mp4", exists=True, generation=7),
+    }
+    with (
+        patch.object(ingestion, "lookup_blobs", new_callable=AsyncMock) as lookup,
+        patch.object(ingestion.file_extract_store, "exists", new_callable=AsyncMock) as exists,
+    ):
+        lookup.side_effect = lambda bucket, uid, files: {
+            f"{uid}/{name}": blob_infos[f"{uid}/{name}"] for name in files
+        }
+        exists.return_value = True
+        status = await manager.check_status(MOCK_BUCKET_NAME, "u", 1, "a.pdf")
+        assert status["state"] == "completed"
+        assert status["ready"] is True
+        assert status["generation"] == 5
+        exists.assert_awaited_with(MOCK_BUCKET_NAME, 1, 5, ingestion.pdf_variant())
+
+        exists.return_value = False
+        status = await manager.check_status(MOCK_BUCKET_NAME, "u", 2, "b.mp4")
+        assert status["state"] == "not_ready"
+        assert status["ready"] is False
+        assert exists.await_args.args[3].startswith("transcript:")
+
+        status = await manager.check_status(MOCK_BUCKET_NAME, "u", 3, "slide.png")
+        assert status["state"] == "not_required"
+        assert status["ready"] is True
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from app.utils.ingestion_governor import IngestionGovernor
+
+
+async def hold(
+    governor: IngestionGovernor, order: list[str], name: str, user: str, **kwargs: int
+) -> None:
+    async with governor.slot(user=user, **kwargs):
+        order.append(name)
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_slot_limits_bytes_and_cpu() -> None:
+    """サイズの上限を超える処理は、先の処理が終わるまで待つことをテスト"""
+    governor = IngestionGovernor(max_bytes=100, cpu_slots=4)
+    first = governor.slot(nbytes=60, user="a")
+    await first.__aenter__()
+
+    order: list[str] = []
+    waiting = asyncio.create_task(hold(governor, order, "second", "b", nbytes=60))
+    await asyncio.sleep(0)
+    assert order == []
+    assert governor.stats()["queue_depth"] == 1
+    assert governor.stats()["bytes_in_use"] == 60
+
+    await asyncio.sleep(0.01)
+    await first.__aexit__(None, None, None)
+    await waiting
+    assert order == ["second"]
+    stats = governor.stats()
+    assert stats["queue_depth"] == 0
+    assert stats["bytes_in_use"] == 0
+    assert stats["waited"] == 1
+    assert stats["max_wait_seconds"] > 0
+
+
+@pytest.mark.asyncio
+async def test_slot_is_fair_between_users() -> None:
+    """待機中の処理がユーザーごとに順番に実行されることをテスト"""
+    governor = IngestionGovernor(max_bytes=100, cpu_slots=1)
+    order: list[str] = []
+    tasks = [
+        asyncio.create_task(hold(governor, order, name, user))
+        for name, user in [("a1", "a"), ("a2", "a"), ("a3", "a"), ("b1", "b")]
+    ]
+    await asyncio.gather(*tasks)
+
+    assert order == ["a1", "a2", "b1", "a3"]
+
+
+@pytest.mark.asyncio
+async def test_slot_handles_cancel_and_oversized_work() -> None:
+    """取り消された待機が取り除かれ、上限より大きい処理も単独で実行されることをテスト"""
+    governor = IngestionGovernor(max_bytes=100, cpu_slots=1)
+    order: list[str] = []
+
+    first = governor.slot(user="a")
+    await first.__aenter__()
+    cancelled = asyncio.create_task(hold(governor, order, "cancelled", "b"))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    assert governor.stats()["queue_depth"] == 0
+    await first.__aexit__(None, None, None)
+
+    await hold(governor, order, "oversized", "a", nbytes=1000)
+    assert order == ["oversized"]
+    assert governor.stats()["active"] == 0
@@ -0,0 +1,183 @@
+import io
+import os
+import tempfile
+from pathlib import Path
+from typing import Generator
+from unittest.mock import patch
+
+import pytest
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+from google.api_core.exceptions import NotFound
+
+from app.main import app
+from app.utils.blob_cache import open_blob_path
+from app.utils.local_storage import TEMP_PREFIX, LocalStorageClient
+from app.utils.operate_cloud_storage import delete_files_from_gcs, upload_files
+from app.utils.storage_client import set_storage_client
+
+MOCK_BUCKET_NAME = "test-bucket"
+
+
+@pytest.fixture
+def local_client(tmp_path: Path) -> Generator[LocalStorageClient, None, None]:
+    client = LocalStorageClient(root=str(tmp_path))
+    set_storage_client(client)
+    with patch.dict(os.environ, {"BUCKET_NAME": MOCK_BUCKET_NAME}):
+        yield client
+    set_storage_client(None)
+
+
+def test_local_blob_read_write(local_client: LocalStorageClient, tmp_path: Path) -> None:
+    """書き込んだ内容がメモリマップ、sendfileのどちらの経路でも読み込めることをテスト"""
+    bucket = local_client.bucket(MOCK_BUCKET_NAME)
+    blob = bucket.blob("test_user/a.pdf")
+    assert not blob.exists()
+    assert blob.generation is None
+
+    # 実ファイルからのアップロード（sendfile）
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"pdf content")
+    blob.upload_from_filename(str(source))
+    generation = blob.generation
+    assert blob.download_as_bytes() == b"pdf content"
+    assert blob.size == len(b"pdf content")
+    assert blob.content_type == "application/pdf"
+
+    # メモリ上のファイルからのアップロードで世代番号が変わる
+    blob.upload_from_file(io.BytesIO(b"new content"), rewind=True)
+    assert blob.generation != generation
+
+    # 実ファイルへのダウンロード（sendfile）とメモリ上のファイルへのダウンロード
+    with tempfile.TemporaryFile() as f:
+        f.write(b"header:")
+        blob.download_to_file(f)
+        f.write(b":footer")
+        f.seek(0)
+        assert f.read() == b"header:new content:footer"
+    buffer = io.BytesIO()
+    blob.download_to_file(buffer)
+    assert buffer.getvalue() == b"new content"
+
+    # 書き込みに失敗した場合は既存の内容が残る
+    with pytest.raises(RuntimeError):
+        with blob.open("wb") as writer:
+            writer.write(b"partial")
+            raise RuntimeError("中断")
+    assert blob.download_as_bytes() == b"new content"
+    assert not list(tmp_path.rglob(f"{TEMP_PREFIX}*"))
+
+    blob.delete()
+    with pytest.raises(NotFound):
+        blob.download_as_bytes()
+
+
+def test_local_blob_generation_is_unique_within_a_timestamp(
+    local_client: LocalStorageClient,
+) -> None:
+    """最終更新日時が同じでも、書き込みごとに世代番号が増えることをテスト"""
+    bucket = local_client.bucket(MOCK_BUCKET_NAME)
+    blob = bucket.blob("test_user/a.pdf")
+    generations = []
+    with patch("app.utils.local_storage.time.time_ns", return_value=1_000):
+        for content in (b"first", b"second", b"third"):
+            blob.upload_from_string(content)
+            os.utime(blob.path, ns=(1_000, 1_000))
+            generations.append(blob.generation)
+    assert generations == sorted(set(generations))
+
+    # メタデータを変更しても世代番号は変わらない
+    blob.metadata = {"source_generation": "3"}
+    blob.patch()
+    assert blob.generation == generations[-1]
+
+
+def test_local_blob_metadata(local_client: LocalStorageClient) -> None:
+    """カスタムメタデータがアップロード時に保存され、reload で読み込めることをテスト"""
+    blob = local_client.bucket(MOCK_BUCKET_NAME).blob("mp3/test_user/a.mp3")
+    blob.metadata = {"source_generation": "3"}
+    blob.upload_from_string(b"mp3 content")
+
+    reloaded = local_client.bucket(MOCK_BUCKET_NAME).blob("mp3/test_user/a.mp3")
+    reloaded.reload()
+    assert reloaded.metadata == {"source_generation": "3"}
+
+
+def test_local_blob_rewrite(local_client: LocalStorageClient) -> None:
+    """一時的なブロブから保存先に内容とメタデータをコピーできることをテスト"""
+    bucket = local_client.bucket(MOCK_BUCKET_NAME)
+    temp_blob = bucket.blob("tmp/conversions/run/a.mp3")
+    temp_blob.metadata = {"source_generation": "3"}
+    temp_blob.upload_from_string(b"mp3 content")
+
+    blob = bucket.blob("mp3/test_user/a.mp3")
+    assert blob.rewrite(temp_blob) == (None, 11, 11)
+    blob.reload()
+    assert blob.download_as_bytes() == b"mp3 content"
+    assert blob.metadata == {"source_generation": "3"}
+
+
+def test_local_bucket_list_and_invalid_names(local_client: LocalStorageClient) -> None:
+    """プレフィックスでの一覧取得と、バケット外を指すブロブ名の拒否をテスト"""
+    bucket = local_client.bucket(MOCK_BUCKET_NAME)
+    for name in ["test_user/a.pdf", "test_user/b.png", "mp3/test_user/c.mp3", "other/d.pdf"]:
+        bucket.blob(name).upload_from_string(name)
+
+    names = [blob.name for blob in local_client.list_blobs(MOCK_BUCKET_NAME, prefix="test_user/")]
+    assert names == ["test_user/a.pdf", "test_user/b.png"]
+    assert bucket.blob("test_user/a.pdf").md5_hash == bucket.blob("test_user/a.pdf").md5_hash
+
+    for name in ["../secret", "/etc/passwd", "test_user/../../x", f"test_user/{TEMP_PREFIX}x"]:
+        with pytest.raises(ValueError):
+            bucket.blob(name)
+
+
+@pytest.mark.asyncio
+async def test_upload_and_delete_with_local_storage(local_client: LocalStorageClient) -> None:
+    """アップロード、変更のないファイルのスキップ、一括削除がローカルストレージで動作することをテスト"""
+    files = [UploadFile(file=io.BytesIO(b"lecture"), filename="lecture.pdf")]
+    with (
+        patch("app.utils.operate_cloud_storage.get_storage_client", return_value=local_client),
+        patch("app.utils.operate_cloud_storage.STORAGE_BACKEND", "local"),
+        patch.dict(os.environ, {"GOOGLE_APPLICATION_CREDENTIALS": ""}),
+    ):
+        first = await upload_files(files, "test_user")
+        files[0].file.seek(0)
+        second = await upload_files(files, "test_user")
+
+        assert first["success_files"][0]["skipped"] is False
+        assert second["success_files"][0]["skipped"] is True
+
+        bucket = local_client.bucket(MOCK_BUCKET_NAME)
+        generation = bucket.blob("test_user/lecture.pdf").generation
+        async with open_blob_path(bucket, "test_user/lecture.pdf", generation) as path:
+            assert path == bucket.blob("test_user/lecture.pdf").path
+
+        result = await delete_files_from_gcs(["lecture.pdf", "missing.pdf"], "test_user")
+
+    assert result["success"] is False
+    assert [f["filename"] for f in result["success_files"]] == ["test_user/lecture.pdf"]
+    assert not bucket.blob("test_user/lecture.pdf").exists()
+
+
+def test_local_storage_signed_urls(local_client: LocalStorageClient) -> None:
+    """署名付きURLでのアップロードとダウンロード、不正な署名の拒否をテスト"""
+    client = TestClient(app)
+    blob = local_client.bucket(MOCK_BUCKET_NAME).blob("test_user/note.png")
+
+    put_url = blob.generate_signed_url(method="PUT", content_type="image/png")
+    path = put_url.split("http://localhost:8000", 1)[1]
+    response = client.put(path, content=b"image", headers={"Content-Type": "image/png"})
+    assert response.status_code == 200
+    assert blob.download_as_bytes() == b"image"
+
+    get_url = blob.generate_signed_url(method="GET", response_type="image/png")
+    path = get_url.split("http://localhost:8000", 1)[1]
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.content == b"image"
+    assert response.headers["content-type"] == "image/png"
+
+    # 署名を改ざんしたURLや、PUT用のURLでのダウンロードは拒否される
+    assert client.get(path.replace("signature=", "signature=0")).status_code == 403
+    assert client.get(put_url.split("http://localhost:8000", 1)[1]).status_code == 403
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+from unittest import mock
+
+import pytest
+
+from app.utils.media_workers import MediaWorkerPool
+
+
+@pytest.mark.asyncio
+async def test_run_limits_concurrent_processes() -> None:
+    """同時に実行するプロセス数を制限し、専用のスレッドで実行することをテスト"""
+    pool = MediaWorkerPool(workers=2, threads_per_job=1, nice=0)
+    running = 0
+    max_running = 0
+    thread_names = set()
+    lock = threading.Lock()
+
+    def job() -> None:
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+            thread_names.add(threading.current_thread().name)
+        threading.Event().wait(0.02)
+        with lock:
+            running -= 1
+
+    tasks = [asyncio.create_task(pool.run(job)) for _ in range(5)]
+    await asyncio.sleep(0.005)
+    assert pool.stats()["queue_depth"] == 3
+    await asyncio.gather(*tasks)
+
+    assert max_running == 2
+    assert all(name.startswith("media-worker") for name in thread_names)
+    stats = pool.stats()
+    assert stats["running"] == 0
+    assert stats["queue_depth"] == 0
+    assert stats["completed"] == 5
+    assert stats["max_wait_seconds"] > 0
+    assert stats["total_run_seconds"] > 0
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_slot_counts_failures_and_cancellation() -> None:
+    """失敗したプロセスを数え、待機中に取り消された処理が枠を使わないことをテスト"""
+    pool = MediaWorkerPool(workers=1, threads_per_job=1, nice=0)
+
+    def fail() -> None:
+        raise RuntimeError("ffmpeg failed")
+
+    with pytest.raises(RuntimeError):
+        await pool.run(fail)
+
+    async with pool.slot():
+        waiting = asyncio.create_task(pool.run(lambda: None))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+    assert await pool.run(lambda: "done") == "done"
+
+    stats = pool.stats()
+    assert stats["failed"] == 1
+    assert stats["completed"] == 2
+    assert stats["running"] == 0
+    pool.shutdown()
+
+
+def test_ffmpeg_cmd_and_output_options() -> None:
+    """ffmpegを優先度を下げて起動し、1プロセスのスレッド数を指定することをテスト"""
+    with mock.patch("app.utils.media_workers.available_cpus", return_value=8):
+        pool = MediaWorkerPool(workers=2, threads_per_job=0, nice=10)
+
+    assert pool.output_options() == {"threads": 4}
+    with mock.patch("app.utils.media_workers.shutil.which", return_value="/usr/bin/nice"):
+        assert pool.ffmpeg_cmd() == ["nice", "-n", "10", "ffmpeg"]
+    with mock.patch("app.utils.media_workers.shutil.which", return_value=None):
+        assert pool.ffmpeg_cmd() == ["ffmpeg"]
+    assert MediaWorkerPool(workers=1, threads_per_job=1, nice=0).ffmpeg_cmd() == ["ffmpeg"]
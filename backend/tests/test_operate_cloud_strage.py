@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 from fastapi import UploadFile, HTTPException
 from fastapi.testclient import TestClient
 from app.utils.operate_cloud_storage import (
+    _batch_delete,
     post_files,
     upload_files,
     delete_files_from_gcs,
@@ -12,10 +13,13 @@ from app.utils.operate_cloud_storage import (
     generate_download_signed_url_v4,
 )
 from app.main import app
+from app.utils.in_memory_storage import InMemoryBlob, InMemoryStorageClient
 from unittest.mock import patch, MagicMock, Mock, call
 from google.api_core.exceptions import GoogleAPIError, NotFound
 import unicodedata
+from google.auth.credentials import AnonymousCredentials
 from google.cloud import storage
+import requests
 
 load_dotenv()  # 環境変数の読み込み
 
@@ -184,10 +188,9 @@ async def test_upload_files_nfc_normalization() -> None:
     # パッチを適用してGoogle Cloud Storageの操作をモック
     with (
         patch(
-            "google.cloud.storage.Client.from_service_account_json",
+            "app.utils.operate_cloud_storage.get_storage_client",
             return_value=mock_client,
         ),
-        patch("google.cloud.storage.Bucket", return_value=mock_bucket),
         patch("os.getenv", return_value="mock_value"),
     ):
         # upload_files関数を呼び出す
@@ -205,6 +208,88 @@ async def test_upload_files_nfc_normalization() -> None:
         assert unicodedata.is_normalized("NFC", called_filename)
 
 
+@pytest.mark.asyncio
+async def test_upload_files_streams_concurrently() -> None:
+    """
+    スプールから直接アップロードし、存在確認の追加リクエストを行わないことをテストする関数
+
+    :param None: この関数にはパラメータがありません。
+    :return: None
+    :raises AssertionError: テストが失敗した場合
+    """
+    uid = "test_user"
+    file_names = [f"lecture_{i}.pdf" for i in range(10)]
+    files = [
+        UploadFile(file=io.BytesIO(f"content {name}".encode()), filename=name)
+        for name in file_names
+    ]
+
+    in_memory_client = InMemoryStorageClient()
+    with (
+        patch(
+            "app.utils.operate_cloud_storage.get_storage_client",
+            return_value=in_memory_client,
+        ),
+        patch.dict(os.environ, {"BUCKET_NAME": "test-bucket"}),
+        patch.object(InMemoryBlob, "exists") as mock_exists,
+    ):
+        result = await upload_files(files, uid)
+
+    assert result["success"] is True
+    # 入力順に結果が返されることを確認
+    assert [f["filename"] for f in result["success_files"]] == file_names
+    mock_exists.assert_not_called()
+
+    bucket = in_memory_client.bucket("test-bucket")
+    for name in file_names:
+        assert bucket.blob(f"test_user/{name}").download_as_bytes() == f"content {name}".encode()
+
+
+@pytest.mark.asyncio
+async def test_upload_files_skips_unchanged() -> None:
+    """
+    内容が変わっていないファイルは再アップロードしないことをテストする関数
+
+    :param None: この関数にはパラメータがありません。
+    :return: None
+    :raises AssertionError: テストが失敗した場合
+    """
+    uid = "test_user"
+    in_memory_client = InMemoryStorageClient()
+    bucket = in_memory_client.bucket("test-bucket")
+
+    with (
+        patch(
+            "app.utils.operate_cloud_storage.get_storage_client",
+            return_value=in_memory_client,
+        ),
+        patch.dict(os.environ, {"BUCKET_NAME": "test-bucket"}),
+    ):
+        first = await upload_files(
+            [UploadFile(file=io.BytesIO(b"same content"), filename="a.pdf")], uid
+        )
+        generation = bucket.blob("test_user/a.pdf").generation
+
+        # 同じ内容は世代番号が変わらずスキップされる
+        second = await upload_files(
+            [UploadFile(file=io.BytesIO(b"same content"), filename="a.pdf")], uid
+        )
+        assert bucket.blob("test_user/a.pdf").generation == generation
+
+        # 内容が変わった場合はアップロードされる
+        third = await upload_files(
+            [UploadFile(file=io.BytesIO(b"new content"), filename="a.pdf")], uid
+        )
+
+    assert first["success_files"][0]["skipped"] is False
+    assert second["success"] is True
+    assert second["success_files"][0]["skipped"] is True
+    assert second["success_files"][0]["content_hash"] == first["success_files"][0]["content_hash"]
+    assert third["success_files"][0]["skipped"] is False
+    assert bucket.blob("test_user/a.pdf").generation != generation
+    assert bucket.blob("test_user/a.pdf").download_as_bytes() == b"new content"
+
+
 @pytest.mark.asyncio
 async def test_delete_files_from_gcs() -> None:
     """
@@ -260,15 +345,94 @@ async def test_delete_files_from_gcs() -> None:
         expected_error = f"GCS API エラー - ファイル: test_user/5_アジャイルⅡ.pdf, エラーコード: unknown, 詳細: {error_message}"
         assert expected_error in result["failed_files"]
 
-    # 異常系: ファイルが存在しない場合のテスト
-    with patch(
-        "google.cloud.storage.Bucket.blob",
-        return_value=MagicMock(exists=MagicMock(return_value=False)),
+
+@pytest.mark.asyncio
+async def test_delete_files_from_gcs_batches_deletes() -> None:
+    """
+    削除がバッチでまとめて送信され、ファイルごとの結果と派生ファイルの削除が行われることをテストする関数
+
+    :param None: この関数にはパラメータがありません。
+    :return: None
+    :raises AssertionError: テストが失敗した場合
+    """
+    uid = "test_user"
+    storage_client = InMemoryStorageClient()
+    bucket = storage_client.bucket("test-bucket")
+    bucket.blob("test_user/lecture.mp4").upload_from_string(b"video")
+    bucket.blob("mp3/test_user/lecture.mp3").upload_from_string(b"audio")
+    bucket.blob("test_user/5_アジャイルⅡ.pdf").upload_from_string(b"pdf")
+
+    with (
+        patch.dict(
+            os.environ,
+            {"GOOGLE_APPLICATION_CREDENTIALS": "dummy.json", "BUCKET_NAME": "test-bucket"},
+        ),
+        patch(
+            "app.utils.operate_cloud_storage.get_storage_client",
+            return_value=storage_client,
+        ),
+        patch("app.utils.operate_cloud_storage.DELETE_BATCH_SIZE", 2),
+        patch.object(storage_client, "batch", wraps=storage_client.batch) as mock_batch,
+        patch.object(InMemoryBlob, "exists") as mock_exists,
     ):
-        result = await delete_files_from_gcs(deletefiles, uid)
-        assert result["success"] == False
-        expected_error = "ファイル test_user/5_アジャイルⅡ.pdf が存在しません"
-        assert expected_error in result["failed_files"]
+        result = await delete_files_from_gcs(
+            ["lecture.mp4", "5_アジャイルⅡ.pdf", "missing.pdf"], uid
+        )
+
+    # 派生ファイル（MP3とAAC）を含む5件の削除が2件ずつのバッチで送信される
+    assert mock_batch.call_count == 3
+    mock_exists.assert_not_called()
+
+    assert result["success"] == False
+    assert [f["filename"] for f in result["success_files"]] == [
+        "test_user/lecture.mp4",
+        "test_user/5_アジャイルⅡ.pdf",
+    ]
+    assert result["failed_files"] == "ファイル test_user/missing.pdf が存在しません"
+    assert list(bucket.list_blobs()) == []
+
+
+def test_batch_delete_with_google_cloud_storage_batch() -> None:
+    """
+    google-cloud-storage のバッチで、ブロブごとの削除結果を受け取れることをテストする関数
+
+    :param None: この関数にはパラメータがありません。
+    :return: None
+    :raises AssertionError: テストが失敗した場合
+    """
+    storage_client = storage.Client(project="test-project", credentials=AnonymousCredentials())
+    body = (
+        "--batch_boundary\r\n"
+        "Content-Type: application/http\r\n"
+        "Content-ID: <response-1>\r\n\r\n"
+        "HTTP/1.1 204 No Content\r\n"
+        "Content-Length: 0\r\n\r\n\r\n"
+        "--batch_boundary\r\n"
+        "Content-Type: application/http\r\n"
+        "Content-ID: <response-2>\r\n\r\n"
+        "HTTP/1.1 404 Not Found\r\n"
+        "Content-Type: application/json\r\n\r\n"
+        '{"error": {"code": 404, "message": "No such object"}}\r\n'
+        "--batch_boundary--\r\n"
+    )
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["content-type"] = "multipart/mixed; boundary=batch_boundary"
+    response._content = body.encode("utf-8")
+
+    with patch.object(
+        storage_client._base_connection, "_make_request", return_value=response
+    ) as mock_request:
+        results = _batch_delete(
+            storage_client,
+            storage_client.bucket("test-bucket"),
+            ["test_user/a.pdf", "test_user/missing.pdf"],
+        )
+
+    # 2件の削除が1回のリクエストで送信される
+    mock_request.assert_called_once()
+    assert results["test_user/a.pdf"] is None
+    assert isinstance(results["test_user/missing.pdf"], NotFound)
 
 
 @pytest.mark.asyncio
@@ -306,10 +470,8 @@ async def test_generate_download_signed_url_v4() -> None:
     os.environ["BUCKET_NAME"] = "test-bucket"
 
     # GCSのモックを設定
-    with (
-        patch("google.cloud.storage.Client") as mock_client,
-        patch("google.cloud.storage.Bucket") as mock_bucket,
-    ):
+    with patch("app.utils.operate_cloud_storage.get_storage_client") as mock_client:
+        mock_bucket = mock_client.return_value.bucket
         # blobのモックを設定
         mock_blob = Mock()
         mock_blob.exists.return_value = True
@@ -363,10 +525,8 @@ async def test_generate_download_signed_url_v4_with_gcs_error() -> None:
     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "dummy_credentials.json"
     os.environ["BUCKET_NAME"] = "test-bucket"
 
-    with (
-        patch("google.cloud.storage.Client") as mock_client,
-        patch("google.cloud.storage.Bucket") as mock_bucket,
-    ):
+    with patch("app.utils.operate_cloud_storage.get_storage_client") as mock_client:
+        mock_bucket = mock_client.return_value.bucket
         # GCS APIエラーをシミュレート
         mock_blob = Mock()
         mock_blob.exists.return_value = True
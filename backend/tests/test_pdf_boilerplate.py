@@ -0,0 +1,72 @@
+from pathlib import Path
+from unittest.mock import patch
+
+import fitz
+import pytest
+
+from app.utils import pdf_extraction
+from app.utils.pdf_boilerplate import BoilerplateStats, normalize_line, strip_boilerplate
+from app.utils.pdf_extraction import extract_pages_from_path
+
+
+def test_normalize_line() -> None:
+    """ページ番号や空白の違いを無視して比較できることをテスト"""
+    assert normalize_line("  3 /  20 ") == "# / #"
+    assert normalize_line("情報処理 第12回") == normalize_line("情報処理 第3回")
+
+
+def test_strip_boilerplate_removes_repeated_header_and_footer() -> None:
+    """上端・下端に繰り返し現れる行だけが取り除かれることをテスト"""
+    pages = [
+        [
+            (0.05, "情報システム特論\n"),
+            (0.5, f"第{i}回の本文\n情報システム特論\n"),
+            (0.95, f"© 2024 AIIT\n{i}\n"),
+        ]
+        for i in range(1, 5)
+    ]
+    # 1ページだけにあるフッターは残す
+    pages[3].append((0.97, "参考文献あり\n"))
+
+    stripped, removed = strip_boilerplate(pages)
+
+    assert stripped[0] == "第1回の本文\n情報システム特論\n"
+    assert stripped[3] == "第4回の本文\n情報システム特論\n参考文献あり\n"
+    assert removed == 12
+
+
+def test_strip_boilerplate_keeps_short_documents() -> None:
+    """ページ数が少ない場合は取り除かないことをテスト"""
+    pages = [[(0.05, "講義名\n"), (0.5, "本文\n")]] * 2
+    assert strip_boilerplate(pages) == (["講義名\n本文\n"] * 2, 0)
+
+
+@pytest.mark.asyncio
+async def test_extract_pages_from_path_strips_slide_boilerplate(tmp_path: Path) -> None:
+    """スライドのPDFから講義名とページ番号が取り除かれ、削減したトークン数が記録されることをテスト"""
+    path = str(tmp_path / "slides.pdf")
+    doc = fitz.open()
+    for i in range(1, 7):
+        page = doc.new_page(width=720, height=540)
+        page.insert_text((36, 30), "Advanced Information Systems 2024")
+        page.insert_text((72, 250), f"Topic {i}: normalization step {i}")
+        page.insert_text((660, 525), f"{i} / 6")
+    doc.save(path)
+    doc.close()
+
+    stats = BoilerplateStats()
+    with (
+        patch.object(pdf_extraction, "get_extraction_executor", return_value=None),
+        patch.object(pdf_extraction, "boilerplate_stats", stats),
+    ):
+        pages = await extract_pages_from_path(path)
+        raw = await extract_pages_from_path(path, strip=False)
+
+    assert [page.strip() for page in pages] == [
+        f"Topic {i}: normalization step {i}" for i in range(1, 7)
+    ]
+    assert "Advanced Information Systems 2024" in raw[0]
+    recorded = stats.stats()
+    assert recorded["documents"] == 1
+    assert recorded["removed_lines"] == 12
+    assert 0 < recorded["removed_tokens"] < recorded["original_tokens"]
@@ -0,0 +1,94 @@
+import asyncio
+import subprocess
+import sys
+from pathlib import Path
+from typing import Generator
+from unittest.mock import AsyncMock, patch
+
+import fitz
+import pytest
+
+from app.utils import pdf_extraction
+from app.utils.pdf_extraction import (
+    extract_pages_from_path,
+    join_pages,
+    load_pdf_pages,
+    shutdown_extraction_executor,
+)
+
+
+# 2プロセスのプロセスプールを使い、テスト後に停止するフィクスチャ
+@pytest.fixture
+def process_pool() -> Generator[None, None, None]:
+    with (
+        patch.object(pdf_extraction, "PDF_EXTRACTION_WORKERS", 2),
+        patch.object(pdf_extraction, "PDF_PAGES_PER_TASK", 4),
+    ):
+        yield
+        shutdown_extraction_executor()
+
+
+@pytest.fixture
+def pdf_path(tmp_path: Path) -> str:
+    path = str(tmp_path / "lecture.pdf")
+    doc = fitz.open()
+    for i in range(10):
+        page = doc.new_page()
+        page.insert_text((72, 300), f"page {i + 1}")
+    doc.save(path)
+    doc.close()
+    return path
+
+
+@pytest.mark.asyncio
+async def test_extract_pages_from_path_in_process_pool(process_pool: None, pdf_path: str) -> None:
+    """ページを分割してプロセスプールで抽出し、ページ順に結合されることをテスト"""
+    pages = await extract_pages_from_path(pdf_path)
+
+    assert [page.strip() for page in pages] == [f"page {i}" for i in range(1, 11)]
+    assert pdf_extraction._executor is not None
+
+
+def test_worker_module_does_not_import_app_dependencies() -> None:
+    """プロセスプールで実行するモジュールが、重い依存パッケージを読み込まないことをテスト"""
+    code = (
+        "import sys, app.utils.pdf_pages; "
+        "print(sorted(m for m in ('vertexai', 'anthropic', 'sqlalchemy') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip().splitlines()[-1] == "[]"
+
+
+def test_join_pages() -> None:
+    """ページ番号の見出しを付けて結合されることをテスト"""
+    assert join_pages(["a", "b"]) == "\n# 1ページ\na\n# 2ページ\nb"
+    assert join_pages([]) == ""
+
+
+@pytest.mark.asyncio
+async def test_load_pdf_pages_joins_running_extraction() -> None:
+    """同じファイルの抽出が実行中の場合は、抽出を重複して実行せずに結果を待つことをテスト"""
+
+    async def extract(*args: object) -> list[str]:
+        await asyncio.sleep(0.01)
+        return ["page 1"]
+
+    with (
+        patch.object(pdf_extraction, "extract_pages_from_pdf", side_effect=extract) as mock_extract,
+        patch.object(pdf_extraction.file_extract_store, "load", new_callable=AsyncMock) as load,
+        patch.object(pdf_extraction.file_extract_store, "save", new_callable=AsyncMock) as save,
+    ):
+        load.return_value = None
+        results = await asyncio.gather(
+            load_pdf_pages("test-bucket", "u/a.pdf", 5, 1),
+            load_pdf_pages("test-bucket", "u/a.pdf", 5, 1),
+            load_pdf_pages("test-bucket", "u/a.pdf", 6, 1),
+        )
+
+    assert results == [["page 1"]] * 3
+    # 世代番号が異なるファイルは別に抽出する
+    assert mock_extract.await_count == 2
+    assert save.await_count == 2
+    assert pdf_extraction.pdf_extractions.stats()["in_flight"] == 0
@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+from app.utils.prompt_packer import (
+    PromptDocument,
+    PromptPacker,
+    estimate_tokens,
+    pack_documents,
+    parse_token_budgets,
+    truncate_to_tokens,
+)
+
+
+def test_estimate_tokens() -> None:
+    """日本語は1文字1トークン、英数字は4文字で1トークンとして見積もることをテスト"""
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("講義資料") == 4
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("講義 notes") == 2 + 2
+
+
+def test_parse_token_budgets() -> None:
+    """モデルごとの上限の指定を解析できることをテスト"""
+    assert parse_token_budgets("claude-3-5-sonnet-v2@20241022=60000, gemini=8000,broken") == {
+        "claude-3-5-sonnet-v2@20241022": 60000,
+        "gemini": 8000,
+    }
+
+
+def test_pack_documents_within_budget() -> None:
+    """上限に収まる場合は、従来と同じ形式ですべてのページを含めることをテスト"""
+    documents = [
+        PromptDocument("u/a.pdf", ["1ページ目", "2ページ目"]),
+        PromptDocument("u/b.mp3", ["文字起こし"], paged=False),
+    ]
+    packed = pack_documents(documents, 1000)
+
+    assert packed.text == (
+        "\n=== u/a.pdf ===\n\n# 1ページ\n1ページ目\n# 2ページ\n2ページ目"
+        "\n=== u/b.mp3 ===\n文字起こし"
+    )
+    assert not packed.trimmed
+    # 部分ごとに切り上げるため、全体の見積もり以上になる
+    assert packed.estimated_tokens >= estimate_tokens(packed.text)
+
+
+def test_pack_documents_trims_by_relevance_and_coverage() -> None:
+    """上限を超える場合は関連するページを優先し、すべてのファイルを含めることをテスト"""
+    documents = [
+        PromptDocument(
+            "u/a.pdf",
+            ["ネットワークの基礎" * 40, "データベースの正規化" * 40, "正規化の例題" * 40],
+        ),
+        PromptDocument("u/b.mp3", ["講義の要約" * 400], paged=False),
+    ]
+    packed = pack_documents(documents, 1500, query="データベースの正規化")
+
+    assert packed.trimmed
+    assert packed.estimated_tokens <= 1500
+    # 関連するページが元のページ番号で含まれ、関連しないページは省略される
+    assert "# 2ページ\nデータベースの正規化" in packed.text
+    assert "ネットワークの基礎" not in packed.text
+    # 収まらない文字起こしも切り詰めて含まれる
+    assert "=== u/b.mp3 ===" in packed.text
+    assert packed.text.endswith("…（以下省略）")
+
+
+def test_truncate_to_tokens() -> None:
+    """切り詰めたテキストが上限に収まることをテスト"""
+    truncated = truncate_to_tokens("講義" * 500, 100)
+    assert estimate_tokens(truncated) <= 100
+    assert truncate_to_tokens("短い", 100) == "短い"
+
+
+def test_prompt_packer_budget_and_usage() -> None:
+    """モデルごとの上限を適用し、実際のトークン数を記録することをテスト"""
+    packer = PromptPacker(default_budget=1000, budgets={"small": 10})
+    documents = [PromptDocument("u/a.pdf", ["講義資料" * 20])]
+
+    assert not packer.pack(documents, "large").trimmed
+    packed = packer.pack(documents, "small")
+    assert packed.trimmed
+    assert packed.text == ""
+
+    response = SimpleNamespace(usage=SimpleNamespace(input_tokens=120, output_tokens=30))
+    packer.record_usage("large", packed, response)
+    packer.record_usage("large", packed, SimpleNamespace())
+
+    stats = packer.stats()
+    assert stats["requests"] == 2
+    assert stats["trimmed_requests"] == 1
+    assert stats["input_tokens"] == 120
+    assert stats["output_tokens"] == 30
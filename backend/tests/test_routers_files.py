@@ -1,15 +1,26 @@
+from datetime import datetime, timedelta, timezone
+
 import pytest
 from dotenv import load_dotenv
+from fastapi import HTTPException
 from httpx import ASGITransport, AsyncClient
 from sqlalchemy.ext.asyncio import AsyncSession
+import app.cruds.files as files_cruds
+import app.schemas.files as files_schemas
 from app.main import app
+from app.utils.blob_metadata import BlobInfo
+from app.utils.ingestion import IngestionStatus
+from app.utils.signed_url_cache import signed_url_cache
 import unicodedata
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 import os
 
 # .envファイルから環境変数を読み込む
 load_dotenv()
 
+# 日本時間のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
 
 # ファイルアップロードのテスト
 @pytest.mark.asyncio
@@ -31,6 +42,29 @@ async def test_upload_files(session: AsyncSession, mock_auth: Mock) -> None:
         assert len(data["success_files"]) == 1
 
 
+# アップロードに失敗した場合もメタデータキャッシュを破棄することのテスト
+@pytest.mark.asyncio
+async def test_upload_files_failure_invalidates_cache(
+    session: AsyncSession, mock_auth: Mock
+) -> None:
+    files = [
+        ("files", ("test_file.pdf", b"test file content", "application/pdf")),
+    ]
+    headers = {"Authorization": "Bearer fake_token"}
+    with (
+        patch("app.routers.files.post_files", new_callable=AsyncMock) as mock_post_files,
+        patch("app.routers.files.invalidate_blob_metadata") as mock_invalidate,
+    ):
+        mock_post_files.side_effect = HTTPException(status_code=500, detail="Upload failed")
+        async with AsyncClient(
+            transport=ASGITransport(app),  # type: ignore
+            base_url="http://test",
+        ) as client:
+            response = await client.post("/files/upload", files=files, headers=headers)
+    assert response.status_code == 500
+    mock_invalidate.assert_called_once_with("test_user", ["test_file.pdf"])
+
+
 # ファイル一覧取得のテスト
 @pytest.mark.asyncio
 async def test_get_files(session: AsyncSession, mock_auth: Mock) -> None:
@@ -218,24 +252,33 @@ async def test_generate_download_signed_url(session: AsyncSession) -> None:
     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "dummy_credentials.json"
     os.environ["BUCKET_NAME"] = "test-bucket"
 
+    # DBにファイルを登録（存在確認はDBで行われる）
+    for file_name in ["test_file1.pdf", "test_file2.pdf"]:
+        file_create = files_schemas.FileCreate(
+            file_name=file_name,
+            file_size=12345,
+            user_id="test_user",
+            created_at=datetime.now(JST),
+            updated_at=datetime.now(JST),
+        )
+        await files_cruds.create_file(session, file_create, "test_user")
+
     # GCSのモックを設定
-    with (
-        patch("google.cloud.storage.Client") as mock_client,
-        patch("google.cloud.storage.Bucket") as mock_bucket,
-    ):
+    signed_url_cache.clear()
+    with patch("app.utils.operate_cloud_storage.get_storage_client") as mock_client:
+        mock_bucket = mock_client.return_value.bucket
+        mock_bucket.return_value.name = "test-bucket"
         # blobのモックを設定
         mock_blob = Mock()
-        mock_blob.exists.return_value = True
         mock_blob.generate_signed_url.return_value = "https://example.com/signed-url"
         mock_bucket.return_value.blob.return_value = mock_blob
-        mock_client.from_service_account_json.return_value = mock_bucket.return_value
 
         headers = {"Authorization": "Bearer fake_token"}
         async with AsyncClient(
             transport=ASGITransport(app),  # type: ignore
             base_url="http://test",
         ) as client:
-            testfiles = ["test_file1.pdf", "test_file2.pdf"]
+            testfiles = ["test_file1.pdf", "test_file2.pdf", "not_registered.pdf"]
             response = await client.post(
                 "/files/generate_download_signed_url",
                 headers=headers,
@@ -245,6 +288,9 @@ async def test_generate_download_signed_url(session: AsyncSession) -> None:
             data = response.json()
             assert data["test_user/test_file1.pdf"] is not None
             assert data["test_user/test_file2.pdf"] is not None
+            # DBに登録されていないファイルは署名されない
+            assert "test_user/not_registered.pdf" not in data
+            mock_blob.exists.assert_not_called()
 
 
 @pytest.mark.asyncio
@@ -278,3 +324,62 @@ async def test_generate_download_signed_url_server_error(session: AsyncSession)
                     "指定されたファイルの署名付きURLを生成できませんでした。システム管理者に連絡してください。"
                     in data["detail"]
                 )
+
+
+# ファイルの前処理の状態取得のテスト
+@pytest.mark.asyncio
+async def test_get_ingestion_status(session: AsyncSession) -> None:
+    """前処理の状態取得エンドポイントのテスト"""
+    file_create = files_schemas.FileCreate(
+        file_name="lecture.pdf",
+        file_size=12345,
+        user_id="test_user",
+        created_at=datetime.now(JST),
+        updated_at=datetime.now(JST),
+    )
+    file = await files_cruds.create_file(session, file_create, "test_user")
+    headers = {"Authorization": "Bearer fake_token"}
+
+    async with AsyncClient(
+        transport=ASGITransport(app),  # type: ignore
+        base_url="http://test",
+    ) as client:
+        blob_infos = {
+            "test_user/lecture.pdf": BlobInfo(
+                name="test_user/lecture.pdf", exists=True, generation=5
+            )
+        }
+        with (
+            patch("app.utils.ingestion.lookup_blobs", new_callable=AsyncMock) as lookup,
+            patch(
+                "app.utils.ingestion.file_extract_store.exists", new_callable=AsyncMock
+            ) as exists,
+        ):
+            lookup.return_value = blob_infos
+            # 抽出結果が保存されておらず、このプロセスで前処理していない場合
+            exists.return_value = False
+            response = await client.get(f"/files/{file.id}/ingestion_status", headers=headers)
+            assert response.status_code == 200
+            assert response.json()["state"] == "not_ready"
+            assert response.json()["ready"] is False
+
+            status = IngestionStatus(
+                file_id=file.id, file_name="lecture.pdf", state="running", step="extract_text"
+            )
+            with patch("app.routers.files.ingestion_manager.get_status", return_value=status):
+                response = await client.get(
+                    f"/files/{file.id}/ingestion_status", headers=headers
+                )
+            assert response.status_code == 200
+            assert response.json()["state"] == "running"
+            assert response.json()["step"] == "extract_text"
+
+            # 他のワーカーで前処理が完了した場合
+            exists.return_value = True
+            response = await client.get(f"/files/{file.id}/ingestion_status", headers=headers)
+            assert response.json()["state"] == "completed"
+            assert response.json()["ready"] is True
+
+        # 存在しないファイルの場合
+        response = await client.get(f"/files/{file.id + 1}/ingestion_status", headers=headers)
+        assert response.status_code == 404
@@ -0,0 +1,79 @@
+import time
+from typing import Generator
+from unittest.mock import patch
+
+import pytest
+
+from app.utils.in_memory_storage import InMemoryBlob, InMemoryStorageClient
+from app.utils.signed_url_cache import SignedUrlCache, get_signed_urls, signed_url_cache
+
+MOCK_BUCKET_NAME = "test-bucket"
+
+
+# テストごとに共有キャッシュをリセットするフィクスチャ
+@pytest.fixture(autouse=True)
+def reset_signed_url_cache() -> Generator[None, None, None]:
+    signed_url_cache.clear()
+    yield
+    signed_url_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_get_signed_urls_reuses_cached_urls() -> None:
+    """2回目の呼び出しではキャッシュした署名付きURLが再利用されることをテスト"""
+    bucket = InMemoryStorageClient().bucket(MOCK_BUCKET_NAME)
+    targets = {"test_user/a.pdf": "application/pdf", "test_user/b.png": "image/*"}
+
+    with patch.object(
+        InMemoryBlob, "generate_signed_url", autospec=True, return_value="https://signed"
+    ) as mock_sign:
+        first = await get_signed_urls(bucket, targets, method="GET")
+        second = await get_signed_urls(bucket, targets, method="GET")
+
+    assert first == second == {name: "https://signed" for name in targets}
+    assert mock_sign.call_count == 2
+    assert signed_url_cache.hits == 2
+    assert signed_url_cache.misses == 2
+
+    # メソッドが異なる場合は別のURLとして署名される
+    with patch.object(
+        InMemoryBlob, "generate_signed_url", autospec=True, return_value="https://put"
+    ) as mock_sign:
+        result = await get_signed_urls(bucket, {"test_user/a.pdf": "image/*"}, method="PUT")
+
+    assert result == {"test_user/a.pdf": "https://put"}
+    assert mock_sign.call_args.kwargs["content_type"] == "image/*"
+
+
+@pytest.mark.asyncio
+async def test_get_signed_urls_skips_failed_signatures() -> None:
+    """署名に失敗したブロブは結果に含まれず、キャッシュもされないことをテスト"""
+    bucket = InMemoryStorageClient().bucket(MOCK_BUCKET_NAME)
+
+    with patch.object(InMemoryBlob, "generate_signed_url", side_effect=ValueError("sign failed")):
+        result = await get_signed_urls(bucket, {"test_user/a.pdf": "application/pdf"}, "GET")
+
+    assert result == {}
+    assert (
+        signed_url_cache.get((MOCK_BUCKET_NAME, "test_user/a.pdf", "GET", "application/pdf"))
+        is None
+    )
+
+
+def test_signed_url_cache_expiry_and_eviction() -> None:
+    """期限が近いURLの破棄、件数上限による追い出し、明示的な破棄をテスト"""
+    cache = SignedUrlCache(max_entries=2)
+    now = time.time()
+
+    cache.put(("bucket", "a", "GET", "application/pdf"), "https://a", now + 60)
+    assert cache.get(("bucket", "a", "GET", "application/pdf")) is None
+
+    cache.put(("bucket", "a", "GET", "application/pdf"), "https://a", now + 900)
+    cache.put(("bucket", "b", "GET", "application/pdf"), "https://b", now + 900)
+    cache.put(("bucket", "c", "GET", "application/pdf"), "https://c", now + 900)
+    assert cache.get(("bucket", "a", "GET", "application/pdf")) is None
+    assert cache.get(("bucket", "c", "GET", "application/pdf")) == "https://c"
+
+    cache.invalidate("bucket", ["c"])
+    assert cache.get(("bucket", "c", "GET", "application/pdf")) is None
+    assert cache.get(("bucket", "b", "GET", "application/pdf")) == "https://b"
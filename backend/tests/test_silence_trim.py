@@ -0,0 +1,28 @@
+from app.utils.silence_trim import SilenceTrimStats, silence_filter, silence_trim_tag
+
+
+def test_silence_filter() -> None:
+    """長い無音を短い無音に縮めるフィルタを作成することをテスト"""
+    assert silence_filter(threshold_db=-40, min_seconds=2.0, keep_seconds=0.5) == (
+        "silenceremove=start_periods=1:start_threshold=-40dB:start_silence=0.5:"
+        "stop_periods=-1:stop_duration=2.0:stop_threshold=-40dB:stop_silence=0.5"
+    )
+    # 残す無音は取り除く無音より長くしない
+    assert "stop_silence=1.0" in silence_filter(min_seconds=1.0, keep_seconds=3.0)
+    assert silence_trim_tag(-40, 2.0) != silence_trim_tag(-30, 2.0)
+
+
+def test_silence_trim_stats() -> None:
+    """取り除いた長さと削減できたトークン数の見積もりを集計することをテスト"""
+    stats = SilenceTrimStats()
+    assert stats.record("a.mp4", 5400, 4800) == 600
+    # 変換後の方が長い場合は0秒として数える
+    assert stats.record("b.mp4", 600, 600.5) == 0
+
+    assert stats.stats() == {
+        "files": 2,
+        "source_seconds": 6000,
+        "trimmed_seconds": 600,
+        "saved_tokens": 600 * 32,
+        "trimmed_ratio": 0.1,
+    }
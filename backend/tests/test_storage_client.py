@@ -0,0 +1,86 @@
+import io
+from typing import Generator
+from unittest.mock import MagicMock, patch
+
+import pytest
+from google.api_core.exceptions import NotFound
+
+from app.utils import storage_client
+from app.utils.in_memory_storage import InMemoryStorageClient
+from app.utils.storage_client import (
+    close_storage_client,
+    get_storage_client,
+    set_storage_client,
+)
+
+
+# テストごとに共有クライアントをリセットするフィクスチャ
+@pytest.fixture(autouse=True)
+def reset_storage_client() -> Generator[None, None, None]:
+    set_storage_client(None)
+    yield
+    set_storage_client(None)
+
+
+def test_get_storage_client_is_shared() -> None:
+    """共有クライアントが一度だけ生成されることをテスト"""
+    with patch("app.utils.storage_client._build_client") as mock_build:
+        mock_build.return_value = MagicMock()
+
+        first = get_storage_client()
+        second = get_storage_client()
+
+        assert first is second
+        mock_build.assert_called_once()
+
+
+def test_close_storage_client_closes_session() -> None:
+    """終了処理でHTTPセッションが閉じられ、クライアントが破棄されることをテスト"""
+    mock_client = MagicMock()
+    set_storage_client(mock_client)
+
+    close_storage_client()
+
+    mock_client._http_internal.close.assert_called_once()
+    assert storage_client._client is None
+
+
+def test_build_client_mounts_connection_pool() -> None:
+    """コネクションプールを設定したセッションでクライアントが生成されることをテスト"""
+    with (
+        patch("app.utils.storage_client.google.auth.default") as mock_default,
+        patch("app.utils.storage_client.AuthorizedSession") as mock_session,
+        patch("app.utils.storage_client.storage.Client") as mock_client,
+        patch.dict("os.environ", {"GOOGLE_APPLICATION_CREDENTIALS": ""}),
+    ):
+        mock_default.return_value = (MagicMock(), "test-project")
+
+        storage_client._build_client(pool_size=8)
+
+        mock_session.return_value.mount.assert_called_once()
+        adapter = mock_session.return_value.mount.call_args[0][1]
+        assert adapter._pool_maxsize == 8
+        assert mock_client.call_args.kwargs["_http"] is mock_session.return_value
+
+
+def test_in_memory_storage_client() -> None:
+    """インメモリクライアントの基本操作をテスト"""
+    client = InMemoryStorageClient()
+    set_storage_client(client)
+
+    bucket = get_storage_client().bucket("test-bucket")
+    blob = bucket.blob("test_user/test.pdf")
+    assert blob.exists() is False
+
+    blob.upload_from_file(io.BytesIO(b"dummy pdf content"), content_type="application/pdf")
+    assert blob.exists() is True
+    assert blob.size == len(b"dummy pdf content")
+    assert bucket.blob("test_user/test.pdf").download_as_bytes() == b"dummy pdf content"
+    assert [b.name for b in client.list_blobs("test-bucket", prefix="test_user/")] == [
+        "test_user/test.pdf"
+    ]
+
+    blob.delete()
+    assert blob.exists() is False
+    with pytest.raises(NotFound):
+        blob.delete()